@@ -0,0 +1,422 @@
+"""
+Agendador de jobs com atraso (lembretes de exame, notificações de tarefa
+atrasada), com backends intercambiáveis.
+
+O agendamento estava amarrado ao Cloud Tasks: uma task e um callback HTTP por
+job, impossível de rodar (ou testar com carga) sem o GCP. Os tipos de job são
+registrados com a função que executa um LOTE de payloads; o backend decide
+como e quando chamá-la:
+
+BACKENDS (AGENDADOR_BACKEND):
+    cloud_tasks - uma Cloud Task por job, chamando a rota interna registrada
+                  para o tipo (padrão, produção). A rota executa o job.
+    local       - roda de tempo no próprio processo: os jobs são agrupados em
+                  ticks de AGENDADOR_TICK_SECONDS e, quando o tick vence, os
+                  jobs do mesmo tipo são executados juntos numa única chamada
+                  da função do tipo (milhares de lembretes do mesmo minuto viram
+                  poucas execuções em lote, em vez de um callback HTTP cada).
+                  Os jobs ficam também em 'jobs_agendados' e são recarregados
+                  por iniciar() após um restart. Pensado para uma única
+                  instância (desenvolvimento, testes offline, medições de
+                  carga): com várias instâncias, cada uma executaria os jobs
+                  recarregados.
+
+USO (em crud.py):
+    registrar_tipo_job('LEMBRETE_EXAME', _executar_lote_lembretes_exame, rota='/internal/notificar-lembrete-exame')
+
+    referencia = agendar_job(db, 'LEMBRETE_EXAME', momento, {'exame_id': ...}, chave=exame_id)
+    cancelar_job(db, referencia)
+
+    # Testes/medições com o backend local: executa na hora o que vence até 'instante'
+    processar_jobs_vencidos(db, ate=instante)
+
+Configuração (variáveis de ambiente):
+    AGENDADOR_BACKEND=cloud_tasks | local
+    AGENDADOR_TICK_SECONDS=1
+    CLOUD_TASKS_QUEUE=notificacoes-atrasadas      # fila do backend cloud_tasks
+    CLOUD_TASKS_LOCATION=southamerica-east1
+    CLOUD_RUN_SERVICE_URL, CLOUD_RUN_SERVICE_ACCOUNT
+"""
+
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'jobs_agendados'
+
+BACKEND_CLOUD_TASKS = 'cloud_tasks'
+BACKEND_LOCAL = 'local'
+
+AGENDADOR_BACKEND = os.getenv('AGENDADOR_BACKEND', BACKEND_CLOUD_TASKS).lower()
+AGENDADOR_TICK_SECONDS = float(os.getenv('AGENDADOR_TICK_SECONDS', '1'))
+
+STATUS_PENDENTE = 'pendente'
+STATUS_ERRO = 'erro'
+
+# Referências de Cloud Tasks são nomes completos ('projects/.../tasks/...')
+_PREFIXO_CLOUD_TASK = 'projects/'
+
+
+class _TipoJob:
+    __slots__ = ('executar_lote', 'rota')
+
+    def __init__(self, executar_lote: Callable[[firestore.client, List[Dict]], None], rota: str):
+        self.executar_lote = executar_lote
+        self.rota = rota
+
+
+# tipo do job -> função(db, payloads) e rota interna do Cloud Tasks
+_tipos: Dict[str, _TipoJob] = {}
+
+
+def registrar_tipo_job(tipo: str, executar_lote: Callable[[firestore.client, List[Dict]], None], rota: str) -> None:
+    """
+    Associa um tipo de job à função que executa um lote de payloads e à rota
+    interna chamada pelo Cloud Tasks (que executa um payload por chamada).
+    """
+    _tipos[tipo] = _TipoJob(executar_lote, rota)
+
+
+def _utc(momento: datetime) -> datetime:
+    return momento if momento.tzinfo is not None else momento.replace(tzinfo=timezone.utc)
+
+
+def agendar_job(
+    db: firestore.client,
+    tipo: str,
+    executar_em: datetime,
+    payload: Dict,
+    chave: Optional[str] = None,
+    service_url: Optional[str] = None,
+) -> str:
+    """
+    Agenda o job no backend configurado. O payload deve ser serializável em
+    JSON e conter só IDs e dados simples.
+    chave identifica o job no backend local (reagendar a mesma chave substitui o job).
+
+    Returns:
+        Referência do job, para cancelar_job()
+    """
+    if tipo not in _tipos:
+        raise ValueError(f"Tipo de job não registrado: '{tipo}'")
+    executar_em = _utc(executar_em)
+    if AGENDADOR_BACKEND == BACKEND_LOCAL:
+        return _agendar_local(db, tipo, executar_em, payload, chave)
+    return _criar_cloud_task(tipo, executar_em, payload, service_url)
+
+
+def cancelar_job(db: firestore.client, referencia: Optional[str]) -> bool:
+    """
+    Cancela o job (em qualquer backend, pelo formato da referência).
+
+    Returns:
+        True se o job foi cancelado, False se não existia mais (já executado ou expirado)
+    """
+    if not referencia:
+        return False
+    if referencia.startswith(_PREFIXO_CLOUD_TASK):
+        try:
+            _get_cloud_tasks_client().delete_task(name=referencia)
+            return True
+        except Exception as e:
+            if 'NOT_FOUND' in str(e):
+                return False
+            raise
+    return _cancelar_local(db, referencia)
+
+
+# =================================================================================
+# BACKEND CLOUD TASKS
+# =================================================================================
+
+def _get_cloud_tasks_client():
+    """Retorna o cliente do Cloud Tasks (singleton)."""
+    if not hasattr(_get_cloud_tasks_client, 'client'):
+        from google.cloud import tasks_v2
+        _get_cloud_tasks_client.client = tasks_v2.CloudTasksClient()
+    return _get_cloud_tasks_client.client
+
+
+def _get_cloud_tasks_queue_path() -> str:
+    """Retorna o caminho completo da fila do Cloud Tasks."""
+    # Usa FIREBASE_PROJECT_ID como fallback, que é configurado no deploy
+    project_id = os.getenv('GCP_PROJECT_ID') or os.getenv('GOOGLE_CLOUD_PROJECT') or os.getenv('FIREBASE_PROJECT_ID')
+    location = os.getenv('CLOUD_TASKS_LOCATION') or 'southamerica-east1'
+    queue_name = os.getenv('CLOUD_TASKS_QUEUE') or 'notificacoes-atrasadas'
+
+    logger.debug("Cloud Tasks: project_id=%s, location=%s, queue_name=%s", project_id, location, queue_name)
+
+    if not project_id:
+        raise RuntimeError("GCP_PROJECT_ID não configurado: Cloud Tasks não funcionará")
+
+    return _get_cloud_tasks_client().queue_path(project_id, location, queue_name)
+
+
+def _url_do_servico(service_url: Optional[str]) -> str:
+    if not service_url:
+        service_url = os.getenv('CLOUD_RUN_SERVICE_URL') or 'https://barbearia-backend-service-je3t25fkiq-rj.a.run.app'
+
+    # Garante que a URL comece com https:// (obrigatório para OIDC)
+    if not service_url.startswith('https://') and not service_url.startswith('http://'):
+        service_url = f'https://{service_url}'
+    elif service_url.startswith('http://'):
+        service_url = service_url.replace('http://', 'https://', 1)
+    return service_url
+
+
+def _criar_cloud_task(tipo: str, executar_em: datetime, payload: Dict, service_url: Optional[str]) -> str:
+    """Cria uma Cloud Task que chama a rota interna do tipo em executar_em."""
+    from google.cloud import tasks_v2
+    from google.protobuf import timestamp_pb2
+
+    service_url = _url_do_servico(service_url)
+    endpoint_url = f"{service_url}{_tipos[tipo].rota}"
+    logger.debug("Cloud Tasks: endpoint_url=%s", endpoint_url)
+
+    task = {
+        'http_request': {
+            'http_method': tasks_v2.HttpMethod.POST,
+            'url': endpoint_url,
+            'headers': {
+                'Content-Type': 'application/json',
+            },
+            'body': json.dumps(payload).encode()
+        },
+        'schedule_time': timestamp_pb2.Timestamp(seconds=int(executar_em.timestamp()))
+    }
+
+    # Adiciona autenticação OIDC para Cloud Run
+    if 'run.app' in service_url:
+        service_account = os.getenv('CLOUD_RUN_SERVICE_ACCOUNT') or '862082955632-compute@developer.gserviceaccount.com'
+        task['http_request']['oidc_token'] = {
+            'service_account_email': service_account,
+            'audience': service_url
+        }
+
+    response = _get_cloud_tasks_client().create_task(parent=_get_cloud_tasks_queue_path(), task=task)
+    return response.name
+
+
+# =================================================================================
+# BACKEND LOCAL (roda de tempo)
+# =================================================================================
+
+class _Job:
+    __slots__ = ('id', 'tipo', 'executar_em', 'payload')
+
+    def __init__(self, job_id: str, tipo: str, executar_em: datetime, payload: Dict):
+        self.id = job_id
+        self.tipo = tipo
+        self.executar_em = executar_em
+        self.payload = payload
+
+
+class RodaDeTempo:
+    """
+    Jobs agrupados por tick: o job que vence em t fica no tick ceil(t / tick)
+    (nunca dispara antes da hora). Um heap guarda só os ticks ocupados, então
+    a thread dorme até o próximo tick com jobs em vez de acordar a cada tick.
+    """
+
+    def __init__(self, tick_segundos: float):
+        self.tick_segundos = tick_segundos
+        self._condicao = threading.Condition()
+        self._slots: Dict[int, Dict[str, _Job]] = {}
+        self._ticks: List[int] = []
+        self._tick_do_job: Dict[str, int] = {}
+
+    def _tick(self, momento: datetime) -> int:
+        return math.ceil(momento.timestamp() / self.tick_segundos)
+
+    def adicionar(self, job: _Job):
+        with self._condicao:
+            self._remover(job.id)
+            tick = self._tick(job.executar_em)
+            if tick not in self._slots:
+                self._slots[tick] = {}
+                heapq.heappush(self._ticks, tick)
+            self._slots[tick][job.id] = job
+            self._tick_do_job[job.id] = tick
+            self._condicao.notify()
+
+    def remover(self, job_id: str) -> bool:
+        with self._condicao:
+            return self._remover(job_id)
+
+    def _remover(self, job_id: str) -> bool:
+        tick = self._tick_do_job.pop(job_id, None)
+        if tick is None:
+            return False
+        # O tick vazio continua no heap e é descartado quando vencer
+        self._slots[tick].pop(job_id, None)
+        return True
+
+    def retirar_vencidos(self, ate: datetime) -> List[_Job]:
+        """Remove e retorna os jobs de todos os ticks vencidos até 'ate'."""
+        limite = math.floor(ate.timestamp() / self.tick_segundos)
+        vencidos = []
+        with self._condicao:
+            while self._ticks and self._ticks[0] <= limite:
+                tick = heapq.heappop(self._ticks)
+                for job in self._slots.pop(tick, {}).values():
+                    self._tick_do_job.pop(job.id, None)
+                    vencidos.append(job)
+        return vencidos
+
+    def __len__(self):
+        with self._condicao:
+            return len(self._tick_do_job)
+
+    def aguardar_proximo(self, parar: threading.Event, espera_maxima: float = 60.0):
+        """Bloqueia até o próximo tick ocupado vencer, um job novo chegar ou 'parar' ser sinalizado."""
+        with self._condicao:
+            while self._ticks and not self._slots.get(self._ticks[0]):
+                self._slots.pop(heapq.heappop(self._ticks), None)
+            if self._ticks:
+                espera = self._ticks[0] * self.tick_segundos - time.time()
+                if espera <= 0:
+                    return
+            else:
+                espera = espera_maxima
+            if not parar.is_set():
+                self._condicao.wait(timeout=min(espera, espera_maxima))
+
+    def acordar(self):
+        with self._condicao:
+            self._condicao.notify_all()
+
+
+_roda = RodaDeTempo(AGENDADOR_TICK_SECONDS)
+_thread: Optional[threading.Thread] = None
+_parar = threading.Event()
+_thread_lock = threading.Lock()
+
+
+def _agendar_local(db: firestore.client, tipo: str, executar_em: datetime, payload: Dict, chave: Optional[str]) -> str:
+    job_id = f"{tipo}:{chave}" if chave else f"{tipo}:{uuid.uuid4().hex}"
+    db.collection(JOBS_COLLECTION).document(job_id).set({
+        'tipo': tipo,
+        'payload': payload,
+        'executar_em': executar_em,
+        'status': STATUS_PENDENTE,
+        'criado_em': datetime.now(timezone.utc),
+        'ultimo_erro': None,
+    })
+    _roda.adicionar(_Job(job_id, tipo, executar_em, payload))
+    return job_id
+
+
+def _cancelar_local(db: firestore.client, job_id: str) -> bool:
+    job_ref = db.collection(JOBS_COLLECTION).document(job_id)
+    existia = _roda.remover(job_id) or job_ref.get().exists
+    job_ref.delete()
+    return existia
+
+
+def processar_jobs_vencidos(db: firestore.client, ate: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Executa (na thread atual) os jobs do backend local vencidos até 'ate'
+    (padrão: agora), uma chamada por tipo com todos os payloads do tipo.
+    Jobs executados saem de 'jobs_agendados'; lotes que falham ficam lá com status 'erro'.
+    """
+    from bulk_writer import EscritorEmLote
+
+    vencidos = _roda.retirar_vencidos(_utc(ate) if ate else datetime.now(timezone.utc))
+    stats = {"jobs_executados": 0, "jobs_com_erro": 0, "lotes": 0}
+    if not vencidos:
+        return stats
+
+    por_tipo: Dict[str, List[_Job]] = {}
+    for job in vencidos:
+        por_tipo.setdefault(job.tipo, []).append(job)
+
+    colecao = db.collection(JOBS_COLLECTION)
+    for tipo, jobs in por_tipo.items():
+        stats["lotes"] += 1
+        erro = None
+        try:
+            tipo_job = _tipos.get(tipo)
+            if tipo_job is None:
+                raise ValueError(f"Tipo de job não registrado: '{tipo}'")
+            tipo_job.executar_lote(db, [job.payload for job in jobs])
+        except Exception as e:
+            erro = e
+            logger.error("❌ Lote de %d job(s) '%s' falhou: %s", len(jobs), tipo, e)
+
+        with EscritorEmLote(db, descricao=f"jobs_agendados:{tipo}") as escritor:
+            for job in jobs:
+                if erro is None:
+                    escritor.delete(colecao.document(job.id))
+                else:
+                    escritor.update(colecao.document(job.id), {'status': STATUS_ERRO, 'ultimo_erro': str(erro)[:500]})
+        stats["jobs_com_erro" if erro else "jobs_executados"] += len(jobs)
+
+    logger.info("⏰ Jobs agendados executados: %s", stats)
+    return stats
+
+
+def _executar_roda(db: firestore.client):
+    while not _parar.is_set():
+        try:
+            _roda.aguardar_proximo(_parar)
+            if not _parar.is_set():
+                processar_jobs_vencidos(db)
+        except Exception as e:
+            logger.error("❌ Erro na roda de tempo do agendador: %s", e)
+            _parar.wait(AGENDADOR_TICK_SECONDS)
+
+
+def iniciar(db: firestore.client) -> int:
+    """
+    Com o backend local, recarrega os jobs pendentes de 'jobs_agendados' e
+    inicia a thread da roda de tempo (chamado no startup de main.py).
+    Sem efeito com o backend cloud_tasks.
+
+    Returns:
+        Quantidade de jobs recarregados
+    """
+    global _thread
+    if AGENDADOR_BACKEND != BACKEND_LOCAL:
+        return 0
+
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return 0
+
+        recarregados = 0
+        for doc in db.collection(JOBS_COLLECTION).where('status', '==', STATUS_PENDENTE).stream():
+            dados = doc.to_dict() or {}
+            executar_em = dados.get('executar_em')
+            if dados.get('tipo') and isinstance(executar_em, datetime):
+                _roda.adicionar(_Job(doc.id, dados['tipo'], _utc(executar_em), dados.get('payload') or {}))
+                recarregados += 1
+
+        _parar.clear()
+        _thread = threading.Thread(target=_executar_roda, args=(db,), name="agendador-roda", daemon=True)
+        _thread.start()
+
+    logger.info("⏰ Agendador local iniciado (tick de %ss, %d job(s) recarregados)", AGENDADOR_TICK_SECONDS, recarregados)
+    return recarregados
+
+
+def encerrar():
+    """Para a thread da roda de tempo (os jobs pendentes continuam em 'jobs_agendados')."""
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            return
+        _parar.set()
+        _roda.acordar()
+        _thread.join(timeout=5)
+        _thread = None
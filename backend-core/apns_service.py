@@ -12,18 +12,37 @@ Configuração necessária:
    - APNS_TEAM_ID=M83XX73UUS
    - APNS_TOPIC=web.ygg.conciergeanalicegrubert
    - APNS_USE_SANDBOX=False  (True para desenvolvimento, False para produção)
+
+Desempenho (opcionais):
+   - APNS_MAX_CONCURRENCY=10        (envios simultâneos no mesmo cliente HTTP/2)
+   - APNS_JWT_REFRESH_SECONDS=3000  (a Apple aceita o token entre 20 e 60 minutos)
+   - APNS_TIMEOUT_SECONDS=10
+
+O cliente HTTP/2 é mantido aberto entre envios (uma única conexão TLS com
+streams multiplexados), assim como o pool de threads dos envios em lote, e o
+JWT do provedor é reutilizado até a renovação, em vez de um handshake e uma
+assinatura por token. Quando a Apple recusa o JWT (ExpiredProviderToken), só
+uma thread o renova: a Apple responde TooManyProviderTokenUpdates a renovações
+frequentes.
 """
 
 import os
 import logging
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 import httpx
 import jwt
 
+from metricas import registrar_push
+
 logger = logging.getLogger(__name__)
 
+# Motivos retornados pela Apple (status 400/410) que indicam token que nunca mais será válido
+MOTIVOS_TOKEN_INVALIDO = {"BadDeviceToken", "Unregistered", "DeviceTokenNotForTopic"}
+
 
 class APNsService:
     """Serviço para enviar notificações via Apple Push Notification Service (Web Push)"""
@@ -37,6 +56,17 @@ class APNsService:
         self.topic = None
         self.use_sandbox = False
         self.apns_host = None
+        self.max_concorrencia = max(1, int(os.getenv('APNS_MAX_CONCURRENCY', '10')))
+        self.jwt_refresh_segundos = int(os.getenv('APNS_JWT_REFRESH_SECONDS', '3000'))
+        self.timeout_segundos = float(os.getenv('APNS_TIMEOUT_SECONDS', '10'))
+
+        self._client: Optional[httpx.Client] = None
+        self._client_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._auth_token: Optional[str] = None
+        self._auth_token_gerado_em = 0.0
+        self._auth_token_lock = threading.Lock()
 
         try:
             # Carrega configurações do ambiente
@@ -92,6 +122,139 @@ class APNsService:
 
         return token
 
+    def _get_auth_token(self, recusado: Optional[str] = None) -> str:
+        """
+        Retorna o JWT do provedor em cache, renovando-o após APNS_JWT_REFRESH_SECONDS.
+
+        Args:
+            recusado: JWT que a Apple recusou (ExpiredProviderToken). Só é renovado se
+                ainda for o JWT em cache (mesmo iat); se outra thread já o renovou, o
+                novo é reutilizado em vez de gerar outro.
+        """
+        with self._auth_token_lock:
+            expirado = time.time() - self._auth_token_gerado_em >= self.jwt_refresh_segundos
+            recusado_em_cache = recusado is not None and recusado == self._auth_token
+            if self._auth_token is None or expirado or recusado_em_cache:
+                self._auth_token = self._generate_auth_token()
+                self._auth_token_gerado_em = time.time()
+                logger.debug("🔑 JWT do provedor APNs renovado")
+            return self._auth_token
+
+    def _get_client(self) -> httpx.Client:
+        """Retorna o cliente HTTP/2 compartilhado, criando-o na primeira chamada"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        http2=True,
+                        timeout=self.timeout_segundos,
+                        limits=httpx.Limits(
+                            max_connections=self.max_concorrencia,
+                            max_keepalive_connections=self.max_concorrencia
+                        )
+                    )
+        return self._client
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Retorna o pool de threads compartilhado dos envios em lote, criando-o na primeira chamada"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_concorrencia, thread_name_prefix="apns-send")
+        return self._executor
+
+    def close(self):
+        """Fecha o cliente HTTP/2 e o pool de threads compartilhados (ex: no shutdown da aplicação)"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        with self._client_lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def _montar_payload(self, titulo: str, corpo: str, data_payload: Optional[Dict[str, str]]) -> Dict:
+        """Constrói o payload da notificação"""
+        payload = {
+            "aps": {
+                "alert": {
+                    "title": titulo,
+                    "body": corpo
+                },
+                "sound": "default"
+            }
+        }
+
+        # Adiciona dados customizados se fornecidos
+        if data_payload:
+            for key, value in data_payload.items():
+                payload[key] = value
+
+        return payload
+
+    def _enviar(self, token: str, payload: Dict) -> Dict:
+        """Envia o payload para um token e registra latência e resultado nas métricas."""
+        inicio = time.perf_counter()
+        resultado = self._enviar_para_token(token, payload)
+        registrar_push(
+            'apns', inicio,
+            sucessos=int(resultado["sucesso"]),
+            falhas=int(not resultado["sucesso"]),
+            tokens_invalidos=int(resultado["token_invalido"])
+        )
+        return resultado
+
+    def _enviar_para_token(self, token: str, payload: Dict) -> Dict:
+        """
+        Envia o payload para um token usando o cliente compartilhado.
+
+        Returns:
+            {"token", "sucesso", "status", "motivo", "token_invalido"}
+        """
+        resultado = {"token": token, "sucesso": False, "status": None, "motivo": None, "token_invalido": False}
+        url = f"{self.apns_host}/3/device/{token}"
+
+        try:
+            # Uma segunda tentativa só quando a Apple recusa o JWT (ex: expirado/renovado)
+            auth_token = None
+            for _ in range(2):
+                auth_token = self._get_auth_token(recusado=auth_token)
+                headers = {
+                    "authorization": f"bearer {auth_token}",
+                    "apns-topic": self.topic,
+                    "apns-push-type": "alert",
+                    "apns-priority": "10",
+                    "apns-expiration": "0"
+                }
+                response = self._get_client().post(url, headers=headers, json=payload)
+                resultado["status"] = response.status_code
+
+                if response.status_code == 200:
+                    resultado["sucesso"] = True
+                    logger.info(f"✅ Notificação APNs enviada com sucesso para token {token[:15]}...")
+                    return resultado
+
+                try:
+                    resultado["motivo"] = response.json().get("reason")
+                except (json.JSONDecodeError, ValueError):
+                    resultado["motivo"] = response.text
+
+                if response.status_code == 403 and resultado["motivo"] == "ExpiredProviderToken":
+                    continue
+                break
+
+            resultado["token_invalido"] = (
+                resultado["status"] == 410 or resultado["motivo"] in MOTIVOS_TOKEN_INVALIDO
+            )
+            logger.error(f"❌ Erro ao enviar APNs. Status: {resultado['status']}, Motivo: {resultado['motivo']}")
+
+        except Exception as e:
+            resultado["motivo"] = str(e)
+            logger.error(f"❌ Erro ao enviar notificação APNs para token {token[:15]}...: {e}")
+
+        return resultado
+
     def send_notification(
         self,
         token: str,
@@ -115,57 +278,7 @@ class APNsService:
             logger.debug("APNs desabilitado. Ignorando envio.")
             return False
 
-        try:
-            # Gera o token de autenticação
-            auth_token = self._generate_auth_token()
-
-            # Constrói o payload da notificação
-            payload = {
-                "aps": {
-                    "alert": {
-                        "title": titulo,
-                        "body": corpo
-                    },
-                    "sound": "default"
-                }
-            }
-
-            # Adiciona dados customizados se fornecidos
-            if data_payload:
-                for key, value in data_payload.items():
-                    payload[key] = value
-
-            # Headers da requisição
-            headers = {
-                "authorization": f"bearer {auth_token}",
-                "apns-topic": self.topic,
-                "apns-push-type": "alert",
-                "apns-priority": "10",
-                "apns-expiration": "0"
-            }
-
-            # URL do endpoint APNs
-            url = f"{self.apns_host}/3/device/{token}"
-
-            # Envia a requisição HTTP/2
-            with httpx.Client(http2=True) as client:
-                response = client.post(
-                    url,
-                    headers=headers,
-                    json=payload,
-                    timeout=10.0
-                )
-
-            if response.status_code == 200:
-                logger.info(f"✅ Notificação APNs enviada com sucesso para token {token[:15]}...")
-                return True
-            else:
-                logger.error(f"❌ Erro ao enviar APNs. Status: {response.status_code}, Response: {response.text}")
-                return False
-
-        except Exception as e:
-            logger.error(f"❌ Erro ao enviar notificação APNs para token {token[:15]}...: {e}")
-            return False
+        return self._enviar(token, self._montar_payload(titulo, corpo, data_payload))["sucesso"]
 
     def send_notification_batch(
         self,
@@ -173,9 +286,10 @@ class APNsService:
         titulo: str,
         corpo: str,
         data_payload: Optional[Dict[str, str]] = None
-    ) -> Dict[str, int]:
+    ) -> Dict:
         """
-        Envia notificações para múltiplos tokens Safari (método em loop, seguindo padrão FCM).
+        Envia notificações para múltiplos tokens Safari concorrentemente,
+        reutilizando o cliente HTTP/2 e o JWT (até APNS_MAX_CONCURRENCY envios simultâneos).
 
         Args:
             tokens: Lista de tokens APNs
@@ -184,23 +298,37 @@ class APNsService:
             data_payload: Dados extras para a aplicação
 
         Returns:
-            Dicionário com contadores: {"sucessos": X, "falhas": Y}
+            Dicionário: {"sucessos": X, "falhas": Y, "resultados": [...], "tokens_invalidos": [...]}
+            Os tokens em "tokens_invalidos" foram recusados pela Apple (410/BadDeviceToken)
+            e devem ser removidos do usuário.
         """
         if not self.enabled:
             logger.debug("APNs desabilitado. Ignorando envio em lote.")
-            return {"sucessos": 0, "falhas": 0}
-
-        sucessos = 0
-        falhas = 0
-
-        for token in tokens:
-            if self.send_notification(token, titulo, corpo, data_payload):
-                sucessos += 1
-            else:
-                falhas += 1
-
-        logger.info(f"📊 Envio APNs em lote concluído. Sucessos: {sucessos}, Falhas: {falhas}")
-        return {"sucessos": sucessos, "falhas": falhas}
+            return {"sucessos": 0, "falhas": 0, "resultados": [], "tokens_invalidos": []}
+
+        tokens = list(dict.fromkeys(t for t in tokens if t))
+        if not tokens:
+            return {"sucessos": 0, "falhas": 0, "resultados": [], "tokens_invalidos": []}
+
+        payload = self._montar_payload(titulo, corpo, data_payload)
+
+        if len(tokens) == 1 or self.max_concorrencia == 1:
+            resultados = [self._enviar(token, payload) for token in tokens]
+        else:
+            # Pool compartilhado: APNS_MAX_CONCURRENCY limita os envios de todos os lotes juntos
+            resultados = list(self._get_executor().map(lambda token: self._enviar(token, payload), tokens))
+
+        sucessos = sum(1 for r in resultados if r["sucesso"])
+        falhas = len(resultados) - sucessos
+        tokens_invalidos = [r["token"] for r in resultados if r["token_invalido"]]
+
+        logger.info(f"📊 Envio APNs em lote concluído. Sucessos: {sucessos}, Falhas: {falhas}, Tokens inválidos: {len(tokens_invalidos)}")
+        return {
+            "sucessos": sucessos,
+            "falhas": falhas,
+            "resultados": resultados,
+            "tokens_invalidos": tokens_invalidos
+        }
 
 
 # Instância global do serviço (singleton)
@@ -6,11 +6,29 @@ from firebase_admin import auth
 import schemas
 import crud
 from database import get_db
+from firestore_async import get_async_db
+from auth_cache import get_principal_cache
+from data_loader import get_carregador
+import repositorio_async
+import asyncio
 from typing import Optional, Dict
+import logging
+
+logger = logging.getLogger(__name__)
 
 # O OAuth2PasswordBearer ainda pode ser útil para a documentação interativa (botão "Authorize")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False) # auto_error=False é importante para dependências opcionais
 
+def _verificar_token(token: str) -> Dict:
+    """Verifica o ID Token do Firebase. Lança 401 se for inválido ou expirado."""
+    try:
+        return auth.verify_id_token(token)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Token inválido ou expirado: {e}"
+        )
+
 def get_current_user_firebase(token: str = Depends(oauth2_scheme), db = Depends(get_db)) -> schemas.UsuarioProfile:
     """
     Decodifica o ID Token do Firebase, busca o usuário correspondente no Firestore
@@ -21,14 +39,15 @@ def get_current_user_firebase(token: str = Depends(oauth2_scheme), db = Depends(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token de autenticação não fornecido."
         )
-    try:
-        decoded_token = auth.verify_id_token(token)
-        firebase_uid = decoded_token['uid']
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Token inválido ou expirado: {e}"
-        )
+
+    # Perfil já verificado e enriquecido para este mesmo token (ver auth_cache.py)
+    principal_cache = get_principal_cache()
+    usuario_cacheado = principal_cache.obter(token)
+    if usuario_cacheado:
+        return schemas.UsuarioProfile(**usuario_cacheado)
+
+    decoded_token = _verificar_token(token)
+    firebase_uid = decoded_token['uid']
 
     usuario_doc = crud.buscar_usuario_por_firebase_uid(db, firebase_uid=firebase_uid)
     
@@ -51,8 +70,10 @@ def get_current_user_firebase(token: str = Depends(oauth2_scheme), db = Depends(
                     # Interrompe o loop assim que encontrar o primeiro perfil
                     # para evitar sobreposições desnecessárias.
                     break
-    
-    return schemas.UsuarioProfile(**usuario_doc)
+
+    perfil = schemas.UsuarioProfile(**usuario_doc)
+    principal_cache.armazenar(token, decoded_token, usuario_doc)
+    return perfil
 
 
 def validate_negocio_id(
@@ -63,6 +84,10 @@ def validate_negocio_id(
     Valida se o usuário tem permissão para acessar o negócio especificado.
     Super Admin tem acesso a todos os negócios.
     """
+    return _validar_acesso_negocio(negocio_id, current_user)
+
+
+def _validar_acesso_negocio(negocio_id: str, current_user: schemas.UsuarioProfile) -> str:
     # Se for super_admin, permite o acesso a qualquer negócio
     if current_user.roles.get("platform") == "super_admin":
         return negocio_id
@@ -205,30 +230,43 @@ def get_paciente_autorizado(
     para acessar ou modificar os dados de um paciente específico.
     Super Admin tem acesso total.
     """
-    print("--- INICIANDO VERIFICAÇÃO DE ACESSO AO PACIENTE ---")
-    print(f"ID do Paciente alvo: {paciente_id}")
-    print(f"ID do Usuário tentando acessar: {current_user.id}")
-    print(f"Roles do Usuário: {current_user.roles}")
+    if _acesso_paciente_sem_leitura(current_user, paciente_id):
+        return current_user
+
+    # Busca o documento completo do paciente para obter os vínculos
+    paciente_data = _ler_paciente(db, paciente_id)
+    _autorizar_pelos_vinculos_do_paciente(current_user, paciente_data)
+    return current_user
+
+
+def _ler_paciente(db, paciente_id: str) -> Dict:
+    """
+    Documento do paciente pelo mapa de identidade da requisição (data_loader):
+    o endpoint protegido reutiliza esta leitura em vez de buscar o paciente de novo.
+    Lança 404 se o paciente não existe.
+    """
+    paciente_data = get_carregador(db).carregar('usuarios', paciente_id)
+    if paciente_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente não encontrado.")
+    return paciente_data
+
 
+def _acesso_paciente_sem_leitura(current_user: schemas.UsuarioProfile, paciente_id: str) -> bool:
+    """Regras de acesso ao paciente que não dependem do documento dele (Super Admin e o próprio paciente)."""
     # 0. Super Admin tem acesso total a todos os pacientes
     if current_user.roles.get("platform") == "super_admin":
-        print("DEBUG: Acesso permitido. Usuário é Super Admin.")
-        return current_user
+        logger.debug("Acesso ao paciente %s permitido para %s: super admin", paciente_id, current_user.id)
+        return True
 
     # 1. O próprio paciente sempre tem acesso.
     if current_user.id == paciente_id:
-        print("DEBUG: Acesso permitido. Usuário é o próprio paciente.")
-        return current_user
+        logger.debug("Acesso ao paciente %s permitido: o próprio paciente", paciente_id)
+        return True
+    return False
 
-    # Busca o documento completo do paciente para obter os vínculos
-    paciente_doc_ref = db.collection('usuarios').document(paciente_id)
-    paciente_doc = paciente_doc_ref.get()
-    if not paciente_doc.exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente não encontrado.")
-    
-    paciente_data = paciente_doc.to_dict()
-    print(f"Dados do Paciente no DB: {paciente_data}")
-    
+
+def _autorizar_pelos_vinculos_do_paciente(current_user: schemas.UsuarioProfile, paciente_data: Dict):
+    """Regras de acesso pelos vínculos do paciente (admin da clínica, enfermeiro, técnicos). Lança 403 se nenhuma atende."""
     # Extrai o negocio_id do paciente
     negocio_id_paciente = list(paciente_data.get('roles', {}).keys())[0] if paciente_data.get('roles') else None
     if not negocio_id_paciente:
@@ -236,25 +274,25 @@ def get_paciente_autorizado(
 
     # 2. O Gestor (admin) da clínica do paciente tem acesso.
     if current_user.roles.get(negocio_id_paciente) == 'admin':
-        print("DEBUG: Acesso permitido. Usuário é admin da clínica.")
-        return current_user
+        logger.debug("Acesso a paciente permitido para %s: admin do negócio %s", current_user.id, negocio_id_paciente)
+        return
         
     # 3. O Enfermeiro vinculado ao paciente tem acesso.
     enfermeiro_vinculado_id = paciente_data.get('enfermeiro_id')
     if enfermeiro_vinculado_id and current_user.id == enfermeiro_vinculado_id:
-        print("DEBUG: Acesso permitido. Usuário é o enfermeiro vinculado.")
-        return current_user
+        logger.debug("Acesso a paciente permitido para %s: enfermeiro vinculado", current_user.id)
+        return
 
     # --- INÍCIO DA CORREÇÃO ---
     # 4. O Técnico vinculado ao paciente tem acesso.
     tecnicos_vinculados_ids = paciente_data.get('tecnicos_ids', [])
     if current_user.id in tecnicos_vinculados_ids:
-        print("DEBUG: Acesso permitido. Usuário é um técnico vinculado.")
-        return current_user
+        logger.debug("Acesso a paciente permitido para %s: técnico vinculado", current_user.id)
+        return
     # --- FIM DA CORREÇÃO ---
 
     # Se nenhuma das condições for atendida, nega o acesso.
-    print("--- ACESSO NEGADO. Nenhuma regra de permissão foi atendida. ---")
+    logger.warning("⛔ Acesso a paciente negado para %s: nenhuma regra de permissão atendida", current_user.id)
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
         detail="Acesso negado: você não tem permissão para visualizar ou modificar os dados deste paciente."
@@ -332,11 +370,7 @@ def get_paciente_autorizado_anamnese(
     if current_user.id == paciente_id:
         return current_user
 
-    paciente_doc = db.collection('usuarios').document(paciente_id).get()
-    if not paciente_doc.exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente não encontrado.")
-    
-    paciente_data = paciente_doc.to_dict()
+    paciente_data = _ler_paciente(db, paciente_id)
     negocio_id_paciente = list(paciente_data.get('roles', {}).keys())[0] if paciente_data.get('roles') else None
     if not negocio_id_paciente:
          raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Paciente não está associado a uma clínica.")
@@ -396,12 +430,7 @@ def get_admin_or_profissional_autorizado_paciente(
         return current_user
 
     # Busca o documento completo do paciente para obter o negócio
-    paciente_doc_ref = db.collection('usuarios').document(paciente_id)
-    paciente_doc = paciente_doc_ref.get()
-    if not paciente_doc.exists:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente não encontrado.")
-
-    paciente_data = paciente_doc.to_dict()
+    paciente_data = _ler_paciente(db, paciente_id)
 
     # Extrai o negocio_id do paciente
     negocio_id_paciente = list(paciente_data.get('roles', {}).keys())[0] if paciente_data.get('roles') else None
@@ -460,4 +489,71 @@ def get_relatorio_autorizado(
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
         detail="Acesso negado: você não tem permissão para visualizar este relatório."
-    )
\ No newline at end of file
+    )
+
+
+# =================================================================================
+# DEPENDÊNCIAS ASSÍNCRONAS (endpoints 'async def', ver repositorio_async.py)
+# =================================================================================
+# Mesmas regras das dependências síncronas acima, com as leituras feitas pelo
+# AsyncClient do Firestore. Um endpoint async não deve depender das versões
+# síncronas: elas rodariam no threadpool e anulariam o ganho.
+
+async def get_current_user_firebase_async(
+    token: str = Depends(oauth2_scheme), db_async = Depends(get_async_db)
+) -> schemas.UsuarioProfile:
+    """Versão assíncrona de get_current_user_firebase (compartilha o cache de principal)."""
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token de autenticação não fornecido."
+        )
+
+    principal_cache = get_principal_cache()
+    usuario_cacheado = principal_cache.obter(token)
+    if usuario_cacheado:
+        return schemas.UsuarioProfile(**usuario_cacheado)
+
+    # A verificação pode buscar os certificados públicos do Google (HTTP síncrono)
+    decoded_token = await asyncio.to_thread(_verificar_token, token)
+    firebase_uid = decoded_token['uid']
+
+    usuario_doc = await repositorio_async.buscar_usuario_por_firebase_uid(db_async, firebase_uid)
+    if not usuario_doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Perfil de usuário não encontrado em nosso sistema."
+        )
+
+    usuario_doc['profissional_id'] = await repositorio_async.buscar_profissional_id_por_roles(
+        db_async, usuario_doc.get('roles'), firebase_uid
+    )
+
+    perfil = schemas.UsuarioProfile(**usuario_doc)
+    principal_cache.armazenar(token, decoded_token, usuario_doc)
+    return perfil
+
+
+async def validate_negocio_id_async(
+    negocio_id: str = Header(..., description="ID do Negócio a ser validado."),
+    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase_async)
+):
+    """Versão assíncrona de validate_negocio_id."""
+    return _validar_acesso_negocio(negocio_id, current_user)
+
+
+async def get_paciente_autorizado_async(
+    paciente_id: str = Path(..., description="ID do paciente cujos dados estão sendo acessados."),
+    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase_async),
+    db_async = Depends(get_async_db)
+) -> schemas.UsuarioProfile:
+    """Versão assíncrona de get_paciente_autorizado."""
+    if _acesso_paciente_sem_leitura(current_user, paciente_id):
+        return current_user
+
+    paciente_data = await repositorio_async.buscar_documento_usuario(db_async, paciente_id)
+    if paciente_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente não encontrado.")
+
+    _autorizar_pelos_vinculos_do_paciente(current_user, paciente_data)
+    return current_user
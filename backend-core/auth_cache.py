@@ -0,0 +1,181 @@
+"""
+Cache em memória do usuário autenticado (principal) para get_current_user_firebase.
+
+Cada requisição autenticada executava verify_id_token, a busca do usuário por
+firebase_uid, as descriptografias dos dados sensíveis e a busca do perfil
+profissional. Este cache guarda o perfil já enriquecido, indexado pelo hash do
+ID Token, evitando esse custo nas requisições seguintes com o mesmo token.
+
+REGRAS:
+- A validade de cada entrada é o menor valor entre AUTH_CACHE_TTL_SECONDS e o
+  'exp' do próprio token (um token expirado nunca é servido do cache).
+- Quando o limite AUTH_CACHE_MAX_ENTRIES é atingido, a entrada usada há mais
+  tempo é descartada (LRU).
+- As funções de escrita do crud que alteram o perfil chamam
+  invalidar_usuario() para que a próxima requisição busque o dado atualizado
+  (o documento também sai do mapa de identidade da requisição, ver data_loader.py).
+  A invalidação é local à instância; as demais instâncias do Cloud Run
+  enxergam a alteração no máximo após o TTL.
+
+Configuração (variáveis de ambiente):
+    AUTH_CACHE_ENABLED=true
+    AUTH_CACHE_TTL_SECONDS=60
+    AUTH_CACHE_MAX_ENTRIES=1000
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from data_loader import esquecer_documento
+
+logger = logging.getLogger(__name__)
+
+# Margem de segurança para não servir um token que está prestes a expirar
+_MARGEM_EXPIRACAO_SEGUNDOS = 5
+
+
+def _hash_token(token: str) -> str:
+    """Gera a chave do cache a partir do token (o token em si nunca é armazenado)."""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class PrincipalCache:
+    """Cache LRU com TTL dos perfis de usuários autenticados."""
+
+    def __init__(self, ttl_segundos: int = 60, max_entradas: int = 1000, enabled: bool = True):
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.enabled = enabled and ttl_segundos > 0 and max_entradas > 0
+        self._lock = threading.Lock()
+        # chave -> (expira_em, firebase_uid, usuario_id, usuario_doc)
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        # Índices para invalidação por firebase_uid e por ID do documento
+        self._chaves_por_uid: Dict[str, set] = {}
+        self._chaves_por_usuario_id: Dict[str, set] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, token: str) -> Optional[Dict]:
+        """Retorna uma cópia do perfil em cache para o token, ou None se ausente/expirado."""
+        if not self.enabled:
+            return None
+
+        chave = _hash_token(token)
+        agora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            if entrada[0] <= agora:
+                self._remover_chave(chave)
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            usuario_doc = entrada[3]
+
+        # Cópia para que o chamador possa alterar o dicionário sem afetar o cache
+        return copy.deepcopy(usuario_doc)
+
+    def armazenar(self, token: str, decoded_token: Dict, usuario_doc: Dict) -> None:
+        """Armazena o perfil enriquecido respeitando o TTL e o 'exp' do token."""
+        if not self.enabled:
+            return
+
+        agora = time.time()
+        expira_em = agora + self.ttl_segundos
+        token_exp = decoded_token.get('exp')
+        if token_exp:
+            expira_em = min(expira_em, float(token_exp) - _MARGEM_EXPIRACAO_SEGUNDOS)
+        if expira_em <= agora:
+            return
+
+        chave = _hash_token(token)
+        firebase_uid = decoded_token.get('uid') or usuario_doc.get('firebase_uid')
+        usuario_id = usuario_doc.get('id')
+
+        with self._lock:
+            if chave in self._entradas:
+                self._remover_chave(chave)
+            self._entradas[chave] = (expira_em, firebase_uid, usuario_id, copy.deepcopy(usuario_doc))
+            if firebase_uid:
+                self._chaves_por_uid.setdefault(firebase_uid, set()).add(chave)
+            if usuario_id:
+                self._chaves_por_usuario_id.setdefault(usuario_id, set()).add(chave)
+
+            while len(self._entradas) > self.max_entradas:
+                chave_antiga = next(iter(self._entradas))
+                self._remover_chave(chave_antiga)
+
+    def invalidar(self, firebase_uid: Optional[str] = None, usuario_id: Optional[str] = None) -> int:
+        """Remove todas as entradas do usuário. Retorna quantas entradas foram removidas."""
+        with self._lock:
+            chaves = set()
+            if firebase_uid:
+                chaves |= self._chaves_por_uid.get(firebase_uid, set())
+            if usuario_id:
+                chaves |= self._chaves_por_usuario_id.get(usuario_id, set())
+            for chave in chaves:
+                self._remover_chave(chave)
+
+        if chaves:
+            logger.debug(f"Cache de autenticação invalidado: {len(chaves)} entrada(s) (uid={firebase_uid}, id={usuario_id})")
+        return len(chaves)
+
+    def limpar(self) -> None:
+        """Remove todas as entradas do cache."""
+        with self._lock:
+            self._entradas.clear()
+            self._chaves_por_uid.clear()
+            self._chaves_por_usuario_id.clear()
+
+    def estatisticas(self) -> Dict[str, int]:
+        """Retorna contadores simples para diagnóstico."""
+        with self._lock:
+            return {"entradas": len(self._entradas), "hits": self.hits, "misses": self.misses}
+
+    def _remover_chave(self, chave: str) -> None:
+        """Remove uma chave e seus índices. Deve ser chamado com o lock adquirido."""
+        entrada = self._entradas.pop(chave, None)
+        if entrada is None:
+            return
+        _, firebase_uid, usuario_id, _ = entrada
+        for indice, valor in ((self._chaves_por_uid, firebase_uid), (self._chaves_por_usuario_id, usuario_id)):
+            if valor and valor in indice:
+                indice[valor].discard(chave)
+                if not indice[valor]:
+                    del indice[valor]
+
+
+# Instância global do cache (singleton)
+_principal_cache_instance = None
+
+def get_principal_cache() -> PrincipalCache:
+    """Retorna a instância singleton do PrincipalCache"""
+    global _principal_cache_instance
+    if _principal_cache_instance is None:
+        _principal_cache_instance = PrincipalCache(
+            ttl_segundos=int(os.getenv('AUTH_CACHE_TTL_SECONDS', '60')),
+            max_entradas=int(os.getenv('AUTH_CACHE_MAX_ENTRIES', '1000')),
+            enabled=os.getenv('AUTH_CACHE_ENABLED', 'True').lower() == 'true'
+        )
+    return _principal_cache_instance
+
+
+def invalidar_usuario(firebase_uid: Optional[str] = None, usuario_id: Optional[str] = None) -> None:
+    """
+    Hook de invalidação chamado pelas funções de escrita do crud.
+    Nunca lança exceção: uma falha aqui não pode derrubar a operação de escrita.
+    """
+    try:
+        esquecer_documento('usuarios', usuario_id)
+        get_principal_cache().invalidar(firebase_uid=firebase_uid, usuario_id=usuario_id)
+    except Exception as e:
+        logger.error(f"Erro ao invalidar cache de autenticação (uid={firebase_uid}, id={usuario_id}): {e}")
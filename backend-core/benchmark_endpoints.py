@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos endpoints de leitura contra o Firestore em memória (firestore_fake.py).
+
+Monta negócios fictícios (admin, médico, enfermeiros, técnicos e pacientes com
+plano de cuidado, registros diários, relatórios e notificações), chama os
+endpoints pela TestClient do FastAPI e imprime, por endpoint, a latência
+(p50/p95) e as operações de Firestore de UMA requisição (leituras, escritas,
+round trips).
+
+A latência medida é a da aplicação + Firestore em memória (sem rede): serve para
+comparar versões do código, não para estimar a latência em produção. Os números
+de operações são os que o Firestore cobraria.
+
+Sem Firebase, KMS nem rede: o Firestore (síncrono e AsyncClient) é substituído via dependency_overrides,
+o verify_id_token aceita o próprio firebase_uid como token e a criptografia usa
+a chave derivada de KMS_CRYPTO_KEY_NAME (sem chamar o KMS).
+
+USO:
+    python benchmark_endpoints.py
+    python benchmark_endpoints.py --pacientes 5000 --registros-por-paciente 10   # 5k pacientes / 50k registros
+    python benchmark_endpoints.py --salvar baseline.json
+    python benchmark_endpoints.py --comparar baseline.json   # falha se leituras/round trips aumentarem
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+# Precisa estar definido antes de importar o app (lido na importação dos módulos)
+os.environ.setdefault('OUTBOX_BACKEND', 'sincrono')
+os.environ.setdefault('KMS_CRYPTO_KEY_NAME', 'benchmark-local')
+
+from firestore_fake import FakeFirestore, FakeAsyncFirestore, transactional as fake_transactional
+
+
+def configurar_app(db: FakeFirestore, cache_auth: bool):
+    """Importa o app e troca Firestore, autenticação e criptografia pelos equivalentes locais."""
+    if not cache_auth:
+        os.environ['AUTH_CACHE_ENABLED'] = 'false'
+
+    # crypto_utils inicializa na importação criando o cliente KMS (exige credenciais);
+    # a chave Fernet em si é derivada de KMS_CRYPTO_KEY_NAME, então o cliente não é necessário
+    from google.cloud import kms
+    kms.KeyManagementServiceClient = lambda *a, **kw: None
+
+    from firebase_admin import firestore as admin_firestore
+    admin_firestore.transactional = fake_transactional
+
+    import auth
+    import crud
+    import main
+    from database import get_db
+    from firestore_async import get_async_db
+
+    crud.transactional = fake_transactional
+    auth.auth.verify_id_token = lambda token, *a, **kw: {'uid': token, 'exp': time.time() + 3600}
+    main.app.dependency_overrides[get_db] = lambda: db
+    # Endpoints assíncronos (repositorio_async.py): mesmo armazenamento, mesmo contador
+    main.app.dependency_overrides[get_async_db] = lambda: FakeAsyncFirestore(db)
+
+    from fastapi.testclient import TestClient
+    # Sem o context manager: o startup (inicialização do Firebase) não é executado
+    return TestClient(main.app)
+
+
+# =================================================================================
+# MASSA DE DADOS
+# =================================================================================
+
+def semear(db: FakeFirestore, args) -> dict:
+    """Cria os negócios e retorna os IDs usados para montar as requisições."""
+    from crypto_utils import encrypt_data
+
+    random.seed(args.semente)
+    agora = datetime.now(timezone.utc)
+    hoje_inicio = datetime.combine(date.today(), datetime.min.time(), tzinfo=timezone.utc)
+    cenario = {"negocios": []}
+
+    def usuario(negocio_id, uid, role, **extra):
+        dados = {
+            'nome': encrypt_data(f"Usuário {uid}"),
+            'email': f"{uid}@example.com",
+            'firebase_uid': uid,
+            'telefone': encrypt_data('11999990000'),
+            'roles': {negocio_id: role},
+            'status_por_negocio': {negocio_id: 'ativo'},
+            'fcm_tokens': [],
+            'apns_tokens': [],
+            **extra
+        }
+        return db.semear('usuarios', uid, dados)
+
+    for n in range(args.negocios):
+        negocio_id = f"negocio-{n}"
+        db.semear('negocios', negocio_id, {'nome': f"Clínica {n}", 'admin_uid': f"{negocio_id}-admin"})
+
+        admin_id = usuario(negocio_id, f"{negocio_id}-admin", 'admin')
+        medico_id = usuario(negocio_id, f"{negocio_id}-medico", 'medico')
+        enfermeiros = [usuario(negocio_id, f"{negocio_id}-enf-{i}", 'profissional') for i in range(args.enfermeiros)]
+        tecnicos = [usuario(negocio_id, f"{negocio_id}-tec-{i}", 'tecnico') for i in range(args.tecnicos)]
+
+        profissionais = [
+            db.semear('profissionais', None, {'negocio_id': negocio_id, 'usuario_uid': uid, 'nome': uid, 'ativo': True,
+                                              'fotos': {'thumbnail': f"https://example.com/{uid}.jpg"}})
+            for uid in [admin_id] + enfermeiros
+        ]
+
+        for i in range(args.postagens):
+            postagem_id = db.semear('postagens', None, {
+                'negocio_id': negocio_id, 'profissional_id': profissionais[i % len(profissionais)],
+                'titulo': f"Postagem {i}", 'descricao': '...', 'fotos': {},
+                'profissional_nome': 'Profissional', 'data_postagem': agora - timedelta(hours=i),
+                'total_curtidas': 0, 'total_comentarios': 0,
+            })
+            if i % 3 == 0:
+                db.semear(f"postagens/{postagem_id}/curtidas", enfermeiros[0], {'data': agora})
+
+        for uid in [admin_id, medico_id] + enfermeiros + tecnicos:
+            for i in range(args.notificacoes_por_usuario):
+                db.semear(f"usuarios/{uid}/notificacoes", None, {
+                    'title': 'Notificação', 'body': f"Mensagem {i}", 'lida': i % 3 == 0,
+                    'tipo': 'GERAL', 'data_criacao': agora - timedelta(minutes=i),
+                })
+
+        pacientes = []
+        relatorio_id = None
+        for p in range(args.pacientes):
+            enfermeiro_id = enfermeiros[p % len(enfermeiros)]
+            tecnicos_ids = random.sample(tecnicos, min(2, len(tecnicos)))
+            paciente_id = usuario(negocio_id, f"{negocio_id}-pac-{p}", 'cliente',
+                                  enfermeiro_id=enfermeiro_id, tecnicos_ids=tecnicos_ids)
+            pacientes.append(paciente_id)
+            base = f"usuarios/{paciente_id}"
+
+            consulta_id = None
+            for c in range(2):
+                consulta_id = db.semear(f"{base}/consultas", None, {
+                    'negocio_id': negocio_id, 'paciente_id': paciente_id, 'resumo': f"Plano {c}",
+                    'data_consulta': agora - timedelta(days=30 - c), 'created_at': agora - timedelta(days=30 - c),
+                })
+            for i in range(3):
+                item = {'negocio_id': negocio_id, 'paciente_id': paciente_id, 'consulta_id': consulta_id,
+                        'data_criacao': agora - timedelta(days=10)}
+                db.semear(f"{base}/medicacoes", None, {**item, 'nome_medicamento': f"Med {i}", 'dosagem': '10mg', 'instrucoes': '8/8h'})
+                db.semear(f"{base}/checklist", None, {**item, 'descricao_item': f"Item {i}", 'concluido': False})
+                db.semear(f"{base}/orientacoes", None, {**item, 'titulo': f"Orientação {i}", 'conteudo': '...'})
+
+            for r in range(args.registros_por_paciente):
+                tecnico_id = tecnicos_ids[r % len(tecnicos_ids)]
+                data_registro = agora - timedelta(hours=6 * r)
+                db.semear(f"{base}/registros_diarios_estruturados", None, {
+                    'negocio_id': negocio_id, 'paciente_id': paciente_id, 'usuario_id': tecnico_id,
+                    'tipo': 'anotacao', 'data_registro': data_registro,
+                    'conteudo': {'descricao': encrypt_data(f"Registro {r}")},
+                })
+                db.semear(f"{base}/prontuarios", None, {
+                    'negocio_id': negocio_id, 'tipo': 'anotacao', 'data': data_registro, 'texto': f"Prontuário {r}",
+                    'tecnico': {'id': tecnico_id, 'nome': 'Técnico', 'email': f"{tecnico_id}@example.com"},
+                })
+
+            if p % 5 == 0:
+                relatorio_id = db.semear('relatorios_medicos', None, {
+                    'paciente_id': paciente_id, 'negocio_id': negocio_id, 'criado_por_id': enfermeiro_id,
+                    'medico_id': medico_id, 'consulta_id': consulta_id, 'conteudo': 'Relatório',
+                    'status': 'pendente' if p % 10 == 0 else 'aprovado', 'fotos': [],
+                    'data_criacao': hoje_inicio - timedelta(days=p % 30),
+                })
+
+        cenario["negocios"].append({
+            "negocio_id": negocio_id, "admin": admin_id, "medico": medico_id,
+            "enfermeiro": enfermeiros[0], "tecnico": tecnicos[0],
+            "paciente": pacientes[0] if pacientes else None, "relatorio": relatorio_id,
+        })
+
+    return cenario
+
+
+def montar_requisicoes(cenario: dict) -> list:
+    """(nome, token, url, headers) de cada endpoint medido, usando o primeiro negócio."""
+    n = cenario["negocios"][0]
+    negocio_id, paciente_id = n["negocio_id"], n["paciente"]
+    cabecalho_negocio = {'negocio-id': negocio_id}
+
+    requisicoes = [
+        ("GET /notificacoes", n["enfermeiro"], "/notificacoes", {}),
+        ("GET /notificacoes?limit=20", n["enfermeiro"], "/notificacoes?limit=20", {}),
+        ("GET /notificacoes/nao-lidas/contagem", n["enfermeiro"], "/notificacoes/nao-lidas/contagem", {}),
+        ("GET /negocios/{id}/usuarios", n["admin"], f"/negocios/{negocio_id}/usuarios", {}),
+        ("GET /negocios/{id}/clientes", n["admin"], f"/negocios/{negocio_id}/clientes", {}),
+        ("GET /me/pacientes (admin)", n["admin"], "/me/pacientes", cabecalho_negocio),
+        ("GET /me/pacientes (técnico)", n["tecnico"], "/me/pacientes", cabecalho_negocio),
+        ("GET /medico/relatorios/pendentes", n["medico"], "/medico/relatorios/pendentes", cabecalho_negocio),
+        ("GET /medico/relatorios/pendentes?limit=20", n["medico"], "/medico/relatorios/pendentes?limit=20", cabecalho_negocio),
+        ("GET /medico/relatorios/contadores", n["medico"], "/medico/relatorios/contadores", cabecalho_negocio),
+        ("GET /feed", n["enfermeiro"], f"/feed?negocio_id={negocio_id}", {}),
+        ("GET /feed?limit=20", n["enfermeiro"], f"/feed?negocio_id={negocio_id}&limit=20", {}),
+    ]
+    if paciente_id:
+        requisicoes += [
+            ("GET /pacientes/{id}/ficha-completa", n["enfermeiro"], f"/pacientes/{paciente_id}/ficha-completa", {}),
+            ("GET /pacientes/{id}/registros", n["enfermeiro"], f"/pacientes/{paciente_id}/registros", {}),
+            ("GET /pacientes/{id}/checklist-diario", n["enfermeiro"],
+             f"/pacientes/{paciente_id}/checklist-diario?data={date.today().isoformat()}", cabecalho_negocio),
+        ]
+    if n["relatorio"]:
+        requisicoes.append(("GET /relatorios/{id}", n["medico"], f"/relatorios/{n['relatorio']}", {}))
+    return requisicoes
+
+
+# =================================================================================
+# MEDIÇÃO
+# =================================================================================
+
+def medir(client, db: FakeFirestore, requisicoes: list, repeticoes: int) -> list:
+    resultados = []
+    for nome, token, url, headers in requisicoes:
+        headers = {**headers, 'Authorization': f"Bearer {token}"}
+
+        # Aquecimento: popula o cache de autenticação e replicações do dia (checklist)
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.get(url, headers=headers)
+
+        latencias, operacoes, status_http = [], None, None
+        for _ in range(repeticoes):
+            db.contador.zerar()
+            inicio = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                resposta = client.get(url, headers=headers)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            operacoes = db.contador.snapshot()
+            status_http = resposta.status_code
+
+        latencias.sort()
+        resultados.append({
+            "endpoint": nome,
+            "status": status_http,
+            "p50_ms": round(statistics.median(latencias), 2),
+            "p95_ms": round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))], 2),
+            **operacoes,
+        })
+    return resultados
+
+
+def imprimir_tabela(resultados: list):
+    colunas = [("endpoint", "Endpoint", 42), ("status", "Status", 6), ("p50_ms", "p50 ms", 9),
+               ("p95_ms", "p95 ms", 9), ("leituras", "Leituras", 9), ("escritas", "Escritas", 9),
+               ("round_trips", "Round trips", 11)]
+    print(" ".join(titulo.ljust(largura) if chave == "endpoint" else titulo.rjust(largura)
+                   for chave, titulo, largura in colunas))
+    print(" ".join("-" * largura for _, _, largura in colunas))
+    for linha in resultados:
+        print(" ".join(str(linha[chave]).ljust(largura) if chave == "endpoint" else str(linha[chave]).rjust(largura)
+                       for chave, _, largura in colunas))
+
+
+def comparar_com_baseline(resultados: list, caminho: str, tolerancia: float) -> bool:
+    """Retorna False se algum endpoint passou a fazer mais leituras ou round trips que o baseline."""
+    with open(caminho, 'r', encoding='utf-8') as f:
+        baseline = {linha["endpoint"]: linha for linha in json.load(f)["resultados"]}
+
+    ok = True
+    for linha in resultados:
+        anterior = baseline.get(linha["endpoint"])
+        if not anterior:
+            continue
+        for metrica in ("leituras", "round_trips"):
+            limite = anterior[metrica] * (1 + tolerancia)
+            if linha[metrica] > limite:
+                ok = False
+                print(f"❌ {linha['endpoint']}: {metrica} {anterior[metrica]} -> {linha[metrica]}")
+    if ok:
+        print(f"✅ Nenhum endpoint aumentou leituras/round trips em relação a {caminho}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos endpoints contra o Firestore em memória.")
+    parser.add_argument('--negocios', type=int, default=1)
+    parser.add_argument('--pacientes', type=int, default=500, help="Pacientes por negócio.")
+    parser.add_argument('--registros-por-paciente', type=int, default=10)
+    parser.add_argument('--enfermeiros', type=int, default=5, help="Enfermeiros por negócio.")
+    parser.add_argument('--tecnicos', type=int, default=10, help="Técnicos por negócio.")
+    parser.add_argument('--notificacoes-por-usuario', type=int, default=200)
+    parser.add_argument('--postagens', type=int, default=300, help="Postagens do feed por negócio.")
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--sem-cache-auth', action='store_true', help="Desativa o cache de autenticação.")
+    parser.add_argument('--salvar', help="Grava os resultados em JSON (para usar como baseline).")
+    parser.add_argument('--comparar', help="Compara com um baseline salvo e falha se houver regressão.")
+    parser.add_argument('--tolerancia', type=float, default=0.0, help="Aumento relativo aceito na comparação (0.1 = 10%%).")
+    args = parser.parse_args()
+
+    db = FakeFirestore()
+    client = configurar_app(db, cache_auth=not args.sem_cache_auth)
+    # Depois do import do app: main.py configura o logging (LOG_LEVEL) ao ser importado
+    logging.getLogger().setLevel(logging.WARNING)
+
+    inicio = time.perf_counter()
+    cenario = semear(db, args)
+    print(f"🌱 {db.total_documentos()} documentos semeados em {time.perf_counter() - inicio:.1f}s "
+          f"({args.negocios} negócio(s), {args.pacientes} pacientes/negócio, "
+          f"{args.registros_por_paciente} registros/paciente)\n")
+
+    resultados = medir(client, db, montar_requisicoes(cenario), args.repeticoes)
+    imprimir_tabela(resultados)
+
+    if args.salvar:
+        with open(args.salvar, 'w', encoding='utf-8') as f:
+            json.dump({"parametros": vars(args), "resultados": resultados}, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultados gravados em {args.salvar}")
+
+    if args.comparar:
+        print()
+        if not comparar_com_baseline(resultados, args.comparar, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
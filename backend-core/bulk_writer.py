@@ -0,0 +1,213 @@
+"""
+Escrita em lote (estilo BulkWriter) para mutações de muitos documentos no Firestore.
+
+Um único db.batch() aceita no máximo 500 operações: marcar milhares de
+notificações como lidas, por exemplo, falhava inteiro. O EscritorEmLote divide
+as operações em batches de até 500, faz os commits em paralelo num pool
+compartilhado, repete batches com erro transitório (backoff exponencial) e
+registra métricas ao final.
+
+USO:
+    from bulk_writer import EscritorEmLote
+
+    with EscritorEmLote(db, descricao="marcar_todas_como_lidas") as escritor:
+        for doc in query.stream():
+            escritor.update(doc.reference, {'lida': True})
+    escritor.estatisticas  # {"operacoes": ..., "lotes": ..., ...}
+
+IMPORTANTE: cada batch é atômico, mas batches diferentes são independentes e
+podem ser aplicados em qualquer ordem. Não escreva o mesmo documento duas vezes
+no mesmo escritor; para gravações que precisam ser atômicas entre si (documento
++ evento do outbox, por exemplo), use um db.batch() comum.
+
+Configuração (variáveis de ambiente):
+    BULK_WRITER_MAX_PARALELO=4
+    BULK_WRITER_MAX_TENTATIVAS=5
+"""
+
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from google.api_core import exceptions as gexc
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# Limite de operações por commit imposto pelo Firestore
+TAMANHO_MAXIMO_LOTE = 500
+
+MAX_PARALELO = int(os.getenv('BULK_WRITER_MAX_PARALELO', '4'))
+MAX_TENTATIVAS = int(os.getenv('BULK_WRITER_MAX_TENTATIVAS', '5'))
+_BACKOFF_INICIAL_SEGUNDOS = 0.5
+_BACKOFF_MAXIMO_SEGUNDOS = 8.0
+
+# Erros em que repetir o commit do batch é seguro e costuma resolver
+_ERROS_TRANSITORIOS = (
+    gexc.Aborted,
+    gexc.DeadlineExceeded,
+    gexc.InternalServerError,
+    gexc.ResourceExhausted,
+    gexc.ServiceUnavailable,
+)
+
+
+class ErroEscritaEmLote(Exception):
+    """Lançada quando algum batch falhou mesmo após as novas tentativas."""
+
+    def __init__(self, mensagem: str, estatisticas: Dict):
+        super().__init__(mensagem)
+        self.estatisticas = estatisticas
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_PARALELO, thread_name_prefix="bulk-writer")
+    return _executor
+
+
+class EscritorEmLote:
+    """Acumula set/update/delete e faz commit em batches de até 500 operações."""
+
+    def __init__(self, db: firestore.client, descricao: str = "", tamanho_lote: int = TAMANHO_MAXIMO_LOTE,
+                 max_tentativas: int = MAX_TENTATIVAS):
+        self.db = db
+        self.descricao = descricao
+        self.tamanho_lote = max(1, min(tamanho_lote, TAMANHO_MAXIMO_LOTE))
+        self.max_tentativas = max(1, max_tentativas)
+
+        self._pendentes: List[Tuple[str, object, Optional[Dict], Dict]] = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._inicio = time.monotonic()
+        self._fechado = False
+
+        self.estatisticas = {
+            "operacoes": 0,
+            "lotes": 0,
+            "lotes_com_falha": 0,
+            "novas_tentativas": 0,
+            "duracao_ms": 0,
+        }
+
+    # --- Operações ---
+
+    def set(self, doc_ref, dados: Dict, merge: bool = False):
+        self._adicionar(('set', doc_ref, dados, {'merge': merge}))
+
+    def update(self, doc_ref, dados: Dict):
+        self._adicionar(('update', doc_ref, dados, {}))
+
+    def delete(self, doc_ref):
+        self._adicionar(('delete', doc_ref, None, {}))
+
+    # --- Ciclo de vida ---
+
+    def flush(self):
+        """Envia o batch parcial e aguarda todos os commits em andamento."""
+        self._enviar_lote()
+        wait(self._futures)
+
+    def fechar(self) -> Dict:
+        """
+        Envia o que falta, aguarda os commits e retorna as estatísticas.
+
+        Raises:
+            ErroEscritaEmLote: se algum batch falhou após todas as tentativas.
+        """
+        if self._fechado:
+            return self.estatisticas
+        self._fechado = True
+        self.flush()
+
+        self.estatisticas["duracao_ms"] = int((time.monotonic() - self._inicio) * 1000)
+        erros = [f.exception() for f in self._futures if f.exception() is not None]
+
+        if self.estatisticas["operacoes"]:
+            logger.info(
+                f"📦 Escrita em lote{f' ({self.descricao})' if self.descricao else ''}: "
+                f"{self.estatisticas['operacoes']} operações em {self.estatisticas['lotes']} lote(s), "
+                f"{self.estatisticas['lotes_com_falha']} com falha, "
+                f"{self.estatisticas['novas_tentativas']} nova(s) tentativa(s), {self.estatisticas['duracao_ms']}ms"
+            )
+
+        if erros:
+            raise ErroEscritaEmLote(
+                f"{len(erros)} lote(s) falharam na escrita em lote '{self.descricao}': {erros[0]}",
+                dict(self.estatisticas)
+            )
+        return self.estatisticas
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.fechar()
+        else:
+            # Erro no corpo do 'with': não envia o batch parcial, apenas aguarda os commits em andamento
+            self._fechado = True
+            wait(self._futures)
+        return False
+
+    # --- Interno ---
+
+    def _adicionar(self, operacao):
+        if self._fechado:
+            raise RuntimeError("EscritorEmLote já foi fechado")
+        self._pendentes.append(operacao)
+        self.estatisticas["operacoes"] += 1
+        if len(self._pendentes) >= self.tamanho_lote:
+            self._enviar_lote()
+
+    def _enviar_lote(self):
+        if not self._pendentes:
+            return
+        operacoes, self._pendentes = self._pendentes, []
+        self.estatisticas["lotes"] += 1
+        # Os commits herdam o contexto da requisição (ex: rota usada nas métricas)
+        self._futures.append(_get_executor().submit(contextvars.copy_context().run, self._commit_com_retry, operacoes))
+
+    def _commit_com_retry(self, operacoes):
+        espera = _BACKOFF_INICIAL_SEGUNDOS
+        for tentativa in range(1, self.max_tentativas + 1):
+            try:
+                batch = self.db.batch()
+                for tipo, doc_ref, dados, opcoes in operacoes:
+                    if tipo == 'set':
+                        batch.set(doc_ref, dados, merge=opcoes.get('merge', False))
+                    elif tipo == 'update':
+                        batch.update(doc_ref, dados)
+                    else:
+                        batch.delete(doc_ref)
+                batch.commit()
+                return len(operacoes)
+            except _ERROS_TRANSITORIOS as e:
+                if tentativa == self.max_tentativas:
+                    self._registrar_falha(e, len(operacoes))
+                    raise
+                with self._lock:
+                    self.estatisticas["novas_tentativas"] += 1
+                logger.warning(f"⚠️ Commit em lote ({self.descricao}) falhou na tentativa {tentativa}, repetindo em {espera:.1f}s: {e}")
+                time.sleep(espera + random.uniform(0, espera / 2))
+                espera = min(espera * 2, _BACKOFF_MAXIMO_SEGUNDOS)
+            except Exception as e:
+                self._registrar_falha(e, len(operacoes))
+                raise
+
+    def _registrar_falha(self, erro: Exception, quantidade: int):
+        with self._lock:
+            self.estatisticas["lotes_com_falha"] += 1
+        logger.error(f"❌ Commit em lote ({self.descricao}) de {quantidade} operações falhou: {erro}")
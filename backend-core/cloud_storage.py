@@ -0,0 +1,139 @@
+"""
+Armazenamento de arquivos: cliente compartilhado do Cloud Storage, backends
+(GCS ou sistema de arquivos local) e upload em streaming com limite de tamanho.
+
+Cada upload criava um storage.Client() novo: autenticação, descoberta do
+projeto e um novo pool de conexões HTTP a cada chamada. O cliente é
+thread-safe para uploads, então uma única instância por processo atende
+todos os endpoints (e as threads que fazem uploads em paralelo).
+
+Os backends expõem a mesma interface (abrir_escrita/descartar/remover/
+enviar_bytes/url_publica): o upload em streaming (upload_streaming.py) e o
+pipeline de imagens gravam no GCS em produção e no disco local em
+desenvolvimento e testes (STORAGE_BACKEND=local).
+
+USO:
+    from cloud_storage import get_backend_armazenamento
+
+    backend = get_backend_armazenamento(bucket_name)
+    url = backend.enviar_bytes("uploads/x.jpeg", dados, "image/jpeg")
+
+Configuração (variáveis de ambiente):
+    STORAGE_BACKEND=gcs                 # 'local' grava em STORAGE_LOCAL_DIR (desenvolvimento/testes)
+    STORAGE_LOCAL_DIR=uploads/local
+    STORAGE_LOCAL_BASE_URL=             # padrão: file:// + caminho absoluto de STORAGE_LOCAL_DIR
+    UPLOAD_CHUNK_BYTES=1048576          # tamanho de cada bloco do upload resumable
+"""
+
+import logging
+import os
+import threading
+
+from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'gcs').lower()
+STORAGE_LOCAL_DIR = os.getenv('STORAGE_LOCAL_DIR', os.path.join('uploads', 'local'))
+STORAGE_LOCAL_BASE_URL = os.getenv('STORAGE_LOCAL_BASE_URL', '')
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', str(1024 * 1024)))
+
+# O upload resumable do GCS exige blocos múltiplos de 256 KiB
+_GCS_CHUNK_MULTIPLO = 256 * 1024
+
+_storage_client = None
+_storage_client_lock = threading.Lock()
+
+
+def get_storage_client() -> storage.Client:
+    """Retorna a instância singleton do cliente do Cloud Storage (criada no primeiro uso)."""
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+                logger.info("☁️ Cliente do Cloud Storage inicializado")
+    return _storage_client
+
+
+def get_bucket(bucket_name: str) -> storage.Bucket:
+    """Referência ao bucket usando o cliente compartilhado (não faz chamada de rede)."""
+    return get_storage_client().bucket(bucket_name)
+
+
+# =================================================================================
+# BACKENDS
+# =================================================================================
+
+class BackendGCS:
+    """Grava no bucket do Cloud Storage com o cliente compartilhado."""
+
+    def __init__(self, bucket_name: str):
+        self.bucket = get_bucket(bucket_name)
+
+    def abrir_escrita(self, blob_name: str, content_type: str):
+        """Abre um upload resumable; cada write() envia os blocos completos acumulados."""
+        chunk_size = max(_GCS_CHUNK_MULTIPLO, UPLOAD_CHUNK_BYTES // _GCS_CHUNK_MULTIPLO * _GCS_CHUNK_MULTIPLO)
+        return self.bucket.blob(blob_name).open('wb', content_type=content_type, chunk_size=chunk_size)
+
+    def descartar(self, escrita, blob_name: str):
+        """
+        Abandona o upload: sem o close() o bloco final não é enviado, o objeto
+        não é criado e a sessão resumable expira sozinha no GCS.
+        """
+
+    def remover(self, blob_name: str):
+        """Remove um objeto já gravado."""
+        self.bucket.blob(blob_name).delete()
+
+    def enviar_bytes(self, blob_name: str, dados: bytes, content_type: str) -> str:
+        blob = self.bucket.blob(blob_name)
+        blob.upload_from_string(dados, content_type=content_type)
+        return blob.public_url
+
+    def url_publica(self, blob_name: str) -> str:
+        return self.bucket.blob(blob_name).public_url
+
+
+class BackendLocal:
+    """Grava no sistema de arquivos local: substitui o GCS em desenvolvimento e testes."""
+
+    def __init__(self, bucket_name: str, diretorio: str = STORAGE_LOCAL_DIR, base_url: str = STORAGE_LOCAL_BASE_URL):
+        self.raiz = os.path.abspath(os.path.join(diretorio, bucket_name or 'default'))
+        self.base_url = (base_url or f"file://{self.raiz}").rstrip('/')
+
+    def _caminho(self, blob_name: str) -> str:
+        caminho = os.path.abspath(os.path.join(self.raiz, blob_name))
+        if not caminho.startswith(self.raiz + os.sep):
+            raise ValueError(f"Nome de arquivo inválido: {blob_name}")
+        return caminho
+
+    def abrir_escrita(self, blob_name: str, content_type: str):
+        caminho = self._caminho(blob_name)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        return open(caminho, 'wb')
+
+    def descartar(self, escrita, blob_name: str):
+        escrita.close()
+        try:
+            os.remove(self._caminho(blob_name))
+        except OSError:
+            pass
+
+    def remover(self, blob_name: str):
+        os.remove(self._caminho(blob_name))
+
+    def enviar_bytes(self, blob_name: str, dados: bytes, content_type: str) -> str:
+        with self.abrir_escrita(blob_name, content_type) as arquivo:
+            arquivo.write(dados)
+        return self.url_publica(blob_name)
+
+    def url_publica(self, blob_name: str) -> str:
+        return f"{self.base_url}/{blob_name}"
+
+
+def get_backend_armazenamento(bucket_name: str):
+    """Backend configurado em STORAGE_BACKEND para o bucket informado."""
+    if STORAGE_BACKEND == 'local':
+        return BackendLocal(bucket_name)
+    return BackendGCS(bucket_name)
@@ -4,8 +4,19 @@ import schemas
 from datetime import datetime, date, time, timedelta, timezone
 from zoneinfo import ZoneInfo
 import pytz
-from typing import Optional, List, Dict, Union
-from crypto_utils import encrypt_data, decrypt_data
+from typing import Optional, List, Dict, Tuple, Union
+from crypto_utils import encrypt_data, decrypt_data, decrypt_document, decrypt_many, ERRO_DESCRIPTOGRAFIA
+from auth_cache import invalidar_usuario
+from query_executor import executar_em_paralelo
+from notification_outbox import registrar_evento, despachar, registrar_handler
+from notificacoes_agendadas import processar_vencidas, EntregaImpossivel
+from agendador import agendar_job, cancelar_job, registrar_tipo_job
+from bulk_writer import EscritorEmLote
+from data_loader import get_carregador, esquecer_documento, CarregadorDocumentos, TAMANHO_LOTE_GET_ALL
+from disponibilidade import calcular_slots_livres, get_cache_disponibilidade, invalidar_profissional
+from metricas import registrar_push
+from logging_config import debug_amostrado
+from time import perf_counter
 
 
 # --- INÍCIO DA CORREÇÃO ---
@@ -17,10 +28,13 @@ from fastapi import HTTPException
 
 from pydantic import BaseModel
 
-from firebase_admin import firestore, messaging, auth
+from firebase_admin import firestore, auth
 import logging
 import secrets
+import base64
+import json
 from firebase_admin.firestore import transactional
+from google.api_core.exceptions import NotFound
 
 # --- IMPORT DO ACK: compatível com pacote ou script ---
 try:
@@ -34,6 +48,14 @@ except Exception:
 # Setup do logger para este módulo
 logger = logging.getLogger(__name__)
 
+# Política de erro de descriptografia do perfil do usuário autenticado:
+# telefone e campos de endereço ilegíveis viram None em vez de texto de erro.
+CAMPOS_USUARIO_AUTENTICADO = {
+    'nome': '[Erro na descriptografia do nome]',
+    'telefone': None,
+    'endereco': None,
+}
+
 # =================================================================================
 # FUNÇÕES DE USUÁRIOS
 # =================================================================================
@@ -41,60 +63,23 @@ logger = logging.getLogger(__name__)
 def buscar_usuario_por_firebase_uid(db: firestore.client, firebase_uid: str) -> Optional[Dict]:
     """Busca um usuário na coleção 'usuarios' pelo seu firebase_uid e descriptografa os dados sensíveis."""
     try:
-        logger.info(f"🔍 BUSCAR_USUARIO DEBUG - Procurando firebase_uid: {firebase_uid}")
         query = db.collection('usuarios').where('firebase_uid', '==', firebase_uid).limit(1)
         docs = list(query.stream())
-        logger.info(f"🔍 BUSCAR_USUARIO DEBUG - Documentos encontrados: {len(docs)}")
         if docs:
             user_doc = docs[0].to_dict()
+            # Mapa de identidade: o crud não relê o documento do usuário autenticado na requisição
+            get_carregador(db).registrar('usuarios', docs[0].id, user_doc)
             user_doc['id'] = docs[0].id
-            logger.info(f"🔍 BUSCAR_USUARIO DEBUG - Usuário encontrado ID: {user_doc['id']}")
-            logger.info(f"🔍 BUSCAR_USUARIO DEBUG - Dados brutos: nome_len={len(user_doc.get('nome', ''))}, telefone={user_doc.get('telefone', 'None')}, email={user_doc.get('email', 'None')}")
-            logger.info(f"🔍 BUSCAR_USUARIO DEBUG - Campos de imagem: profile_image_url={user_doc.get('profile_image_url', 'None')}, profile_image={user_doc.get('profile_image', 'None')}")
 
             # Descriptografa os campos com tratamento individual de erros
-            if 'nome' in user_doc:
-                try:
-                    user_doc['nome'] = decrypt_data(user_doc['nome'])
-                    logger.info(f"✅ BUSCAR_USUARIO DEBUG - Nome descriptografado com sucesso")
-                except Exception as e:
-                    logger.error(f"❌ BUSCAR_USUARIO DEBUG - Erro ao descriptografar NOME: {e}")
-                    user_doc['nome'] = '[Erro na descriptografia do nome]'
-            
-            if 'telefone' in user_doc and user_doc['telefone']:
-                try:
-                    user_doc['telefone'] = decrypt_data(user_doc['telefone'])
-                    logger.info(f"✅ BUSCAR_USUARIO DEBUG - Telefone descriptografado com sucesso")
-                except Exception as e:
-                    logger.error(f"❌ BUSCAR_USUARIO DEBUG - Erro ao descriptografar TELEFONE: {e}")
-                    user_doc['telefone'] = None
-            
-            if 'endereco' in user_doc and user_doc['endereco']:
-                try:
-                    endereco_descriptografado = {}
-                    for k, v in user_doc['endereco'].items():
-                        if v and isinstance(v, str) and v.strip():
-                            try:
-                                endereco_descriptografado[k] = decrypt_data(v)
-                            except Exception as field_error:
-                                logger.warning(f"⚠️ BUSCAR_USUARIO DEBUG - Erro ao descriptografar campo '{k}' do endereço: {field_error}")
-                                endereco_descriptografado[k] = None
-                        else:
-                            endereco_descriptografado[k] = v  # Manter valor original se não for string válida
-                    user_doc['endereco'] = endereco_descriptografado
-                    logger.info(f"✅ BUSCAR_USUARIO DEBUG - Endereço descriptografado com sucesso")
-                except Exception as e:
-                    logger.error(f"❌ BUSCAR_USUARIO DEBUG - Erro geral ao processar endereço: {e}")
-                    user_doc['endereco'] = None
+            decrypt_document(user_doc, CAMPOS_USUARIO_AUTENTICADO)
 
-            logger.info(f"✅ BUSCAR_USUARIO DEBUG - Retornando usuário: ID={user_doc['id']}, Nome={user_doc.get('nome', 'N/A')}")
+            logger.debug("Usuário %s encontrado para o firebase_uid %s", user_doc['id'], firebase_uid)
             return user_doc
-        logger.info(f"❌ BUSCAR_USUARIO DEBUG - Nenhum usuário encontrado com firebase_uid: {firebase_uid}")
+        logger.debug("Nenhum usuário encontrado com o firebase_uid %s", firebase_uid)
         return None
-    except Exception as e:
-        logger.error(f"Erro ao buscar/descriptografar usuário por firebase_uid {firebase_uid}: {e}")
-        import traceback
-        logger.error(f"Stack trace completo: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Erro ao buscar/descriptografar usuário por firebase_uid %s", firebase_uid)
         # Se a descriptografia falhar (ex: chave errada), não retorna dados corrompidos
         return None
 
@@ -126,7 +111,7 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
             doc_ref = db.collection('usuarios').document()
             doc_ref.set(user_dict)
             user_dict['id'] = doc_ref.id
-            logger.info(f"Novo usuário {user_data.email} criado como Super Admin.")
+            logger.info("Novo usuário %s criado como Super Admin.", doc_ref.id)
             
             # Descriptografa para retornar ao usuário
             user_dict['nome'] = user_data.nome
@@ -136,11 +121,11 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
             raise ValueError("Não é possível se registrar sem um negócio específico.")
     
     # Fluxo multi-tenant
+    # Role adicionada ao negócio nesta sincronização (para manter o diretório de roles)
+    role_adicionada = {}
+
     @firestore.transactional
     def transaction_sync_user(transaction):
-        # CRITICAL DEBUG: Verificar usuário existente DENTRO da transação
-        logger.info(f"🔍 SYNC DEBUG - Firebase UID: {user_data.firebase_uid}")
-        
         # Buscar usuário existente DENTRO da transação para evitar race conditions
         user_query = db.collection('usuarios').where('firebase_uid', '==', user_data.firebase_uid).limit(1)
         user_docs = list(user_query.stream(transaction=transaction))
@@ -156,18 +141,16 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
             if 'nome' in user_doc:
                 try:
                     user_doc['nome'] = decrypt_data(user_doc['nome'])
-                    logger.info(f"✅ TRANSACAO DEBUG - Nome descriptografado com sucesso")
                 except Exception as e:
-                    logger.error(f"❌ TRANSACAO DEBUG - Erro ao descriptografar NOME: {e}")
+                    logger.error("❌ Erro ao descriptografar o nome do usuário %s: %s", user_doc['id'], e)
                     user_doc['nome'] = '[Erro na descriptografia do nome]'
             
             # Descriptografar telefone
             if 'telefone' in user_doc and user_doc['telefone']:
                 try:
                     user_doc['telefone'] = decrypt_data(user_doc['telefone'])
-                    logger.info(f"✅ TRANSACAO DEBUG - Telefone descriptografado com sucesso")
                 except Exception as e:
-                    logger.error(f"❌ TRANSACAO DEBUG - Erro ao descriptografar TELEFONE: {e}")
+                    logger.error("❌ Erro ao descriptografar o telefone do usuário %s: %s", user_doc['id'], e)
                     user_doc['telefone'] = None
             
             # Descriptografar endereço com tratamento de erro robusto
@@ -179,22 +162,15 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
                             try:
                                 endereco_descriptografado[k] = decrypt_data(v)
                             except Exception as field_error:
-                                logger.warning(f"⚠️ TRANSACAO DEBUG - Erro ao descriptografar campo '{k}' do endereço: {field_error}")
+                                logger.warning("⚠️ Erro ao descriptografar o campo '%s' do endereço do usuário %s: %s", k, user_doc['id'], field_error)
                                 endereco_descriptografado[k] = None
                         else:
                             endereco_descriptografado[k] = v  # Manter valor original se não for string válida
                     user_doc['endereco'] = endereco_descriptografado
-                    logger.info(f"✅ TRANSACAO DEBUG - Endereço descriptografado com sucesso")
                 except Exception as e:
-                    logger.error(f"❌ TRANSACAO DEBUG - Erro geral ao processar endereço: {e}")
-                    logger.error(f"❌ TRANSACAO DEBUG - Dados do endereço corrompidos, definindo como None")
+                    logger.error("❌ Endereço do usuário %s corrompido, definindo como None: %s", user_doc['id'], e)
                     user_doc['endereco'] = None
         
-        logger.info(f"🔍 SYNC DEBUG - Usuário existente encontrado: {user_existente is not None}")
-        if user_existente:
-            logger.info(f"🔍 SYNC DEBUG - ID do usuário existente: {user_existente.get('id')}")
-            logger.info(f"🔍 SYNC DEBUG - Roles atuais: {user_existente.get('roles', {})}")
-        
         negocio_doc_ref = db.collection('negocios').document(negocio_id)
         negocio_doc = negocio_doc_ref.get(transaction=transaction)
 
@@ -209,27 +185,23 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
             role = "admin"
         
         if user_existente:
-            logger.info(f"✅ SYNC DEBUG - Usuário existe, atualizando roles se necessário")
             user_ref = db.collection('usuarios').document(user_existente['id'])
             current_roles = user_existente.get("roles", {})
             
             if negocio_id not in current_roles:
-                logger.info(f"🔄 SYNC DEBUG - Adicionando role '{role}' para negócio {negocio_id}")
+                logger.info("🔄 Sync: adicionando role '%s' ao usuário %s no negócio %s", role, user_existente['id'], negocio_id)
                 transaction.update(user_ref, {f'roles.{negocio_id}': role})
                 user_existente["roles"][negocio_id] = role
+                role_adicionada['role'] = role
                 if role == "admin":
                     transaction.update(negocio_doc_ref, {'admin_uid': user_data.firebase_uid})
-            else:
-                logger.info(f"✅ SYNC DEBUG - Role já existe para este negócio: {current_roles[negocio_id]}")
-            
+
             # CRITICAL: Sempre atualizar dados básicos se necessário
             updates_needed = {}
             if user_existente.get('nome') != user_data.nome:
                 updates_needed['nome'] = encrypt_data(user_data.nome)
-                logger.info(f"🔄 SYNC DEBUG - Atualizando nome")
             if user_existente.get('email') != user_data.email:
                 updates_needed['email'] = user_data.email
-                logger.info(f"🔄 SYNC DEBUG - Atualizando email")
             
             if updates_needed:
                 transaction.update(user_ref, updates_needed)
@@ -238,18 +210,15 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
                 if 'nome' in updates_needed:
                     user_existente['nome'] = user_data.nome
             
-            logger.info(f"✅ SYNC DEBUG - Retornando usuário existente ID: {user_existente['id']}")
-            logger.info(f"🔍 SYNC DEBUG - FINAL RETURN USER - ID: {user_existente['id']}, Firebase_UID: {user_existente.get('firebase_uid', 'N/A')}")
+            logger.debug("Sync: usuário existente %s (campos atualizados: %s)", user_existente['id'], sorted(updates_needed))
             return user_existente
 
         # CRIAR NOVO USUÁRIO
-        logger.info(f"🆕 SYNC DEBUG - Criando novo usuário com role '{role}'")
-        
         # DOUBLE CHECK: Verificação final antes de criar usuário para prevenir duplicação
         final_check_query = db.collection('usuarios').where('firebase_uid', '==', user_data.firebase_uid).limit(1)
         final_check_docs = list(final_check_query.stream(transaction=transaction))
         if final_check_docs:
-            logger.warning(f"⚠️ SYNC DEBUG - Usuário encontrado na verificação final! Usando usuário existente em vez de criar novo.")
+            logger.warning("⚠️ Sync: usuário do firebase_uid %s encontrado na verificação final; usando o existente", user_data.firebase_uid)
             existing_doc = final_check_docs[0].to_dict()
             existing_doc['id'] = final_check_docs[0].id
             # Descriptografar e retornar usuário existente
@@ -278,6 +247,7 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
         new_user_ref = db.collection('usuarios').document()
         transaction.set(new_user_ref, user_dict)
         user_dict['id'] = new_user_ref.id
+        role_adicionada['role'] = role
 
         if role == "admin":
             transaction.update(negocio_doc_ref, {'admin_uid': user_data.firebase_uid})
@@ -288,11 +258,15 @@ def criar_ou_atualizar_usuario(db: firestore.client, user_data: schemas.UsuarioS
         if 'endereco' in user_dict and user_dict['endereco']:
              user_dict['endereco'] = user_data.endereco.dict()
 
-        logger.info(f"🔍 SYNC DEBUG - NOVO USUARIO CRIADO - ID: {user_dict['id']}, Firebase_UID: {user_dict.get('firebase_uid', 'N/A')}")
+        logger.info("🆕 Sync: usuário %s criado com a role '%s' no negócio %s", user_dict['id'], role, negocio_id)
         return user_dict
     
     # Executar como transação Firestore
-    return transaction_sync_user(db.transaction())
+    usuario_sincronizado = transaction_sync_user(db.transaction())
+    invalidar_usuario(firebase_uid=user_data.firebase_uid, usuario_id=usuario_sincronizado.get('id'))
+    if role_adicionada.get('role'):
+        _atualizar_diretorio_roles(db, negocio_id, usuario_sincronizado['id'], None, role_adicionada['role'])
+    return usuario_sincronizado
 
 
 def check_admin_status(db: firestore.client, negocio_id: str) -> bool:
@@ -393,7 +367,7 @@ def adicionar_fcm_token(db: firestore.client, firebase_uid: str, fcm_token: str)
         user_doc = buscar_usuario_por_firebase_uid(db, firebase_uid)
 
         if user_doc:
-            logger.info(f"✅ Usuário encontrado: ID={user_doc['id']}, Nome={user_doc.get('nome', 'N/A')[:20]}")
+            logger.info("✅ Usuário encontrado: ID=%s", user_doc['id'])
             doc_ref = db.collection('usuarios').document(user_doc['id'])
 
             # Busca tokens existentes
@@ -422,6 +396,7 @@ def adicionar_fcm_token(db: firestore.client, firebase_uid: str, fcm_token: str)
                 'fcm_tokens': existing_tokens
             }, merge=True)
 
+            invalidar_usuario(firebase_uid=firebase_uid, usuario_id=user_doc['id'])
             logger.info(f"✅ FCM Token salvo. Total de tokens FCM: {len(existing_tokens)}")
 
         else:
@@ -456,6 +431,7 @@ def remover_fcm_token(db: firestore.client, firebase_uid: str, fcm_token: str):
                     'fcm_tokens': existing_tokens
                 }, merge=True)
 
+                invalidar_usuario(firebase_uid=firebase_uid, usuario_id=user_doc['id'])
                 logger.info(f"🗑️ FCM Token removido. Tokens restantes: {len(existing_tokens)}")
             else:
                 logger.warning(f"⚠️ Token não encontrado para remoção: {fcm_token[:20]}...")
@@ -490,12 +466,32 @@ def remover_fcm_token_por_id_usuario(db: firestore.client, usuario_id: str, fcm_
                 'fcm_tokens': existing_tokens
             }, merge=True)
 
+            invalidar_usuario(usuario_id=usuario_id)
             logger.info(f"🗑️ FCM Token inválido removido do usuário {usuario_id}. Tokens restantes: {len(existing_tokens)}")
 
     except Exception as e:
         logger.error(f"❌ Erro ao remover FCM token do usuário {usuario_id}: {e}", exc_info=True)
 
 
+def remover_fcm_tokens_invalidos(db: firestore.client, usuario_id: str, fcm_tokens: List[str]):
+    """
+    Remove de uma só vez os FCM tokens recusados (Unregistered) no último envio.
+    Recebe a lista 'tokens_invalidos' retornada pelo envio em lote.
+    """
+    if not usuario_id or not fcm_tokens:
+        return
+
+    try:
+        db.collection('usuarios').document(usuario_id).update({
+            'fcm_tokens': firestore.ArrayRemove(list(fcm_tokens))
+        })
+        invalidar_usuario(usuario_id=usuario_id)
+        logger.info(f"🗑️ {len(fcm_tokens)} FCM token(s) inválido(s) removido(s) do usuário {usuario_id}")
+
+    except Exception as e:
+        logger.error(f"❌ Erro ao remover FCM tokens inválidos do usuário {usuario_id}: {e}", exc_info=True)
+
+
 # ---------------------------------------------------------------------
 # FUNÇÕES DE GERENCIAMENTO DE APNS TOKENS (CORRIGIDAS)
 # ---------------------------------------------------------------------
@@ -528,7 +524,7 @@ def adicionar_apns_token(db: firestore.client, firebase_uid: str, apns_token: st
         user_doc = buscar_usuario_por_firebase_uid(db, firebase_uid)
 
         if user_doc:
-            logger.info(f"✅ Usuário encontrado: ID={user_doc['id']}, Nome={user_doc.get('nome', 'N/A')[:20]}")
+            logger.info("✅ Usuário encontrado: ID=%s", user_doc['id'])
             doc_ref = db.collection('usuarios').document(user_doc['id'])
 
             # Busca tokens existentes
@@ -557,6 +553,7 @@ def adicionar_apns_token(db: firestore.client, firebase_uid: str, apns_token: st
                 'apns_tokens': existing_tokens
             }, merge=True)
 
+            invalidar_usuario(firebase_uid=firebase_uid, usuario_id=user_doc['id'])
             logger.info(f"✅ APNs Token salvo. Total de tokens APNs: {len(existing_tokens)}")
 
         else:
@@ -588,6 +585,7 @@ def remover_apns_token(db: firestore.client, firebase_uid: str, apns_token: str)
                     'apns_tokens': existing_tokens
                 }, merge=True)
 
+                invalidar_usuario(firebase_uid=firebase_uid, usuario_id=user_doc['id'])
                 logger.info(f"🗑️ APNs Token removido. Tokens restantes: {len(existing_tokens)}")
             else:
                 logger.warning(f"⚠️ APNs Token não encontrado para remoção: {apns_token[:20]}...")
@@ -622,11 +620,39 @@ def remover_apns_token_por_id_usuario(db: firestore.client, usuario_id: str, apn
                 'apns_tokens': existing_tokens
             }, merge=True)
 
+            invalidar_usuario(usuario_id=usuario_id)
             logger.info(f"🗑️ APNs Token inválido removido do usuário {usuario_id}. Tokens restantes: {len(existing_tokens)}")
 
     except Exception as e:
         logger.error(f"❌ Erro ao remover APNs token do usuário {usuario_id}: {e}", exc_info=True)
 
+
+def remover_apns_tokens_invalidos(db: firestore.client, usuario_id: str, apns_tokens: List[str]):
+    """
+    Remove de uma só vez os APNs tokens recusados pela Apple (410/BadDeviceToken)
+    no último envio. Recebe a lista 'tokens_invalidos' retornada pelo envio em lote.
+    """
+    if not usuario_id or not apns_tokens:
+        return
+
+    try:
+        db.collection('usuarios').document(usuario_id).update({
+            'apns_tokens': firestore.ArrayRemove(list(apns_tokens))
+        })
+        invalidar_usuario(usuario_id=usuario_id)
+        logger.info(f"🗑️ {len(apns_tokens)} APNs token(s) inválido(s) removido(s) do usuário {usuario_id}")
+
+    except Exception as e:
+        logger.error(f"❌ Erro ao remover APNs tokens inválidos do usuário {usuario_id}: {e}", exc_info=True)
+
+
+def remover_tokens_invalidos_do_envio(db: firestore.client, usuario_id: str, resultado_envio: Optional[Dict]):
+    """Remove os tokens FCM e APNs apontados como inválidos no resultado de enviar_notificacao_hibrida."""
+    if not resultado_envio:
+        return
+    remover_fcm_tokens_invalidos(db, usuario_id, resultado_envio.get('fcm_tokens_invalidos'))
+    remover_apns_tokens_invalidos(db, usuario_id, resultado_envio.get('apns_tokens_invalidos'))
+
 # =================================================================================
 # FUNÇÕES DE ADMINISTRAÇÃO DA PLATAFORMA (SUPER-ADMIN)
 # =================================================================================
@@ -753,8 +779,19 @@ def admin_listar_usuarios_por_negocio(db: firestore.client, negocio_id: str, sta
     usuarios = []
     try:
         query = db.collection('usuarios').where(f'roles.{negocio_id}', 'in', ['cliente', 'profissional', 'admin', 'tecnico', 'medico'])
+        docs = list(query.stream())
 
-        for doc in query.stream():
+        # Enfermeiros vinculados aos pacientes em uma única leitura em lote; perfis profissionais uma vez por UID
+        carregador = get_carregador(db)
+        carregador.carregar_muitos('usuarios', ((doc.to_dict() or {}).get('enfermeiro_id') for doc in docs))
+        perfis_profissionais: Dict[str, Optional[Dict]] = {}
+
+        def _perfil_profissional(firebase_uid: str) -> Optional[Dict]:
+            if firebase_uid not in perfis_profissionais:
+                perfis_profissionais[firebase_uid] = buscar_profissional_por_uid(db, negocio_id, firebase_uid)
+            return perfis_profissionais[firebase_uid]
+
+        for doc in docs:
             usuario_data = doc.to_dict()
             
             # Pega o status do usuário para o negócio específico, com 'ativo' como padrão.
@@ -769,35 +806,7 @@ def admin_listar_usuarios_por_negocio(db: firestore.client, negocio_id: str, sta
 
             if deve_incluir:
                 usuario_data['id'] = doc.id
-                
-                # Descriptografa campos sensíveis do usuário
-                if 'nome' in usuario_data and usuario_data['nome']:
-                    try:
-                        usuario_data['nome'] = decrypt_data(usuario_data['nome'])
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar nome do usuário {doc.id}: {e}")
-                        usuario_data['nome'] = "[Erro na descriptografia]"
-                
-                if 'telefone' in usuario_data and usuario_data['telefone']:
-                    try:
-                        usuario_data['telefone'] = decrypt_data(usuario_data['telefone'])
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar telefone do usuário {doc.id}: {e}")
-                        usuario_data['telefone'] = "[Erro na descriptografia]"
-                
-                if 'endereco' in usuario_data and usuario_data['endereco']:
-                    endereco_descriptografado = {}
-                    for key, value in usuario_data['endereco'].items():
-                        if value and isinstance(value, str) and value.strip():
-                            try:
-                                endereco_descriptografado[key] = decrypt_data(value)
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar campo de endereço {key} do usuário {doc.id}: {e}")
-                                endereco_descriptografado[key] = "[Erro na descriptografia]"
-                        else:
-                            endereco_descriptografado[key] = value
-                    usuario_data['endereco'] = endereco_descriptografado
-                
+
                 # ***** A CORREÇÃO ESTÁ AQUI *****
                 # Adiciona o status do negócio ao dicionário de resposta.
                 # O nome do campo foi corrigido no schema para 'status_por_negocio' para ser mais claro.
@@ -809,21 +818,22 @@ def admin_listar_usuarios_por_negocio(db: firestore.client, negocio_id: str, sta
                 if user_role in ['profissional', 'admin']:
                     firebase_uid = usuario_data.get('firebase_uid')
                     if firebase_uid:
-                        perfil_profissional = buscar_profissional_por_uid(db, negocio_id, firebase_uid)
+                        perfil_profissional = _perfil_profissional(firebase_uid)
                         usuario_data['profissional_id'] = perfil_profissional.get('id') if perfil_profissional else None
                 elif user_role == 'cliente':
                     enfermeiro_user_id = usuario_data.get('enfermeiro_id')
                     if enfermeiro_user_id:
-                        enfermeiro_doc = db.collection('usuarios').document(enfermeiro_user_id).get()
-                        if enfermeiro_doc.exists:
-                            firebase_uid_enfermeiro = enfermeiro_doc.to_dict().get('firebase_uid')
-                            perfil_enfermeiro = buscar_profissional_por_uid(db, negocio_id, firebase_uid_enfermeiro)
+                        enfermeiro_data = carregador.carregar('usuarios', enfermeiro_user_id)
+                        if enfermeiro_data is not None:
+                            firebase_uid_enfermeiro = enfermeiro_data.get('firebase_uid')
+                            perfil_enfermeiro = _perfil_profissional(firebase_uid_enfermeiro)
                             usuario_data['enfermeiro_vinculado_id'] = perfil_enfermeiro.get('id') if perfil_enfermeiro else None
                     usuario_data['tecnicos_vinculados_ids'] = usuario_data.get('tecnicos_ids', [])
 
                 usuarios.append(usuario_data)
 
-        return usuarios
+        # Descriptografa os campos sensíveis de todos os usuários em uma única passada
+        return decrypt_many(usuarios)
     except Exception as e:
         logger.error(f"Erro ao listar usuários para o negocio_id {negocio_id}: {e}")
         return []
@@ -836,6 +846,7 @@ def admin_set_usuario_status(db: firestore.client, negocio_id: str, user_id: str
     user_ref = db.collection('usuarios').document(user_id)
     status_path = f'status_por_negocio.{negocio_id}'
     user_ref.update({status_path: status})
+    invalidar_usuario(usuario_id=user_id)
 
     criar_log_auditoria(
         db,
@@ -850,36 +861,7 @@ def admin_set_usuario_status(db: firestore.client, negocio_id: str, user_id: str
     if doc.exists:
         data = doc.to_dict()
         data['id'] = doc.id
-        
-        # Descriptografa campos sensíveis do usuário
-        if 'nome' in data and data['nome']:
-            try:
-                data['nome'] = decrypt_data(data['nome'])
-            except Exception as e:
-                logger.error(f"Erro ao descriptografar nome do usuário {doc.id}: {e}")
-                data['nome'] = "[Erro na descriptografia]"
-        
-        if 'telefone' in data and data['telefone']:
-            try:
-                data['telefone'] = decrypt_data(data['telefone'])
-            except Exception as e:
-                logger.error(f"Erro ao descriptografar telefone do usuário {doc.id}: {e}")
-                data['telefone'] = "[Erro na descriptografia]"
-        
-        if 'endereco' in data and data['endereco']:
-            endereco_descriptografado = {}
-            for key, value in data['endereco'].items():
-                if value and isinstance(value, str) and value.strip():
-                    try:
-                        endereco_descriptografado[key] = decrypt_data(value)
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar campo de endereço {key} do usuário {doc.id}: {e}")
-                        endereco_descriptografado[key] = "[Erro na descriptografia]"
-                else:
-                    endereco_descriptografado[key] = value
-            data['endereco'] = endereco_descriptografado
-        
-        return data
+        return decrypt_document(data)
     return None
 
 def admin_atualizar_role_usuario(db: firestore.client, negocio_id: str, user_id: str, novo_role: str, autor_uid: str) -> Optional[Dict]:
@@ -910,6 +892,8 @@ def admin_atualizar_role_usuario(db: firestore.client, negocio_id: str, user_id:
 
     role_path = f'roles.{negocio_id}'
     user_ref.update({role_path: novo_role})
+    invalidar_usuario(firebase_uid=user_data.get('firebase_uid'), usuario_id=user_id)
+    _atualizar_diretorio_roles(db, negocio_id, user_id, role_antiga, novo_role)
 
     criar_log_auditoria(
         db,
@@ -933,55 +917,26 @@ def admin_atualizar_role_usuario(db: firestore.client, negocio_id: str, user_id:
                 fotos={}
             )
             criar_profissional(db, novo_profissional_data)
-            logger.info(f"Perfil profissional criado para o usuário {user_data['email']} no negócio {negocio_id}.")
+            logger.info("Perfil profissional criado para o usuário %s no negócio %s.", user_id, negocio_id)
         elif not perfil_profissional.get('ativo'):
             # Reativa o perfil se já existir e estiver inativo
             prof_ref = db.collection('profissionais').document(perfil_profissional['id'])
             prof_ref.update({"ativo": True})
-            logger.info(f"Perfil profissional reativado para o usuário {user_data['email']} no negócio {negocio_id}.")
+            logger.info("Perfil profissional reativado para o usuário %s no negócio %s.", user_id, negocio_id)
 
     elif novo_role == 'cliente' or novo_role == 'tecnico' or novo_role == 'medico': # Desativa perfil se virar cliente, tecnico ou medico
         if perfil_profissional and perfil_profissional.get('ativo'):
             # Desativa o perfil profissional se existir e estiver ativo
             prof_ref = db.collection('profissionais').document(perfil_profissional['id'])
             prof_ref.update({"ativo": False})
-            logger.info(f"Perfil profissional desativado para o usuário {user_data['email']} no negócio {negocio_id}.")
+            logger.info("Perfil profissional desativado para o usuário %s no negócio %s.", user_id, negocio_id)
 
-    logger.info(f"Role do usuário {user_data['email']} atualizada para '{novo_role}' no negócio {negocio_id}.")
+    logger.info("Role do usuário %s atualizada para '%s' no negócio %s.", user_id, novo_role, negocio_id)
 
     updated_user_doc = user_ref.get()
     updated_user_data = updated_user_doc.to_dict()
     updated_user_data['id'] = updated_user_doc.id
-    
-    # Descriptografa campos sensíveis do usuário
-    if 'nome' in updated_user_data and updated_user_data['nome']:
-        try:
-            updated_user_data['nome'] = decrypt_data(updated_user_data['nome'])
-        except Exception as e:
-            logger.error(f"Erro ao descriptografar nome do usuário {updated_user_doc.id}: {e}")
-            updated_user_data['nome'] = "[Erro na descriptografia]"
-    
-    if 'telefone' in updated_user_data and updated_user_data['telefone']:
-        try:
-            updated_user_data['telefone'] = decrypt_data(updated_user_data['telefone'])
-        except Exception as e:
-            logger.error(f"Erro ao descriptografar telefone do usuário {updated_user_doc.id}: {e}")
-            updated_user_data['telefone'] = "[Erro na descriptografia]"
-    
-    if 'endereco' in updated_user_data and updated_user_data['endereco']:
-        endereco_descriptografado = {}
-        for key, value in updated_user_data['endereco'].items():
-            if value and isinstance(value, str) and value.strip():
-                try:
-                    endereco_descriptografado[key] = decrypt_data(value)
-                except Exception as e:
-                    logger.error(f"Erro ao descriptografar campo de endereço {key} do usuário {updated_user_doc.id}: {e}")
-                    endereco_descriptografado[key] = "[Erro na descriptografia]"
-            else:
-                endereco_descriptografado[key] = value
-        updated_user_data['endereco'] = endereco_descriptografado
-    
-    return updated_user_data
+    return decrypt_document(updated_user_data)
 
 def admin_criar_paciente(db: firestore.client, negocio_id: str, paciente_data: schemas.PacienteCreateByAdmin) -> Dict:
     """
@@ -1044,7 +999,7 @@ def admin_criar_paciente(db: firestore.client, negocio_id: str, paciente_data: s
             # Adicionar aos dados de resposta
             user_profile.update(dados_pessoais_update)
 
-        logger.info(f"Perfil do paciente {paciente_data.email} sincronizado com sucesso no Firestore.")
+        logger.info("Perfil do paciente %s sincronizado com sucesso no Firestore.", user_profile.get('id'))
         return user_profile
 
     except Exception as e:
@@ -1070,35 +1025,7 @@ def admin_listar_clientes_por_negocio(db: firestore.client, negocio_id: str, sta
 
             if status_no_negocio == status:
                 cliente_data['id'] = doc.id
-                
-                # Descriptografa campos sensíveis do cliente
-                if 'nome' in cliente_data and cliente_data['nome']:
-                    try:
-                        cliente_data['nome'] = decrypt_data(cliente_data['nome'])
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar nome do cliente {doc.id}: {e}")
-                        cliente_data['nome'] = "[Erro na descriptografia]"
-                
-                if 'telefone' in cliente_data and cliente_data['telefone']:
-                    try:
-                        cliente_data['telefone'] = decrypt_data(cliente_data['telefone'])
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar telefone do cliente {doc.id}: {e}")
-                        cliente_data['telefone'] = "[Erro na descriptografia]"
-                
-                if 'endereco' in cliente_data and cliente_data['endereco']:
-                    endereco_descriptografado = {}
-                    for key, value in cliente_data['endereco'].items():
-                        if value and isinstance(value, str) and value.strip():
-                            try:
-                                endereco_descriptografado[key] = decrypt_data(value)
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar campo de endereço {key} do cliente {doc.id}: {e}")
-                                endereco_descriptografado[key] = "[Erro na descriptografia]"
-                        else:
-                            endereco_descriptografado[key] = value
-                    cliente_data['endereco'] = endereco_descriptografado
-                
+
                 # CORREÇÃO: Busca o ID do perfil profissional a partir do ID do usuário (enfermeiro)
                 enfermeiro_user_id = cliente_data.get('enfermeiro_id')
                 if enfermeiro_user_id:
@@ -1119,7 +1046,7 @@ def admin_listar_clientes_por_negocio(db: firestore.client, negocio_id: str, sta
                 
                 clientes.append(cliente_data)
 
-        return clientes
+        return decrypt_many(clientes)
     except Exception as e:
         logger.error(f"Erro ao listar clientes para o negocio_id {negocio_id}: {e}")
         return []
@@ -1140,6 +1067,8 @@ def admin_promover_cliente_para_profissional(db: firestore.client, negocio_id: s
             user_ref.update({
                 f'roles.{negocio_id}': 'profissional'
             })
+            invalidar_usuario(firebase_uid=cliente_uid, usuario_id=user_doc['id'])
+            _atualizar_diretorio_roles(db, negocio_id, user_doc['id'], 'cliente', 'profissional')
             
             # 2. Cria o perfil profissional básico
             novo_profissional_data = schemas.ProfissionalCreate(
@@ -1152,12 +1081,12 @@ def admin_promover_cliente_para_profissional(db: firestore.client, negocio_id: s
             )
             criar_profissional(db, novo_profissional_data)
             
-            logger.info(f"Usuário {user_doc['email']} promovido para profissional no negócio {negocio_id}.")
+            logger.info("Usuário %s promovido para profissional no negócio %s.", user_doc['id'], negocio_id)
             
             # Retorna os dados atualizados do usuário
             return buscar_usuario_por_firebase_uid(db, cliente_uid)
         else:
-            logger.warning(f"Usuário {user_doc.get('email')} não é um cliente deste negócio e não pode ser promovido.")
+            logger.warning("Usuário %s não é um cliente do negócio %s e não pode ser promovido.", user_doc['id'], negocio_id)
             return None
     except Exception as e:
         logger.error(f"Erro ao promover cliente {cliente_uid} para profissional: {e}")
@@ -1179,6 +1108,8 @@ def admin_rebaixar_profissional_para_cliente(db: firestore.client, negocio_id: s
             user_ref.update({
                 f'roles.{negocio_id}': 'cliente'
             })
+            invalidar_usuario(firebase_uid=profissional_uid, usuario_id=user_doc['id'])
+            _atualizar_diretorio_roles(db, negocio_id, user_doc['id'], 'profissional', 'cliente')
             
             # 2. Desativa o perfil profissional
             perfil_profissional = buscar_profissional_por_uid(db, negocio_id, profissional_uid)
@@ -1186,17 +1117,79 @@ def admin_rebaixar_profissional_para_cliente(db: firestore.client, negocio_id: s
                 prof_ref = db.collection('profissionais').document(perfil_profissional['id'])
                 prof_ref.update({"ativo": False})
 
-            logger.info(f"Usuário {user_doc['email']} rebaixado para cliente no negócio {negocio_id}.")
+            logger.info("Usuário %s rebaixado para cliente no negócio %s.", user_doc['id'], negocio_id)
             
             # Retorna os dados atualizados do usuário
             return buscar_usuario_por_firebase_uid(db, profissional_uid)
         else:
-            logger.warning(f"Usuário {user_doc.get('email')} não é um profissional deste negócio e não pode ser rebaixado.")
+            logger.warning("Usuário %s não é um profissional do negócio %s e não pode ser rebaixado.", user_doc['id'], negocio_id)
             return None
     except Exception as e:
         logger.error(f"Erro ao rebaixar profissional {profissional_uid}: {e}")
         return None
 
+# =================================================================================
+# DIRETÓRIO DE ROLES POR NEGÓCIO
+# =================================================================================
+# Projeção mantida em negocios/{negocio_id}/diretorio/roles no formato
+# {role: [usuario_id, ...]}, para responder "quem são os admins/enfermeiros/técnicos
+# do negócio X" com uma única leitura, sem varrer a coleção 'usuarios'.
+# É atualizada pelas funções que alteram roles; se ainda não existir para um negócio,
+# é reconstruída a partir da query indexada em roles.{negocio_id}.
+
+ROLES_DIRETORIO = ['admin', 'profissional', 'tecnico', 'medico', 'cliente']
+
+
+def _diretorio_roles_ref(db: firestore.client, negocio_id: str):
+    return db.collection('negocios').document(negocio_id).collection('diretorio').document('roles')
+
+
+def _atualizar_diretorio_roles(db: firestore.client, negocio_id: str, usuario_id: str, role_antiga: Optional[str], role_nova: Optional[str]):
+    """Move o usuário de role_antiga para role_nova no diretório do negócio."""
+    if not negocio_id or negocio_id == 'platform' or role_antiga == role_nova:
+        return
+    update = {}
+    if role_antiga:
+        update[role_antiga] = firestore.ArrayRemove([usuario_id])
+    if role_nova:
+        update[role_nova] = firestore.ArrayUnion([usuario_id])
+    try:
+        try:
+            _diretorio_roles_ref(db, negocio_id).update(update)
+        except NotFound:
+            # Negócio ainda sem diretório: criá-lo só com este usuário esconderia os demais
+            # membros de listar_membros_por_role. A reconstrução já inclui a role nova.
+            reconstruir_diretorio_roles(db, negocio_id)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar diretório de roles do negócio {negocio_id} para o usuário {usuario_id}: {e}")
+
+
+def reconstruir_diretorio_roles(db: firestore.client, negocio_id: str) -> Dict[str, List[str]]:
+    """Reconstrói o diretório de roles do negócio a partir dos documentos de usuários."""
+    diretorio = {role: [] for role in ROLES_DIRETORIO}
+    query = db.collection('usuarios').where(f'roles.{negocio_id}', 'in', ROLES_DIRETORIO)
+    for doc in query.stream():
+        role = (doc.to_dict().get('roles') or {}).get(negocio_id)
+        if role in diretorio:
+            diretorio[role].append(doc.id)
+    _diretorio_roles_ref(db, negocio_id).set(diretorio)
+    logger.info(f"Diretório de roles do negócio {negocio_id} reconstruído: { {r: len(ids) for r, ids in diretorio.items()} }")
+    return diretorio
+
+
+def listar_membros_por_role(db: firestore.client, negocio_id: str, role: str) -> List[str]:
+    """Retorna os IDs dos usuários com a role informada no negócio (uma leitura de documento)."""
+    try:
+        diretorio_doc = _diretorio_roles_ref(db, negocio_id).get()
+        if diretorio_doc.exists:
+            return list(diretorio_doc.to_dict().get(role, []))
+        return reconstruir_diretorio_roles(db, negocio_id).get(role, [])
+    except Exception as e:
+        logger.error(f"Erro ao consultar diretório de roles do negócio {negocio_id}: {e}")
+        # Fallback: query indexada pela role, sem depender do diretório
+        return [doc.id for doc in db.collection('usuarios').where(f'roles.{negocio_id}', '==', role).stream()]
+
+
 # =================================================================================
 # FUNÇÕES DE GESTÃO CLÍNICA (MÉDICOS)
 # =================================================================================
@@ -1330,7 +1323,6 @@ def listar_profissionais_por_negocio(db: firestore.client, negocio_id: str) -> L
             prof_data['id'] = doc.id
 
             firebase_uid = prof_data.get('usuario_uid')
-            logger.info(f"🔍 DEBUG PROFISSIONAL - ID: {prof_data.get('id')}, usuario_uid: {firebase_uid}")
 
             # --- INÍCIO DA CORREÇÃO ---
             # Busca os dados do usuário, mas não pula o profissional se não encontrar
@@ -1343,7 +1335,7 @@ def listar_profissionais_por_negocio(db: firestore.client, negocio_id: str) -> L
                                  usuario_doc.get('profile_image') or
                                  prof_data.get('fotos', {}).get('thumbnail'))
                     prof_data['profile_image_url'] = user_image
-                    logger.info(f"🖼️ PROFISSIONAL DEBUG - Profissional {prof_data.get('id')}: user_image_url={usuario_doc.get('profile_image_url')}, user_image={usuario_doc.get('profile_image')}, prof_fotos_thumbnail={prof_data.get('fotos', {}).get('thumbnail')}, final_image={user_image}")
+                    debug_amostrado(logger, "Profissional %s: imagem do perfil do usuário = %s", prof_data['id'], user_image)
                     prof_data['email'] = usuario_doc.get('email', '')
                 else:
                     # Fallback se o usuário não for encontrado
@@ -1352,7 +1344,7 @@ def listar_profissionais_por_negocio(db: firestore.client, negocio_id: str) -> L
                                          prof_data.get('fotos', {}).get('original'))
                     prof_data['profile_image_url'] = prof_fallback_image
                     prof_data['email'] = ''
-                    logger.info(f"🖼️ PROFISSIONAL DEBUG - Profissional {prof_data.get('id')} (sem usuário): prof_fotos={prof_data.get('fotos', {})}, final_image={prof_fallback_image}")
+                    debug_amostrado(logger, "Profissional %s sem usuário: imagem das fotos = %s", prof_data['id'], prof_fallback_image)
             else:
                 # Fallback se não houver firebase_uid
                 prof_fallback_image = (prof_data.get('fotos', {}).get('thumbnail') or
@@ -1360,7 +1352,7 @@ def listar_profissionais_por_negocio(db: firestore.client, negocio_id: str) -> L
                                      prof_data.get('fotos', {}).get('original'))
                 prof_data['profile_image_url'] = prof_fallback_image
                 prof_data['email'] = ''
-                logger.info(f"🖼️ PROFISSIONAL DEBUG - Profissional {prof_data.get('id')} (sem firebase_uid): prof_fotos={prof_data.get('fotos', {})}, final_image={prof_fallback_image}")
+                debug_amostrado(logger, "Profissional %s sem firebase_uid: imagem das fotos = %s", prof_data['id'], prof_fallback_image)
             
             # Garante que o firebase_uid sempre esteja na resposta
             prof_data['firebase_uid'] = firebase_uid
@@ -1464,19 +1456,23 @@ def definir_horarios_trabalho(db: firestore.client, profissional_id: str, horari
     prof_ref = db.collection('profissionais').document(profissional_id)
     horarios_ref = prof_ref.collection('horarios_trabalho')
     
-    batch = db.batch()
-    for doc in horarios_ref.stream():
-        batch.delete(doc.reference)
-    batch.commit()
-        
-    for horario in horarios:
-        horario_to_save = {
-            "dia_semana": horario.dia_semana,
-            "hora_inicio": horario.hora_inicio.isoformat(),
-            "hora_fim": horario.hora_fim.isoformat()
-        }
-        horarios_ref.document(str(horario.dia_semana)).set(horario_to_save)
-    
+    novos_ids = {str(horario.dia_semana) for horario in horarios}
+
+    with EscritorEmLote(db, descricao=f"horarios_trabalho:{profissional_id}") as escritor:
+        # Remove apenas os dias que não serão regravados (cada documento aparece uma única vez)
+        for doc in horarios_ref.select([]).stream():
+            if doc.id not in novos_ids:
+                escritor.delete(doc.reference)
+
+        for horario in horarios:
+            horario_to_save = {
+                "dia_semana": horario.dia_semana,
+                "hora_inicio": horario.hora_inicio.isoformat(),
+                "hora_fim": horario.hora_fim.isoformat()
+            }
+            escritor.set(horarios_ref.document(str(horario.dia_semana)), horario_to_save)
+
+    invalidar_profissional(profissional_id)
     return listar_horarios_trabalho(db, profissional_id)
 
 def listar_horarios_trabalho(db: firestore.client, profissional_id: str) -> List[Dict]:
@@ -1495,6 +1491,7 @@ def criar_bloqueio(db: firestore.client, profissional_id: str, bloqueio_data: sc
     bloqueios_ref = db.collection('profissionais').document(profissional_id).collection('bloqueios')
     time_created, doc_ref = bloqueios_ref.add(bloqueio_dict)
     bloqueio_dict['id'] = doc_ref.id
+    invalidar_profissional(profissional_id)
     return bloqueio_dict
 
 def deletar_bloqueio(db: firestore.client, profissional_id: str, bloqueio_id: str) -> bool:
@@ -1503,68 +1500,145 @@ def deletar_bloqueio(db: firestore.client, profissional_id: str, bloqueio_id: st
         bloqueio_ref = db.collection('profissionais').document(profissional_id).collection('bloqueios').document(bloqueio_id)
         if bloqueio_ref.get().exists:
             bloqueio_ref.delete()
+            invalidar_profissional(profissional_id)
             return True
         return False
     except Exception as e:
         logger.error(f"Erro ao deletar bloqueio {bloqueio_id}: {e}")
         return False
         
-def calcular_horarios_disponiveis(db: firestore.client, profissional_id: str, dia: date, duracao_servico_min: int = 60) -> List[time]:
-    """Calcula os horários disponíveis para um profissional em um dia específico."""
-    dia_semana = dia.weekday()
-    
-    horario_trabalho_ref = db.collection('profissionais').document(profissional_id).collection('horarios_trabalho').document(str(dia_semana))
-    horario_trabalho_doc = horario_trabalho_ref.get()
+# Status de agendamento que ocupam o horário do profissional
+STATUS_AGENDAMENTO_OCUPA_HORARIO = ('pendente', 'confirmado')
+# Limite de valores por filtro 'in' do Firestore
+_LIMITE_FILTRO_IN = 30
 
-    if not horario_trabalho_doc.exists:
-        return [] 
+def _carregar_agenda_periodo(db: firestore.client, profissional_ids: List[str], inicio: date, fim: date) -> Dict[str, Dict]:
+    """
+    Carrega horários de trabalho, agendamentos e bloqueios de vários profissionais
+    no período [inicio, fim] (dias inclusivos), com as leituras em paralelo:
+    - horários de trabalho: um db.get_all() com os dias da semana do período;
+    - agendamentos: uma consulta por grupo de até 30 profissionais;
+    - bloqueios: uma consulta por profissional (a subcoleção não guarda o profissional_id).
 
-    horario_trabalho = horario_trabalho_doc.to_dict()
-    
-    slots_disponiveis = []
-    hora_inicio_str = horario_trabalho['hora_inicio']
-    hora_fim_str = horario_trabalho['hora_fim']
+    Returns:
+        {profissional_id: {'horarios': {dia_semana: {...}}, 'ocupados': [(inicio, fim), ...]}}
+        com datetimes sem fuso (mesma convenção do cálculo por dia).
+    """
+    limite_inferior = datetime.combine(inicio, time.min)
+    limite_superior = datetime.combine(fim + timedelta(days=1), time.min)
+    dias_semana = sorted({(inicio + timedelta(days=i)).weekday() for i in range(min((fim - inicio).days + 1, 7))})
+
+    def carregar_horarios():
+        refs = [
+            db.collection('profissionais').document(profissional_id).collection('horarios_trabalho').document(str(dia_semana))
+            for profissional_id in profissional_ids for dia_semana in dias_semana
+        ]
+        return [(doc.reference.parent.parent.id, doc.to_dict()) for doc in db.get_all(refs) if doc.exists]
+
+    def carregar_agendamentos(grupo):
+        # Índice composto (profissional_id ASC, data_hora ASC) em firestore.indexes.json
+        query = db.collection('agendamentos')\
+            .where('profissional_id', 'in', grupo)\
+            .where('data_hora', '>=', limite_inferior)\
+            .where('data_hora', '<', limite_superior)
+        return [doc.to_dict() for doc in query.stream()]
+
+    def carregar_bloqueios(profissional_id):
+        query = db.collection('profissionais').document(profissional_id).collection('bloqueios')\
+            .where('fim', '>', limite_inferior)
+        return [doc.to_dict() for doc in query.stream()]
+
+    tarefas = {'horarios': carregar_horarios}
+    for i in range(0, len(profissional_ids), _LIMITE_FILTRO_IN):
+        grupo = profissional_ids[i:i + _LIMITE_FILTRO_IN]
+        tarefas[f'agendamentos:{i}'] = lambda grupo=grupo: carregar_agendamentos(grupo)
+    for profissional_id in profissional_ids:
+        tarefas[f'bloqueios:{profissional_id}'] = lambda profissional_id=profissional_id: carregar_bloqueios(profissional_id)
+
+    resultados = executar_em_paralelo(tarefas)
+
+    agenda = {profissional_id: {'horarios': {}, 'ocupados': []} for profissional_id in profissional_ids}
+    for profissional_id, horario in resultados['horarios']:
+        agenda[profissional_id]['horarios'][int(horario['dia_semana'])] = horario
+
+    for nome, itens in resultados.items():
+        if nome.startswith('agendamentos:'):
+            for agendamento in itens:
+                if agendamento.get('status') not in STATUS_AGENDAMENTO_OCUPA_HORARIO:
+                    continue
+                inicio_ag = agendamento['data_hora'].replace(tzinfo=None)
+                # Sem a duração do serviço, ocupa apenas o slot em que começa
+                duracao_ag = agendamento.get('servico_duracao_minutos') or 1
+                agenda[agendamento['profissional_id']]['ocupados'].append(
+                    (inicio_ag, inicio_ag + timedelta(minutes=duracao_ag))
+                )
+        elif nome.startswith('bloqueios:'):
+            profissional_id = nome.split(':', 1)[1]
+            for bloqueio in itens:
+                inicio_bl = bloqueio['inicio'].replace(tzinfo=None)
+                if inicio_bl < limite_superior:
+                    agenda[profissional_id]['ocupados'].append((inicio_bl, bloqueio['fim'].replace(tzinfo=None)))
 
-    hora_inicio = datetime.combine(dia, time.fromisoformat(hora_inicio_str))
-    hora_fim = datetime.combine(dia, time.fromisoformat(hora_fim_str))
-    
-    hora_atual = hora_inicio
-    while hora_atual < hora_fim:
-        slots_disponiveis.append(hora_atual)
-        hora_atual += timedelta(minutes=duracao_servico_min)
+    return agenda
 
-    agendamentos_no_dia_query = db.collection('agendamentos')\
-        .where('profissional_id', '==', profissional_id)\
-        .where('status', '==', 'pendente')\
-        .where('data_hora', '>=', datetime.combine(dia, time.min))\
-        .where('data_hora', '<=', datetime.combine(dia, time.max))
-        
-    horarios_ocupados = {ag.to_dict()['data_hora'].replace(tzinfo=None) for ag in agendamentos_no_dia_query.stream()}
-    
-    bloqueios_no_dia_query = db.collection('profissionais').document(profissional_id).collection('bloqueios')\
-        .where('inicio', '<=', datetime.combine(dia, time.max))\
-        .where('fim', '>=', datetime.combine(dia, time.min))
-    
-    bloqueios = [b.to_dict() for b in bloqueios_no_dia_query.stream()]
+def calcular_disponibilidade_periodo(db: firestore.client, profissional_ids: List[str], inicio: date, fim: date,
+                                     duracao_servico_min: int = 60) -> Dict[str, Dict[date, List[time]]]:
+    """
+    Calcula os horários livres de vários profissionais em todos os dias de [inicio, fim].
 
-    horarios_finais = []
-    for slot in slots_disponiveis:
-        if slot in horarios_ocupados:
-            continue
-        
-        em_bloqueio = False
-        for bloqueio in bloqueios:
-            if bloqueio['inicio'].replace(tzinfo=None) <= slot < bloqueio['fim'].replace(tzinfo=None):
-                em_bloqueio = True
-                break
-        
-        if not em_bloqueio:
-            horarios_finais.append(slot.time())
-            
-    return horarios_finais
+    Os dias já presentes no cache de disponibilidade não são recalculados; para os
+    demais, a agenda é carregada de uma vez (_carregar_agenda_periodo) e os slots
+    são obtidos por varredura dos intervalos ocupados (disponibilidade.calcular_slots_livres).
+
+    Returns:
+        {profissional_id: {dia: [horários livres]}}
+    """
+    cache = get_cache_disponibilidade()
+    profissional_ids = list(dict.fromkeys(p for p in profissional_ids if p))
+    dias = [inicio + timedelta(days=i) for i in range((fim - inicio).days + 1)]
+
+    resultado: Dict[str, Dict[date, List[time]]] = {}
+    faltantes: Dict[str, List[date]] = {}
+    for profissional_id in profissional_ids:
+        resultado[profissional_id] = {}
+        for dia in dias:
+            slots = cache.obter(profissional_id, dia, duracao_servico_min)
+            if slots is None:
+                faltantes.setdefault(profissional_id, []).append(dia)
+            else:
+                resultado[profissional_id][dia] = slots
+
+    if faltantes:
+        versoes = {profissional_id: cache.versao(profissional_id) for profissional_id in faltantes}
+        todos_dias_faltantes = [dia for dias_prof in faltantes.values() for dia in dias_prof]
+        agenda = _carregar_agenda_periodo(db, list(faltantes), min(todos_dias_faltantes), max(todos_dias_faltantes))
+
+        for profissional_id, dias_prof in faltantes.items():
+            agenda_prof = agenda[profissional_id]
+            for dia in dias_prof:
+                horario = agenda_prof['horarios'].get(dia.weekday())
+                if horario:
+                    slots = calcular_slots_livres(
+                        dia,
+                        time.fromisoformat(horario['hora_inicio']),
+                        time.fromisoformat(horario['hora_fim']),
+                        duracao_servico_min,
+                        agenda_prof['ocupados']
+                    )
+                else:
+                    slots = []
+                resultado[profissional_id][dia] = slots
+                cache.armazenar(profissional_id, dia, duracao_servico_min, slots, versoes[profissional_id])
+
+    # Mantém a ordem cronológica dos dias
+    return {p: {dia: resultado[p][dia] for dia in dias} for p in profissional_ids}
+
+def calcular_horarios_disponiveis(db: firestore.client, profissional_id: str, dia: date, duracao_servico_min: int = 60) -> List[time]:
+    """Calcula os horários disponíveis para um profissional em um dia específico."""
+    return calcular_disponibilidade_periodo(db, [profissional_id], dia, dia, duracao_servico_min)[profissional_id][dia]
 
 # =================================================================================
-# HELPER: envio FCM unitário por token (sem /batch)
+# HELPER: envio FCM em lote (send_each_for_multicast)
 # =================================================================================
 
 def _send_data_push_to_tokens(
@@ -1575,77 +1649,89 @@ def _send_data_push_to_tokens(
     logger_prefix: str = "",
     notification_title: str = None,
     notification_body: str = None
-) -> None:
+) -> Dict:
     """
-    Envia mensagens FCM com notification e data objects.
+    Envia mensagens FCM com notification e data objects, em lotes de até 500 tokens.
     Remove tokens inválidos (Unregistered) do usuário.
     Inclui tag webpush para evitar notificações duplicadas na web.
+    Retorna o resultado por token de enviar_fcm_em_lote.
     """
-    successes = 0
-    failures = 0
+    from notification_helper import enviar_fcm_em_lote
+
+    inicio = perf_counter()
+    # Gera tag webpush única para evitar duplicação em navegador/PWA
+    tipo = data_dict.get("tipo", "NOTIFICACAO")
+    tag_parts = [tipo]
+
+    # Adiciona IDs relevantes à tag baseado no tipo de notificação
+    if "relatorio_id" in data_dict:
+        tag_parts.append(f"relatorio-{data_dict['relatorio_id']}")
+    if "tarefa_id" in data_dict:
+        tag_parts.append(f"tarefa-{data_dict['tarefa_id']}")
+    if "exame_id" in data_dict:
+        tag_parts.append(f"exame-{data_dict['exame_id']}")
+    if "suporte_id" in data_dict:
+        tag_parts.append(f"suporte-{data_dict['suporte_id']}")
+    if "registro_id" in data_dict:
+        tag_parts.append(f"registro-{data_dict['registro_id']}")
+    if "consulta_id" in data_dict:
+        tag_parts.append(f"consulta-{data_dict['consulta_id']}")
+    if "paciente_id" in data_dict:
+        tag_parts.append(f"paciente-{data_dict['paciente_id']}")
+
+    webpush_tag = "-".join(tag_parts)
+
+    resultado = enviar_fcm_em_lote(
+        tokens=tokens,
+        titulo=notification_title,
+        corpo=notification_body,
+        data_payload=data_dict,
+        webpush_tag=webpush_tag,
+        logger_prefix=logger_prefix
+    )
 
-    for t in list(tokens or []):
+    if resultado["tokens_invalidos"]:
         try:
-            # Constrói a mensagem com notification e data objects
-            message_kwargs = {"data": data_dict, "token": t}
-
-            # Adiciona notification object se título e corpo forem fornecidos
-            if notification_title and notification_body:
-                message_kwargs["notification"] = messaging.Notification(
-                    title=notification_title,
-                    body=notification_body
-                )
-
-            # Gera tag webpush única para evitar duplicação em navegador/PWA
-            tipo = data_dict.get("tipo", "NOTIFICACAO")
-            tag_parts = [tipo]
-
-            # Adiciona IDs relevantes à tag baseado no tipo de notificação
-            if "relatorio_id" in data_dict:
-                tag_parts.append(f"relatorio-{data_dict['relatorio_id']}")
-            if "tarefa_id" in data_dict:
-                tag_parts.append(f"tarefa-{data_dict['tarefa_id']}")
-            if "exame_id" in data_dict:
-                tag_parts.append(f"exame-{data_dict['exame_id']}")
-            if "suporte_id" in data_dict:
-                tag_parts.append(f"suporte-{data_dict['suporte_id']}")
-            if "registro_id" in data_dict:
-                tag_parts.append(f"registro-{data_dict['registro_id']}")
-            if "consulta_id" in data_dict:
-                tag_parts.append(f"consulta-{data_dict['consulta_id']}")
-            if "paciente_id" in data_dict:
-                tag_parts.append(f"paciente-{data_dict['paciente_id']}")
-
-            webpush_tag = "-".join(tag_parts)
-
-            # Adiciona configuração webpush com tag
-            message_kwargs["webpush"] = messaging.WebpushConfig(
-                notification=messaging.WebpushNotification(
-                    tag=webpush_tag
-                )
-            )
+            user_doc = buscar_usuario_por_firebase_uid(db, firebase_uid_destinatario)
+            if user_doc:
+                remover_fcm_tokens_invalidos(db, user_doc['id'], resultado["tokens_invalidos"])
+                logger.info(f"{logger_prefix}{len(resultado['tokens_invalidos'])} token(s) inválido(s) removido(s) do usuário {firebase_uid_destinatario}.")
+        except Exception as rem_err:
+            logger.error(f"{logger_prefix}Falha ao remover tokens inválidos: {rem_err}")
+
+    logger.info(f"{logger_prefix}Envio FCM concluído: sucesso={resultado['sucessos']} falhas={resultado['falhas']}")
+    # Envio completo (lotes + limpeza de tokens); as entregas por token já foram contadas no canal fcm
+    registrar_push('fcm_data_push', inicio)
+    return resultado
 
-            messaging.send(messaging.Message(**message_kwargs))
-            successes += 1
-        except Exception as e:
-            failures += 1
-            logger.error(f"{logger_prefix}Erro no token {t[:12]}…: {e}")
-            msg = str(e)
-            # Heurísticas comuns do Admin SDK para token inválido
-            if any(s in msg for s in [
-                "Unregistered",                        # Android/iOS
-                "NotRegistered",                       # variação
-                "requested entity was not found",      # inglês minúsculo em algumas libs
-                "Requested entity was not found",      # inglês capitalizado
-                "registration-token-not-registered"    # mensagem do FCM
-            ]):
-                try:
-                    remover_fcm_token(db, firebase_uid_destinatario, t)
-                    logger.info(f"{logger_prefix}Token inválido removido do usuário {firebase_uid_destinatario}.")
-                except Exception as rem_err:
-                    logger.error(f"{logger_prefix}Falha ao remover token inválido: {rem_err}")
 
-    logger.info(f"{logger_prefix}Envio FCM concluído: sucesso={successes} falhas={failures}")
+def _enviar_fcm_ao_usuario(
+    db: firestore.client,
+    usuario_id: str,
+    tokens: List[str],
+    titulo: str,
+    corpo: str,
+    data_payload: Dict[str, str],
+    webpush_tag: Optional[str] = None,
+    logger_prefix: str = ""
+) -> Dict:
+    """
+    Envia a mesma notificação FCM para todos os tokens do usuário (em lote) e
+    remove do usuário os tokens recusados. Retorna o resultado de enviar_fcm_em_lote.
+    """
+    from notification_helper import enviar_fcm_em_lote
+
+    resultado = enviar_fcm_em_lote(
+        tokens=tokens,
+        titulo=titulo,
+        corpo=corpo,
+        data_payload=data_payload,
+        webpush_tag=webpush_tag,
+        logger_prefix=logger_prefix
+    )
+    if resultado["tokens_invalidos"]:
+        remover_fcm_tokens_invalidos(db, usuario_id, resultado["tokens_invalidos"])
+    return resultado
 
 # =================================================================================
 # FUNÇÕES DE AGENDAMENTOS
@@ -1669,7 +1755,7 @@ def criar_agendamento(db: firestore.client, agendamento_data: schemas.Agendament
         usuario_doc = buscar_usuario_por_firebase_uid(db, firebase_uid)
         if usuario_doc:
             nome_profissional_real = usuario_doc.get('nome', nome_profissional_real)
-            logger.info(f"🔧 AGENDAMENTO - Nome do profissional enriquecido: {nome_profissional_real}")
+            logger.info("🔧 AGENDAMENTO - Nome do profissional %s enriquecido", agendamento_data.profissional_id)
         else:
             logger.warning(f"🔧 AGENDAMENTO - Usuário não encontrado para firebase_uid: {firebase_uid}")
 
@@ -1678,7 +1764,7 @@ def criar_agendamento(db: firestore.client, agendamento_data: schemas.Agendament
     cliente_doc = buscar_usuario_por_firebase_uid(db, cliente.firebase_uid)
     if cliente_doc:
         nome_cliente_real = cliente_doc.get('nome', cliente.nome)
-        logger.info(f"🔧 AGENDAMENTO - Nome do cliente enriquecido: {nome_cliente_real}")
+        logger.info("🔧 AGENDAMENTO - Nome do cliente %s enriquecido", cliente_doc['id'])
 
     agendamento_dict = {
         "negocio_id": agendamento_data.negocio_id,
@@ -1697,6 +1783,7 @@ def criar_agendamento(db: firestore.client, agendamento_data: schemas.Agendament
 
     doc_ref = db.collection('agendamentos').document()
     doc_ref.set(agendamento_dict)
+    invalidar_profissional(profissional['id'])
     
     agendamento_dict['id'] = doc_ref.id
     
@@ -1771,6 +1858,7 @@ def cancelar_agendamento(db: firestore.client, agendamento_id: str, cliente_id:
     
     agendamento_ref.update({"status": "cancelado_pelo_cliente"})
     agendamento["status"] = "cancelado_pelo_cliente"
+    invalidar_profissional(agendamento.get('profissional_id'))
         
     profissional = buscar_profissional_por_id(db, agendamento['profissional_id'])
     if profissional:
@@ -1845,6 +1933,7 @@ def cancelar_agendamento_pelo_profissional(db: firestore.client, agendamento_id:
     # Atualiza o status
     agendamento_ref.update({"status": "cancelado_pelo_profissional"})
     agendamento["status"] = "cancelado_pelo_profissional"
+    invalidar_profissional(profissional_id)
     logger.info(f"Agendamento {agendamento_id} cancelado pelo profissional {profissional_id}.")
     
     # Dispara a notificação para o cliente
@@ -1903,9 +1992,9 @@ def listar_agendamentos_por_cliente(db: firestore.client, negocio_id: str, clien
             if isinstance(cliente_nome, str) and cliente_nome.startswith('gAAAAA'):
                 try:
                     ag_data['cliente_nome'] = decrypt_data(cliente_nome)
-                    logger.info(f"🔓 Cliente nome descriptografado no agendamento {doc.id}")
+                    debug_amostrado(logger, "🔓 Cliente nome descriptografado no agendamento %s", doc.id)
                 except Exception as e:
-                    logger.error(f"Erro ao descriptografar cliente_nome no agendamento {doc.id}: {e}")
+                    logger.error("Erro ao descriptografar cliente_nome no agendamento %s: %s", doc.id, e)
                     ag_data['cliente_nome'] = "[Erro na descriptografia]"
             # Se não começa com gAAAAA, mantém o valor original (não criptografado)
 
@@ -1914,9 +2003,9 @@ def listar_agendamentos_por_cliente(db: firestore.client, negocio_id: str, clien
             if isinstance(profissional_nome, str) and profissional_nome.startswith('gAAAAA'):
                 try:
                     ag_data['profissional_nome'] = decrypt_data(profissional_nome)
-                    logger.info(f"🔓 Profissional nome descriptografado no agendamento {doc.id}")
+                    debug_amostrado(logger, "🔓 Profissional nome descriptografado no agendamento %s", doc.id)
                 except Exception as e:
-                    logger.error(f"Erro ao descriptografar profissional_nome no agendamento {doc.id}: {e}")
+                    logger.error("Erro ao descriptografar profissional_nome no agendamento %s: %s", doc.id, e)
                     ag_data['profissional_nome'] = "[Erro na descriptografia]"
             # Se não começa com gAAAAA, mantém o valor original (não criptografado)
         
@@ -1939,9 +2028,9 @@ def listar_agendamentos_por_profissional(db: firestore.client, negocio_id: str,
             if isinstance(cliente_nome, str) and cliente_nome.startswith('gAAAAA'):
                 try:
                     ag_data['cliente_nome'] = decrypt_data(cliente_nome)
-                    logger.info(f"🔓 Cliente nome descriptografado no agendamento {doc.id}")
+                    debug_amostrado(logger, "🔓 Cliente nome descriptografado no agendamento %s", doc.id)
                 except Exception as e:
-                    logger.error(f"Erro ao descriptografar cliente_nome no agendamento {doc.id}: {e}")
+                    logger.error("Erro ao descriptografar cliente_nome no agendamento %s: %s", doc.id, e)
                     ag_data['cliente_nome'] = "[Erro na descriptografia]"
             # Se não começa com gAAAAA, mantém o valor original (não criptografado)
 
@@ -1950,9 +2039,9 @@ def listar_agendamentos_por_profissional(db: firestore.client, negocio_id: str,
             if isinstance(profissional_nome, str) and profissional_nome.startswith('gAAAAA'):
                 try:
                     ag_data['profissional_nome'] = decrypt_data(profissional_nome)
-                    logger.info(f"🔓 Profissional nome descriptografado no agendamento {doc.id}")
+                    debug_amostrado(logger, "🔓 Profissional nome descriptografado no agendamento %s", doc.id)
                 except Exception as e:
-                    logger.error(f"Erro ao descriptografar profissional_nome no agendamento {doc.id}: {e}")
+                    logger.error("Erro ao descriptografar profissional_nome no agendamento %s: %s", doc.id, e)
                     ag_data['profissional_nome'] = "[Erro na descriptografia]"
             # Se não começa com gAAAAA, mantém o valor original (não criptografado)
         
@@ -1973,7 +2062,7 @@ def criar_postagem(db: firestore.client, postagem_data: schemas.PostagemCreate,
         usuario_doc = buscar_usuario_por_firebase_uid(db, firebase_uid)
         if usuario_doc:
             profissional['nome'] = usuario_doc.get('nome', profissional.get('nome'))
-            logger.info(f"🔧 POSTAGEM - Nome do profissional enriquecido: {usuario_doc.get('nome', 'N/A')}")
+            logger.info("🔧 POSTAGEM - Nome do profissional %s enriquecido", profissional.get('id'))
 
     post_dict = postagem_data.dict()
     post_dict['data_postagem'] = datetime.utcnow()
@@ -2000,41 +2089,91 @@ def listar_postagens_por_profissional(db: firestore.client, profissional_id: str
         postagens.append(post_data)
     return postagens
 
-def listar_feed_por_negocio(db: firestore.client, negocio_id: str, user_id: Optional[str] = None) -> List[Dict]:
-    """Lista o feed de postagens de um negócio específico."""
+def _enriquecer_postagens(db: firestore.client, docs: list, user_id: Optional[str] = None) -> List[Dict]:
+    """
+    Completa as postagens com a miniatura atual do profissional e com 'curtido_pelo_usuario'.
+    Os perfis dos autores vêm do carregador da requisição (um db.get_all para os autores
+    distintos) e as curtidas do usuário de um db.get_all sobre as refs curtidas/{user_id}.
+    """
     postagens = []
-    query = db.collection('postagens')\
-        .where('negocio_id', '==', negocio_id)\
-        .order_by('data_postagem', direction=firestore.Query.DESCENDING)
-        
-    # Cache para perfis de profissionais já buscados, para evitar múltiplas leituras do mesmo perfil
-    perfis_profissionais_cache = {}
-
-    for doc in query.stream():
+    for doc in docs:
         post_data = doc.to_dict()
         post_data['id'] = doc.id
-        
-        # --- INÍCIO DA CORREÇÃO ---
-        profissional_id = post_data.get('profissional_id')
-        if profissional_id in perfis_profissionais_cache:
-            perfil_profissional = perfis_profissionais_cache[profissional_id]
-        else:
-            perfil_profissional = buscar_profissional_por_id(db, profissional_id)
-            perfis_profissionais_cache[profissional_id] = perfil_profissional
-        
+        post_data['curtido_pelo_usuario'] = False
+        postagens.append(post_data)
+
+    perfis_profissionais = get_carregador(db).carregar_muitos('profissionais', [p.get('profissional_id') for p in postagens])
+    for post_data in postagens:
+        perfil_profissional = perfis_profissionais.get(post_data.get('profissional_id'))
         if perfil_profissional:
             post_data['profissional_foto_thumbnail'] = perfil_profissional.get('fotos', {}).get('thumbnail')
-        # --- FIM DA CORREÇÃO ---
 
-        post_data['curtido_pelo_usuario'] = False
-        if user_id:
-            curtida_ref = db.collection('postagens').document(doc.id).collection('curtidas').document(user_id)
-            if curtida_ref.get().exists:
-                post_data['curtido_pelo_usuario'] = True
-                
-        postagens.append(post_data)
+    if user_id and postagens:
+        curtidas_refs = [
+            db.collection('postagens').document(post_data['id']).collection('curtidas').document(user_id)
+            for post_data in postagens
+        ]
+        curtidas = set()
+        for inicio in range(0, len(curtidas_refs), TAMANHO_LOTE_GET_ALL):
+            for curtida in db.get_all(curtidas_refs[inicio:inicio + TAMANHO_LOTE_GET_ALL]):
+                if curtida.exists:
+                    curtidas.add(curtida.reference.parent.parent.id)
+        for post_data in postagens:
+            post_data['curtido_pelo_usuario'] = post_data['id'] in curtidas
+
     return postagens
 
+def listar_feed_por_negocio(db: firestore.client, negocio_id: str, user_id: Optional[str] = None) -> List[Dict]:
+    """Lista o feed de postagens de um negócio específico."""
+    query = db.collection('postagens')\
+        .where('negocio_id', '==', negocio_id)\
+        .order_by('data_postagem', direction=firestore.Query.DESCENDING)
+
+    return _enriquecer_postagens(db, list(query.stream()), user_id)
+
+def listar_feed_por_negocio_paginado(db: firestore.client, negocio_id: str, limit: int, cursor: Optional[str] = None,
+                                     user_id: Optional[str] = None) -> Dict:
+    """
+    Lista uma página do feed de um negócio, da postagem mais recente para a mais antiga.
+
+    Args:
+        limit: Quantidade máxima de postagens na página
+        cursor: Valor de 'proximo_cursor' retornado pela página anterior (None na primeira página)
+        user_id: Usuário autenticado, para preencher 'curtido_pelo_usuario'
+
+    Returns:
+        {"postagens": [...], "proximo_cursor": str ou None quando não há mais páginas}
+
+    Raises:
+        ValueError: se o cursor for inválido
+    """
+    postagens_ref = db.collection('postagens')
+    query = postagens_ref\
+        .where('negocio_id', '==', negocio_id)\
+        .order_by('data_postagem', direction=firestore.Query.DESCENDING)\
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+
+    if cursor:
+        data_postagem, postagem_id = _decodificar_cursor(cursor)
+        query = query.start_after({
+            'data_postagem': data_postagem,
+            '__name__': postagens_ref.document(postagem_id)
+        })
+
+    # Busca um item a mais para saber se existe próxima página
+    docs = list(query.limit(limit + 1).stream())
+    tem_mais = len(docs) > limit
+    docs = docs[:limit]
+
+    postagens = _enriquecer_postagens(db, docs, user_id)
+
+    proximo_cursor = None
+    if tem_mais and postagens:
+        ultima = postagens[-1]
+        proximo_cursor = _codificar_cursor(ultima.get('data_postagem'), ultima['id'])
+
+    return {"postagens": postagens, "proximo_cursor": proximo_cursor}
+
 def toggle_curtida(db: firestore.client, postagem_id: str, user_id: str) -> bool:
     """Adiciona ou remove uma curtida de uma postagem."""
     post_ref = db.collection('postagens').document(postagem_id)
@@ -2167,60 +2306,132 @@ def listar_avaliacoes_por_profissional(db: firestore.client, profissional_id: st
 # FUNÇÕES DE NOTIFICAÇÕES
 # =================================================================================
 
-def listar_notificacoes(db: firestore.client, usuario_id: str) -> List[Dict]:
+def _normalizar_notificacao(doc) -> Dict:
+    """Converte um documento de notificação para o formato de NotificacaoResponse."""
+    notificacao_data = doc.to_dict()
+    notificacao_data['id'] = doc.id
+
+    # Mapear campos para compatibilidade com schema
+    # Se tem 'titulo', mapear para 'title'
+    if 'titulo' in notificacao_data and 'title' not in notificacao_data:
+        notificacao_data['title'] = notificacao_data['titulo']
+
+    # Se tem 'corpo', mapear para 'body'
+    if 'corpo' in notificacao_data and 'body' not in notificacao_data:
+        notificacao_data['body'] = notificacao_data['corpo']
+
+    # Garantir campos obrigatórios estão presentes e não são null
+    if 'title' not in notificacao_data or notificacao_data['title'] is None:
+        notificacao_data['title'] = notificacao_data.get('titulo', 'Notificação')
+
+    if 'body' not in notificacao_data or notificacao_data['body'] is None:
+        notificacao_data['body'] = notificacao_data.get('corpo', 'Conteúdo da notificação')
+
+    # Garantir campo 'lida' existe e não é null
+    if 'lida' not in notificacao_data or notificacao_data['lida'] is None:
+        notificacao_data['lida'] = False
+
+    # Garantir campo 'data_criacao' existe e não é null
+    if 'data_criacao' not in notificacao_data or notificacao_data['data_criacao'] is None:
+        notificacao_data['data_criacao'] = firestore.SERVER_TIMESTAMP
+
+    # Garantir que campos string não sejam null
+    if notificacao_data['title'] is None:
+        notificacao_data['title'] = 'Notificação'
+    if notificacao_data['body'] is None:
+        notificacao_data['body'] = 'Conteúdo da notificação'
+    if 'tipo' in notificacao_data and notificacao_data['tipo'] is None:
+        notificacao_data['tipo'] = 'GERAL'
+
+    return notificacao_data
+
+
+def _codificar_cursor(valor: Optional[datetime], doc_id: str) -> str:
+    """Gera o cursor opaco (base64 do campo de ordenação + id) do último item da página."""
+    bruto = json.dumps({"t": valor.isoformat() if valor else None, "id": doc_id})
+    return base64.urlsafe_b64encode(bruto.encode('utf-8')).decode('ascii')
+
+
+def _decodificar_cursor(cursor: str):
+    """Retorna (valor do campo de ordenação, id) do cursor. Lança ValueError se o cursor for inválido."""
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return (datetime.fromisoformat(dados['t']) if dados['t'] else None), str(dados['id'])
+    except Exception as e:
+        raise ValueError(f"Cursor de paginação inválido: {e}")
+
+
+def listar_notificacoes(db: firestore.client, usuario_id: str) -> List[Dict]:
     """Lista o histórico de notificações de um usuário."""
-    notificacoes = []
     # No Firestore, as notificações podem ser uma subcoleção dentro do documento do usuário
     query = db.collection('usuarios').document(usuario_id).collection('notificacoes')\
         .order_by('data_criacao', direction=firestore.Query.DESCENDING)
-    
-    for doc in query.stream():
-        notificacao_data = doc.to_dict()
-        notificacao_data['id'] = doc.id
-        
-        # Mapear campos para compatibilidade com schema
-        # Se tem 'titulo', mapear para 'title'
-        if 'titulo' in notificacao_data and 'title' not in notificacao_data:
-            notificacao_data['title'] = notificacao_data['titulo']
-        
-        # Se tem 'corpo', mapear para 'body'  
-        if 'corpo' in notificacao_data and 'body' not in notificacao_data:
-            notificacao_data['body'] = notificacao_data['corpo']
-            
-        # Garantir campos obrigatórios estão presentes e não são null
-        if 'title' not in notificacao_data or notificacao_data['title'] is None:
-            notificacao_data['title'] = notificacao_data.get('titulo', 'Notificação')
 
-        if 'body' not in notificacao_data or notificacao_data['body'] is None:
-            notificacao_data['body'] = notificacao_data.get('corpo', 'Conteúdo da notificação')
+    return [_normalizar_notificacao(doc) for doc in query.stream()]
 
-        # Garantir campo 'lida' existe e não é null
-        if 'lida' not in notificacao_data or notificacao_data['lida'] is None:
-            notificacao_data['lida'] = False
 
-        # Garantir campo 'data_criacao' existe e não é null
-        if 'data_criacao' not in notificacao_data or notificacao_data['data_criacao'] is None:
-            notificacao_data['data_criacao'] = firestore.SERVER_TIMESTAMP
+def listar_notificacoes_paginado(db: firestore.client, usuario_id: str, limit: int, cursor: Optional[str] = None) -> Dict:
+    """
+    Lista uma página do histórico de notificações, da mais recente para a mais antiga.
+
+    Args:
+        limit: Quantidade máxima de notificações na página
+        cursor: Valor de 'proximo_cursor' retornado pela página anterior (None na primeira página)
+
+    Returns:
+        {"notificacoes": [...], "proximo_cursor": str ou None quando não há mais páginas}
+
+    Raises:
+        ValueError: se o cursor for inválido
+    """
+    # Busca um item a mais para saber se existe próxima página
+    docs = list(_query_pagina_notificacoes(db, usuario_id, limit, cursor).stream())
+    return _montar_pagina_notificacoes(docs, limit)
+
+
+def _query_pagina_notificacoes(db, usuario_id: str, limit: int, cursor: Optional[str]):
+    """Consulta de uma página de notificações (limit + 1 itens); serve ao cliente síncrono e ao AsyncClient."""
+    notificacoes_ref = db.collection('usuarios').document(usuario_id).collection('notificacoes')
+    query = notificacoes_ref\
+        .order_by('data_criacao', direction=firestore.Query.DESCENDING)\
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+
+    if cursor:
+        data_criacao, notificacao_id = _decodificar_cursor(cursor)
+        query = query.start_after({
+            'data_criacao': data_criacao,
+            '__name__': notificacoes_ref.document(notificacao_id)
+        })
+    return query.limit(limit + 1)
+
+
+def _montar_pagina_notificacoes(docs: List, limit: int) -> Dict:
+    """Monta a resposta paginada a partir dos limit + 1 documentos lidos."""
+    tem_mais = len(docs) > limit
+    docs = docs[:limit]
+
+    proximo_cursor = None
+    if tem_mais and docs:
+        ultimo = docs[-1]
+        proximo_cursor = _codificar_cursor(ultimo.get('data_criacao'), ultimo.id)
+
+    return {
+        "notificacoes": [_normalizar_notificacao(doc) for doc in docs],
+        "proximo_cursor": proximo_cursor
+    }
 
-        # Garantir que campos string não sejam null
-        if notificacao_data['title'] is None:
-            notificacao_data['title'] = 'Notificação'
-        if notificacao_data['body'] is None:
-            notificacao_data['body'] = 'Conteúdo da notificação'
-        if 'tipo' in notificacao_data and notificacao_data['tipo'] is None:
-            notificacao_data['tipo'] = 'GERAL'
-        
-        notificacoes.append(notificacao_data)
-    return notificacoes
 
 def contar_notificacoes_nao_lidas(db: firestore.client, usuario_id: str) -> int:
-    """Conta o número de notificações não lidas de um usuário."""
+    """
+    Conta o número de notificações não lidas de um usuário.
+    Usa a agregação count() do Firestore: o servidor conta os documentos sem
+    transferi-los, então o custo não cresce com o histórico do usuário.
+    """
     query = db.collection('usuarios').document(usuario_id).collection('notificacoes')\
         .where('lida', '==', False)
-    
-    # .get() em uma query retorna um snapshot da coleção, podemos contar os documentos
-    docs = query.get()
-    return len(docs)
+
+    resultado = query.count(alias='nao_lidas').get()
+    return int(resultado[0][0].value)
 
 def marcar_notificacao_como_lida(db: firestore.client, usuario_id: str, notificacao_id: str) -> bool:
     """Marca uma notificação específica de um usuário como lida."""
@@ -2258,22 +2469,23 @@ def agendar_notificacao(db: firestore.client, notificacao_data: schemas.Notifica
     return agendamento_dict
 
 def marcar_todas_como_lidas(db: firestore.client, usuario_id: str) -> bool:
-    """Marca todas as notificações não lidas de um usuário como lidas."""
+    """
+    Marca todas as notificações não lidas de um usuário como lidas.
+    Usa o EscritorEmLote: com milhares de notificações, as atualizações são
+    divididas em batches de 500 em vez de estourar o limite de um único batch.
+    """
     try:
         notificacoes_ref = db.collection('usuarios').document(usuario_id).collection('notificacoes')
-        query = notificacoes_ref.where('lida', '==', False)
-        docs = query.stream()
+        # select([]) traz só as referências, sem o conteúdo das notificações
+        query = notificacoes_ref.where('lida', '==', False).select([])
+
+        with EscritorEmLote(db, descricao=f"marcar_todas_como_lidas:{usuario_id}") as escritor:
+            for doc in query.stream():
+                escritor.update(doc.reference, {'lida': True})
+
+        if escritor.estatisticas["operacoes"] > 0:
+            logger.info(f"{escritor.estatisticas['operacoes']} notificações marcadas como lidas para o usuário {usuario_id}.")
 
-        batch = db.batch()
-        doc_count = 0
-        for doc in docs:
-            batch.update(doc.reference, {'lida': True})
-            doc_count += 1
-        
-        if doc_count > 0:
-            batch.commit()
-            logger.info(f"{doc_count} notificações marcadas como lidas para o usuário {usuario_id}.")
-        
         return True
     except Exception as e:
         logger.error(f"Erro ao marcar todas as notificações como lidas para o usuário {usuario_id}: {e}")
@@ -2393,20 +2605,9 @@ def _notificar_cliente_confirmacao(db: firestore.client, agendamento: Dict, agen
                 "click_action": f"/agendamentos/{agendamento_id}"
             }
 
-            # PASSO 6: Enviar o push em loop
-            sucessos = 0
-            for token in fcm_tokens:
-                try:
-                    message = messaging.Message(
-                        notification=messaging.Notification(title=titulo, body=corpo),
-                        data=data_payload,
-                        token=token
-                    )
-                    messaging.send(message)
-                    sucessos += 1
-                except Exception as e:
-                    logger.error(f"Erro ao enviar para o token {token[:10]}...: {e}")
-            logger.info(f"Notificação FCM de confirmação enviada. Sucessos: {sucessos}")
+            # PASSO 6: Enviar o push (em lote)
+            envio = _enviar_fcm_ao_usuario(db, cliente_id, fcm_tokens, titulo, corpo, data_payload)
+            logger.info(f"Notificação FCM de confirmação enviada. Sucessos: {envio['sucessos']}")
         else:
             logger.info(f"Cliente {cliente_id} não possui tokens FCM para notificar.")
 
@@ -2792,6 +2993,38 @@ def vincular_supervisor_tecnico(db: firestore.client, tecnico_id: str, superviso
 
 # Em crud.py, SUBSTITUA esta função inteira:
 
+def _query_pacientes_vinculados(db, negocio_id: str, usuario_id: str, role: str):
+    """
+    Monta a consulta dos pacientes visíveis para a role (serve ao cliente síncrono e ao AsyncClient).
+    Retorna None se a role não tem acesso a pacientes.
+    """
+    query = db.collection('usuarios').where(f'roles.{negocio_id}', '==', 'cliente')
+
+    # ***** A CORREÇÃO ESTÁ AQUI *****
+    # Adiciona a lógica para o gestor ('admin')
+    if role == 'admin':
+        # Se for admin, não aplica filtro de vínculo, pega todos os clientes do negócio.
+        return query
+    elif role == 'profissional':
+        return query.where('enfermeiro_id', '==', usuario_id)
+    elif role == 'tecnico':
+        return query.where('tecnicos_ids', 'array_contains', usuario_id)
+    return None
+
+def _paciente_ativo(doc, negocio_id: str) -> Optional[Dict]:
+    """Converte o documento do paciente, ou None se ele não está ativo no negócio."""
+    paciente_data = doc.to_dict()
+    status_no_negocio = paciente_data.get('status_por_negocio', {}).get(negocio_id, 'ativo')
+    if status_no_negocio != 'ativo':
+        return None
+
+    paciente_data['id'] = doc.id
+    # --- INÍCIO DA ADIÇÃO SOLICITADA ---
+    profile_image_url = paciente_data.get('profile_image_url') or paciente_data.get('profile_image')
+    paciente_data['profile_image_url'] = profile_image_url
+    # --- FIM DA ADIÇÃO SOLICITADA ---
+    return paciente_data
+
 def listar_pacientes_por_profissional_ou_tecnico(db: firestore.client, negocio_id: str, usuario_id: str, role: str) -> List[Dict]:
     """
     Lista todos os pacientes ATIVOS.
@@ -2800,69 +3033,117 @@ def listar_pacientes_por_profissional_ou_tecnico(db: firestore.client, negocio_i
     """
     pacientes = []
     try:
-        query = db.collection('usuarios').where(f'roles.{negocio_id}', '==', 'cliente')
-        
-        # ***** A CORREÇÃO ESTÁ AQUI *****
-        # Adiciona a lógica para o gestor ('admin')
-        if role == 'admin':
-            # Se for admin, não aplica filtro de vínculo, pega todos os clientes do negócio.
-            pass
-        elif role == 'profissional':
-            query = query.where('enfermeiro_id', '==', usuario_id)
-        elif role == 'tecnico':
-            query = query.where('tecnicos_ids', 'array_contains', usuario_id)
-        else:
+        query = _query_pacientes_vinculados(db, negocio_id, usuario_id, role)
+        if query is None:
             return []
 
         for doc in query.stream():
-            paciente_data = doc.to_dict()
-            status_no_negocio = paciente_data.get('status_por_negocio', {}).get(negocio_id, 'ativo')
-            
-            if status_no_negocio == 'ativo':
-                paciente_data['id'] = doc.id
-                
-                # Descriptografa campos sensíveis do paciente
-                if 'nome' in paciente_data and paciente_data['nome']:
-                    try:
-                        paciente_data['nome'] = decrypt_data(paciente_data['nome'])
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar nome do paciente {doc.id}: {e}")
-                        paciente_data['nome'] = "[Erro na descriptografia]"
-                
-                if 'telefone' in paciente_data and paciente_data['telefone']:
-                    try:
-                        paciente_data['telefone'] = decrypt_data(paciente_data['telefone'])
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar telefone do paciente {doc.id}: {e}")
-                        paciente_data['telefone'] = "[Erro na descriptografia]"
-                
-                if 'endereco' in paciente_data and paciente_data['endereco']:
-                    endereco_descriptografado = {}
-                    for key, value in paciente_data['endereco'].items():
-                        if value and isinstance(value, str) and value.strip():
-                            try:
-                                endereco_descriptografado[key] = decrypt_data(value)
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar campo de endereço {key} do paciente {doc.id}: {e}")
-                                endereco_descriptografado[key] = "[Erro na descriptografia]"
-                        else:
-                            endereco_descriptografado[key] = value
-                    paciente_data['endereco'] = endereco_descriptografado
-                
-                # --- INÍCIO DA ADIÇÃO SOLICITADA ---
-                profile_image_url = paciente_data.get('profile_image_url') or paciente_data.get('profile_image')
-                paciente_data['profile_image_url'] = profile_image_url
-                # --- FIM DA ADIÇÃO SOLICITADA ---
-
+            paciente_data = _paciente_ativo(doc, negocio_id)
+            if paciente_data:
                 pacientes.append(paciente_data)
-        
-        return pacientes
+
+        # Descriptografa nome, telefone e endereço de todos os pacientes em uma única passada
+        return decrypt_many(pacientes)
     except Exception as e:
         logger.error(f"Erro ao listar pacientes para o usuário {usuario_id} com role '{role}': {e}")
         return []
     
+# =================================================================================
+# PLANO ATIVO (ponteiro no documento do paciente)
+# =================================================================================
+# O plano de cuidado ativo é a consulta mais recente (maior created_at). O
+# documento do paciente guarda plano_ativo_id e um resumo em plano_ativo
+# ({id, created_at, data_consulta, medico_id}), mantidos por criar_consulta,
+# update_consulta e delete_consulta. Descobrir o plano ativo é a leitura do
+# paciente (em geral já feita pelas dependências de auth.py, ver o mapa de
+# identidade em data_loader.py) em vez de listar as consultas.
+# plano_ativo_id = None indica paciente sem consultas. Pacientes sem o campo
+# (cadastrados antes do ponteiro, ver reconstruir_planos_ativos) seguem pela
+# listagem das consultas.
+
+def _resumo_plano(consulta_id: str, consulta: Dict) -> Dict:
+    return {
+        'id': consulta_id,
+        'created_at': consulta.get('created_at'),
+        'data_consulta': consulta.get('data_consulta'),
+        'medico_id': consulta.get('medico_id'),
+    }
+
+def _campos_plano_ativo(consulta_id: Optional[str], consulta: Optional[Dict]) -> Dict:
+    """Campos do ponteiro a gravar no documento do paciente."""
+    if not consulta_id:
+        return {'plano_ativo_id': None, 'plano_ativo': None}
+    return {'plano_ativo_id': consulta_id, 'plano_ativo': _resumo_plano(consulta_id, consulta)}
+
+def _tem_ponteiro_plano_ativo(paciente: Optional[Dict]) -> bool:
+    return paciente is not None and 'plano_ativo_id' in paciente
+
+def _plano_vigente_no_dia(plano: Optional[Dict], dia: date) -> bool:
+    """Se o plano (resumo do ponteiro) já existia no dia informado."""
+    criado = (plano or {}).get('created_at')
+    if not isinstance(criado, datetime):
+        return False
+    if criado.tzinfo is not None:
+        criado = criado.astimezone(timezone.utc).replace(tzinfo=None)
+    return criado <= datetime.combine(dia, time.max)
+
+def _consulta_mais_recente(db: firestore.client, paciente_id: str) -> Optional[Dict]:
+    """Consulta mais recente do paciente (com 'id'), lida diretamente do Firestore."""
+    query = db.collection('usuarios').document(paciente_id).collection('consultas')\
+        .order_by('created_at', direction=firestore.Query.DESCENDING).limit(1)
+    for doc in query.stream():
+        consulta = doc.to_dict()
+        consulta['id'] = doc.id
+        return consulta
+    return None
+
+def get_plano_ativo_id(db: firestore.client, paciente_id: str) -> Optional[str]:
+    """ID da consulta do plano de cuidado ativo do paciente, ou None se ele não tem consultas."""
+    paciente = get_carregador(db).carregar('usuarios', paciente_id)
+    if _tem_ponteiro_plano_ativo(paciente):
+        return paciente.get('plano_ativo_id')
+    consultas = listar_consultas(db, paciente_id)
+    return consultas[0]['id'] if consultas else None
+
+def _recalcular_plano_ativo(db: firestore.client, paciente_id: str) -> Optional[str]:
+    """Regrava o ponteiro a partir das consultas (após excluir o plano ativo)."""
+    consulta = _consulta_mais_recente(db, paciente_id)
+    consulta_id = consulta['id'] if consulta else None
+    db.collection('usuarios').document(paciente_id).update(_campos_plano_ativo(consulta_id, consulta))
+    esquecer_documento('usuarios', paciente_id)
+    logger.info(f"Plano ativo do paciente {paciente_id} recalculado: {consulta_id}")
+    return consulta_id
+
+def reconstruir_planos_ativos(db: firestore.client) -> Dict:
+    """
+    Backfill do ponteiro do plano ativo para os usuários cadastrados antes dele.
+    Percorre os usuários uma única vez e só grava os que ainda não têm o campo
+    (pode ser repetido sem efeito); deve ser executado manualmente após o deploy.
+    """
+    stats = {"usuarios_verificados": 0, "planos_ativos_gravados": 0, "pacientes_sem_plano": 0}
+
+    with EscritorEmLote(db, descricao="reconstruir_planos_ativos") as escritor:
+        for usuario_doc in db.collection('usuarios').select(['plano_ativo_id', 'roles']).stream():
+            stats["usuarios_verificados"] += 1
+            usuario = usuario_doc.to_dict()
+            if _tem_ponteiro_plano_ativo(usuario):
+                continue
+            consulta = _consulta_mais_recente(db, usuario_doc.id)
+            if consulta:
+                escritor.update(usuario_doc.reference, _campos_plano_ativo(consulta['id'], consulta))
+                stats["planos_ativos_gravados"] += 1
+            elif 'cliente' in (usuario.get('roles') or {}).values():
+                escritor.update(usuario_doc.reference, _campos_plano_ativo(None, None))
+                stats["pacientes_sem_plano"] += 1
+
+    logger.info(f"📊 Ponteiros de plano ativo reconstruídos: {stats}")
+    return stats
+
 def criar_consulta(db: firestore.client, consulta_data: schemas.ConsultaCreate) -> Dict:
-    """Salva uma nova consulta na subcoleção de um paciente."""
+    """
+    Salva uma nova consulta na subcoleção de um paciente. A nova consulta passa
+    a ser o plano ativo: o ponteiro do paciente é gravado no mesmo batch.
+    """
     consulta_dict = consulta_data.model_dump()
     if 'created_at' not in consulta_dict:
         try:
@@ -2872,7 +3153,11 @@ def criar_consulta(db: firestore.client, consulta_data: schemas.ConsultaCreate)
             consulta_dict['created_at'] = datetime.utcnow()
     paciente_ref = db.collection('usuarios').document(consulta_data.paciente_id)
     doc_ref = paciente_ref.collection('consultas').document()
-    doc_ref.set(consulta_dict)
+    batch = db.batch()
+    batch.set(doc_ref, consulta_dict)
+    batch.update(paciente_ref, _campos_plano_ativo(doc_ref.id, consulta_dict))
+    batch.commit()
+    esquecer_documento('usuarios', consulta_data.paciente_id)
     consulta_dict['id'] = doc_ref.id
     
     # Notificar técnicos sobre novo plano de cuidado
@@ -2894,12 +3179,20 @@ def adicionar_exame(db: firestore.client, exame_data: schemas.ExameBase, criador
 
     paciente_ref = db.collection('usuarios').document(exame_data.paciente_id)
     doc_ref = paciente_ref.collection('exames').document()
-    doc_ref.set(exame_dict)
+
+    # Grava o exame e o evento de notificação no mesmo batch (outbox)
+    batch = db.batch()
+    batch.set(doc_ref, exame_dict)
+    evento_ref = registrar_evento(db, batch, 'EXAME_CRIADO', {'paciente_id': exame_data.paciente_id, 'exame_id': doc_ref.id})
+    batch.commit()
 
     exame_dict['id'] = doc_ref.id
 
-    # Notificar paciente sobre o exame criado (imediato)
-    _notificar_paciente_exame_criado(db, exame_data.paciente_id, exame_dict)
+    # Enfileira o lembrete para o job processar_lembretes_exames
+    sincronizar_lembrete_exame(db, exame_data.paciente_id, doc_ref.id, exame_dict)
+
+    # Notificar paciente sobre o exame criado (fora da requisição)
+    despachar(db, evento_ref.id)
 
     # Agendar lembrete via Cloud Task
     agendar_lembrete_exame(
@@ -2956,41 +3249,34 @@ def listar_tecnicos_supervisionados_por_paciente(db: firestore.client, paciente_
     Lista os técnicos vinculados a um paciente que são supervisionados pelo enfermeiro logado.
     """
     try:
+        carregador = get_carregador(db)
+
         # 1. Busca os dados do paciente para obter a lista de IDs de técnicos vinculados.
-        paciente_doc = db.collection('usuarios').document(paciente_id).get()
-        if not paciente_doc.exists:
+        paciente_data = carregador.carregar('usuarios', paciente_id)
+        if paciente_data is None:
             logger.warning(f"Paciente com ID {paciente_id} não encontrado.")
             return []
             
-        paciente_data = paciente_doc.to_dict()
         tecnicos_vinculados_ids = paciente_data.get('tecnicos_ids', [])
         
         if not tecnicos_vinculados_ids:
             logger.info(f"Paciente {paciente_id} não possui técnicos vinculados.")
             return []
 
+        # 2. Carrega todos os técnicos vinculados de uma vez e verifica a supervisão de cada um.
+        tecnicos = carregador.carregar_muitos('usuarios', tecnicos_vinculados_ids)
         tecnicos_finais = []
-        # 2. Itera sobre os técnicos vinculados e verifica a supervisão de cada um.
         for tecnico_id in tecnicos_vinculados_ids:
-            tecnico_doc = db.collection('usuarios').document(tecnico_id).get()
-            if not tecnico_doc.exists:
+            tecnico_data = tecnicos.get(tecnico_id)
+            if tecnico_data is None:
                 continue # Pula para o próximo se o técnico não for encontrado
 
-            tecnico_data = tecnico_doc.to_dict()
             # 3. Se o supervisor_id do técnico bate com o ID do enfermeiro, adiciona à lista.
             if tecnico_data.get('supervisor_id') == enfermeiro_id:
-                # Descriptografa o nome do técnico
-                nome_tecnico = tecnico_data.get('nome', 'Nome não disponível')
-                if nome_tecnico and nome_tecnico != 'Nome não disponível':
-                    try:
-                        nome_tecnico = decrypt_data(nome_tecnico)
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar nome do técnico {tecnico_doc.id}: {e}")
-                        nome_tecnico = "[Erro na descriptografia]"
-                
+                perfil = carregador.perfil_usuario(tecnico_id)
                 tecnicos_finais.append({
-                    "id": tecnico_doc.id,
-                    "nome": nome_tecnico,
+                    "id": tecnico_id,
+                    "nome": perfil.get('nome') or 'Nome não disponível',
                     "email": tecnico_data.get('email', 'Email não disponível')
                 })
         
@@ -3119,35 +3405,52 @@ def _dedup_checklist_items(itens: List[Dict]) -> List[Dict]:
         resultado.append(it)
     return resultado
 
+def _tarefas_itens_plano(db: firestore.client, paciente_id: str, consulta_id: str) -> Dict:
+    """Leituras independentes dos itens de um plano de cuidado, para executar_em_paralelo."""
+    return {
+        "medicacoes": lambda: listar_medicacoes(db, paciente_id, consulta_id=consulta_id),
+        "checklist": lambda: listar_checklist(db, paciente_id, consulta_id=consulta_id),
+        "orientacoes": lambda: listar_orientacoes(db, paciente_id, consulta_id=consulta_id),
+    }
+
 def get_ficha_completa_paciente(db: firestore.client, paciente_id: str, consulta_id: Optional[str] = None) -> Dict:
     """
     Retorna um dicionário com os dados da ficha do paciente,
     filtrando para mostrar apenas o "Plano Ativo" (o mais recente).
+    As leituras independentes são feitas em paralelo (ver query_executor.py).
     """
-    # 1. Encontra a última consulta do paciente.
+    if not consulta_id:
+        # O ponteiro do plano ativo dispensa esperar a lista de consultas
+        paciente = get_carregador(db).carregar('usuarios', paciente_id)
+        if _tem_ponteiro_plano_ativo(paciente):
+            consulta_id = paciente.get('plano_ativo_id')
+            if not consulta_id:
+                return {"consultas": [], "medicacoes": [], "checklist": [], "orientacoes": []}
+
+    # Com o consulta_id (informado ou do ponteiro), todas as leituras são independentes.
+    if consulta_id:
+        ficha = executar_em_paralelo({
+            "consultas": lambda: listar_consultas(db, paciente_id),
+            **_tarefas_itens_plano(db, paciente_id, consulta_id),
+        })
+        ficha['checklist'] = _dedup_checklist_items(ficha.get('checklist', []))
+        return ficha
+
+    # 1. Paciente sem o ponteiro: encontra a última consulta do paciente.
     consultas = listar_consultas(db, paciente_id)
 
-    # Se um consulta_id específico for informado, usa ele.
-    if consulta_id:
-        ultima_consulta_id = consulta_id
-    else:
-        # Se não, OBRIGATORIAMENTE usa o ID da mais recente.
-        if not consultas:
-            # Se não há consultas, retorna tudo vazio.
-            return {
-                "consultas": [], "medicacoes": [],
-                "checklist": [], "orientacoes": [],
-            }
-        # 2. Pega o ID da última consulta (a primeira da lista ordenada).
-        ultima_consulta_id = consultas[0]['id']
+    # Se não, OBRIGATORIAMENTE usa o ID da mais recente.
+    if not consultas:
+        # Se não há consultas, retorna tudo vazio.
+        return {
+            "consultas": [], "medicacoes": [],
+            "checklist": [], "orientacoes": [],
+        }
+    # 2. Pega o ID da última consulta (a primeira da lista ordenada).
+    ultima_consulta_id = consultas[0]['id']
 
     # 3. Usa o ID da última consulta para buscar todos os itens relacionados.
-    ficha = {
-        "consultas": consultas,
-        "medicacoes": listar_medicacoes(db, paciente_id, consulta_id=ultima_consulta_id),
-        "checklist": listar_checklist(db, paciente_id, consulta_id=ultima_consulta_id),
-        "orientacoes": listar_orientacoes(db, paciente_id, consulta_id=ultima_consulta_id),
-    }
+    ficha = {"consultas": consultas, **executar_em_paralelo(_tarefas_itens_plano(db, paciente_id, ultima_consulta_id))}
 
     # Garante que o checklist não tenha itens duplicados.
     ficha['checklist'] = _dedup_checklist_items(ficha.get('checklist', []))
@@ -3257,10 +3560,26 @@ def _delete_subcollection_item(db: firestore.client, paciente_id: str, collectio
 
 # --- Consultas ---
 def update_consulta(db: firestore.client, paciente_id: str, consulta_id: str, update_data: schemas.ConsultaUpdate) -> Optional[Dict]:
-    return _update_subcollection_item(db, paciente_id, "consultas", consulta_id, update_data)
+    consulta = _update_subcollection_item(db, paciente_id, "consultas", consulta_id, update_data)
+    if consulta and update_data.model_dump(exclude_unset=True):
+        # Mantém o resumo do plano ativo no paciente em dia
+        paciente = get_carregador(db).carregar('usuarios', paciente_id)
+        if paciente and paciente.get('plano_ativo_id') == consulta_id:
+            db.collection('usuarios').document(paciente_id).update(_campos_plano_ativo(consulta_id, consulta))
+            esquecer_documento('usuarios', paciente_id)
+    return consulta
 
 def delete_consulta(db: firestore.client, paciente_id: str, consulta_id: str) -> bool:
-    return _delete_subcollection_item(db, paciente_id, "consultas", consulta_id)
+    if not _delete_subcollection_item(db, paciente_id, "consultas", consulta_id):
+        return False
+    # Excluir o plano ativo devolve o posto à consulta anterior
+    paciente = get_carregador(db).carregar('usuarios', paciente_id)
+    if paciente and paciente.get('plano_ativo_id') == consulta_id:
+        try:
+            _recalcular_plano_ativo(db, paciente_id)
+        except Exception as e:
+            logger.error(f"Erro ao recalcular plano ativo do paciente {paciente_id}: {e}")
+    return True
 
 # --- Exames ---
 def update_exame(
@@ -3296,6 +3615,9 @@ def update_exame(
     updated_doc = exame_ref.get()
     data = updated_doc.to_dict()
     data['id'] = updated_doc.id
+
+    # Data/horário podem ter mudado: recalcula o lembrete na fila
+    sincronizar_lembrete_exame(db, paciente_id, exame_id, data)
     return data
 
 def delete_exame(
@@ -3323,6 +3645,7 @@ def delete_exame(
         )
 
     exame_ref.delete()
+    remover_lembrete_exame(db, paciente_id, exame_id)
     return True
 
 # --- Medicações ---
@@ -3424,13 +3747,15 @@ def listar_registros_diario(db: firestore.client, paciente_id: str) -> List[sche
     registros_pydantic = []
     try:
         query = db.collection('usuarios').document(paciente_id).collection('diario_tecnico').order_by('data_ocorrencia', direction=firestore.Query.DESCENDING)
-        
-        tecnicos_cache = {}
+        docs = list(query.stream())
+
+        # Perfis de todos os técnicos da lista em uma única leitura em lote
+        tecnicos = get_carregador(db).perfis_usuarios((doc.to_dict() or {}).get('tecnico_id') for doc in docs)
 
         # Define campos sensíveis que precisam ser descriptografados
         sensitive_fields = ['anotacao_geral', 'medicamentos', 'atividades', 'intercorrencias']
 
-        for doc in query.stream():
+        for doc in docs:
             registro_data = doc.to_dict()
             registro_data['id'] = doc.id
             
@@ -3447,29 +3772,7 @@ def listar_registros_diario(db: firestore.client, paciente_id: str) -> List[sche
             tecnico_id = registro_data.get('tecnico_id')
 
             if tecnico_id:
-                if tecnico_id in tecnicos_cache:
-                    tecnico_perfil = tecnicos_cache[tecnico_id]
-                else:
-                    tecnico_doc = db.collection('usuarios').document(tecnico_id).get()
-                    if tecnico_doc.exists:
-                        tecnico_data = tecnico_doc.to_dict()
-                        nome_tecnico = tecnico_data.get('nome')
-                        if nome_tecnico:
-                            try:
-                                nome_tecnico = decrypt_data(nome_tecnico)
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar nome do técnico {tecnico_id}: {e}")
-                                nome_tecnico = "[Erro na descriptografia]"
-                        
-                        tecnico_perfil = {
-                            "id": tecnico_doc.id,
-                            "nome": nome_tecnico,
-                            "email": tecnico_data.get('email')
-                        }
-                        tecnicos_cache[tecnico_id] = tecnico_perfil
-                    else:
-                        tecnico_perfil = { "id": tecnico_id, "nome": "Técnico Desconhecido", "email": "" }
-                
+                tecnico_perfil = tecnicos.get(tecnico_id) or { "id": tecnico_id, "nome": "Técnico Desconhecido", "email": "" }
                 registro_data['tecnico'] = tecnico_perfil
             
             # Remove os campos desnormalizados antigos, que não fazem parte do schema de resposta
@@ -3834,23 +4137,21 @@ def listar_checklist_diario_com_replicacao(db: firestore.client, paciente_id: st
         if not docs_para_replicar:
             return []
 
-        # 4. Cria os novos itens em batch
-        batch = db.batch()
+        # 4. Cria os novos itens em lote
         novos_itens_resposta = []
-        for doc in docs_para_replicar:
-            dados_antigos = doc.to_dict()
-            novos_dados = {
-                "paciente_id": paciente_id, "negocio_id": negocio_id,
-                "descricao_item": dados_antigos.get("descricao_item", "Item sem descrição"),
-                "concluido": False,
-                "data_criacao": datetime.combine(dia, datetime.utcnow().time()), # Usa a data de hoje
-                "consulta_id": dados_antigos.get("consulta_id")
-            }
-            novo_doc_ref = col_ref.document()
-            batch.set(novo_doc_ref, novos_dados)
-            novos_itens_resposta.append({'id': novo_doc_ref.id, 'descricao': novos_dados['descricao_item'], 'concluido': novos_dados['concluido']})
-        
-        batch.commit()
+        with EscritorEmLote(db, descricao=f"replicar_checklist:{paciente_id}") as escritor:
+            for doc in docs_para_replicar:
+                dados_antigos = doc.to_dict()
+                novos_dados = {
+                    "paciente_id": paciente_id, "negocio_id": negocio_id,
+                    "descricao_item": dados_antigos.get("descricao_item", "Item sem descrição"),
+                    "concluido": False,
+                    "data_criacao": datetime.combine(dia, datetime.utcnow().time()), # Usa a data de hoje
+                    "consulta_id": dados_antigos.get("consulta_id")
+                }
+                novo_doc_ref = col_ref.document()
+                escritor.set(novo_doc_ref, novos_dados)
+                novos_itens_resposta.append({'id': novo_doc_ref.id, 'descricao': novos_dados['descricao_item'], 'concluido': novos_dados['concluido']})
         logger.info(f"Checklist replicado com {len(novos_itens_resposta)} itens para o paciente {paciente_id} no dia {dia.isoformat()}.")
         return novos_itens_resposta
 
@@ -3860,8 +4161,29 @@ def listar_checklist_diario_com_replicacao(db: firestore.client, paciente_id: st
         # É importante levantar uma exceção aqui para que o FastAPI retorne uma resposta de erro adequada em vez de travar
         raise HTTPException(status_code=500, detail=f"Erro interno ao processar o checklist: {e}")
 
-def atualizar_item_checklist_diario(db: firestore.client, paciente_id: str, item_id: str, update_data: schemas.ChecklistItemDiarioUpdate) -> Optional[Dict]:
-    """Permite ao técnico marcar os itens ao longo do dia."""
+def atualizar_item_checklist_diario(db: firestore.client, paciente_id: str, item_id: str, update_data: schemas.ChecklistItemDiarioUpdate, dia: Optional[date] = None) -> Optional[Dict]:
+    """
+    Permite ao técnico marcar os itens ao longo do dia.
+    Com o dia informado, o item é atualizado no checklist_diario/{dia} (ver
+    get_checklist_diario_plano_ativo); dias que ainda não têm esse documento
+    seguem no formato antigo, um documento por item em 'checklist'.
+    """
+    if dia is not None:
+        try:
+            resultado = _marcar_item_checklist_do_dia(db, paciente_id, dia, item_id, update_data.concluido)
+        except ValueError as e:
+            logger.error(f"Erro ao atualizar item do checklist {item_id}: {e}")
+            return None
+        if resultado is not None:
+            item, checklist_concluido, negocio_id = resultado
+            if checklist_concluido:
+                logger.info(f"CONFIRMADO: Checklist 100% concluído para paciente {paciente_id} em {dia}. Disparando notificação.")
+                try:
+                    _notificar_checklist_concluido(db, paciente_id, dia, negocio_id)
+                except Exception as e:
+                    logger.error(f"Erro ao notificar checklist concluído: {e}")
+            return item
+
     item_ref = db.collection('usuarios').document(paciente_id).collection('checklist').document(item_id)
     if not item_ref.get().exists: return None
     item_ref.update(update_data.model_dump())
@@ -3877,94 +4199,194 @@ def atualizar_item_checklist_diario(db: firestore.client, paciente_id: str, item
     return {'id': item_id, 'descricao': updated_doc.get('descricao_item', ''), 'concluido': updated_doc.get('concluido', False)}
 
 
-# Em crud.py, substitua a função inteira por esta:
+def _marcar_item_checklist_do_dia(db: firestore.client, paciente_id: str, dia: date, item_id: str, concluido: bool) -> Optional[tuple]:
+    """
+    Marca/desmarca o item no checklist_diario/{dia} numa transação, mantendo
+    itens_concluidos. A conclusão do dia é sinalizada uma única vez
+    (conclusao_notificada).
 
-# Em crud.py, SUBSTITUA a função inteira por esta:
+    Returns:
+        (item, checklist_concluido_agora, negocio_id), ou None se o documento do dia não existe.
 
-def get_checklist_diario_plano_ativo(db: firestore.client, paciente_id: str, dia: date, negocio_id: str) -> List[Dict]:
-    """
-    Busca o checklist do dia com a lógica corrigida.
-    1. Encontra o plano de cuidado (consulta) que estava ativo NA DATA solicitada.
-    2. Se nenhum plano existia naquela data, retorna [].
-    3. Se um plano existia, busca o checklist daquela data.
-    4. A replicação de um novo checklist só ocorre se a data solicitada for HOJE.
-    5. CORREÇÃO: Garante que a lista final não tenha itens duplicados.
+    Raises:
+        ValueError: se o item não faz parte do checklist do dia
     """
-    try:
-        # 1. Encontrar o plano de cuidado (consulta) válido para a data solicitada.
-        end_of_day = datetime.combine(dia, time.max)
-        consulta_ref = db.collection('usuarios').document(paciente_id).collection('consultas')
+    dia_ref = _checklist_do_dia_ref(db, paciente_id, dia)
 
-        # Query SEM order_by para evitar problema de índice composto
-        query_plano_valido = consulta_ref.where('created_at', '<=', end_of_day)
+    @firestore.transactional
+    def marcar_em_transacao(transaction):
+        snapshot = dia_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
 
-        docs_plano_valido = list(query_plano_valido.stream())
+        checklist = snapshot.to_dict()
+        itens = checklist.get('itens', [])
+        item = next((i for i in itens if i.get('id') == item_id), None)
+        if item is None:
+            raise ValueError(f"Item do checklist com ID '{item_id}' não encontrado em {dia.isoformat()}.")
+
+        itens_concluidos = checklist.get('itens_concluidos', 0)
+        if bool(item.get('concluido')) != concluido:
+            item['concluido'] = concluido
+            itens_concluidos += 1 if concluido else -1
+            alteracoes = {'itens': itens, 'itens_concluidos': itens_concluidos}
+        else:
+            alteracoes = {}
 
-        if not docs_plano_valido:
-            logger.info(f"Nenhum plano de cuidado ativo para {paciente_id} em {dia.isoformat()}.")
-            return []
+        checklist_concluido = (
+            concluido
+            and itens_concluidos >= checklist.get('total_itens', len(itens))
+            and not checklist.get('conclusao_notificada', False)
+        )
+        if checklist_concluido:
+            alteracoes['conclusao_notificada'] = True
+        if alteracoes:
+            transaction.update(dia_ref, alteracoes)
+
+        resposta = {'id': item_id, 'descricao': item.get('descricao', ''), 'concluido': bool(item.get('concluido'))}
+        return resposta, checklist_concluido, checklist.get('negocio_id')
+
+    return marcar_em_transacao(db.transaction())
+
+def _plano_mais_recente(docs_consultas) -> str:
+    """ID da consulta (plano de cuidado) mais recente entre os documentos informados."""
+    return max(docs_consultas, key=lambda doc: doc.to_dict().get('created_at', datetime.min)).id
+
+def _filtrar_checklist_do_dia(docs, dia: date) -> List:
+    """Mantém os itens de checklist criados no dia informado (filtro de data feito em Python)."""
+    # O Firestore devolve datetimes com fuso (UTC): o dia é comparado em UTC
+    start_dt = datetime.combine(dia, time.min, tzinfo=timezone.utc)
+    end_dt = datetime.combine(dia, time.max, tzinfo=timezone.utc)
+    itens = []
+    for doc in docs:
+        data_criacao = doc.to_dict().get('data_criacao')
+        if not isinstance(data_criacao, datetime):
+            continue
+        if data_criacao.tzinfo is None:
+            data_criacao = data_criacao.replace(tzinfo=timezone.utc)
+        if start_dt <= data_criacao <= end_dt:
+            itens.append(doc)
+    return itens
+
+def _formatar_checklist_do_dia(docs) -> List[Dict]:
+    """Formata os itens do checklist do dia, garantindo que não haja descrições duplicadas."""
+    itens_formatados = []
+    descricoes_vistas = set()
+    for doc in docs:
+        item_data = doc.to_dict()
+        descricao = item_data.get('descricao_item', '')
+        if descricao not in descricoes_vistas:
+            itens_formatados.append({
+                'id': doc.id,
+                'descricao': descricao,
+                'concluido': item_data.get('concluido', False)
+            })
+            descricoes_vistas.add(descricao)
+    return itens_formatados
 
-        # Ordena em Python e pega o mais recente
-        docs_plano_valido.sort(key=lambda doc: doc.to_dict().get('created_at', datetime.min), reverse=True)
-        plano_valido_id = docs_plano_valido[0].id
-        logger.info(f"Plano válido para {dia.isoformat()} é a consulta {plano_valido_id}.")
+# O checklist de cada dia é um documento por paciente,
+# usuarios/{paciente_id}/checklist_diario/{YYYY-MM-DD}, com os itens e os
+# contadores de conclusão. Ler o checklist do dia é um único get, e marcar um
+# item atualiza o mesmo documento numa transação (a conclusão é detectada
+# comparando itens_concluidos com total_itens, sem reler o dia).
 
-        checklist_template = listar_checklist(db, paciente_id, plano_valido_id)
-        if not checklist_template:
-            logger.info(f"Plano {plano_valido_id} não possui checklist.")
-            return []
+def _checklist_do_dia_ref(db: firestore.client, paciente_id: str, dia: date):
+    return db.collection('usuarios').document(paciente_id).collection('checklist_diario').document(dia.isoformat())
 
-        col_ref = db.collection('usuarios').document(paciente_id).collection('checklist')
-        start_dt = datetime.combine(dia, time.min)
-        end_dt = datetime.combine(dia, time.max)
+def _novo_checklist_do_dia(docs_do_plano, paciente_id: str, negocio_id: str, consulta_id: str, dia: date) -> Optional[Dict]:
+    """
+    Monta o documento checklist_diario/{dia} a partir dos itens do plano ativo
+    (documentos de 'checklist' com o consulta_id do plano):
+    - itens já replicados para o dia no formato antigo (um documento por item)
+      são migrados com seus IDs e estados;
+    - senão, se o dia é HOJE, os itens do plano são replicados, não concluídos.
+    Retorna None se não há o que criar (plano sem checklist ou dia passado sem itens).
+    """
+    docs_do_dia = [doc for doc in _filtrar_checklist_do_dia(docs_do_plano, dia) if doc.to_dict().get('negocio_id') == negocio_id]
+    if docs_do_dia:
+        itens = _formatar_checklist_do_dia(docs_do_dia)
+    elif dia == date.today():
+        itens = [{**item, 'concluido': False} for item in _formatar_checklist_do_dia(docs_do_plano)]
+    else:
+        return None
+    if not itens:
+        return None
+
+    itens_concluidos = sum(1 for item in itens if item['concluido'])
+    return {
+        "paciente_id": paciente_id,
+        "negocio_id": negocio_id,
+        "consulta_id": consulta_id,
+        "data": dia.isoformat(),
+        "itens": itens,
+        "total_itens": len(itens),
+        "itens_concluidos": itens_concluidos,
+        # Um dia migrado já completo foi notificado pelo fluxo antigo
+        "conclusao_notificada": itens_concluidos == len(itens),
+        "data_criacao": datetime.utcnow(),
+    }
 
-        # Query simplificada SEM múltiplos where para evitar índice composto
-        # Filtramos apenas por consulta_id e negocio_id, e fazemos o filtro de data em Python
-        query_checklist_do_dia = col_ref.where('negocio_id', '==', negocio_id)\
-                                        .where('consulta_id', '==', plano_valido_id)
+def _itens_checklist_do_dia(checklist_do_dia: Optional[Dict]) -> List[Dict]:
+    """Itens no formato de ChecklistItemDiarioResponse."""
+    if not checklist_do_dia:
+        return []
+    return [
+        {'id': item['id'], 'descricao': item.get('descricao', ''), 'concluido': bool(item.get('concluido', False))}
+        for item in checklist_do_dia.get('itens', [])
+    ]
 
-        all_docs = list(query_checklist_do_dia.stream())
+def _criar_checklist_do_dia(db: firestore.client, paciente_id: str, dia: date, negocio_id: str) -> Optional[Dict]:
+    """Cria o checklist_diario/{dia} a partir do plano ativo na data (ou devolve o criado por outra requisição)."""
+    # 1. Encontrar o plano de cuidado (consulta) válido para a data solicitada.
+    paciente_ref = db.collection('usuarios').document(paciente_id)
+    paciente = get_carregador(db).carregar('usuarios', paciente_id)
+    if _tem_ponteiro_plano_ativo(paciente) and (
+        not paciente.get('plano_ativo_id') or _plano_vigente_no_dia(paciente.get('plano_ativo'), dia)
+    ):
+        # O plano ativo já existia no dia (ou o paciente não tem consultas): sem consultar o histórico
+        plano_valido_id = paciente.get('plano_ativo_id')
+    else:
+        # Dia anterior ao plano ativo (ou paciente sem o ponteiro). Query SEM order_by para evitar problema de índice composto
+        end_of_day = datetime.combine(dia, time.max)
+        docs_plano_valido = list(paciente_ref.collection('consultas').where('created_at', '<=', end_of_day).stream())
+        plano_valido_id = _plano_mais_recente(docs_plano_valido) if docs_plano_valido else None
+    if not plano_valido_id:
+        logger.info(f"Nenhum plano de cuidado ativo para {paciente_id} em {dia.isoformat()}.")
+        return None
 
-        # Filtra por data em Python
-        docs_checklist_do_dia = [
-            doc for doc in all_docs
-            if start_dt <= doc.to_dict().get('data_criacao', datetime.min) <= end_dt
-        ]
+    # 2. Itens do plano: o template e, no formato antigo, os já replicados para o dia
+    docs_do_plano = list(paciente_ref.collection('checklist').where('consulta_id', '==', plano_valido_id).stream())
+    checklist_do_dia = _novo_checklist_do_dia(docs_do_plano, paciente_id, negocio_id, plano_valido_id, dia)
+    if checklist_do_dia is None:
+        logger.info(f"Plano {plano_valido_id} não possui checklist para {dia.isoformat()}.")
+        return None
 
-        # Se não encontrou e a data for HOJE, replica o checklist.
-        if not docs_checklist_do_dia and dia == date.today():
-            logger.info(f"Replicando {len(checklist_template)} itens do plano {plano_valido_id} para hoje.")
-            batch = db.batch()
-            for item_template in checklist_template:
-                novo_doc_ref = col_ref.document()
-                batch.set(novo_doc_ref, {
-                    "paciente_id": paciente_id, "negocio_id": negocio_id,
-                    "descricao_item": item_template.get("descricao_item", "Item sem descrição"),
-                    "concluido": False,
-                    "data_criacao": datetime.combine(dia, datetime.utcnow().time()),
-                    "consulta_id": plano_valido_id
-                })
-            batch.commit()
-            # Após a replicação, busca novamente para obter os IDs corretos
-            docs_checklist_do_dia = list(query_checklist_do_dia.stream())
-
-        # --- INÍCIO DA CORREÇÃO CONTRA DUPLICATAS ---
-        itens_formatados = []
-        descricoes_vistas = set()
-        for doc in docs_checklist_do_dia:
-            item_data = doc.to_dict()
-            descricao = item_data.get('descricao_item', '')
-            if descricao not in descricoes_vistas:
-                itens_formatados.append({
-                    'id': doc.id,
-                    'descricao': descricao,
-                    'concluido': item_data.get('concluido', False)
-                })
-                descricoes_vistas.add(descricao)
-        # --- FIM DA CORREÇÃO ---
+    # 3. create() falha se outra requisição criou o dia antes: vale o documento dela
+    dia_ref = _checklist_do_dia_ref(db, paciente_id, dia)
+    try:
+        dia_ref.create(checklist_do_dia)
+    except Exception:
+        existente = dia_ref.get()
+        if not existente.exists:
+            raise
+        return existente.to_dict()
+    logger.info(f"Checklist de {dia.isoformat()} criado com {checklist_do_dia['total_itens']} itens do plano {plano_valido_id}.")
+    return checklist_do_dia
 
-        logger.info(f"Retornando {len(itens_formatados)} itens de checklist únicos para o dia {dia.isoformat()}.")
-        return itens_formatados
+def get_checklist_diario_plano_ativo(db: firestore.client, paciente_id: str, dia: date, negocio_id: str) -> List[Dict]:
+    """
+    Busca o checklist do dia (documento checklist_diario/{dia} do paciente).
+    1. Se o documento do dia existe, é a resposta (uma leitura).
+    2. Senão, é criado a partir do plano de cuidado (consulta) que estava ativo NA DATA.
+    3. Se nenhum plano existia naquela data, ou o plano não tem checklist, retorna [].
+    4. A replicação de um novo checklist só ocorre se a data solicitada for HOJE.
+    5. A lista não tem itens duplicados (deduplicada na criação).
+    """
+    try:
+        snapshot = _checklist_do_dia_ref(db, paciente_id, dia).get()
+        if snapshot.exists:
+            return _itens_checklist_do_dia(snapshot.to_dict())
+        return _itens_checklist_do_dia(_criar_checklist_do_dia(db, paciente_id, dia, negocio_id))
 
     except Exception as e:
         logger.error(f"ERRO CRÍTICO ao buscar checklist do plano ativo para o paciente {paciente_id}: {e}")
@@ -4059,19 +4481,28 @@ def criar_registro_diario_estruturado(db: firestore.client, registro_data: schem
 
         paciente_ref = db.collection('usuarios').document(registro_data.paciente_id)
         doc_ref = paciente_ref.collection('registros_diarios_estruturados').document()
-        doc_ref.set(registro_dict_para_salvar)
+
+        # Grava o registro e o evento de notificação no mesmo batch (outbox)
+        batch = db.batch()
+        batch.set(doc_ref, registro_dict_para_salvar)
+        evento_ref = registrar_evento(db, batch, 'REGISTRO_DIARIO_CRIADO', {
+            'paciente_id': registro_data.paciente_id,
+            'registro_id': doc_ref.id,
+            'tecnico_id': usuario_id
+        })
+        batch.commit()
 
         # Prepara a resposta da API
         resposta_dict = registro_dict_para_salvar.copy()
         resposta_dict['id'] = doc_ref.id
 
-        usuario_doc = db.collection('usuarios').document(usuario_id).get()
-        if usuario_doc.exists:
-            udat = usuario_doc.to_dict() or {}
+        # Autor da requisição: já está no mapa de identidade (lido pela autenticação)
+        perfil_autor = get_carregador(db).perfil_usuario(usuario_id)
+        if perfil_autor:
             resposta_dict['tecnico'] = {
-                "id": usuario_doc.id,
-                "nome": decrypt_data(udat.get('nome', '')) if udat.get('nome') else 'Usuário',
-                "email": udat.get('email', ''),
+                "id": usuario_id,
+                "nome": perfil_autor.get('nome') or 'Usuário',
+                "email": perfil_autor.get('email') or '',
             }
         else:
             resposta_dict['tecnico'] = {"id": usuario_id, "nome": "Usuário Desconhecido", "email": ""}
@@ -4079,14 +4510,8 @@ def criar_registro_diario_estruturado(db: firestore.client, registro_data: schem
         if 'descricao' in conteudo_dict and conteudo_dict['descricao']:
              resposta_dict['conteudo']['descricao'] = decrypt_data(conteudo_dict['descricao'])
         
-        # --- INÍCIO DA ALTERAÇÃO ---
-        # 5. Notificar o enfermeiro responsável
-        try:
-            # Passamos o dicionário já com o ID para a função de notificação
-            _notificar_enfermeiro_novo_registro_diario(db, resposta_dict)
-        except Exception as e:
-            logger.error(f"Falha ao disparar notificação para novo registro diário {doc_ref.id}: {e}")
-        # --- FIM DA ALTERAÇÃO ---
+        # 5. Notificar o enfermeiro responsável (fora da requisição)
+        despachar(db, evento_ref.id)
 
         return resposta_dict
 
@@ -4121,7 +4546,11 @@ def listar_registros_diario_estruturado(
             query = query.where('data_registro', '>=', inicio).where('data_registro', '<=', fim)
 
         docs = list(query.stream())
-        tecnicos_cache: Dict[str, Dict] = {}
+
+        # Perfis de todos os autores da lista em uma única leitura em lote (campo novo e antigo)
+        autores = get_carregador(db).perfis_usuarios(
+            dados.get('usuario_id') or dados.get('tecnico_id') for dados in (doc.to_dict() or {} for doc in docs)
+        )
 
         for doc in docs:
             d = doc.to_dict() or {}
@@ -4167,24 +4596,7 @@ def listar_registros_diario_estruturado(
             autor_id = d.get('usuario_id') or d.get('tecnico_id')
             tecnico_perfil = None
             if autor_id:
-                if autor_id in tecnicos_cache:
-                    tecnico_perfil = tecnicos_cache[autor_id]
-                else:
-                    tdoc = db.collection('usuarios').document(autor_id).get()
-                    if tdoc.exists:
-                        tdat = tdoc.to_dict() or {}
-                        nome_tecnico = tdat.get('nome')
-                        if nome_tecnico:
-                            try:
-                                nome_tecnico = decrypt_data(nome_tecnico)
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar nome do usuário {autor_id}: {e}")
-                                nome_tecnico = "[Erro na descriptografia]"
-
-                        tecnico_perfil = {'id': tdoc.id, 'nome': nome_tecnico, 'email': tdat.get('email')}
-                    else:
-                        tecnico_perfil = {'id': autor_id, 'nome': 'Usuário Desconhecido', 'email': ''}
-                    tecnicos_cache[autor_id] = tecnico_perfil
+                tecnico_perfil = autores.get(autor_id) or {'id': autor_id, 'nome': 'Usuário Desconhecido', 'email': ''}
             
             # Constrói a resposta final
             registro_data = {
@@ -4715,18 +5127,17 @@ def _popular_criado_por(db: firestore.client, relatorio_dict: Dict) -> Dict:
     Popula o campo 'criado_por' no relatório com os dados do usuário que o criou.
     Retorna o relatório com o campo 'criado_por' adicionado (ou None se não encontrar).
     """
-    logger.info(f"🔵🔵🔵 EXECUTANDO _popular_criado_por para relatório {relatorio_dict.get('id', 'UNKNOWN')}")
     criado_por_id = relatorio_dict.get('criado_por_id')
-    logger.info(f"   criado_por_id encontrado: {criado_por_id}")
+    debug_amostrado(logger, "Populando criado_por %s do relatório %s", criado_por_id, relatorio_dict.get('id'))
     if not criado_por_id:
-        logger.warning("⚠️⚠️⚠️ Relatório sem criado_por_id")
+        logger.warning("⚠️ Relatório %s sem criado_por_id", relatorio_dict.get('id'))
         relatorio_dict['criado_por'] = None
         return relatorio_dict
 
     try:
-        criador_doc = db.collection('usuarios').document(criado_por_id).get()
-        if criador_doc.exists:
-            criador_data = criador_doc.to_dict()
+        # Memorizado por requisição: listagens pré-carregam os criadores em lote
+        criador_data = get_carregador(db).carregar('usuarios', criado_por_id)
+        if criador_data is not None:
             nome_criador = criador_data.get('nome', '')
             email_criador = criador_data.get('email', '')
 
@@ -4739,8 +5150,7 @@ def _popular_criado_por(db: firestore.client, relatorio_dict: Dict) -> Dict:
                 except Exception:
                     # Se falhou ao descriptografar, assume que já está descriptografado
                     # (pode ser admin/enfermeiro sem criptografia)
-                    logger.info(f"Nome do criador {criado_por_id} não está criptografado ou já foi descriptografado")
-                    pass
+                    debug_amostrado(logger, "Nome do criador %s não está criptografado ou já foi descriptografado", criado_por_id)
 
             # Descriptografar email se necessário
             if email_criador:
@@ -4751,7 +5161,6 @@ def _popular_criado_por(db: firestore.client, relatorio_dict: Dict) -> Dict:
                     # Email não está criptografado
                     pass
 
-            logger.info(f"✅ Criador populado: {nome_criador} ({email_criador})")
 
             relatorio_dict['criado_por'] = {
                 'id': criado_por_id,
@@ -4759,10 +5168,10 @@ def _popular_criado_por(db: firestore.client, relatorio_dict: Dict) -> Dict:
                 'email': email_criador
             }
         else:
-            logger.warning(f"Criador {criado_por_id} não encontrado no banco de dados")
+            logger.warning("Criador %s não encontrado no banco de dados", criado_por_id)
             relatorio_dict['criado_por'] = None
     except Exception as e:
-        logger.error(f"Erro ao popular criado_por para relatório: {e}")
+        logger.error("Erro ao popular criado_por do relatório %s: %s", relatorio_dict.get('id'), e)
         import traceback
         logger.error(traceback.format_exc())
         relatorio_dict['criado_por'] = None
@@ -4777,11 +5186,9 @@ def criar_relatorio_medico(db: firestore.client, paciente_id: str, relatorio_dat
     """
     # 1. Encontrar a consulta mais recente (plano de cuidado ativo)
     # CORREÇÃO: Tornar consulta_id opcional para permitir relatórios de pacientes novos
-    consultas = listar_consultas(db, paciente_id)
-    consulta_id_recente = None
+    consulta_id_recente = get_plano_ativo_id(db, paciente_id)
 
-    if consultas:
-        consulta_id_recente = consultas[0]['id']
+    if consulta_id_recente:
         logger.info(f"Relatório será vinculado à consulta {consulta_id_recente}")
     else:
         logger.warning(f"Paciente {paciente_id} não possui plano de cuidado. Criando relatório sem consulta vinculada.")
@@ -4801,18 +5208,17 @@ def criar_relatorio_medico(db: firestore.client, paciente_id: str, relatorio_dat
         "data_revisao": None,
     }
 
-    # 3. Salvar no Firestore
+    # 3. Salvar no Firestore, junto com o evento de notificação (outbox)
     doc_ref = db.collection('relatorios_medicos').document()
-    doc_ref.set(relatorio_dict)
+    batch = db.batch()
+    batch.set(doc_ref, relatorio_dict)
+    _registrar_inbox_no_batch(db, batch, doc_ref.id, None, relatorio_dict)
+    evento_ref = registrar_evento(db, batch, 'RELATORIO_CRIADO', {'relatorio_id': doc_ref.id})
+    batch.commit()
     relatorio_dict['id'] = doc_ref.id
-    
-    # --- INÍCIO DA ALTERAÇÃO ---
-    # 4. Notificar o médico sobre o novo relatório
-    try:
-        _notificar_medico_novo_relatorio(db, relatorio_dict)
-    except Exception as e:
-        logger.error(f"Falha ao disparar notificação para novo relatório {doc_ref.id}: {e}")
-    # --- FIM DA ALTERAÇÃO ---
+
+    # 4. Notificar o médico sobre o novo relatório (fora da requisição)
+    despachar(db, evento_ref.id)
 
     logger.info(f"Relatório médico {doc_ref.id} criado para o paciente {paciente_id} pelo usuário {autor.id}.")
 
@@ -4825,79 +5231,42 @@ def listar_relatorios_por_paciente(db: firestore.client, paciente_id: str) -> Li
     """
     relatorios = []
     try:
-        logger.info(f"🔍 DEBUG: Buscando relatórios para paciente_id={paciente_id}")
-
         query = db.collection('relatorios_medicos') \
             .where('paciente_id', '==', paciente_id) \
             .order_by('data_criacao', direction=firestore.Query.DESCENDING)
 
-        profissionais_cache = {}
+        docs = list(query.stream())
 
-        logger.info(f"🔍 DEBUG: Query criada, iniciando stream...")
-        for doc in query.stream():
+        # Médicos e criadores de todos os relatórios em uma única leitura em lote
+        perfis = get_carregador(db).perfis_usuarios(
+            id_usuario
+            for dados in (doc.to_dict() or {} for doc in docs)
+            for id_usuario in (dados.get('medico_id'), dados.get('criado_por_id'))
+        )
+
+        for doc in docs:
             data = doc.to_dict()
             data['id'] = doc.id
             
             # Adiciona informações do médico se disponível
             medico_id = data.get('medico_id')
             if medico_id:
-                if medico_id in profissionais_cache:
-                    data['medico_nome'] = profissionais_cache[medico_id]['nome']
+                perfil_medico = perfis.get(medico_id)
+                if perfil_medico:
+                    data['medico_nome'] = perfil_medico.get('nome') or 'Médico desconhecido'
                 else:
-                    medico_doc = db.collection('usuarios').document(medico_id).get()
-                    if medico_doc.exists:
-                        medico_data = medico_doc.to_dict()
-                        nome_medico = medico_data.get('nome', 'Médico desconhecido')
-                        # --- INÍCIO DA CORREÇÃO ---
-                        if nome_medico and nome_medico != 'Médico desconhecido':
-                            try:
-                                nome_medico = decrypt_data(nome_medico)
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar nome do médico {medico_id}: {e}")
-                                nome_medico = "[Erro na descriptografia]"
-                        # --- FIM DA CORREÇÃO ---
-                        
-                        profissionais_cache[medico_id] = {'nome': nome_medico}
-                        data['medico_nome'] = nome_medico
-                    else:
-                        data['medico_nome'] = 'Médico não encontrado'
+                    data['medico_nome'] = 'Médico não encontrado'
             
             # Popula informações completas do criador
-            criado_por_id = data.get('criado_por_id')
-            if criado_por_id:
-                if criado_por_id in profissionais_cache and 'criado_por' in profissionais_cache[criado_por_id]:
-                    data['criado_por'] = profissionais_cache[criado_por_id]['criado_por']
-                else:
-                    criador_doc = db.collection('usuarios').document(criado_por_id).get()
-                    if criador_doc.exists:
-                        criador_data = criador_doc.to_dict()
-                        nome_criador = criador_data.get('nome', '')
-
-                        # Descriptografar nome
-                        if nome_criador:
-                            try:
-                                nome_criador = decrypt_data(nome_criador)
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar nome do criador {criado_por_id}: {e}")
-                                nome_criador = "[Erro na descriptografia]"
-
-                        criado_por_obj = {
-                            'id': criado_por_id,
-                            'nome': nome_criador,
-                            'email': criador_data.get('email', '')
-                        }
-
-                        profissionais_cache[criado_por_id] = profissionais_cache.get(criado_por_id, {})
-                        profissionais_cache[criado_por_id]['criado_por'] = criado_por_obj
-                        data['criado_por'] = criado_por_obj
-                    else:
-                        data['criado_por'] = None
+            perfil_criador = perfis.get(data.get('criado_por_id'))
+            if perfil_criador:
+                data['criado_por'] = {**perfil_criador, 'nome': perfil_criador.get('nome') or '', 'email': perfil_criador.get('email') or ''}
             else:
                 data['criado_por'] = None
             
             relatorios.append(data)
 
-        logger.info(f"🔍 DEBUG: Total de relatórios encontrados: {len(relatorios)}")
+        logger.debug("%d relatórios encontrados para o paciente %s", len(relatorios), paciente_id)
         # --- CORREÇÃO ADICIONAL: MOVER O RETURN PARA FORA DO LOOP ---
         return relatorios
 
@@ -4917,7 +5286,12 @@ def adicionar_foto_relatorio(db: firestore.client, relatorio_id: str, foto_url:
             return None
 
         # Operação atômica no servidor: evita sobrescrita do array e é segura em concorrência
-        relatorio_ref.update({ "fotos": firestore.ArrayUnion([foto_url]) })
+        alteracoes = { "fotos": firestore.ArrayUnion([foto_url]) }
+        relatorio_anterior = snapshot.to_dict() or {}
+        batch = db.batch()
+        batch.update(relatorio_ref, alteracoes)
+        _registrar_inbox_no_batch(db, batch, relatorio_id, relatorio_anterior, {**relatorio_anterior, **alteracoes})
+        batch.commit()
 
         # Retorna documento atualizado
         updated = relatorio_ref.get()
@@ -4928,152 +5302,26 @@ def adicionar_foto_relatorio(db: firestore.client, relatorio_id: str, foto_url:
         logger.error(f"Erro ao adicionar foto (ArrayUnion) ao relatório {relatorio_id}: {e}")
         raise
 
+def _pre_carregar_usuarios_dos_relatorios(db: firestore.client, docs: List) -> CarregadorDocumentos:
+    """Carrega em lote (DataLoader da requisição) os pacientes e criadores de uma lista de relatórios."""
+    carregador = get_carregador(db)
+    carregador.carregar_muitos('usuarios', (
+        id_usuario
+        for dados in (doc.to_dict() or {} for doc in docs)
+        for id_usuario in (dados.get('paciente_id'), dados.get('criado_por_id'))
+    ))
+    return carregador
+
 def listar_relatorios_pendentes_medico(db: firestore.client, medico_id: str, negocio_id: str) -> List[Dict]:
     """
-    Lista todos os relatórios com status 'pendente' atribuídos a um médico específico.
+    Lista todos os relatórios com status 'pendente' atribuídos a um médico específico,
+    do mais recente para o mais antigo (lidos da inbox materializada do médico).
     """
-    relatorios = []
     try:
-        # Log dos parâmetros de entrada
-        logger.info(f"🔍 DEBUG RELATÓRIOS PENDENTES:")
-        logger.info(f"   - medico_id: {medico_id}")
-        logger.info(f"   - negocio_id: {negocio_id}")
-        logger.info(f"   - status: pendente")
-        
-        # Primeiro, vamos verificar se existem relatórios com esse médico em geral
-        query_medico = db.collection('relatorios_medicos').where('medico_id', '==', medico_id)
-        count_medico = len(list(query_medico.stream()))
-        logger.info(f"   - Total de relatórios para este médico: {count_medico}")
-        
-        # Verificar se existem relatórios com esse negócio
-        query_negocio = db.collection('relatorios_medicos').where('negocio_id', '==', negocio_id)
-        count_negocio = len(list(query_negocio.stream()))
-        logger.info(f"   - Total de relatórios para este negócio: {count_negocio}")
-        
-        # Verificar se existem relatórios pendentes em geral
-        query_pendentes = db.collection('relatorios_medicos').where('status', '==', 'pendente')
-        count_pendentes = len(list(query_pendentes.stream()))
-        logger.info(f"   - Total de relatórios pendentes no sistema: {count_pendentes}")
-        
-        # Query sem ordenação para evitar erro de índice
-        # TODO: Criar índice composto no Firestore para incluir order_by
-        query = db.collection('relatorios_medicos') \
-            .where('negocio_id', '==', negocio_id) \
-            .where('medico_id', '==', medico_id) \
-            .where('status', '==', 'pendente')
-        
-        for doc in query.stream():
-            data = doc.to_dict()
-            data['id'] = doc.id
-            
-            # Buscar e incluir dados do paciente
-            paciente_id = data.get('paciente_id')
-            if paciente_id:
-                try:
-                    paciente_doc = db.collection('usuarios').document(paciente_id).get()
-                    if paciente_doc.exists:
-                        paciente_data = paciente_doc.to_dict()
-                        
-                        # Descriptografar dados sensíveis do paciente
-                        paciente_info = {
-                            'id': paciente_id,
-                            'email': paciente_data.get('email', '')
-                        }
-                        
-                        # Descriptografar nome
-                        if 'nome' in paciente_data and paciente_data['nome']:
-                            try:
-                                paciente_info['nome'] = decrypt_data(paciente_data['nome'])
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar nome do paciente {paciente_id}: {e}")
-                                paciente_info['nome'] = "[Erro na descriptografia]"
-                        else:
-                            paciente_info['nome'] = "Nome não disponível"
-                        
-                        # Descriptografar telefone se disponível
-                        if 'telefone' in paciente_data and paciente_data['telefone']:
-                            try:
-                                paciente_info['telefone'] = decrypt_data(paciente_data['telefone'])
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar telefone do paciente {paciente_id}: {e}")
-                                paciente_info['telefone'] = "[Erro na descriptografia]"
-                        
-                        # Adicionar dados pessoais básicos se disponíveis
-                        if 'data_nascimento' in paciente_data:
-                            paciente_info['data_nascimento'] = paciente_data['data_nascimento']
-                        if 'sexo' in paciente_data:
-                            paciente_info['sexo'] = paciente_data['sexo']
-                        if 'estado_civil' in paciente_data:
-                            paciente_info['estado_civil'] = paciente_data['estado_civil']
-                        if 'profissao' in paciente_data:
-                            paciente_info['profissao'] = paciente_data['profissao']
-                        
-                        data['paciente'] = paciente_info
-                    else:
-                        data['paciente'] = {
-                            'id': paciente_id,
-                            'nome': 'Paciente não encontrado',
-                            'email': ''
-                        }
-                        logger.warning(f"Paciente {paciente_id} não encontrado para relatório {doc.id}")
-                except Exception as e:
-                    logger.error(f"Erro ao buscar dados do paciente {paciente_id}: {e}")
-                    data['paciente'] = {
-                        'id': paciente_id,
-                        'nome': 'Erro ao carregar dados',
-                        'email': ''
-                    }
-
-            # Popula informações do criador
-            data = _popular_criado_por(db, data)
-
-            relatorios.append(data)
-            logger.info(f"✅ Relatório encontrado: {doc.id}")
-            logger.info(f"   - medico_id: {data.get('medico_id')}")
-            logger.info(f"   - negocio_id: {data.get('negocio_id')}")
-            logger.info(f"   - status: {data.get('status')}")
-            logger.info(f"   - paciente: {data.get('paciente', {}).get('nome', 'N/A')}")
-            logger.info(f"   - criado_por_id: {data.get('criado_por_id', 'N/A')}")
-            logger.info(f"   - criado_por: {data.get('criado_por', 'N/A')}")
-        
-        # Ordenar manualmente por data_criacao (mais recente primeiro)
-        relatorios.sort(key=lambda x: x.get('data_criacao', datetime.min), reverse=True)
-        
-        logger.info(f"📊 RESULTADO FINAL: {len(relatorios)} relatórios pendentes encontrados")
-        
-        # Se não encontrou nada, vamos verificar os relatórios específicos mencionados no bug report
-        if len(relatorios) == 0:
-            logger.warning("❌ Nenhum relatório encontrado! Verificando relatórios específicos...")
-            relatorio_ids_debug = ["6O75Oh2o9rHggN8oXUhj", "Qb0y0CeCADAlzdUxTtGN"]
-            
-            for relatorio_id in relatorio_ids_debug:
-                doc_ref = db.collection('relatorios_medicos').document(relatorio_id)
-                doc = doc_ref.get()
-                if doc.exists:
-                    data = doc.to_dict()
-                    logger.info(f"🔍 Relatório específico {relatorio_id}:")
-                    logger.info(f"   - medico_id: {data.get('medico_id')} (esperado: {medico_id})")
-                    logger.info(f"   - negocio_id: {data.get('negocio_id')} (esperado: {negocio_id})")
-                    logger.info(f"   - status: {data.get('status')} (esperado: pendente)")
-                    logger.info(f"   - data_criacao: {data.get('data_criacao')}")
-                    
-                    # Verificar se os valores são exatamente iguais
-                    medico_match = data.get('medico_id') == medico_id
-                    negocio_match = data.get('negocio_id') == negocio_id
-                    status_match = data.get('status') == 'pendente'
-                    
-                    logger.info(f"   - medico_id match: {medico_match}")
-                    logger.info(f"   - negocio_id match: {negocio_match}")
-                    logger.info(f"   - status match: {status_match}")
-                else:
-                    logger.warning(f"❌ Relatório {relatorio_id} não existe no banco!")
-            
+        return listar_inbox_medico(db, medico_id, negocio_id, ['pendente'])['relatorios']
     except Exception as e:
         logger.error(f"Erro ao listar relatórios pendentes para o médico {medico_id}: {e}")
-        # Log do stack trace completo para debug
-        import traceback
-        logger.error(f"Stack trace: {traceback.format_exc()}")
-    return relatorios
+        return []
 
 # SUBSTITUA A FUNÇÃO 'aprovar_relatorio' INTEIRA PELA VERSÃO ABAIXO
 
@@ -5083,36 +5331,34 @@ def aprovar_relatorio(db: firestore.client, relatorio_id: str, medico_id: str) -
     """
     Muda o status de um relatório para 'aprovado' e notifica o criador, usando o método de envio individual.
     """
-    print(f"--- INICIANDO APROVAÇÃO DO RELATÓRIO {relatorio_id} PELO MÉDICO {medico_id} ---")
     relatorio_ref = db.collection('relatorios_medicos').document(relatorio_id)
     relatorio_doc = relatorio_ref.get()
 
     if not relatorio_doc.exists or relatorio_doc.to_dict().get('medico_id') != medico_id:
-        print(f"[ERRO] Acesso negado ou relatório não encontrado.")
+        logger.warning("⛔ Aprovação do relatório %s negada ao médico %s (não encontrado ou não atribuído)", relatorio_id, medico_id)
         raise HTTPException(status_code=403, detail="Acesso negado: este relatório não está atribuído a você.")
 
     # 1. Atualiza o status do relatório no banco
-    print("[PASSO 1] Atualizando status do relatório para 'aprovado'.")
-    relatorio_ref.update({
+    alteracoes = {
         "status": "aprovado",
         "data_revisao": datetime.utcnow()
+    }
+    relatorio_anterior = relatorio_doc.to_dict()
+    batch = db.batch()
+    batch.update(relatorio_ref, alteracoes)
+    _registrar_inbox_no_batch(db, batch, relatorio_id, relatorio_anterior, {**relatorio_anterior, **alteracoes})
+    evento_ref = registrar_evento(db, batch, 'RELATORIO_AVALIADO', {
+        'relatorio_id': relatorio_id, 'medico_id': medico_id, 'status': 'aprovado'
     })
+    batch.commit()
     
     updated_doc = relatorio_ref.get()
     relatorio = updated_doc.to_dict()
     relatorio['id'] = updated_doc.id
-    print("[PASSO 1] Status atualizado com sucesso.")
-    
-    # --- NOTIFICAÇÃO EM CASCATA ---
-    print("\n--- INICIANDO NOTIFICAÇÃO EM CASCATA ---")
-    try:
-        _notificar_avaliacao_relatorio_cascata(db, relatorio, medico_id, "aprovado")
-    except Exception as e:
-        print(f"[ERRO NA NOTIFICAÇÃO EM CASCATA] Exceção: {e}")
-        import traceback
-        print(traceback.format_exc())
+    logger.info("✅ Relatório %s aprovado pelo médico %s", relatorio_id, medico_id)
     
-    print("--- FINALIZANDO APROVAÇÃO DO RELATÓRIO ---")
+    # --- NOTIFICAÇÃO EM CASCATA (fora da requisição, via outbox) ---
+    despachar(db, evento_ref.id)
 
     # Popula o criado_por antes de retornar
     return _popular_criado_por(db, relatorio)
@@ -5123,35 +5369,38 @@ def recusar_relatorio(db: firestore.client, relatorio_id: str, medico_id: str, m
     """
     Muda o status de um relatório para 'recusado', adiciona o motivo e notifica o criador.
     """
-    print(f"--- INICIANDO RECUSA DO RELATÓRIO {relatorio_id} PELO MÉDICO {medico_id} ---")
     relatorio_ref = db.collection('relatorios_medicos').document(relatorio_id)
     relatorio_doc = relatorio_ref.get()
 
     if not relatorio_doc.exists or relatorio_doc.to_dict().get('medico_id') != medico_id:
         raise HTTPException(status_code=403, detail="Acesso negado: este relatório não está atribuído a você.")
 
-    relatorio_ref.update({
+    alteracoes = {
         "status": "recusado",
         "data_revisao": datetime.utcnow(),
         "motivo_recusa": motivo
+    }
+    relatorio_anterior = relatorio_doc.to_dict()
+    batch = db.batch()
+    batch.update(relatorio_ref, alteracoes)
+    _registrar_inbox_no_batch(db, batch, relatorio_id, relatorio_anterior, {**relatorio_anterior, **alteracoes})
+    evento_ref = registrar_evento(db, batch, 'RELATORIO_AVALIADO', {
+        'relatorio_id': relatorio_id, 'medico_id': medico_id, 'status': 'recusado'
     })
+    batch.commit()
     
     updated_doc = relatorio_ref.get()
     relatorio = updated_doc.to_dict()
     relatorio['id'] = updated_doc.id
-    print("[PASSO 1 - RECUSA] Status atualizado com sucesso.")
+    logger.info("✅ Relatório %s recusado pelo médico %s", relatorio_id, medico_id)
     
-    # --- NOTIFICAÇÃO EM CASCATA ---
-    print("\n--- INICIANDO NOTIFICAÇÃO EM CASCATA PARA RECUSA ---")
-    try:
-        _notificar_avaliacao_relatorio_cascata(db, relatorio, medico_id, "recusado")
-    except Exception as e:
-        logger.error(f"Erro na notificação em cascata de recusa do relatório {relatorio_id}: {e}")
+    # --- NOTIFICAÇÃO EM CASCATA (fora da requisição, via outbox) ---
+    despachar(db, evento_ref.id)
 
     # Popula o criado_por antes de retornar
     return _popular_criado_por(db, relatorio)
 
-def _notificar_avaliacao_relatorio_cascata(db: firestore.client, relatorio: Dict, medico_id: str, status: str):
+def _notificar_avaliacao_relatorio_cascata(db: firestore.client, evento_id: str, relatorio: Dict, medico_id: str, status: str):
     """
     Notifica sobre avaliação de relatório seguindo lógica de cascata:
     1. SEMPRE notifica quem criou o relatório (criado_por_id)
@@ -5159,146 +5408,91 @@ def _notificar_avaliacao_relatorio_cascata(db: firestore.client, relatorio: Dict
     3. Se criador NÃO for admin, notifica TODOS os admins do negócio
 
     Args:
+        evento_id: ID do evento do outbox (ID do documento de histórico de cada destinatário)
         relatorio: Dicionário do relatório avaliado
         medico_id: ID do médico que avaliou
         status: "aprovado" ou "recusado"
-    """
-    try:
-        criado_por_id = relatorio.get('criado_por_id')
-        paciente_id = relatorio.get('paciente_id')
-        negocio_id = relatorio.get('negocio_id')
-        relatorio_id = relatorio.get('id')
-
-        if not criado_por_id:
-            logger.warning(f"Relatório {relatorio_id} sem criado_por_id. Pulando notificação.")
-            return
-
-        # Buscar informações do médico e paciente para a mensagem
-        medico_doc = db.collection('usuarios').document(medico_id).get()
-        nome_medico = decrypt_data(medico_doc.to_dict().get('nome', '')) if medico_doc.exists else "Médico"
 
-        paciente_doc = db.collection('usuarios').document(paciente_id).get()
-        nome_paciente = decrypt_data(paciente_doc.to_dict().get('nome', '')) if paciente_doc.exists else "Paciente"
-        paciente_data = paciente_doc.to_dict() if paciente_doc.exists else {}
-
-        # Buscar dados do criador
-        criador_doc = db.collection('usuarios').document(criado_por_id).get()
-        if not criador_doc.exists:
-            logger.warning(f"Criador {criado_por_id} não encontrado.")
-            return
-
-        criador_data = criador_doc.to_dict()
-        criador_roles = criador_data.get('roles', {})
-
-        # Conjunto de destinatários (usa set para evitar duplicatas)
-        destinatarios = set()
+    Raises:
+        RuntimeError: se algum destinatário não pôde ser notificado (o outbox tenta de novo)
+    """
+    criado_por_id = relatorio.get('criado_por_id')
+    paciente_id = relatorio.get('paciente_id')
+    negocio_id = relatorio.get('negocio_id')
+    relatorio_id = relatorio.get('id')
 
-        # 1. SEMPRE adiciona o criador
-        destinatarios.add(criado_por_id)
-        logger.info(f"📧 Notificação: Adicionado criador do relatório: {criado_por_id}")
+    if not criado_por_id:
+        logger.warning(f"Relatório {relatorio_id} sem criado_por_id. Pulando notificação.")
+        return
+
+    # Buscar informações do médico e paciente para a mensagem
+    medico_doc = db.collection('usuarios').document(medico_id).get()
+    nome_medico = decrypt_data(medico_doc.to_dict().get('nome', '')) if medico_doc.exists else "Médico"
+
+    paciente_doc = db.collection('usuarios').document(paciente_id).get()
+    nome_paciente = decrypt_data(paciente_doc.to_dict().get('nome', '')) if paciente_doc.exists else "Paciente"
+    paciente_data = paciente_doc.to_dict() if paciente_doc.exists else {}
+
+    # Buscar dados do criador
+    criador_doc = db.collection('usuarios').document(criado_por_id).get()
+    if not criador_doc.exists:
+        logger.warning(f"Criador {criado_por_id} não encontrado.")
+        return
+
+    criador_data = criador_doc.to_dict()
+    criador_roles = criador_data.get('roles', {})
+
+    # Conjunto de destinatários (usa set para evitar duplicatas)
+    destinatarios = set()
+
+    # 1. SEMPRE adiciona o criador
+    destinatarios.add(criado_por_id)
+    logger.info(f"📧 Notificação: Adicionado criador do relatório: {criado_por_id}")
+
+    # 2. Adiciona enfermeiro vinculado ao paciente (se existir)
+    enfermeiro_id = paciente_data.get('enfermeiro_id')
+    if enfermeiro_id:
+        destinatarios.add(enfermeiro_id)
+        logger.info(f"📧 Notificação: Adicionado enfermeiro do paciente: {enfermeiro_id}")
+
+    # 3. Se criador NÃO for admin, notificar TODOS os admins do negócio
+    criador_role_no_negocio = criador_roles.get(negocio_id)
+    if criador_role_no_negocio != 'admin':
+        logger.info(f"📧 Notificação: Criador não é admin (role: {criador_role_no_negocio}). Buscando admins...")
+        # Buscar todos admins do negócio
+        for admin_id in listar_membros_por_role(db, negocio_id, 'admin'):
+            destinatarios.add(admin_id)
+            logger.info(f"📧 Notificação: Adicionado admin: {admin_id}")
+    else:
+        logger.info(f"📧 Notificação: Criador é admin. Não notificando outros admins.")
+
+    # Preparar título, corpo e data_payload
+    acao = "aprovou" if status == "aprovado" else "recusou"
+    titulo = "Relatório Avaliado"
+    corpo = f"O Dr(a). {nome_medico} {acao} o relatório do paciente {nome_paciente}."
+
+    data_payload = {
+        "tipo": "RELATORIO_AVALIADO",
+        "relatorio_id": relatorio_id,
+        "paciente_id": str(paciente_id),
+        "status": status,
+    }
 
-        # 2. Adiciona enfermeiro vinculado ao paciente (se existir)
-        enfermeiro_id = paciente_data.get('enfermeiro_id')
-        if enfermeiro_id:
-            destinatarios.add(enfermeiro_id)
-            logger.info(f"📧 Notificação: Adicionado enfermeiro do paciente: {enfermeiro_id}")
-
-        # 3. Se criador NÃO for admin, notificar TODOS os admins do negócio
-        criador_role_no_negocio = criador_roles.get(negocio_id)
-        if criador_role_no_negocio != 'admin':
-            logger.info(f"📧 Notificação: Criador não é admin (role: {criador_role_no_negocio}). Buscando admins...")
-            # Buscar todos admins do negócio
-            usuarios_ref = db.collection('usuarios')
-            usuarios_docs = usuarios_ref.stream()
-
-            for usuario_doc in usuarios_docs:
-                usuario_data = usuario_doc.to_dict()
-                usuario_roles = usuario_data.get('roles', {})
-                if usuario_roles.get(negocio_id) == 'admin':
-                    destinatarios.add(usuario_doc.id)
-                    logger.info(f"📧 Notificação: Adicionado admin: {usuario_doc.id}")
-        else:
-            logger.info(f"📧 Notificação: Criador é admin. Não notificando outros admins.")
+    webpush_tag = f"RELATORIO_AVALIADO-relatorio-{relatorio_id}-paciente-{paciente_id}"
 
-        # Preparar título, corpo e data_payload
-        acao = "aprovou" if status == "aprovado" else "recusou"
-        titulo = "Relatório Avaliado"
-        corpo = f"O Dr(a). {nome_medico} {acao} o relatório do paciente {nome_paciente}."
+    logger.info(f"📧 Notificação em cascata: Total de {len(destinatarios)} destinatário(s)")
 
-        data_payload = {
-            "tipo": "RELATORIO_AVALIADO",
+    _entregar_notificacao_evento_a_todos(db, evento_id, destinatarios, {
+        "title": titulo,
+        "body": corpo,
+        "tipo": "RELATORIO_AVALIADO",
+        "relacionado": {
             "relatorio_id": relatorio_id,
-            "paciente_id": str(paciente_id),
-            "status": status,
-        }
-
-        webpush_tag = f"RELATORIO_AVALIADO-relatorio-{relatorio_id}-paciente-{paciente_id}"
-
-        logger.info(f"📧 Notificação em cascata: Total de {len(destinatarios)} destinatário(s)")
-
-        # Enviar notificação para cada destinatário
-        for destinatario_id in destinatarios:
-            try:
-                # Persistir no Firestore
-                db.collection('usuarios').document(destinatario_id).collection('notificacoes').add({
-                    "title": titulo,
-                    "body": corpo,
-                    "tipo": "RELATORIO_AVALIADO",
-                    "relacionado": {
-                        "relatorio_id": relatorio_id,
-                        "paciente_id": paciente_id
-                    },
-                    "lida": False,
-                    "data_criacao": firestore.SERVER_TIMESTAMP
-                })
-
-                # Enviar push notification (FCM + APNs)
-                destinatario_doc = db.collection('usuarios').document(destinatario_id).get()
-                if destinatario_doc.exists:
-                    destinatario_data = destinatario_doc.to_dict()
-                    fcm_tokens = destinatario_data.get('fcm_tokens', [])
-                    apns_tokens = destinatario_data.get('apns_tokens', [])
-
-                    # Enviar FCM
-                    for token in fcm_tokens:
-                        try:
-                            message = messaging.Message(
-                                notification=messaging.Notification(title=titulo, body=corpo),
-                                data=data_payload,
-                                token=token,
-                                webpush=messaging.WebpushConfig(
-                                    notification=messaging.WebpushNotification(tag=webpush_tag)
-                                )
-                            )
-                            messaging.send(message)
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar FCM para {destinatario_id}: {e}")
-
-                    # Enviar APNs
-                    if apns_tokens:
-                        from notification_helper import enviar_notificacao_para_usuario
-                        try:
-                            enviar_notificacao_para_usuario(
-                                destinatario_data,
-                                titulo,
-                                corpo,
-                                data_payload,
-                                webpush_tag
-                            )
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar APNs para {destinatario_id}: {e}")
-
-                logger.info(f"✅ Notificação enviada para: {destinatario_id}")
-
-            except Exception as e:
-                logger.error(f"❌ Erro ao notificar {destinatario_id}: {e}")
-
-        logger.info(f"🎉 Notificação em cascata concluída para relatório {relatorio_id}")
+            "paciente_id": paciente_id
+        },
+    }, data_payload, webpush_tag)
 
-    except Exception as e:
-        logger.error(f"❌ Erro crítico na notificação em cascata: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+    logger.info(f"🎉 Notificação em cascata concluída para relatório {relatorio_id}")
 
 def _notificar_criador_relatorio_avaliado(db: firestore.client, relatorio: Dict, status: str):
     """Notifica o criador do relatório sobre aprovação/recusa pelo médico."""
@@ -5381,12 +5575,10 @@ def _notificar_criador_relatorio_avaliado(db: firestore.client, relatorio: Dict,
 def _notificar_tecnicos_plano_atualizado(db: firestore.client, paciente_id: str, consulta_id: str):
     """Notifica todos os técnicos vinculados sobre novo plano de cuidado."""
     try:
-        print(f"--- INICIANDO NOTIFICAÇÃO DE PLANO DE CUIDADO ATUALIZADO para paciente {paciente_id} ---")
-        
         # PASSO 1 e 2: Buscar dados do paciente e dos técnicos
         paciente_doc = db.collection('usuarios').document(paciente_id).get()
         if not paciente_doc.exists:
-            print(f"[ERRO DE NOTIFICAÇÃO] Paciente {paciente_id} não encontrado.")
+            logger.warning("⚠️ Notificação não enviada: paciente %s não encontrado", paciente_id)
             return
             
         paciente_data = paciente_doc.to_dict()
@@ -5394,10 +5586,10 @@ def _notificar_tecnicos_plano_atualizado(db: firestore.client, paciente_id: str,
         tecnicos_ids = paciente_data.get('tecnicos_ids', [])
         
         if not tecnicos_ids:
-            print(f"[INFO] Paciente {paciente_id} não possui técnicos vinculados. Nenhuma notificação enviada.")
+            logger.info("Paciente %s não possui técnicos vinculados. Nenhuma notificação enviada.", paciente_id)
             return
-        
-        print(f"[PASSO A] Notificação será enviada para {len(tecnicos_ids)} técnico(s).")
+
+        logger.info("🔔 Plano de cuidado do paciente %s atualizado: notificando %d técnico(s)", paciente_id, len(tecnicos_ids))
 
         # PASSO 3: Construir a mensagem visual
         titulo = "Plano de Cuidado Atualizado"
@@ -5415,13 +5607,11 @@ def _notificar_tecnicos_plano_atualizado(db: firestore.client, paciente_id: str,
             try:
                 tecnico_doc = db.collection('usuarios').document(tecnico_id).get()
                 if not tecnico_doc.exists:
-                    print(f"[AVISO] Técnico com ID {tecnico_id} não foi encontrado. Pulando.")
+                    logger.warning("⚠️ Técnico %s não foi encontrado. Pulando.", tecnico_id)
                     continue
                     
                 tecnico_data = tecnico_doc.to_dict()
                 tokens_fcm = tecnico_data.get('fcm_tokens', [])
-                
-                print(f"[PASSO B - Técnico {tecnico_id}] Destinatário: {tecnico_data.get('email')}. Tokens: {len(tokens_fcm)}")
 
                 # PASSO 5: Persistir a notificação no histórico
                 db.collection('usuarios').document(tecnico_id).collection('notificacoes').add({
@@ -5429,52 +5619,31 @@ def _notificar_tecnicos_plano_atualizado(db: firestore.client, paciente_id: str,
                     "relacionado": { "paciente_id": paciente_id, "consulta_id": consulta_id },
                     "lida": False, "data_criacao": firestore.SERVER_TIMESTAMP
                 })
-                print(f"[PASSO C - Técnico {tecnico_id}] Notificação persistida no Firestore.")
 
-                # PASSO 6: Enviar o push em loop
+                # PASSO 6: Enviar o push (em lote)
                 if tokens_fcm:
-                    print(f"[PASSO D - Técnico {tecnico_id}] Enviando notificação para {len(tokens_fcm)} token(s)...")
-
                     # Gera tag webpush única
                     webpush_tag = f"PLANO_CUIDADO_ATUALIZADO-consulta-{consulta_id}-paciente-{paciente_id}"
 
-                    sucessos = 0
-                    for token in tokens_fcm:
-                        try:
-                            message = messaging.Message(
-                                notification=messaging.Notification(title=titulo, body=corpo),
-                                data=data_payload,
-                                token=token,
-                                webpush=messaging.WebpushConfig(
-                                    notification=messaging.WebpushNotification(tag=webpush_tag)
-                                )
-                            )
-                            messaging.send(message)
-                            sucessos += 1
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar para o token {token[:10]}...: {e}")
-                    print(f"[PASSO E SUCESSO - Técnico {tecnico_id}] Envio concluído. Sucessos: {sucessos}")
+                    envio = _enviar_fcm_ao_usuario(db, tecnico_id, tokens_fcm, titulo, corpo, data_payload, webpush_tag)
+                    logger.debug("Push de plano atualizado para o técnico %s: %d/%d enviados", tecnico_id, envio['sucessos'], len(tokens_fcm))
                 else:
-                    print(f"[PASSO D FALHA - Técnico {tecnico_id}] Nenhum token FCM encontrado.")
+                    logger.debug("Técnico %s sem tokens FCM: push não enviado", tecnico_id)
                     
             except Exception as e:
                 logger.error(f"Erro ao processar notificação para o técnico {tecnico_id}: {e}")
                 
     except Exception as e:
-        print(f"[ERRO CRÍTICO NA NOTIFICAÇÃO DE PLANO DE CUIDADO] Exceção: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("❌ Erro crítico na notificação de plano de cuidado do paciente %s: %s", paciente_id, e)
 
 
 def _notificar_profissional_associacao(db: firestore.client, profissional_id: str, paciente_id: str, tipo_profissional: str):
     """Notifica um profissional (enfermeiro ou técnico) sobre associação a um paciente."""
     try:
-        print(f"--- INICIANDO NOTIFICAÇÃO DE ASSOCIAÇÃO para profissional {profissional_id} ---")
-        
         # PASSO 1 e 2: Buscar dados do paciente e do profissional (destinatário)
         paciente_doc = db.collection('usuarios').document(paciente_id).get()
         if not paciente_doc.exists:
-            print(f"[ERRO DE NOTIFICAÇÃO] Paciente {paciente_id} não encontrado.")
+            logger.warning("⚠️ Notificação não enviada: paciente %s não encontrado", paciente_id)
             return
             
         paciente_data = paciente_doc.to_dict()
@@ -5482,12 +5651,10 @@ def _notificar_profissional_associacao(db: firestore.client, profissional_id: st
         
         profissional_doc = db.collection('usuarios').document(profissional_id).get()
         if not profissional_doc.exists:
-            print(f"[ERRO DE NOTIFICAÇÃO] Profissional {profissional_id} não encontrado.")
+            logger.warning("⚠️ Notificação não enviada: profissional %s não encontrado", profissional_id)
             return
         profissional_data = profissional_doc.to_dict()
         tokens_fcm = profissional_data.get('fcm_tokens', [])
-        
-        print(f"[PASSO A] Destinatário: {profissional_data.get('email')}. Tokens encontrados: {len(tokens_fcm)}")
 
         # PASSO 3: Construir a Mensagem Visual
         titulo = "Nova Associação de Paciente"
@@ -5502,7 +5669,6 @@ def _notificar_profissional_associacao(db: firestore.client, profissional_id: st
             "paciente_id": paciente_id,
             "tipo_profissional": tipo_profissional,
         }
-        print(f"[PASSO B] Payload montado. Título: '{titulo}', Corpo: '{corpo}'")
 
         # PASSO 5: Persistir a Notificação no Histórico
         db.collection('usuarios').document(profissional_id).collection('notificacoes').add({
@@ -5510,38 +5676,19 @@ def _notificar_profissional_associacao(db: firestore.client, profissional_id: st
             "relacionado": { "paciente_id": paciente_id },
             "lida": False, "data_criacao": firestore.SERVER_TIMESTAMP
         })
-        print(f"[PASSO C] Notificação persistida no Firestore para o usuário {profissional_id}.")
 
-        # PASSO 6: Enviar o Push em Loop
+        # PASSO 6: Enviar o Push (em lote)
         if tokens_fcm:
-            print(f"[PASSO D] Enviando notificação para {len(tokens_fcm)} token(s) em loop...")
-
             # Gera tag webpush única
             webpush_tag = f"ASSOCIACAO_PACIENTE-paciente-{paciente_id}-profissional-{profissional_id}"
 
-            sucessos = 0
-            for token in tokens_fcm:
-                try:
-                    message = messaging.Message(
-                        notification=messaging.Notification(title=titulo, body=corpo),
-                        data=data_payload,
-                        token=token,
-                        webpush=messaging.WebpushConfig(
-                            notification=messaging.WebpushNotification(tag=webpush_tag)
-                        )
-                    )
-                    messaging.send(message)
-                    sucessos += 1
-                except Exception as e:
-                    logger.error(f"Erro ao enviar para o token {token[:10]}...: {e}")
-            print(f"[PASSO E SUCESSO] Envio de associação concluído. Sucessos: {sucessos}")
+            envio = _enviar_fcm_ao_usuario(db, profissional_id, tokens_fcm, titulo, corpo, data_payload, webpush_tag)
+            logger.debug("Push de associação para o profissional %s: %d/%d enviados", profissional_id, envio['sucessos'], len(tokens_fcm))
         else:
-            print("[PASSO D FALHA] Nenhum token FCM encontrado. Push não enviado.")
+            logger.debug("Profissional %s sem tokens FCM: push de associação não enviado", profissional_id)
             
     except Exception as e:
-        print(f"[ERRO CRÍTICO NA NOTIFICAÇÃO DE ASSOCIAÇÃO] Exceção: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("❌ Erro crítico na notificação de associação do profissional %s: %s", profissional_id, e)
 
 
 def _notificar_checklist_concluido(db: firestore.client, paciente_id: str, dia_do_checklist: date, negocio_id: str):
@@ -5550,12 +5697,10 @@ def _notificar_checklist_concluido(db: firestore.client, paciente_id: str, dia_d
     Segue o padrão de notificação definitivo.
     """
     try:
-        print(f"--- INICIANDO NOTIFICAÇÃO DE CHECKLIST COMPLETO para paciente {paciente_id} ---")
-
         # PASSO 1 e 2: Coletar IDs e Buscar Dados Completos
         paciente_doc = db.collection('usuarios').document(paciente_id).get()
         if not paciente_doc.exists:
-            print(f"[ERRO DE NOTIFICAÇÃO] Paciente {paciente_id} não encontrado.")
+            logger.warning("⚠️ Notificação não enviada: paciente %s não encontrado", paciente_id)
             return
 
         paciente_data = paciente_doc.to_dict()
@@ -5567,15 +5712,13 @@ def _notificar_checklist_concluido(db: firestore.client, paciente_id: str, dia_d
             destinatarios_ids.add(enfermeiro_id)
 
         # Adicionar admins do negócio aos destinatários
-        query_admins = db.collection('usuarios').where(f'roles.{negocio_id}', '==', 'admin')
-        for admin_doc in query_admins.stream():
-            destinatarios_ids.add(admin_doc.id)
+        destinatarios_ids.update(listar_membros_por_role(db, negocio_id, 'admin'))
 
         if not destinatarios_ids:
-            print(f"[INFO] Nenhum destinatário (enfermeiro/admin) encontrado para notificar sobre o paciente {paciente_id}.")
+            logger.info("Nenhum destinatário (enfermeiro/admin) encontrado para notificar sobre o paciente %s.", paciente_id)
             return
 
-        print(f"[PASSO A] Notificação será enviada para {len(destinatarios_ids)} destinatário(s).")
+        logger.info("🔔 Checklist do paciente %s concluído: notificando %d destinatário(s)", paciente_id, len(destinatarios_ids))
 
         # PASSO 3: Construir a Mensagem Visual
         titulo = "Checklist Concluído"
@@ -5593,12 +5736,11 @@ def _notificar_checklist_concluido(db: firestore.client, paciente_id: str, dia_d
             try:
                 dest_doc = db.collection('usuarios').document(dest_id).get()
                 if not dest_doc.exists:
-                    print(f"[AVISO] Destinatário com ID {dest_id} não foi encontrado. Pulando.")
+                    logger.warning("⚠️ Destinatário %s não foi encontrado. Pulando.", dest_id)
                     continue
 
                 dest_data = dest_doc.to_dict()
                 tokens_fcm = dest_data.get('fcm_tokens', [])
-                print(f"[PASSO B - Destinatário {dest_id}] E-mail: {dest_data.get('email')}. Tokens: {len(tokens_fcm)}")
 
                 # PASSO 5: Persistir a Notificação no Histórico
                 db.collection('usuarios').document(dest_id).collection('notificacoes').add({
@@ -5606,41 +5748,22 @@ def _notificar_checklist_concluido(db: firestore.client, paciente_id: str, dia_d
                     "relacionado": { "paciente_id": paciente_id, "data_checklist": dia_do_checklist.isoformat() },
                     "lida": False, "data_criacao": firestore.SERVER_TIMESTAMP
                 })
-                print(f"[PASSO C - Destinatário {dest_id}] Notificação persistida no Firestore.")
 
-                # PASSO 6: Enviar o Push em Loop
+                # PASSO 6: Enviar o Push (em lote)
                 if tokens_fcm:
-                    print(f"[PASSO D - Destinatário {dest_id}] Enviando notificação para {len(tokens_fcm)} token(s)...")
-
                     # Gera tag webpush única
                     webpush_tag = f"CHECKLIST_CONCLUIDO-paciente-{paciente_id}-data-{dia_do_checklist.isoformat()}"
 
-                    sucessos = 0
-                    for token in tokens_fcm:
-                        try:
-                            message = messaging.Message(
-                                notification=messaging.Notification(title=titulo, body=corpo),
-                                data=data_payload,
-                                token=token,
-                                webpush=messaging.WebpushConfig(
-                                    notification=messaging.WebpushNotification(tag=webpush_tag)
-                                )
-                            )
-                            messaging.send(message)
-                            sucessos += 1
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar para o token {token[:10]}...: {e}")
-                    print(f"[PASSO E SUCESSO - Destinatário {dest_id}] Envio concluído. Sucessos: {sucessos}")
+                    envio = _enviar_fcm_ao_usuario(db, dest_id, tokens_fcm, titulo, corpo, data_payload, webpush_tag)
+                    logger.debug("Push de checklist concluído para %s: %d/%d enviados", dest_id, envio['sucessos'], len(tokens_fcm))
                 else:
-                    print(f"[PASSO D FALHA - Destinatário {dest_id}] Nenhum token FCM encontrado.")
+                    logger.debug("Destinatário %s sem tokens FCM: push não enviado", dest_id)
 
             except Exception as e:
                 logger.error(f"Erro ao processar notificação para o destinatário {dest_id}: {e}")
 
     except Exception as e:
-        print(f"[ERRO CRÍTICO NA NOTIFICAÇÃO DE CHECKLIST COMPLETO] Exceção: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("❌ Erro crítico na notificação de checklist concluído do paciente %s: %s", paciente_id, e)
 
 
 def _verificar_checklist_completo(db: firestore.client, paciente_id: str, item_id: str):
@@ -5906,8 +6029,11 @@ def atualizar_relatorio_medico(db: firestore.client, relatorio_id: str, update_d
             current_data["id"] = relatorio_doc.id
             return current_data
         
-        # Atualizar documento
-        relatorio_ref.update(update_dict)
+        # Atualizar documento e a inbox do médico no mesmo batch
+        batch = db.batch()
+        batch.update(relatorio_ref, update_dict)
+        _registrar_inbox_no_batch(db, batch, relatorio_id, relatorio_data, {**relatorio_data, **update_dict})
+        batch.commit()
         logger.info(f"Relatório {relatorio_id} atualizado com sucesso: {list(update_dict.keys())}")
         
         # Retornar documento atualizado
@@ -5924,130 +6050,283 @@ def atualizar_relatorio_medico(db: firestore.client, relatorio_id: str, update_d
 
 def listar_historico_relatorios_medico(db: firestore.client, medico_id: str, negocio_id: str, status_filter: Optional[str] = None) -> List[Dict]:
     """
-    Lista o histórico de relatórios já avaliados pelo médico (aprovados + recusados).
-    COPIADO DA FUNÇÃO DE PENDENTES QUE FUNCIONA
+    Lista o histórico de relatórios já avaliados pelo médico (aprovados + recusados),
+    do avaliado mais recentemente para o mais antigo (lidos da inbox materializada do médico).
     """
-    logger.info(f"🟢🟢🟢 [VERSÃO NOVA] FUNÇÃO HISTÓRICO CHAMADA - medico: {medico_id}, negocio: {negocio_id}, filtro: {status_filter}")
-    relatorios = []
+    return listar_inbox_medico(
+        db, medico_id, negocio_id, _status_historico_inbox(status_filter), ordenar_por='data_revisao'
+    )['relatorios']
 
-    # Query base
-    query = db.collection('relatorios_medicos') \
-        .where('negocio_id', '==', negocio_id) \
-        .where('medico_id', '==', medico_id)
 
-    # Se tem filtro específico, aplica
+def _status_historico_inbox(status_filter: Optional[str]) -> List[str]:
+    """Status consultados no histórico: o filtro informado ou aprovados + recusados."""
     if status_filter and status_filter.lower() in ['aprovado', 'recusado']:
-        query = query.where('status', '==', status_filter.lower())
-    # Senão, busca aprovados E recusados
+        return [status_filter.lower()]
+    return ['aprovado', 'recusado']
+
+
+# =================================================================================
+# INBOX DO MÉDICO (RELATÓRIOS MATERIALIZADOS)
+# =================================================================================
+# Cada médico tem uma cópia dos seus relatórios em
+# usuarios/{medico_id}/inbox_relatorios/{relatorio_id} e contadores por status em
+# usuarios/{medico_id}/inbox_relatorios_contadores/{negocio_id}. As telas do médico
+# leem apenas a própria inbox: o custo não cresce com o total de relatórios do sistema.
+# A entrada guarda só os campos do relatório e os IDs do paciente e do criador (nenhum
+# dado pessoal copiado, que ficaria desatualizado): os dois são resolvidos na leitura
+# pelo DataLoader da requisição, com um get_all para a página inteira.
+#
+# A inbox é atualizada no mesmo batch das escritas em 'relatorios_medicos'
+# (criar, aprovar, recusar, atualizar, adicionar foto). Na primeira leitura de um
+# médico/negócio (contadores sem 'reconstruido_em') ela é reconstruída a partir de
+# 'relatorios_medicos'; reconstruir_inboxes_medicos() refaz todas as inboxes já
+# existentes (POST /tasks/reconstruir-inboxes-medicos, uma vez após o deploy, para
+# remover o paciente/criador embutidos pela versão anterior).
+#
+# Índices compostos da coleção inbox_relatorios (em firestore.indexes.json):
+#   negocio_id ASC, status ASC, data_criacao DESC, __name__ DESC
+#   negocio_id ASC, status ASC, data_revisao DESC, __name__ DESC
+
+INBOX_RELATORIOS_COLLECTION = 'inbox_relatorios'
+INBOX_CONTADORES_COLLECTION = 'inbox_relatorios_contadores'
+STATUS_RELATORIO = ('pendente', 'aprovado', 'recusado')
+
+_CAMPOS_RELATORIO_INBOX = (
+    'paciente_id', 'negocio_id', 'criado_por_id', 'medico_id', 'consulta_id', 'conteudo',
+    'status', 'fotos', 'motivo_recusa', 'data_criacao', 'data_revisao',
+)
+_CAMPOS_PACIENTE_INBOX = ('email', 'nome', 'telefone', 'data_nascimento', 'sexo', 'estado_civil', 'profissao')
+
+
+def _inbox_relatorios_ref(db: firestore.client, medico_id: str):
+    return db.collection('usuarios').document(medico_id).collection(INBOX_RELATORIOS_COLLECTION)
+
+
+def _contadores_inbox_ref(db: firestore.client, medico_id: str, negocio_id: str):
+    return db.collection('usuarios').document(medico_id).collection(INBOX_CONTADORES_COLLECTION).document(negocio_id)
+
+
+def _montar_entrada_inbox(relatorio: Dict) -> Dict:
+    """Cópia dos campos do relatório (paciente e criador apenas por ID)."""
+    entrada = {campo: relatorio.get(campo) for campo in _CAMPOS_RELATORIO_INBOX}
+    entrada['atualizado_em'] = firestore.SERVER_TIMESTAMP
+    return entrada
+
+
+def _registrar_inbox_no_batch(db: firestore.client, batch, relatorio_id: str, anterior: Optional[Dict], atual: Dict) -> None:
+    """
+    Adiciona ao batch as escritas que mantêm a inbox do médico e os contadores.
+
+    Args:
+        anterior: Relatório antes da alteração (None na criação).
+        atual: Relatório após a alteração (anterior + campos alterados).
+    """
+    medico_id, negocio_id = atual.get('medico_id'), atual.get('negocio_id')
+    medico_anterior = (anterior or {}).get('medico_id')
+    ajustes: Dict[tuple, Dict[str, int]] = {}
+
+    def ajustar(medico: Optional[str], negocio: Optional[str], status: Optional[str], delta: int):
+        if medico and negocio and status in STATUS_RELATORIO:
+            contadores = ajustes.setdefault((medico, negocio), {})
+            contadores[status] = contadores.get(status, 0) + delta
+
+    if anterior is None or medico_anterior != medico_id:
+        # Relatório novo ou transferido para outro médico: entrada completa na inbox do médico atual
+        if anterior is not None and medico_anterior:
+            batch.delete(_inbox_relatorios_ref(db, medico_anterior).document(relatorio_id))
+            ajustar(medico_anterior, anterior.get('negocio_id'), anterior.get('status'), -1)
+        if medico_id:
+            batch.set(_inbox_relatorios_ref(db, medico_id).document(relatorio_id), _montar_entrada_inbox(atual))
+            ajustar(medico_id, negocio_id, atual.get('status'), 1)
     else:
-        # Firestore não suporta OR, então fazemos 2 queries
-        query_aprovados = query.where('status', '==', 'aprovado')
-        query_recusados = query.where('status', '==', 'recusado')
+        campos = {campo: atual[campo] for campo in _CAMPOS_RELATORIO_INBOX if campo in atual}
+        batch.set(
+            _inbox_relatorios_ref(db, medico_id).document(relatorio_id),
+            {**campos, 'atualizado_em': firestore.SERVER_TIMESTAMP},
+            merge=True
+        )
+        if anterior.get('status') != atual.get('status'):
+            ajustar(medico_id, negocio_id, anterior.get('status'), -1)
+            ajustar(medico_id, negocio_id, atual.get('status'), 1)
 
-        # Combina resultados
-        docs_all = []
-        docs_all.extend(list(query_aprovados.stream()))
-        docs_all.extend(list(query_recusados.stream()))
+    # Um único write por documento de contadores, mesmo quando dois status mudam
+    for (medico, negocio), deltas in ajustes.items():
+        incrementos = {status: firestore.Increment(delta) for status, delta in deltas.items() if delta}
+        if incrementos:
+            batch.set(_contadores_inbox_ref(db, medico, negocio), incrementos, merge=True)
+
+
+def reconstruir_inbox_medico(db: firestore.client, medico_id: str, negocio_id: str) -> Dict[str, int]:
+    """
+    Reconstrói a inbox e os contadores de um médico em um negócio a partir de 'relatorios_medicos'.
+    Usada automaticamente na primeira leitura e por reconstruir_inboxes_medicos; as entradas
+    são regravadas por inteiro.
+
+    Returns:
+        Contadores por status após a reconstrução.
+    """
+    docs = list(
+        db.collection('relatorios_medicos')
+        .where('negocio_id', '==', negocio_id)
+        .where('medico_id', '==', medico_id)
+        .stream()
+    )
+    inbox_ref = _inbox_relatorios_ref(db, medico_id)
+    contadores = {status: 0 for status in STATUS_RELATORIO}
+    ids_atuais = set()
+
+    with EscritorEmLote(db, descricao=f"reconstruir_inbox:{medico_id}") as escritor:
+        for doc in docs:
+            relatorio = doc.to_dict() or {}
+            escritor.set(inbox_ref.document(doc.id), _montar_entrada_inbox(relatorio))
+            ids_atuais.add(doc.id)
+            if relatorio.get('status') in contadores:
+                contadores[relatorio['status']] += 1
+
+        # Entradas de relatórios que não pertencem mais ao médico
+        for entrada in inbox_ref.where('negocio_id', '==', negocio_id).select([]).stream():
+            if entrada.id not in ids_atuais:
+                escritor.delete(entrada.reference)
+
+    _contadores_inbox_ref(db, medico_id, negocio_id).set({
+        **contadores,
+        'reconstruido_em': firestore.SERVER_TIMESTAMP,
+    })
+    logger.info(f"📥 Inbox do médico {medico_id} no negócio {negocio_id} reconstruída: {contadores}")
+    return contadores
+
+
+def reconstruir_inboxes_medicos(db: firestore.client) -> Dict[str, int]:
+    """
+    Reconstrói todas as inboxes de médicos já criadas (uma por médico/negócio com
+    contadores). Deve ser executado manualmente após o deploy que deixou de embutir
+    paciente e criador nas entradas; pode ser repetido sem efeito.
+    """
+    stats = {"inboxes_reconstruidas": 0, "relatorios": 0, "erros": 0}
+    for contadores_doc in db.collection_group(INBOX_CONTADORES_COLLECTION).stream():
+        medico_id, negocio_id = contadores_doc.reference.parent.parent.id, contadores_doc.id
+        try:
+            contadores = reconstruir_inbox_medico(db, medico_id, negocio_id)
+            stats["inboxes_reconstruidas"] += 1
+            stats["relatorios"] += sum(contadores.values())
+        except Exception as e:
+            stats["erros"] += 1
+            logger.error(f"❌ Erro ao reconstruir a inbox do médico {medico_id} no negócio {negocio_id}: {e}")
+
+    logger.info(f"📥 Inboxes de médicos reconstruídas: {stats}")
+    return stats
 
-        # Processa cada doc
-        for doc in docs_all:
-            data = doc.to_dict()
-            data['id'] = doc.id
 
-            # Buscar dados do paciente (IGUAL AOS PENDENTES)
-            paciente_id = data.get('paciente_id')
-            if paciente_id:
+def obter_contadores_inbox_medico(db: firestore.client, medico_id: str, negocio_id: str) -> Dict[str, int]:
+    """Retorna {pendente, aprovado, recusado} do médico no negócio, reconstruindo a inbox se necessário."""
+    snapshot = _contadores_inbox_ref(db, medico_id, negocio_id).get()
+    dados = snapshot.to_dict() if snapshot.exists else {}
+    if not dados.get('reconstruido_em'):
+        return reconstruir_inbox_medico(db, medico_id, negocio_id)
+    return {status: max(0, int(dados.get(status, 0))) for status in STATUS_RELATORIO}
+
+
+def _entradas_inbox_para_relatorios(db: firestore.client, docs: List) -> List[Dict]:
+    """Converte entradas da inbox no formato das listagens do médico, com paciente e criador atuais."""
+    carregador = _pre_carregar_usuarios_dos_relatorios(db, docs)
+    return [_entrada_inbox_para_relatorio(carregador, doc) for doc in docs]
+
+
+def _entrada_inbox_para_relatorio(carregador: CarregadorDocumentos, doc) -> Dict:
+    """Converte a entrada da inbox no formato retornado pelas listagens do médico."""
+    data = doc.to_dict() or {}
+    data['id'] = doc.id
+    data.pop('atualizado_em', None)
+    # Entradas gravadas antes de reconstruir_inboxes_medicos ainda trazem cópias embutidas: ignoradas
+    data.pop('paciente', None)
+    data.pop('criado_por', None)
+
+    paciente_id, criado_por_id = data.get('paciente_id'), data.get('criado_por_id')
+    paciente_doc = carregador.carregar('usuarios', paciente_id)
+    if paciente_doc:
+        data['paciente'] = {
+            'id': paciente_id, **{campo: paciente_doc[campo] for campo in _CAMPOS_PACIENTE_INBOX if campo in paciente_doc}
+        }
+    criador_doc = carregador.carregar('usuarios', criado_por_id)
+    if criador_doc:
+        data['criado_por'] = {'id': criado_por_id, 'nome': criador_doc.get('nome'), 'email': criador_doc.get('email')}
+
+    paciente = data.get('paciente')
+    if paciente:
+        decrypt_document(paciente, {'nome': ERRO_DESCRIPTOGRAFIA, 'telefone': ERRO_DESCRIPTOGRAFIA})
+        if not paciente.get('nome'):
+            paciente['nome'] = "Nome não disponível"
+        if not paciente.get('telefone'):
+            paciente.pop('telefone', None)
+        paciente.setdefault('email', '')
+    elif data.get('paciente_id'):
+        data['paciente'] = {'id': data['paciente_id'], 'nome': 'Paciente não encontrado', 'email': ''}
+
+    criador = data.get('criado_por')
+    if criador:
+        # Nome/email de admins e enfermeiros podem não estar criptografados (mesma regra de _popular_criado_por)
+        for campo in ('nome', 'email'):
+            if criador.get(campo):
                 try:
-                    paciente_doc = db.collection('usuarios').document(paciente_id).get()
-                    if paciente_doc.exists:
-                        paciente_data = paciente_doc.to_dict()
-                        paciente_info = {
-                            'id': paciente_id,
-                            'email': paciente_data.get('email', '')
-                        }
-
-                        if 'nome' in paciente_data and paciente_data['nome']:
-                            try:
-                                paciente_info['nome'] = decrypt_data(paciente_data['nome'])
-                            except Exception as e:
-                                logger.error(f"Erro ao descriptografar nome do paciente {paciente_id}: {e}")
-                                paciente_info['nome'] = "[Erro na descriptografia]"
-                        else:
-                            paciente_info['nome'] = "Nome não disponível"
+                    criador[campo] = decrypt_data(criador[campo])
+                except Exception:
+                    pass
+        criador['nome'] = criador.get('nome') or 'Nome não disponível'
+        criador['email'] = criador.get('email') or ''
+    return data
 
-                        data['paciente'] = paciente_info
-                    else:
-                        data['paciente'] = {
-                            'id': paciente_id,
-                            'nome': 'Paciente não encontrado',
-                            'email': ''
-                        }
-                except Exception as e:
-                    logger.error(f"Erro ao buscar dados do paciente {paciente_id}: {e}")
-                    data['paciente'] = {
-                        'id': paciente_id,
-                        'nome': 'Erro ao carregar dados',
-                        'email': ''
-                    }
 
-            # Popula informações do criador (IGUAL AOS PENDENTES)
-            data = _popular_criado_por(db, data)
+def listar_inbox_medico(
+    db: firestore.client,
+    medico_id: str,
+    negocio_id: str,
+    status: List[str],
+    ordenar_por: str = 'data_criacao',
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Dict:
+    """
+    Lista relatórios da inbox do médico, do mais recente para o mais antigo.
 
-            relatorios.append(data)
+    Args:
+        status: Status incluídos (ex: ['pendente'] ou ['aprovado', 'recusado'])
+        ordenar_por: 'data_criacao' (pendentes) ou 'data_revisao' (histórico)
+        limit: Tamanho da página (None = todos)
+        cursor: Valor de 'proximo_cursor' retornado pela página anterior
 
-        # Ordenar por data de avaliação
-        relatorios.sort(key=lambda x: x.get('data_revisao', datetime.min), reverse=True)
-        return relatorios
+    Returns:
+        {"relatorios": [...], "proximo_cursor": str ou None quando não há mais páginas}
 
-    # Se tem filtro, executa query única
-    for doc in query.stream():
-        data = doc.to_dict()
-        data['id'] = doc.id
+    Raises:
+        ValueError: se o cursor for inválido
+    """
+    obter_contadores_inbox_medico(db, medico_id, negocio_id)
 
-        # Buscar dados do paciente (IGUAL AOS PENDENTES)
-        paciente_id = data.get('paciente_id')
-        if paciente_id:
-            try:
-                paciente_doc = db.collection('usuarios').document(paciente_id).get()
-                if paciente_doc.exists:
-                    paciente_data = paciente_doc.to_dict()
-                    paciente_info = {
-                        'id': paciente_id,
-                        'email': paciente_data.get('email', '')
-                    }
+    inbox_ref = _inbox_relatorios_ref(db, medico_id)
+    query = inbox_ref.where('negocio_id', '==', negocio_id)
+    query = query.where('status', '==', status[0]) if len(status) == 1 else query.where('status', 'in', status)
+    query = query\
+        .order_by(ordenar_por, direction=firestore.Query.DESCENDING)\
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
 
-                    if 'nome' in paciente_data and paciente_data['nome']:
-                        try:
-                            paciente_info['nome'] = decrypt_data(paciente_data['nome'])
-                        except Exception as e:
-                            logger.error(f"Erro ao descriptografar nome do paciente {paciente_id}: {e}")
-                            paciente_info['nome'] = "[Erro na descriptografia]"
-                    else:
-                        paciente_info['nome'] = "Nome não disponível"
+    if cursor:
+        valor, relatorio_id = _decodificar_cursor(cursor)
+        query = query.start_after({ordenar_por: valor, '__name__': inbox_ref.document(relatorio_id)})
 
-                    data['paciente'] = paciente_info
-                else:
-                    data['paciente'] = {
-                        'id': paciente_id,
-                        'nome': 'Paciente não encontrado',
-                        'email': ''
-                    }
-            except Exception as e:
-                logger.error(f"Erro ao buscar dados do paciente {paciente_id}: {e}")
-                data['paciente'] = {
-                    'id': paciente_id,
-                    'nome': 'Erro ao carregar dados',
-                    'email': ''
-                }
+    if limit is None:
+        return {"relatorios": _entradas_inbox_para_relatorios(db, list(query.stream())), "proximo_cursor": None}
 
-        # Popula informações do criador (IGUAL AOS PENDENTES)
-        data = _popular_criado_por(db, data)
+    # Busca um item a mais para saber se existe próxima página
+    docs = list(query.limit(limit + 1).stream())
+    tem_mais = len(docs) > limit
+    docs = docs[:limit]
 
-        relatorios.append(data)
+    proximo_cursor = None
+    if tem_mais and docs:
+        ultimo = docs[-1].to_dict() or {}
+        proximo_cursor = _codificar_cursor(ultimo.get(ordenar_por), docs[-1].id)
 
-    # Ordenar por data de avaliação
-    relatorios.sort(key=lambda x: x.get('data_revisao', datetime.min), reverse=True)
-    return relatorios
+    return {"relatorios": _entradas_inbox_para_relatorios(db, docs), "proximo_cursor": proximo_cursor}
 
 
 # =================================================================================
@@ -6138,6 +6417,7 @@ def atualizar_perfil_usuario(db: firestore.client, user_id: str, negocio_id: str
         
         # Executar atualização
         user_ref.update(update_dict)
+        invalidar_usuario(firebase_uid=firebase_uid, usuario_id=user_id)
         logger.info(f"Perfil do usuário {user_id} atualizado com sucesso")
         
         # Buscar dados atualizados
@@ -6154,34 +6434,7 @@ def atualizar_perfil_usuario(db: firestore.client, user_id: str, negocio_id: str
                 updated_data['firebase_uid'] = firebase_uid
         
         # Descriptografar dados para resposta
-        if 'nome' in updated_data and updated_data['nome']:
-            try:
-                updated_data['nome'] = decrypt_data(updated_data['nome'])
-            except Exception as e:
-                logger.error(f"Erro ao descriptografar nome: {e}")
-                updated_data['nome'] = "[Erro na descriptografia]"
-        
-        if 'telefone' in updated_data and updated_data['telefone']:
-            try:
-                updated_data['telefone'] = decrypt_data(updated_data['telefone'])
-            except Exception as e:
-                logger.error(f"Erro ao descriptografar telefone: {e}")
-                updated_data['telefone'] = "[Erro na descriptografia]"
-        
-        if 'endereco' in updated_data and updated_data['endereco']:
-            endereco_descriptografado = {}
-            for campo, valor in updated_data['endereco'].items():
-                if valor and isinstance(valor, str) and valor.strip():
-                    try:
-                        endereco_descriptografado[campo] = decrypt_data(valor)
-                    except Exception as e:
-                        logger.error(f"Erro ao descriptografar campo {campo} do endereço: {e}")
-                        endereco_descriptografado[campo] = "[Erro na descriptografia]"
-                else:
-                    endereco_descriptografado[campo] = valor
-            updated_data['endereco'] = endereco_descriptografado
-        
-        return updated_data
+        return decrypt_document(updated_data)
         
     except ValueError as ve:
         logger.warning(f"Erro de validação ao atualizar perfil do usuário {user_id}: {ve}")
@@ -6206,7 +6459,7 @@ def processar_imagem_base64(base64_data: str, user_id: str) -> Optional[str]:
         import base64
         import os
         from datetime import datetime
-        from google.cloud import storage
+        from cloud_storage import get_bucket
         
         # Validar formato Base64
         if not base64_data.startswith('data:image/'):
@@ -6235,8 +6488,7 @@ def processar_imagem_base64(base64_data: str, user_id: str) -> Optional[str]:
         
         try:
             # Tentar usar Google Cloud Storage
-            client = storage.Client()
-            bucket = client.bucket(bucket_name)
+            bucket = get_bucket(bucket_name)
             blob = bucket.blob(f"profiles/{filename}")
             
             # Upload da imagem
@@ -6336,9 +6588,16 @@ def listar_tarefas_por_paciente(db: firestore.client, paciente_id: str, status:
     now = datetime.now(timezone.utc)
     # --- FIM DA CORREÇÃO ---
     
-    user_cache = {}
+    docs = list(query.stream())
 
-    for doc in query.stream():
+    # Criadores e executores de todas as tarefas em uma única leitura em lote
+    perfis = get_carregador(db).perfis_usuarios(
+        id_usuario
+        for dados in (doc.to_dict() or {} for doc in docs)
+        for id_usuario in (dados.get("criadoPorId"), dados.get("executadoPorId"))
+    )
+
+    for doc in docs:
         data = doc.to_dict()
         data['id'] = doc.id
         
@@ -6362,18 +6621,9 @@ def listar_tarefas_por_paciente(db: firestore.client, paciente_id: str, status:
         
         # Enriquecer com dados do criador e executor
         for user_field, user_id in [("criadoPor", data.get("criadoPorId")), ("executadoPor", data.get("executadoPorId"))]:
-            if user_id:
-                if user_id not in user_cache:
-                    user_doc = db.collection('usuarios').document(user_id).get()
-                    if user_doc.exists:
-                        user_data = user_doc.to_dict()
-                        user_cache[user_id] = {
-                            "id": user_id,
-                            "nome": decrypt_data(user_data.get('nome','')),
-                            "email": user_data.get('email', '')
-                        }
-                if user_id in user_cache:
-                    data[user_field] = user_cache[user_id]
+            perfil = perfis.get(user_id) if user_id else None
+            if perfil:
+                data[user_field] = {"id": user_id, "nome": perfil.get('nome') or '', "email": perfil.get('email') or ''}
 
         tarefas.append(data)
         
@@ -6398,17 +6648,17 @@ def marcar_tarefa_como_concluida(db: firestore.client, tarefa_id: str, tecnico:
         "dataConclusao": datetime.utcnow(),
         "executadoPorId": tecnico.id
     }
-    tarefa_ref.update(update_data)
-    
-    # Atualiza o dicionário para a notificação
-    tarefa_data.update(update_data)
-    tarefa_data['id'] = tarefa_id
+    batch = db.batch()
+    batch.update(tarefa_ref, update_data)
 
-    # Dispara a notificação de conclusão
-    _notificar_tarefa_concluida(db, tarefa_data)
-    
     # Remove a verificação de atraso agendada
-    db.collection('tarefas_a_verificar').document(tarefa_id).delete()
+    batch.delete(db.collection('tarefas_a_verificar').document(tarefa_id))
+
+    evento_ref = registrar_evento(db, batch, 'TAREFA_CONCLUIDA', {'tarefa_id': tarefa_id})
+    batch.commit()
+
+    # Dispara a notificação de conclusão (fora da requisição)
+    despachar(db, evento_ref.id)
     
     # Retorna o documento completo e atualizado
     updated_doc = tarefa_ref.get().to_dict()
@@ -6421,151 +6671,93 @@ def marcar_tarefa_como_concluida(db: firestore.client, tarefa_id: str, tecnico:
 
 # SUBSTITUA ESTA FUNÇÃO INTEIRA EM crud.py
 
-def _notificar_medico_novo_relatorio(db: firestore.client, relatorio: Dict):
+def _notificar_medico_novo_relatorio(db: firestore.client, evento_id: str, relatorio: Dict):
     """Notifica o médico vinculado sobre um novo relatório pendente de avaliação."""
-    try:
-        medico_id = relatorio.get('medico_id')
-        paciente_id = relatorio.get('paciente_id')
-        criado_por_id = relatorio.get('criado_por_id')
+    medico_id = relatorio.get('medico_id')
+    paciente_id = relatorio.get('paciente_id')
+    criado_por_id = relatorio.get('criado_por_id')
 
-        if not medico_id:
-            logger.warning(f"Relatório {relatorio.get('id')} sem medico_id para notificar.")
-            return
+    if not medico_id:
+        logger.warning(f"Relatório {relatorio.get('id')} sem medico_id para notificar.")
+        return
 
-        medico_doc = db.collection('usuarios').document(medico_id).get()
-        if not medico_doc.exists:
-            logger.error(f"Médico {medico_id} não encontrado para notificação.")
-            return
-        medico_data = medico_doc.to_dict()
-        tokens_fcm = medico_data.get('fcm_tokens', [])
+    medico_doc = db.collection('usuarios').document(medico_id).get()
+    if not medico_doc.exists:
+        logger.error(f"Médico {medico_id} não encontrado para notificação.")
+        return
 
-        paciente_doc = db.collection('usuarios').document(paciente_id).get()
-        nome_paciente = decrypt_data(paciente_doc.to_dict().get('nome', '')) if paciente_doc.exists else "Paciente"
-        
-        criador_doc = db.collection('usuarios').document(criado_por_id).get()
-        nome_criador = decrypt_data(criador_doc.to_dict().get('nome', '')) if criador_doc.exists else "A equipe"
+    paciente_doc = db.collection('usuarios').document(paciente_id).get()
+    nome_paciente = decrypt_data(paciente_doc.to_dict().get('nome', '')) if paciente_doc.exists else "Paciente"
 
-        # CORREÇÃO DO TÍTULO E CORPO PARA SEGUIR O PADRÃO
-        titulo = "Novo Relatório para Avaliação"
-        corpo = f"{nome_criador} criou um novo relatório para o paciente {nome_paciente} que precisa da sua avaliação."
-        
-        data_payload = {
-            "tipo": "NOVO_RELATORIO_MEDICO",
-            "relatorio_id": relatorio.get('id', ''),
-            "paciente_id": str(paciente_id),
-        }
+    criador_doc = db.collection('usuarios').document(criado_por_id).get()
+    nome_criador = decrypt_data(criador_doc.to_dict().get('nome', '')) if criador_doc.exists else "A equipe"
 
-        db.collection('usuarios').document(medico_id).collection('notificacoes').add({
-            "title": titulo, "body": corpo, "tipo": "NOVO_RELATORIO_MEDICO",
-            "relacionado": { "relatorio_id": relatorio.get('id'), "paciente_id": paciente_id },
-            "lida": False, "data_criacao": firestore.SERVER_TIMESTAMP
-        })
+    # CORREÇÃO DO TÍTULO E CORPO PARA SEGUIR O PADRÃO
+    titulo = "Novo Relatório para Avaliação"
+    corpo = f"{nome_criador} criou um novo relatório para o paciente {nome_paciente} que precisa da sua avaliação."
 
-        if tokens_fcm:
-            # Gera tag webpush única
-            webpush_tag = f"NOVO_RELATORIO_MEDICO-relatorio-{relatorio.get('id', '')}-paciente-{paciente_id}"
+    data_payload = {
+        "tipo": "NOVO_RELATORIO_MEDICO",
+        "relatorio_id": relatorio.get('id', ''),
+        "paciente_id": str(paciente_id),
+    }
 
-            sucessos = 0
-            for token in tokens_fcm:
-                try:
-                    message = messaging.Message(
-                        notification=messaging.Notification(title=titulo, body=corpo),
-                        data=data_payload,
-                        token=token,
-                        webpush=messaging.WebpushConfig(
-                            notification=messaging.WebpushNotification(tag=webpush_tag)
-                        )
-                    )
-                    messaging.send(message)
-                    sucessos += 1
-                except Exception as e:
-                    logger.error(f"Erro ao enviar para o token {token[:10]}...: {e}")
-            logger.info(f"Notificação de NOVO relatório enviada. Sucessos: {sucessos}")
+    # Gera tag webpush única
+    webpush_tag = f"NOVO_RELATORIO_MEDICO-relatorio-{relatorio.get('id', '')}-paciente-{paciente_id}"
 
-    except Exception as e:
-        logger.error(f"Erro ao notificar médico sobre novo relatório: {e}")
+    _entregar_notificacao_evento(db, evento_id, medico_id, {
+        "title": titulo, "body": corpo, "tipo": "NOVO_RELATORIO_MEDICO",
+        "relacionado": {"relatorio_id": relatorio.get('id'), "paciente_id": paciente_id},
+    }, data_payload, webpush_tag, destinatario_data=medico_doc.to_dict())
+    logger.info(f"Notificação de NOVO relatório enviada ao médico {medico_id}")
 
 
-def _notificar_enfermeiro_novo_registro_diario(db: firestore.client, registro: Dict):
+def _notificar_enfermeiro_novo_registro_diario(db: firestore.client, evento_id: str, registro: Dict):
     """Notifica o enfermeiro responsável sobre um novo registro diário feito por um técnico."""
-    try:
-        paciente_id = registro.get('paciente_id')
-        tecnico_info = registro.get('tecnico', {})
-        tecnico_id = tecnico_info.get('id')
+    paciente_id = registro.get('paciente_id')
+    tecnico_info = registro.get('tecnico', {})
+    tecnico_id = tecnico_info.get('id')
 
-        if not paciente_id or not tecnico_id: return
+    if not paciente_id or not tecnico_id: return
 
-        paciente_doc = db.collection('usuarios').document(paciente_id).get()
-        if not paciente_doc.exists: return
-        paciente_data = paciente_doc.to_dict()
-        enfermeiro_id = paciente_data.get('enfermeiro_id')
-        nome_paciente = decrypt_data(paciente_data.get('nome', ''))
+    paciente_doc = db.collection('usuarios').document(paciente_id).get()
+    if not paciente_doc.exists: return
+    paciente_data = paciente_doc.to_dict()
+    enfermeiro_id = paciente_data.get('enfermeiro_id')
+    nome_paciente = decrypt_data(paciente_data.get('nome', ''))
 
-        if not enfermeiro_id: return
+    if not enfermeiro_id: return
 
-        enfermeiro_doc = db.collection('usuarios').document(enfermeiro_id).get()
-        if not enfermeiro_doc.exists: return
-        enfermeiro_data = enfermeiro_doc.to_dict()
-        tokens_fcm = enfermeiro_data.get('fcm_tokens', [])
-        
-        nome_tecnico = tecnico_info.get('nome', 'Um técnico')
+    enfermeiro_doc = db.collection('usuarios').document(enfermeiro_id).get()
+    if not enfermeiro_doc.exists: return
 
-        titulo = "Novo Registro no Diário"
-        corpo = f"{nome_tecnico} adicionou um novo registro no diário do paciente {nome_paciente}."
-        
-        data_payload = {
-            "tipo": "NOVO_REGISTRO_DIARIO",
-            "registro_id": registro.get('id', ''),
-            "paciente_id": paciente_id,
-        }
+    nome_tecnico = tecnico_info.get('nome', 'Um técnico')
 
-        db.collection('usuarios').document(enfermeiro_id).collection('notificacoes').add({
-            "title": titulo, "body": corpo, "tipo": "NOVO_REGISTRO_DIARIO",
-            "relacionado": { "registro_id": registro.get('id'), "paciente_id": paciente_id },
-            "lida": False, "data_criacao": firestore.SERVER_TIMESTAMP
-        })
+    titulo = "Novo Registro no Diário"
+    corpo = f"{nome_tecnico} adicionou um novo registro no diário do paciente {nome_paciente}."
 
-        if tokens_fcm:
-            # Gera tag webpush única
-            webpush_tag = f"NOVO_REGISTRO_DIARIO-registro-{registro.get('id', '')}-paciente-{paciente_id}"
+    data_payload = {
+        "tipo": "NOVO_REGISTRO_DIARIO",
+        "registro_id": registro.get('id', ''),
+        "paciente_id": paciente_id,
+    }
 
-            # PASSO 6: Enviar o push em loop
-            sucessos = 0
-            for token in tokens_fcm:
-                try:
-                    message = messaging.Message(
-                        notification=messaging.Notification(title=titulo, body=corpo),
-                        data=data_payload,
-                        token=token,
-                        webpush=messaging.WebpushConfig(
-                            notification=messaging.WebpushNotification(tag=webpush_tag)
-                        )
-                    )
-                    messaging.send(message)
-                    sucessos += 1
-                except Exception as e:
-                    logger.error(f"Erro ao enviar para o token {token[:10]}...: {e}")
-            logger.info(f"Notificação de novo registro diário enviada. Sucessos: {sucessos}")
+    # Gera tag webpush única
+    webpush_tag = f"NOVO_REGISTRO_DIARIO-registro-{registro.get('id', '')}-paciente-{paciente_id}"
 
-    except Exception as e:
-        logger.error(f"Erro ao notificar enfermeiro sobre novo registro diário: {e}")
+    _entregar_notificacao_evento(db, evento_id, enfermeiro_id, {
+        "title": titulo, "body": corpo, "tipo": "NOVO_REGISTRO_DIARIO",
+        "relacionado": {"registro_id": registro.get('id'), "paciente_id": paciente_id},
+    }, data_payload, webpush_tag, destinatario_data=enfermeiro_doc.to_dict())
+    logger.info(f"Notificação de novo registro diário enviada ao enfermeiro {enfermeiro_id}")
 
 def _buscar_admins_do_negocio(db: firestore.client, negocio_id: str) -> List[str]:
     """
     Busca todos os usuários com role 'admin' no negócio especificado.
     Retorna lista de IDs dos admins.
     """
-    admin_ids = []
     try:
-        usuarios_ref = db.collection('usuarios')
-        usuarios_docs = usuarios_ref.stream()
-
-        for usuario_doc in usuarios_docs:
-            usuario_data = usuario_doc.to_dict()
-            usuario_roles = usuario_data.get('roles', {})
-            if usuario_roles.get(negocio_id) == 'admin':
-                admin_ids.append(usuario_doc.id)
-
+        admin_ids = listar_membros_por_role(db, negocio_id, 'admin')
         logger.info(f"🔍 Encontrados {len(admin_ids)} admin(s) no negócio {negocio_id}")
         return admin_ids
 
@@ -6573,126 +6765,76 @@ def _buscar_admins_do_negocio(db: firestore.client, negocio_id: str) -> List[str
         logger.error(f"Erro ao buscar admins do negócio {negocio_id}: {e}")
         return []
 
-def _notificar_tarefa_concluida(db: firestore.client, tarefa: Dict):
+def _notificar_tarefa_concluida(db: firestore.client, evento_id: str, tarefa: Dict):
     """
     Notifica sobre conclusão de tarefa:
     - Criador da tarefa (quem criou)
     - Todos os admins do negócio
-    """
-    try:
-        criador_id = tarefa.get('criadoPorId')
-        tecnico_id = tarefa.get('executadoPorId')
-        paciente_id = tarefa.get('pacienteId')
-        negocio_id = tarefa.get('negocioId')
 
-        if not all([criador_id, tecnico_id, paciente_id, negocio_id]):
-            logger.warning("Dados insuficientes para notificar tarefa concluída.")
-            return
+    Raises:
+        RuntimeError: se algum destinatário não pôde ser notificado (o outbox tenta de novo)
+    """
+    criador_id = tarefa.get('criadoPorId')
+    tecnico_id = tarefa.get('executadoPorId')
+    paciente_id = tarefa.get('pacienteId')
+    negocio_id = tarefa.get('negocioId')
 
-        # Buscar nomes para a mensagem
-        tecnico_doc = db.collection('usuarios').document(tecnico_id).get()
-        nome_tecnico = decrypt_data(tecnico_doc.to_dict().get('nome', '')) if tecnico_doc.exists else "O técnico"
+    if not all([criador_id, tecnico_id, paciente_id, negocio_id]):
+        logger.warning("Dados insuficientes para notificar tarefa concluída.")
+        return
 
-        paciente_doc = db.collection('usuarios').document(paciente_id).get()
-        nome_paciente = decrypt_data(paciente_doc.to_dict().get('nome', '')) if paciente_doc.exists else "o paciente"
+    # Buscar nomes para a mensagem
+    tecnico_doc = db.collection('usuarios').document(tecnico_id).get()
+    nome_tecnico = decrypt_data(tecnico_doc.to_dict().get('nome', '')) if tecnico_doc.exists else "O técnico"
 
-        titulo = "Tarefa Concluída!"
-        corpo = f"{nome_tecnico} concluiu a tarefa '{tarefa.get('descricao', '')[:30]}...' para {nome_paciente}."
+    paciente_doc = db.collection('usuarios').document(paciente_id).get()
+    nome_paciente = decrypt_data(paciente_doc.to_dict().get('nome', '')) if paciente_doc.exists else "o paciente"
 
-        data_payload = {
-            "tipo": "TAREFA_CONCLUIDA",
-            "tarefa_id": tarefa.get('id', ''),
-            "paciente_id": paciente_id,
-        }
+    titulo = "Tarefa Concluída!"
+    corpo = f"{nome_tecnico} concluiu a tarefa '{tarefa.get('descricao', '')[:30]}...' para {nome_paciente}."
 
-        webpush_tag = f"TAREFA_CONCLUIDA-tarefa-{tarefa.get('id', '')}-paciente-{paciente_id}"
+    data_payload = {
+        "tipo": "TAREFA_CONCLUIDA",
+        "tarefa_id": tarefa.get('id', ''),
+        "paciente_id": paciente_id,
+    }
 
-        # Conjunto de destinatários (usa set para evitar duplicatas)
-        destinatarios = set()
+    webpush_tag = f"TAREFA_CONCLUIDA-tarefa-{tarefa.get('id', '')}-paciente-{paciente_id}"
 
-        # 1. SEMPRE adiciona o criador
-        destinatarios.add(criador_id)
-        logger.info(f"📧 TAREFA_CONCLUIDA: Adicionado criador: {criador_id}")
+    # Conjunto de destinatários (usa set para evitar duplicatas)
+    destinatarios = set()
 
-        # 2. SEMPRE adiciona todos os admins do negócio
-        admins = _buscar_admins_do_negocio(db, negocio_id)
-        for admin_id in admins:
-            destinatarios.add(admin_id)
-            logger.info(f"📧 TAREFA_CONCLUIDA: Adicionado admin: {admin_id}")
+    # 1. SEMPRE adiciona o criador
+    destinatarios.add(criador_id)
+    logger.info(f"📧 TAREFA_CONCLUIDA: Adicionado criador: {criador_id}")
 
-        # 3. Adiciona enfermeiro associado ao paciente (se existir)
-        if paciente_doc.exists:
-            paciente_data = paciente_doc.to_dict()
-            enfermeiro_id = paciente_data.get('enfermeiro_id')
-            if enfermeiro_id:
-                destinatarios.add(enfermeiro_id)
-                logger.info(f"📧 TAREFA_CONCLUIDA: Adicionado enfermeiro do paciente: {enfermeiro_id}")
+    # 2. SEMPRE adiciona todos os admins do negócio
+    admins = _buscar_admins_do_negocio(db, negocio_id)
+    for admin_id in admins:
+        destinatarios.add(admin_id)
+        logger.info(f"📧 TAREFA_CONCLUIDA: Adicionado admin: {admin_id}")
 
-        logger.info(f"📧 TAREFA_CONCLUIDA: Total de {len(destinatarios)} destinatário(s)")
-
-        # Enviar notificação para cada destinatário
-        for destinatario_id in destinatarios:
-            try:
-                # Persistir no Firestore
-                db.collection('usuarios').document(destinatario_id).collection('notificacoes').add({
-                    "title": titulo,
-                    "body": corpo,
-                    "tipo": "TAREFA_CONCLUIDA",
-                    "relacionado": {
-                        "tarefa_id": tarefa.get('id'),
-                        "paciente_id": paciente_id
-                    },
-                    "lida": False,
-                    "data_criacao": firestore.SERVER_TIMESTAMP
-                })
-
-                # Enviar push notification (FCM + APNs)
-                destinatario_doc = db.collection('usuarios').document(destinatario_id).get()
-                if destinatario_doc.exists:
-                    destinatario_data = destinatario_doc.to_dict()
-                    fcm_tokens = destinatario_data.get('fcm_tokens', [])
-                    apns_tokens = destinatario_data.get('apns_tokens', [])
-
-                    # Enviar FCM
-                    sucessos = 0
-                    for token in fcm_tokens:
-                        try:
-                            message = messaging.Message(
-                                notification=messaging.Notification(title=titulo, body=corpo),
-                                data=data_payload,
-                                token=token,
-                                webpush=messaging.WebpushConfig(
-                                    notification=messaging.WebpushNotification(tag=webpush_tag)
-                                )
-                            )
-                            messaging.send(message)
-                            sucessos += 1
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar FCM para {destinatario_id}: {e}")
-
-                    # Enviar APNs se houver tokens
-                    if apns_tokens:
-                        from notification_helper import enviar_notificacao_para_usuario
-                        try:
-                            enviar_notificacao_para_usuario(
-                                destinatario_data,
-                                titulo,
-                                corpo,
-                                data_payload,
-                                webpush_tag
-                            )
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar APNs para {destinatario_id}: {e}")
-
-                    logger.info(f"✅ Notificação TAREFA_CONCLUIDA enviada para: {destinatario_id} (FCM: {sucessos})")
+    # 3. Adiciona enfermeiro associado ao paciente (se existir)
+    if paciente_doc.exists:
+        paciente_data = paciente_doc.to_dict()
+        enfermeiro_id = paciente_data.get('enfermeiro_id')
+        if enfermeiro_id:
+            destinatarios.add(enfermeiro_id)
+            logger.info(f"📧 TAREFA_CONCLUIDA: Adicionado enfermeiro do paciente: {enfermeiro_id}")
 
-            except Exception as e:
-                logger.error(f"❌ Erro ao notificar {destinatario_id} sobre tarefa concluída: {e}")
+    logger.info(f"📧 TAREFA_CONCLUIDA: Total de {len(destinatarios)} destinatário(s)")
 
-        logger.info(f"🎉 Notificação TAREFA_CONCLUIDA concluída para tarefa {tarefa.get('id')}")
+    _entregar_notificacao_evento_a_todos(db, evento_id, destinatarios, {
+        "title": titulo,
+        "body": corpo,
+        "tipo": "TAREFA_CONCLUIDA",
+        "relacionado": {
+            "tarefa_id": tarefa.get('id'),
+            "paciente_id": paciente_id
+        },
+    }, data_payload, webpush_tag)
 
-    except Exception as e:
-        logger.error(f"Erro ao notificar tarefa concluída: {e}")
+    logger.info(f"🎉 Notificação TAREFA_CONCLUIDA concluída para tarefa {tarefa.get('id')}")
 
 def _notificar_tarefa_atrasada(db: firestore.client, tarefa_a_verificar: Dict):
     """
@@ -6774,36 +6916,19 @@ def _notificar_tarefa_atrasada(db: firestore.client, tarefa_a_verificar: Dict):
                     "dedupe_key": f"TAREFA_ATRASADA_{tarefa_id}_{destinatario_id}"
                 })
 
-                # PASSO 6: Enviar o Push em Loop (Método Funcional)
-                # Envio FCM
-                if fcm_tokens:
-                    sucessos_fcm = 0
-                    for token in fcm_tokens:
-                        try:
-                            message = messaging.Message(
-                                notification=messaging.Notification(title=titulo, body=corpo),
-                                data=data_payload,
-                                token=token,
-                                webpush=messaging.WebpushConfig(
-                                    notification=messaging.WebpushNotification(tag=webpush_tag)
-                                )
-                            )
-                            messaging.send(message)
-                            sucessos_fcm += 1
-                        except Exception as e:
-                            logger.error(f"Erro ao enviar FCM para {destinatario_id}: {e}")
-                    logger.info(f"✅ Notificação TAREFA_ATRASADA (FCM) enviada para: {destinatario_id} (Sucessos: {sucessos_fcm})")
-
-                # Envio APNs (CORRIGIDO PARA SEGUIR O PADRÃO)
-                if apns_tokens:
-                    from apns_service import get_apns_service
-                    apns_service = get_apns_service()
-                    sucessos_apns = 0
-                    if apns_service.enabled:
-                        for token in apns_tokens:
-                            if apns_service.send_notification(token=token, titulo=titulo, corpo=corpo, data_payload=data_payload):
-                                sucessos_apns += 1
-                        logger.info(f"✅ Notificação TAREFA_ATRASADA (APNs) enviada para: {destinatario_id} (Sucessos: {sucessos_apns})")
+                # PASSO 6: Enviar o Push (FCM em lote + APNs em paralelo)
+                if fcm_tokens or apns_tokens:
+                    from notification_helper import enviar_notificacao_hibrida
+                    envio = enviar_notificacao_hibrida(
+                        fcm_tokens=fcm_tokens,
+                        apns_tokens=apns_tokens,
+                        titulo=titulo,
+                        corpo=corpo,
+                        data_payload=data_payload,
+                        webpush_tag=webpush_tag
+                    )
+                    remover_tokens_invalidos_do_envio(db, destinatario_id, envio)
+                    logger.info(f"✅ Notificação TAREFA_ATRASADA enviada para: {destinatario_id} (FCM: {envio['fcm_sucessos']}, APNs: {envio['apns_sucessos']})")
 
             except Exception as e:
                 logger.error(f"❌ Erro ao notificar {destinatario_id} sobre tarefa atrasada: {e}")
@@ -6868,96 +6993,39 @@ def processar_tarefas_atrasadas(db: firestore.client) -> Dict:
 # NOVAS NOTIFICAÇÕES INSTANTÂNEAS (SETEMBRO 2025)
 # ================================================================================
 
-def _notificar_paciente_exame_criado(db: firestore.client, paciente_id: str, exame_data: Dict):
+def _notificar_paciente_exame_criado(db: firestore.client, evento_id: str, paciente_id: str, exame_data: Dict):
     """Notifica o paciente sobre um novo exame criado para ele."""
-    try:
-        paciente_doc_ref = db.collection('usuarios').document(paciente_id)
-        paciente_doc = paciente_doc_ref.get()
-
-        if not paciente_doc.exists:
-            logger.warning(f"Paciente {paciente_id} não encontrado para notificar exame criado.")
-            return
-
-        paciente_data = paciente_doc.to_dict()
-        fcm_tokens = paciente_data.get('fcm_tokens', [])
-        apns_tokens = paciente_data.get('apns_tokens', [])
-        nome_exame = exame_data.get('nome_exame', 'exame')
-
-        titulo = "Novo Exame Agendado"
-        corpo = f"Foi agendado o exame '{nome_exame}' para você."
+    paciente_doc = db.collection('usuarios').document(paciente_id).get()
 
-        exame_id = exame_data.get('id', 'novo_exame')
+    if not paciente_doc.exists:
+        logger.warning(f"Paciente {paciente_id} não encontrado para notificar exame criado.")
+        return
 
-        # Persistir no Firestore
-        paciente_doc_ref.collection('notificacoes').add({
-            "title": titulo,
-            "body": corpo,
-            "tipo": "EXAME_CRIADO",
-            "relacionado": {"exame_id": exame_id, "paciente_id": paciente_id},
-            "lida": False,
-            "data_criacao": firestore.SERVER_TIMESTAMP
-        })
-
-        data_payload = {
-            "tipo": "EXAME_CRIADO",
-            "exame_id": str(exame_id),
-            "paciente_id": paciente_id
-        }
+    nome_exame = exame_data.get('nome_exame', 'exame')
 
-        # Gera tag webpush única
-        webpush_tag = f"EXAME_CRIADO-exame-{exame_id}-paciente-{paciente_id}"
+    titulo = "Novo Exame Agendado"
+    corpo = f"Foi agendado o exame '{nome_exame}' para você."
 
-        # Enviar FCM
-        sucessos_fcm = 0
-        for token in fcm_tokens:
-            try:
-                message = messaging.Message(
-                    notification=messaging.Notification(title=titulo, body=corpo),
-                    data=data_payload,
-                    token=token,
-                    webpush=messaging.WebpushConfig(
-                        notification=messaging.WebpushNotification(tag=webpush_tag)
-                    )
-                )
-                messaging.send(message)
-                sucessos_fcm += 1
-            except Exception as e:
-                logger.error(f"Erro ao enviar FCM para paciente {paciente_id}: {e}")
+    exame_id = exame_data.get('id', 'novo_exame')
 
-        # Enviar APNs se houver tokens
-        if apns_tokens:
-            from notification_helper import enviar_notificacao_para_usuario
-            try:
-                enviar_notificacao_para_usuario(
-                    paciente_data,
-                    titulo,
-                    corpo,
-                    data_payload,
-                    webpush_tag
-                )
-                logger.info(f"APNs enviado para paciente {paciente_id} (EXAME_CRIADO)")
-            except Exception as e:
-                logger.error(f"Erro ao enviar APNs para paciente {paciente_id}: {e}")
+    data_payload = {
+        "tipo": "EXAME_CRIADO",
+        "exame_id": str(exame_id),
+        "paciente_id": paciente_id
+    }
 
-        logger.info(f"✅ Notificação EXAME_CRIADO enviada para paciente {paciente_id} (FCM: {sucessos_fcm}, APNs: {len(apns_tokens)})")
+    # Gera tag webpush única
+    webpush_tag = f"EXAME_CRIADO-exame-{exame_id}-paciente-{paciente_id}"
 
-        # Salva na coleção principal de notificações
-        negocio_id = exame_data.get('negocio_id', 'unknown')
-        salvar_notificacao_firestore(
-            db=db,
-            usuario_id=paciente_id,
-            negocio_id=negocio_id,
-            tipo='EXAME_CRIADO',
-            titulo=titulo,
-            mensagem=corpo,
-            relacionado={
-                'exame_id': exame_id,
-                'paciente_id': paciente_id
-            }
-        )
+    # Um único documento de histórico (antes era gravado duas vezes: .add e salvar_notificacao_firestore)
+    _entregar_notificacao_evento(db, evento_id, paciente_id, {
+        "title": titulo,
+        "body": corpo,
+        "tipo": "EXAME_CRIADO",
+        "relacionado": {"exame_id": exame_id, "paciente_id": paciente_id},
+    }, data_payload, webpush_tag, destinatario_data=paciente_doc.to_dict())
 
-    except Exception as e:
-        logger.error(f"❌ Erro ao notificar exame criado para paciente {paciente_id}: {e}")
+    logger.info(f"✅ Notificação EXAME_CRIADO enviada para paciente {paciente_id}")
 
 
 def _notificar_paciente_suporte_adicionado(db: firestore.client, paciente_id: str, suporte_data: Dict):
@@ -6995,35 +7063,131 @@ def _notificar_paciente_suporte_adicionado(db: firestore.client, paciente_id: st
             # Gera tag webpush única
             webpush_tag = f"SUPORTE_ADICIONADO-suporte-{suporte_id}-paciente-{paciente_id}"
 
-            # PASSO 6: Enviar o push em loop
-            sucessos = 0
-            for token in tokens_fcm:
-                try:
-                    message = messaging.Message(
-                        notification=messaging.Notification(title=titulo, body=mensagem_body),
-                        data=data_payload,
-                        token=token,
-                        webpush=messaging.WebpushConfig(
-                            notification=messaging.WebpushNotification(tag=webpush_tag)
-                        )
-                    )
-                    messaging.send(message)
-                    sucessos += 1
-                except Exception as e:
-                    logger.error(f"Erro ao enviar para o token {token[:10]}...: {e}")
-            logger.info(f"Notificação de suporte adicionado enviada. Sucessos: {sucessos}")
+            # PASSO 6: Enviar o push (em lote)
+            envio = _enviar_fcm_ao_usuario(db, paciente_id, tokens_fcm, titulo, mensagem_body, data_payload, webpush_tag)
+            logger.info(f"Notificação de suporte adicionado enviada. Sucessos: {envio['sucessos']}")
 
     except Exception as e:
         logger.error(f"Erro ao notificar suporte adicionado para paciente {paciente_id}: {e}")
 
 
+# ---------------------------------------------------------------------
+# FILA DE LEMBRETES DE EXAMES
+# ---------------------------------------------------------------------
+# Cada exame tem um documento em 'lembretes_exames/{paciente_id}_{exame_id}' com o
+# momento do lembrete já normalizado em UTC ('momento_lembrete'). A fila é mantida por
+# adicionar_exame / update_exame / delete_exame, e o job consulta apenas os lembretes
+# cuja hora cai na janela, em vez de varrer todos os usuários e todos os exames.
+
+LEMBRETES_EXAMES_COLLECTION = 'lembretes_exames'
+
+
+def _calcular_momento_lembrete_exame(data_exame_raw, horario_exame: Optional[str]) -> Optional[datetime]:
+    """
+    Calcula o momento (UTC) do lembrete de um exame:
+    - COM horário: 1h antes do horário marcado
+    - SEM horário: às 09:00 do dia do exame
+    O horário do exame está em horário local do Brasil (America/Sao_Paulo).
+    Retorna None se a data/horário forem inválidos.
+    """
+    if not data_exame_raw:
+        return None
+
+    # Converte data_exame para datetime se for string
+    if isinstance(data_exame_raw, str):
+        try:
+            data_exame = datetime.fromisoformat(data_exame_raw.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    else:
+        data_exame = data_exame_raw
+
+    brasil_tz = pytz.timezone('America/Sao_Paulo')
+    data_exame_naive = data_exame.replace(tzinfo=None)
+
+    if horario_exame:
+        try:
+            hora, minuto = map(int, horario_exame.split(':'))
+        except ValueError:
+            return None
+        momento_exame_brasil = brasil_tz.localize(data_exame_naive.replace(hour=hora, minute=minuto, second=0, microsecond=0))
+        return momento_exame_brasil.astimezone(timezone.utc) - timedelta(hours=1)
+
+    momento_09h_brasil = brasil_tz.localize(data_exame_naive.replace(hour=9, minute=0, second=0, microsecond=0))
+    return momento_09h_brasil.astimezone(timezone.utc)
+
+
+def _lembrete_exame_ref(db: firestore.client, paciente_id: str, exame_id: str):
+    return db.collection(LEMBRETES_EXAMES_COLLECTION).document(f"{paciente_id}_{exame_id}")
+
+
+def _montar_lembrete_exame(paciente_id: str, exame_id: str, exame_data: Dict, momento_lembrete: datetime) -> Dict:
+    return {
+        "paciente_id": paciente_id,
+        "exame_id": exame_id,
+        "negocio_id": exame_data.get('negocio_id'),
+        "nome_exame": exame_data.get('nome_exame', 'Exame'),
+        "horario_exame": exame_data.get('horario_exame') or '',
+        "momento_lembrete": momento_lembrete,
+    }
+
+
+def sincronizar_lembrete_exame(db: firestore.client, paciente_id: str, exame_id: str, exame_data: Dict):
+    """Cria/atualiza a entrada do exame na fila de lembretes (ou a remove se a data for inválida)."""
+    try:
+        momento_lembrete = _calcular_momento_lembrete_exame(exame_data.get('data_exame'), exame_data.get('horario_exame'))
+        lembrete_ref = _lembrete_exame_ref(db, paciente_id, exame_id)
+        if momento_lembrete is None:
+            logger.warning(f"⚠️ Exame {exame_id} sem data/horário válidos, removido da fila de lembretes")
+            lembrete_ref.delete()
+            return
+        lembrete_ref.set(_montar_lembrete_exame(paciente_id, exame_id, exame_data, momento_lembrete))
+    except Exception as e:
+        logger.error(f"❌ Erro ao sincronizar fila de lembretes do exame {exame_id}: {e}")
+
+
+def remover_lembrete_exame(db: firestore.client, paciente_id: str, exame_id: str):
+    """Remove o exame da fila de lembretes."""
+    try:
+        _lembrete_exame_ref(db, paciente_id, exame_id).delete()
+    except Exception as e:
+        logger.error(f"❌ Erro ao remover exame {exame_id} da fila de lembretes: {e}")
+
+
+def reconstruir_fila_lembretes_exames(db: firestore.client, dias: int = 60) -> Dict:
+    """
+    Backfill da fila de lembretes a partir dos exames já existentes.
+    Percorre todos os pacientes uma única vez; deve ser executado manualmente após o deploy.
+    """
+    stats = {"exames_verificados": 0, "lembretes_enfileirados": 0}
+    agora = datetime.now(timezone.utc)
+    limite = agora + timedelta(days=dias)
+
+    with EscritorEmLote(db, descricao="reconstruir_fila_lembretes_exames") as escritor:
+        for usuario_doc in db.collection('usuarios').select([]).stream():
+            for exame_doc in usuario_doc.reference.collection('exames').stream():
+                stats["exames_verificados"] += 1
+                exame_data = exame_doc.to_dict()
+                momento_lembrete = _calcular_momento_lembrete_exame(exame_data.get('data_exame'), exame_data.get('horario_exame'))
+                if momento_lembrete and agora <= momento_lembrete <= limite:
+                    escritor.set(
+                        _lembrete_exame_ref(db, usuario_doc.id, exame_doc.id),
+                        _montar_lembrete_exame(usuario_doc.id, exame_doc.id, exame_data, momento_lembrete)
+                    )
+                    stats["lembretes_enfileirados"] += 1
+
+    logger.info(f"📊 Fila de lembretes de exames reconstruída: {stats}")
+    return stats
+
+
 def processar_lembretes_exames(db: firestore.client) -> Dict:
     """
     Envia lembretes dinâmicos de exames:
     - COM horário: 1h antes do horário marcado
     - SEM horário: às 09:00 do dia do exame
 
-    Sistema roda a cada 15 minutos.
+    Sistema roda a cada 15 minutos e consulta apenas a fila 'lembretes_exames'
+    na janela de tempo atual.
     """
     stats = {"total_exames_verificados": 0, "total_lembretes_enviados": 0, "erros": 0}
 
@@ -7036,231 +7200,142 @@ def processar_lembretes_exames(db: firestore.client) -> Dict:
     logger.info(f"🔍 LEMBRETE_EXAME: Iniciando processamento. Agora={agora.isoformat()}, Janela={inicio_janela.isoformat()} até {fim_janela.isoformat()}")
 
     try:
-        usuarios_ref = db.collection('usuarios')
-        total_usuarios = 0
-        for usuario_doc in usuarios_ref.stream():
-            total_usuarios += 1
-            usuario_id = usuario_doc.id
-            usuario_data = usuario_doc.to_dict()
+        query = db.collection(LEMBRETES_EXAMES_COLLECTION)\
+            .where('momento_lembrete', '>=', inicio_janela)\
+            .where('momento_lembrete', '<', fim_janela)
+        lembretes = list(query.stream())
+        stats["total_exames_verificados"] = len(lembretes)
+
+        # Agrupa por paciente para ler cada documento de usuário uma única vez
+        lembretes_por_paciente: Dict[str, List[Dict]] = {}
+        for lembrete_doc in lembretes:
+            lembrete = lembrete_doc.to_dict()
+            lembretes_por_paciente.setdefault(lembrete['paciente_id'], []).append(lembrete)
+
+        for usuario_id, lembretes_paciente in lembretes_por_paciente.items():
+            usuario_doc = db.collection('usuarios').document(usuario_id).get()
+            if not usuario_doc.exists:
+                logger.warning(f"⚠️ Paciente {usuario_id} da fila de lembretes não encontrado")
+                continue
 
-            exames_ref = usuario_doc.reference.collection('exames')
-            # Busca TODOS os exames (não podemos usar query porque data_exame pode ser string)
-            todos_exames = list(exames_ref.stream())
+            usuario_data = usuario_doc.to_dict()
+            nome_paciente_raw = usuario_data.get('nome', '')
+            nome_paciente = decrypt_data(nome_paciente_raw) if nome_paciente_raw else "Paciente"
+            fcm_tokens = usuario_data.get('fcm_tokens', [])
 
-            # Filtra exames dos próximos 7 dias manualmente
-            hoje_inicio = agora.replace(hour=0, minute=0, second=0, microsecond=0)
-            proximos_dias = hoje_inicio + timedelta(days=7)
+            logger.info(f"📋 Usuario {usuario_id}: {len(lembretes_paciente)} lembrete(s) de exame na janela")
 
-            exames = []
-            for exam_doc in todos_exames:
-                exam_data_dict = exam_doc.to_dict()
-                data_exame_raw = exam_data_dict.get('data_exame')
+            for lembrete in lembretes_paciente:
+                exame_id = lembrete['exame_id']
+                try:
+                    horario_exame = lembrete.get('horario_exame', '')
+                    nome_exame = lembrete.get('nome_exame', 'Exame')
+                    momento_lembrete = lembrete['momento_lembrete']
 
-                if not data_exame_raw:
-                    continue
+                    # ID único para evitar duplicatas
+                    notificacao_id = f"LEMBRETE_EXAME:{exame_id}:{momento_lembrete.strftime('%Y%m%d%H%M')}"
+                    notificacao_doc_ref = usuario_doc.reference.collection('notificacoes').document(notificacao_id)
 
-                # Converte para datetime se for string
-                if isinstance(data_exame_raw, str):
-                    try:
-                        # Tenta parsear ISO format: "2025-10-11T00:00:00"
-                        data_exame_dt = datetime.fromisoformat(data_exame_raw.replace('Z', '+00:00'))
-                        if data_exame_dt.tzinfo is None:
-                            data_exame_dt = data_exame_dt.replace(tzinfo=timezone.utc)
-                    except:
-                        logger.warning(f"⚠️ Formato de data inválido no exame {exam_doc.id}: {data_exame_raw}")
+                    if notificacao_doc_ref.get().exists:
                         continue
-                else:
-                    # Já é timestamp
-                    data_exame_dt = data_exame_raw
-                    if data_exame_dt.tzinfo is None:
-                        data_exame_dt = data_exame_dt.replace(tzinfo=timezone.utc)
 
-                # Verifica se está na janela de 7 dias
-                if hoje_inicio <= data_exame_dt <= proximos_dias:
-                    exames.append(exam_doc)
+                    # Monta mensagem
+                    if horario_exame:
+                        corpo = f"Olá, {nome_paciente}! Você tem o exame '{nome_exame}' marcado para hoje às {horario_exame}."
+                    else:
+                        corpo = f"Olá, {nome_paciente}! Você tem o exame '{nome_exame}' marcado para hoje."
 
-            stats["total_exames_verificados"] += len(exames)
+                    titulo = "Lembrete de Exame"
 
-            if len(exames) > 0:
-                logger.info(f"📋 Usuario {usuario_id}: {len(exames)} exame(s) encontrado(s) nos próximos 7 dias")
+                    data_payload = {
+                        "tipo": "LEMBRETE_EXAME",
+                        "exame_id": exame_id,
+                        "paciente_id": usuario_id
+                    }
 
-            if exames:
-                nome_paciente_raw = usuario_data.get('nome', '')
-                nome_paciente = decrypt_data(nome_paciente_raw) if nome_paciente_raw else "Paciente"
-                fcm_tokens = usuario_data.get('fcm_tokens', [])
-                apns_tokens = usuario_data.get('apns_tokens', [])
+                    webpush_tag = f"LEMBRETE_EXAME-exame-{exame_id}-paciente-{usuario_id}"
 
-                for exame_doc in exames:
-                    try:
-                        exame_data = exame_doc.to_dict()
-                        data_exame_raw = exame_data.get('data_exame')
-                        horario_exame = exame_data.get('horario_exame', '')
-                        nome_exame = exame_data.get('nome_exame', 'Exame')
+                    # Persistir no Firestore
+                    notificacao_doc_ref.set({
+                        "title": titulo,
+                        "body": corpo,
+                        "tipo": "LEMBRETE_EXAME",
+                        "relacionado": {"exame_id": exame_id, "paciente_id": usuario_id},
+                        "lida": False,
+                        "data_criacao": firestore.SERVER_TIMESTAMP
+                    })
 
-                        if not data_exame_raw:
-                            logger.warning(f"⚠️ Exame {exame_doc.id} sem data_exame, pulando")
-                            continue
+                    # Sistema híbrido com retry: VAPID → FCM fallback
+                    enviado_com_sucesso = False
+                    webpush_subscription = usuario_data.get('webpush_subscription_exames')
 
-                        # Converte data_exame para datetime se for string
-                        if isinstance(data_exame_raw, str):
-                            try:
-                                data_exame = datetime.fromisoformat(data_exame_raw.replace('Z', '+00:00'))
-                                if data_exame.tzinfo is None:
-                                    data_exame = data_exame.replace(tzinfo=timezone.utc)
-                            except Exception as e:
-                                logger.warning(f"⚠️ Formato de data inválido no exame {exame_doc.id}: {data_exame_raw} - {e}")
-                                continue
-                        else:
-                            data_exame = data_exame_raw
-                            if data_exame.tzinfo is None:
-                                data_exame = data_exame.replace(tzinfo=timezone.utc)
+                    # 1. Tentar VAPID primeiro
+                    if webpush_subscription:
+                        try:
+                            from pywebpush import webpush, WebPushException
+                            from vapid_config import VAPID_PRIVATE_KEY, VAPID_CLAIMS_EMAIL
+                            import json
+
+                            # Montar payload da notificação
+                            payload = json.dumps({
+                                "title": titulo,
+                                "body": corpo,
+                                "data": data_payload,
+                                "tag": webpush_tag
+                            })
+
+                            # Enviar Web Push
+                            webpush(
+                                subscription_info={
+                                    "endpoint": webpush_subscription["endpoint"],
+                                    "keys": webpush_subscription["keys"]
+                                },
+                                data=payload,
+                                vapid_private_key=VAPID_PRIVATE_KEY,
+                                vapid_claims={"sub": VAPID_CLAIMS_EMAIL}
+                            )
 
-                        # Calcula o horário de envio do lembrete
-                        # IMPORTANTE: horario_exame está em horário local do Brasil (UTC-3)
-                        brasil_tz = pytz.timezone('America/Sao_Paulo')
+                            enviado_com_sucesso = True
+                            stats["total_lembretes_enviados"] += 1
+                            logger.info(f"✅ LEMBRETE_EXAME enviado via VAPID para {usuario_id}")
+
+                        except WebPushException as e:
+                            logger.warning(f"⚠️ Falha VAPID para {usuario_id}: {e}")
+                            # Se erro 403/410, subscription inválida - remover e tentar FCM
+                            if e.response and e.response.status_code in [403, 410]:
+                                logger.warning(f"⚠️ Subscription VAPID inválida/expirada, removendo e tentando FCM...")
+                                usuario_doc.reference.update({
+                                    "webpush_subscription_exames": firestore.DELETE_FIELD
+                                })
+                                usuario_data.pop('webpush_subscription_exames', None)
+                        except Exception as e:
+                            logger.warning(f"⚠️ Erro Web Push para {usuario_id}: {e}, tentando FCM...")
 
-                        if horario_exame:
-                            # COM horário: envia 1h antes
+                    # 2. Fallback para FCM se VAPID falhou ou não existe
+                    if not enviado_com_sucesso:
+                        if fcm_tokens:
                             try:
-                                hora, minuto = map(int, horario_exame.split(':'))
-
-                                # Cria datetime no timezone do Brasil
-                                data_exame_naive = data_exame.replace(tzinfo=None)
-                                momento_exame_brasil = brasil_tz.localize(data_exame_naive.replace(hour=hora, minute=minuto, second=0, microsecond=0))
-
-                                # Converte para UTC
-                                momento_exame_utc = momento_exame_brasil.astimezone(timezone.utc)
-                                momento_lembrete = momento_exame_utc - timedelta(hours=1)
+                                # Todos os dispositivos do paciente numa chamada em lote
+                                envio = _enviar_fcm_ao_usuario(
+                                    db, usuario_id, fcm_tokens, titulo, corpo, data_payload,
+                                    logger_prefix="[LEMBRETE_EXAME] "
+                                )
+                                enviado_com_sucesso = envio['sucessos'] > 0
 
-                                logger.info(f"⏰ Exame {exame_doc.id} COM horário: {horario_exame} (Brasil). Exame em UTC: {momento_exame_utc.isoformat()}. Lembrete: {momento_lembrete.isoformat()}")
+                                if enviado_com_sucesso:
+                                    stats["total_lembretes_enviados"] += 1
+                                    logger.info(f"✅ LEMBRETE_EXAME enviado via FCM para {usuario_id}")
                             except Exception as e:
-                                logger.warning(f"⚠️ Horário inválido '{horario_exame}' para exame {exame_doc.id}: {e}")
-                                continue
+                                logger.error(f"❌ Erro FCM para {usuario_id}: {e}")
                         else:
-                            # SEM horário: envia às 09:00 do dia do exame (horário do Brasil)
-                            data_exame_naive = data_exame.replace(tzinfo=None)
-                            momento_09h_brasil = brasil_tz.localize(data_exame_naive.replace(hour=9, minute=0, second=0, microsecond=0))
-                            momento_lembrete = momento_09h_brasil.astimezone(timezone.utc)
-                            logger.info(f"⏰ Exame {exame_doc.id} SEM horário. Lembrete calculado para: {momento_lembrete.isoformat()}")
-
-                        # Verifica se está na janela de tempo para enviar
-                        esta_na_janela = inicio_janela <= momento_lembrete < fim_janela
-                        logger.info(f"🎯 Exame {exame_doc.id}: Na janela? {esta_na_janela} (momento_lembrete={momento_lembrete.isoformat()})")
-
-                        if esta_na_janela:
-                            # ID único para evitar duplicatas
-                            notificacao_id = f"LEMBRETE_EXAME:{exame_doc.id}:{momento_lembrete.strftime('%Y%m%d%H%M')}"
-                            notificacao_doc_ref = usuario_doc.reference.collection('notificacoes').document(notificacao_id)
-
-                            if not notificacao_doc_ref.get().exists:
-                                # Monta mensagem
-                                if horario_exame:
-                                    corpo = f"Olá, {nome_paciente}! Você tem o exame '{nome_exame}' marcado para hoje às {horario_exame}."
-                                else:
-                                    corpo = f"Olá, {nome_paciente}! Você tem o exame '{nome_exame}' marcado para hoje."
-
-                                titulo = "Lembrete de Exame"
-
-                                data_payload = {
-                                    "tipo": "LEMBRETE_EXAME",
-                                    "exame_id": exame_doc.id,
-                                    "paciente_id": usuario_id
-                                }
-
-                                webpush_tag = f"LEMBRETE_EXAME-exame-{exame_doc.id}-paciente-{usuario_id}"
-
-                                # Persistir no Firestore
-                                notificacao_doc_ref.set({
-                                    "title": titulo,
-                                    "body": corpo,
-                                    "tipo": "LEMBRETE_EXAME",
-                                    "relacionado": {"exame_id": exame_doc.id, "paciente_id": usuario_id},
-                                    "lida": False,
-                                    "data_criacao": firestore.SERVER_TIMESTAMP
-                                })
+                            logger.warning(f"⚠️ Usuário {usuario_id} sem VAPID e sem FCM tokens")
 
-                                # Sistema híbrido com retry: VAPID → FCM fallback
-                                enviado_com_sucesso = False
-                                webpush_subscription = usuario_data.get('webpush_subscription_exames')
-
-                                # 1. Tentar VAPID primeiro
-                                if webpush_subscription:
-                                    try:
-                                        from pywebpush import webpush, WebPushException
-                                        from vapid_config import VAPID_PRIVATE_KEY, VAPID_CLAIMS_EMAIL
-                                        import json
-
-                                        # Montar payload da notificação
-                                        payload = json.dumps({
-                                            "title": titulo,
-                                            "body": corpo,
-                                            "data": data_payload,
-                                            "tag": webpush_tag
-                                        })
-
-                                        # Enviar Web Push
-                                        webpush(
-                                            subscription_info={
-                                                "endpoint": webpush_subscription["endpoint"],
-                                                "keys": webpush_subscription["keys"]
-                                            },
-                                            data=payload,
-                                            vapid_private_key=VAPID_PRIVATE_KEY,
-                                            vapid_claims={"sub": VAPID_CLAIMS_EMAIL}
-                                        )
-
-                                        enviado_com_sucesso = True
-                                        stats["total_lembretes_enviados"] += 1
-                                        logger.info(f"✅ LEMBRETE_EXAME enviado via VAPID para {usuario_id}")
-
-                                    except WebPushException as e:
-                                        logger.warning(f"⚠️ Falha VAPID para {usuario_id}: {e}")
-                                        # Se erro 403/410, subscription inválida - remover e tentar FCM
-                                        if e.response and e.response.status_code in [403, 410]:
-                                            logger.warning(f"⚠️ Subscription VAPID inválida/expirada, removendo e tentando FCM...")
-                                            usuario_doc.reference.update({
-                                                "webpush_subscription_exames": firestore.DELETE_FIELD
-                                            })
-                                    except Exception as e:
-                                        logger.warning(f"⚠️ Erro Web Push para {usuario_id}: {e}, tentando FCM...")
-
-                                # 2. Fallback para FCM se VAPID falhou ou não existe
-                                if not enviado_com_sucesso:
-                                    if fcm_tokens:
-                                        try:
-                                            from firebase_admin import messaging
-
-                                            for token in fcm_tokens:
-                                                try:
-                                                    message = messaging.Message(
-                                                        notification=messaging.Notification(
-                                                            title=titulo,
-                                                            body=corpo
-                                                        ),
-                                                        data=data_payload,
-                                                        token=token
-                                                    )
-                                                    messaging.send(message)
-                                                    enviado_com_sucesso = True
-                                                    logger.info(f"✅ LEMBRETE_EXAME enviado via FCM para {usuario_id}")
-                                                    break  # Sucesso, não precisa tentar outros tokens
-                                                except Exception as token_error:
-                                                    logger.warning(f"⚠️ Falha FCM token {token[:10]}... : {token_error}")
-                                                    continue
-
-                                            if enviado_com_sucesso:
-                                                stats["total_lembretes_enviados"] += 1
-                                        except Exception as e:
-                                            logger.error(f"❌ Erro FCM para {usuario_id}: {e}")
-                                    else:
-                                        logger.warning(f"⚠️ Usuário {usuario_id} sem VAPID e sem FCM tokens")
-
-                                if not enviado_com_sucesso:
-                                    logger.error(f"❌ FALHA TOTAL: Não foi possível enviar LEMBRETE_EXAME para {usuario_id}")
+                    if not enviado_com_sucesso:
+                        logger.error(f"❌ FALHA TOTAL: Não foi possível enviar LEMBRETE_EXAME para {usuario_id}")
 
-                    except Exception as e:
-                        stats["erros"] += 1
-                        logger.error(f"❌ Erro ao processar lembrete para exame {exame_doc.id}: {e}")
+                except Exception as e:
+                    stats["erros"] += 1
+                    logger.error(f"❌ Erro ao processar lembrete para exame {exame_id}: {e}")
 
     except Exception as e:
         stats["erros"] += 1
@@ -7270,117 +7345,108 @@ def processar_lembretes_exames(db: firestore.client) -> Dict:
     return stats
 
 
-def processar_notificacoes_agendadas(db: firestore.client, now: datetime) -> dict:
+def _entregar_notificacao_agendada(db: firestore.client, notificacao_id: str, notif_data: Dict):
     """
-    Processa notificações agendadas que estão prontas para serem enviadas.
+    Entrega uma notificação agendada reivindicada pelo despachante
+    (notificacoes_agendadas.py): histórico do paciente e push (Web Push VAPID,
+    com FCM como fallback). Lança exceção para o despachante tentar de novo.
     """
-    stats = {
-        "notificacoes_verificadas": 0,
-        "notificacoes_enviadas": 0,
-        "notificacoes_erro": 0
-    }
-    try:
-        notificacoes_ref = db.collection('notificacoes_agendadas')
-        query = notificacoes_ref.where('status', '==', 'agendada').where('data_agendamento', '<=', now)
-        notificacoes_pendentes = list(query.stream())
-        stats["notificacoes_verificadas"] = len(notificacoes_pendentes)
+    paciente_id = notif_data.get('paciente_id')
+    titulo = notif_data.get('titulo')
+    mensagem = notif_data.get('mensagem')
+
+    if not paciente_id:
+        raise EntregaImpossivel("Notificação sem paciente_id")
+
+    paciente_doc = db.collection('usuarios').document(paciente_id).get()
+    if not paciente_doc.exists:
+        raise EntregaImpossivel("Paciente não encontrado")
+
+    paciente_data = paciente_doc.to_dict()
+    tokens_fcm = paciente_data.get('fcm_tokens', [])
+
+    # ID fixo: uma nova tentativa regrava o mesmo item do histórico em vez de duplicá-lo
+    paciente_doc.reference.collection('notificacoes').document(f"AGENDADA_{notificacao_id}").set({
+        "title": titulo,
+        "body": mensagem,
+        "tipo": "LEMBRETE_AGENDADO",
+        "relacionado": {"notificacao_agendada_id": notificacao_id},
+        "lida": False,
+        "data_criacao": firestore.SERVER_TIMESTAMP
+    })
 
-        for doc_notificacao in notificacoes_pendentes:
-            try:
-                notif_data = doc_notificacao.to_dict()
-                paciente_id = notif_data.get('paciente_id')
-                titulo = notif_data.get('titulo')
-                mensagem = notif_data.get('mensagem')
+    # HÍBRIDO: Tenta Web Push VAPID primeiro, depois FCM como fallback
+    data_payload = {"tipo": "LEMBRETE_AGENDADO", "notificacao_agendada_id": notificacao_id}
+    webpush_tag = f"LEMBRETE_AGENDADO-notificacao-{notificacao_id}-paciente-{paciente_id}"
 
-                if not paciente_id:
-                    continue
+    # 1. Tentar Web Push VAPID
+    webpush_subscription = paciente_data.get('webpush_subscription_exames')
+    if webpush_subscription:
+        try:
+            from pywebpush import webpush, WebPushException
+            from vapid_config import VAPID_PRIVATE_KEY, VAPID_CLAIMS_EMAIL
+            import json
+
+            payload = json.dumps({
+                "title": titulo,
+                "body": mensagem,
+                "data": data_payload,
+                "tag": webpush_tag
+            })
 
-                paciente_doc = db.collection('usuarios').document(paciente_id).get()
-                if not paciente_doc.exists:
-                    doc_notificacao.reference.update({"status": "erro", "erro": "Paciente não encontrado"})
-                    stats["notificacoes_erro"] += 1
-                    continue
+            webpush(
+                subscription_info={
+                    "endpoint": webpush_subscription["endpoint"],
+                    "keys": webpush_subscription["keys"]
+                },
+                data=payload,
+                vapid_private_key=VAPID_PRIVATE_KEY,
+                vapid_claims={"sub": VAPID_CLAIMS_EMAIL}
+            )
+            logger.info("✅ LEMBRETE_AGENDADO enviado via Web Push para %s", paciente_id)
+            return
 
-                paciente_data = paciente_doc.to_dict()
-                tokens_fcm = paciente_data.get('fcm_tokens', [])
+        except WebPushException as e:
+            logger.warning("⚠️ Falha VAPID para %s: %s, tentando FCM...", paciente_id, e)
+            if e.response and e.response.status_code in [403, 410]:
+                logger.warning("⚠️ Subscription VAPID inválida/expirada, removendo...")
+                paciente_doc.reference.update({"webpush_subscription_exames": firestore.DELETE_FIELD})
+        except Exception as e:
+            logger.warning("⚠️ Erro Web Push para %s: %s, tentando FCM...", paciente_id, e)
 
-                db.collection('usuarios').document(paciente_id).collection('notificacoes').add({
-                    "title": titulo,
-                    "body": mensagem,
-                    "tipo": "LEMBRETE_AGENDADO",
-                    "relacionado": {"notificacao_agendada_id": doc_notificacao.id},
-                    "lida": False,
-                    "data_criacao": firestore.SERVER_TIMESTAMP
-                })
+    # 2. Fallback: FCM (se VAPID não enviou), todos os tokens numa chamada em lote
+    if not tokens_fcm:
+        return
 
-                # HÍBRIDO: Tenta Web Push VAPID primeiro, depois FCM como fallback
-                data_payload = {"tipo": "LEMBRETE_AGENDADO", "notificacao_agendada_id": doc_notificacao.id}
-                webpush_tag = f"LEMBRETE_AGENDADO-notificacao-{doc_notificacao.id}-paciente-{paciente_id}"
-                enviado_vapid = False
+    from notification_helper import enviar_fcm_em_lote
 
-                # 1. Tentar Web Push VAPID
-                webpush_subscription = paciente_data.get('webpush_subscription_exames')
-                if webpush_subscription:
-                    try:
-                        from pywebpush import webpush, WebPushException
-                        from vapid_config import VAPID_PRIVATE_KEY, VAPID_CLAIMS_EMAIL
-                        import json
-
-                        payload = json.dumps({
-                            "title": titulo,
-                            "body": mensagem,
-                            "data": data_payload,
-                            "tag": webpush_tag
-                        })
-
-                        webpush(
-                            subscription_info={
-                                "endpoint": webpush_subscription["endpoint"],
-                                "keys": webpush_subscription["keys"]
-                            },
-                            data=payload,
-                            vapid_private_key=VAPID_PRIVATE_KEY,
-                            vapid_claims={"sub": VAPID_CLAIMS_EMAIL}
-                        )
-
-                        enviado_vapid = True
-                        logger.info(f"✅ LEMBRETE_AGENDADO enviado via Web Push para {paciente_id}")
-
-                    except WebPushException as e:
-                        logger.warning(f"⚠️ Falha VAPID para {paciente_id}: {e}, tentando FCM...")
-                        if e.response and e.response.status_code in [403, 410]:
-                            logger.warning(f"⚠️ Subscription VAPID inválida/expirada, removendo...")
-                            paciente_doc.reference.update({"webpush_subscription_exames": firestore.DELETE_FIELD})
-                    except Exception as e:
-                        logger.warning(f"⚠️ Erro Web Push para {paciente_id}: {e}, tentando FCM...")
+    resultado = enviar_fcm_em_lote(
+        tokens=tokens_fcm,
+        titulo=titulo,
+        corpo=mensagem,
+        data_payload=data_payload,
+        webpush_tag=webpush_tag,
+        logger_prefix="[LEMBRETE_AGENDADO] "
+    )
+    if resultado["tokens_invalidos"]:
+        remover_fcm_tokens_invalidos(db, paciente_id, resultado["tokens_invalidos"])
 
-                # 2. Fallback: FCM (se VAPID não enviou)
-                if not enviado_vapid and tokens_fcm:
-                    for token in tokens_fcm:
-                        try:
-                            message = messaging.Message(
-                                notification=messaging.Notification(title=titulo, body=mensagem),
-                                data=data_payload,
-                                token=token,
-                                webpush=messaging.WebpushConfig(
-                                    notification=messaging.WebpushNotification(tag=webpush_tag)
-                                )
-                            )
-                            messaging.send(message)
-                            logger.info(f"✅ LEMBRETE_AGENDADO enviado via FCM para {paciente_id}")
-                        except Exception as send_error:
-                            logger.error(f"Erro ao enviar FCM para token {token[:10]}...: {send_error}")
+    # Sem nenhuma entrega e com falhas que não são de token inválido: vale tentar de novo
+    if not resultado["sucessos"] and resultado["falhas"] > len(resultado["tokens_invalidos"]):
+        raise RuntimeError(f"Falha no envio FCM para {resultado['falhas']} token(s)")
+    logger.info("✅ LEMBRETE_AGENDADO enviado via FCM para %s: %d sucesso(s)", paciente_id, resultado["sucessos"])
 
-                doc_notificacao.reference.update({"status": "enviada", "data_envio": firestore.SERVER_TIMESTAMP})
-                stats["notificacoes_enviadas"] += 1
 
-            except Exception as e:
-                stats["notificacoes_erro"] += 1
-                doc_notificacao.reference.update({"status": "erro", "erro": str(e)})
+def processar_notificacoes_agendadas(db: firestore.client, now: datetime) -> dict:
+    """
+    Processa notificações agendadas que estão prontas para serem enviadas.
+    O despacho (lease, concorrência, novas tentativas) fica em notificacoes_agendadas.py.
+    """
+    try:
+        return processar_vencidas(db, now, _entregar_notificacao_agendada)
     except Exception as e:
-        stats["notificacoes_erro"] += 1
         logger.error(f"Erro geral no processamento de notificações agendadas: {e}")
-    return stats
+        return {"notificacoes_verificadas": 0, "notificacoes_enviadas": 0, "notificacoes_erro": 1}
 
 def verificar_disponibilidade_profissionais(db: firestore.client) -> Dict:
     """
@@ -7403,100 +7469,232 @@ def _enviar_alerta_ausencia(db: firestore.client, negocio_id: str, tipo_alerta:
 def get_usuario_por_id(db: firestore.client, usuario_id: str) -> Optional[Dict]:
     """
     Busca um usuário pelo seu ID de documento do Firestore e descriptografa os dados.
+    Consulta primeiro o mapa de identidade da requisição (ex: o paciente já lido
+    por get_paciente_autorizado) e descriptografa uma vez por requisição.
     """
     try:
-        usuario_ref = db.collection('usuarios').document(usuario_id)
-        usuario_doc = usuario_ref.get()
+        return get_carregador(db).visao(
+            'usuarios', usuario_id, 'completo',
+            lambda doc_id, dados: _montar_usuario_completo(db, doc_id, dados)
+        )
+    except Exception as e:
+        logger.error(f"Erro ao buscar usuário por ID {usuario_id}: {e}")
+        return None
 
-        if not usuario_doc.exists:
-            return None
 
-        usuario_data = usuario_doc.to_dict()
-        usuario_data['id'] = usuario_doc.id
+def _montar_usuario_completo(db: firestore.client, usuario_id: str, usuario_data: Dict) -> Dict:
+    """Descriptografa o documento do usuário e resolve a URL da imagem de perfil."""
+    usuario_data['id'] = usuario_id
 
-        # Descriptografar dados sensíveis
-        if 'nome' in usuario_data and usuario_data['nome']:
-            try:
-                usuario_data['nome'] = decrypt_data(usuario_data['nome'])
-            except Exception:
-                usuario_data['nome'] = "[Erro na descriptografia]"
+    # Descriptografar dados sensíveis
+    if 'nome' in usuario_data and usuario_data['nome']:
+        try:
+            usuario_data['nome'] = decrypt_data(usuario_data['nome'])
+        except Exception:
+            usuario_data['nome'] = "[Erro na descriptografia]"
 
-        # Descriptografar telefone
-        if 'telefone' in usuario_data and usuario_data['telefone']:
-            try:
-                usuario_data['telefone'] = decrypt_data(usuario_data['telefone'])
-            except Exception:
-                usuario_data['telefone'] = None
+    # Descriptografar telefone
+    if 'telefone' in usuario_data and usuario_data['telefone']:
+        try:
+            usuario_data['telefone'] = decrypt_data(usuario_data['telefone'])
+        except Exception:
+            usuario_data['telefone'] = None
 
-        # Descriptografar endereço
-        if 'endereco' in usuario_data and usuario_data['endereco']:
-            try:
-                endereco_descriptografado = {}
-                for k, v in usuario_data['endereco'].items():
-                    if v and isinstance(v, str) and v.strip():
-                        try:
-                            endereco_descriptografado[k] = decrypt_data(v)
-                        except Exception:
-                            endereco_descriptografado[k] = None
-                    else:
-                        endereco_descriptografado[k] = v
-                usuario_data['endereco'] = endereco_descriptografado
-            except Exception:
-                usuario_data['endereco'] = None
-
-        # Lógica robusta para obter a URL da imagem de perfil
-        profile_image_url = usuario_data.get('profile_image_url') or usuario_data.get('profile_image')
-        
-        # Fallback para a foto de perfil do profissional (se aplicável)
-        if not profile_image_url:
-             firebase_uid = usuario_data.get('firebase_uid')
-             if firebase_uid:
-                # Assumindo que o primeiro negócio é o contexto
-                negocio_id = next(iter(usuario_data.get('roles', {})), None)
-                if negocio_id:
-                    perfil_prof = buscar_profissional_por_uid(db, negocio_id, firebase_uid)
-                    if perfil_prof:
-                        profile_image_url = perfil_prof.get('fotos', {}).get('thumbnail')
-
-        usuario_data['profile_image_url'] = profile_image_url
-        
-        return usuario_data
-    except Exception as e:
-        logger.error(f"Erro ao buscar usuário por ID {usuario_id}: {e}")
-        return None
+    # Descriptografar endereço
+    if 'endereco' in usuario_data and usuario_data['endereco']:
+        try:
+            endereco_descriptografado = {}
+            for k, v in usuario_data['endereco'].items():
+                if v and isinstance(v, str) and v.strip():
+                    try:
+                        endereco_descriptografado[k] = decrypt_data(v)
+                    except Exception:
+                        endereco_descriptografado[k] = None
+                else:
+                    endereco_descriptografado[k] = v
+            usuario_data['endereco'] = endereco_descriptografado
+        except Exception:
+            usuario_data['endereco'] = None
+
+    # Lógica robusta para obter a URL da imagem de perfil
+    profile_image_url = usuario_data.get('profile_image_url') or usuario_data.get('profile_image')
+
+    # Fallback para a foto de perfil do profissional (se aplicável)
+    if not profile_image_url:
+         firebase_uid = usuario_data.get('firebase_uid')
+         if firebase_uid:
+            # Assumindo que o primeiro negócio é o contexto
+            negocio_id = next(iter(usuario_data.get('roles', {})), None)
+            if negocio_id:
+                perfil_prof = buscar_profissional_por_uid(db, negocio_id, firebase_uid)
+                if perfil_prof:
+                    profile_image_url = perfil_prof.get('fotos', {}).get('thumbnail')
+
+    usuario_data['profile_image_url'] = profile_image_url
+
+    return usuario_data
 # =================================================================================
-# CLOUD TASKS - NOTIFICAÇÕES AGENDADAS
+# OUTBOX - HANDLERS DOS EVENTOS DE NOTIFICAÇÃO
 # =================================================================================
+# Os eventos carregam apenas IDs; cada handler lê o estado atual do documento
+# e chama o _notificar_* correspondente (ver notification_outbox.py).
+# Falhas de entrega são propagadas para o outbox tentar de novo; o histórico de
+# cada destinatário usa o ID do evento, então uma nova tentativa só entrega a
+# quem ainda não recebeu.
 
-from google.cloud import tasks_v2
-from google.protobuf import timestamp_pb2
-import json
-import os
 
-def _get_cloud_tasks_client():
-    """Retorna o cliente do Cloud Tasks (singleton)."""
-    if not hasattr(_get_cloud_tasks_client, 'client'):
-        _get_cloud_tasks_client.client = tasks_v2.CloudTasksClient()
-    return _get_cloud_tasks_client.client
+def _envio_falhou(envio: Dict) -> bool:
+    """Nenhum canal entregou e houve falha que não é token inválido (rede, credenciais, indisponibilidade)."""
+    sucessos = envio.get('fcm_sucessos', 0) + envio.get('apns_sucessos', 0)
+    falhas = (envio.get('fcm_falhas', 0) - len(envio.get('fcm_tokens_invalidos') or [])) \
+        + (envio.get('apns_falhas', 0) - len(envio.get('apns_tokens_invalidos') or []))
+    return sucessos == 0 and falhas > 0
+
 
+def _entregar_notificacao_evento(
+    db: firestore.client,
+    evento_id: str,
+    destinatario_id: str,
+    historico: Dict,
+    data_payload: Dict[str, str],
+    webpush_tag: str,
+    destinatario_data: Optional[Dict] = None
+):
+    """
+    Grava o histórico em usuarios/{id}/notificacoes/{evento_id} e envia o push
+    (FCM em lote + APNs) de um evento do outbox a um destinatário.
+    O histórico é gravado antes do push, então o destinatário recebe a notificação
+    no app mesmo que o push falhe em todas as tentativas. A entrega do push fica
+    em push_entregue no mesmo documento: uma nova tentativa só reenvia o push se
+    ele ainda não foi entregue.
+
+    Raises:
+        RuntimeError: se o push falhou em todos os canais (ver _envio_falhou)
+    """
+    from notification_helper import enviar_notificacao_para_usuario
+
+    historico_ref = db.collection('usuarios').document(destinatario_id).collection('notificacoes').document(evento_id)
+    historico_doc = historico_ref.get()
+    if historico_doc.exists and (historico_doc.to_dict() or {}).get('push_entregue'):
+        logger.info("Evento %s já notificado ao usuário %s, pulando", evento_id, destinatario_id)
+        return
+
+    if destinatario_data is None:
+        destinatario_doc = db.collection('usuarios').document(destinatario_id).get()
+        if not destinatario_doc.exists:
+            logger.warning("⚠️ Destinatário %s do evento %s não encontrado", destinatario_id, evento_id)
+            return
+        destinatario_data = destinatario_doc.to_dict()
+
+    # ID fixo: uma nova tentativa não duplica o histórico nem desfaz a leitura do usuário
+    if not historico_doc.exists:
+        historico_ref.set({**historico, "lida": False, "push_entregue": False, "data_criacao": firestore.SERVER_TIMESTAMP})
+
+    envio = enviar_notificacao_para_usuario(
+        destinatario_data,
+        historico['title'],
+        historico['body'],
+        data_payload,
+        webpush_tag
+    )
+    remover_tokens_invalidos_do_envio(db, destinatario_id, envio)
+    if _envio_falhou(envio):
+        raise RuntimeError(f"Push não entregue ao usuário {destinatario_id}")
 
-def _get_cloud_tasks_queue_path():
-    """Retorna o caminho completo da fila do Cloud Tasks."""
-    # Usa FIREBASE_PROJECT_ID como fallback, que é configurado no deploy
-    project_id = os.getenv('GCP_PROJECT_ID') or os.getenv('GOOGLE_CLOUD_PROJECT') or os.getenv('FIREBASE_PROJECT_ID')
-    location = os.getenv('CLOUD_TASKS_LOCATION') or 'southamerica-east1'
-    queue_name = os.getenv('CLOUD_TASKS_QUEUE') or 'notificacoes-atrasadas'
+    historico_ref.update({"push_entregue": True})
+    logger.info("✅ Notificação %s enviada para: %s (FCM: %s, APNs: %s)",
+                historico.get('tipo'), destinatario_id, envio['fcm_sucessos'], envio['apns_sucessos'])
 
-    logger.info(f"🔍 DEBUG Cloud Tasks - project_id: {project_id}, location: {location}, queue_name: {queue_name}")
 
-    if not project_id:
-        logger.error("❌ GCP_PROJECT_ID não configurado! Cloud Tasks não funcionará.")
+def _entregar_notificacao_evento_a_todos(
+    db: firestore.client,
+    evento_id: str,
+    destinatarios,
+    historico: Dict,
+    data_payload: Dict[str, str],
+    webpush_tag: str
+):
+    """
+    _entregar_notificacao_evento para cada destinatário. Uma falha não impede
+    os demais; no fim, lança RuntimeError se algum falhou.
+    """
+    falhas = []
+    for destinatario_id in destinatarios:
+        try:
+            _entregar_notificacao_evento(db, evento_id, destinatario_id, historico, data_payload, webpush_tag)
+        except Exception as e:
+            logger.error(f"❌ Erro ao notificar {destinatario_id} ({historico.get('tipo')}): {e}")
+            falhas.append(destinatario_id)
+    if falhas:
+        raise RuntimeError(f"{len(falhas)} de {len(destinatarios)} destinatário(s) não notificado(s)")
+
+def _ler_documento_com_id(doc_ref) -> Optional[Dict]:
+    """Lê um documento e retorna seus dados com o campo 'id', ou None se não existir."""
+    doc = doc_ref.get()
+    if not doc.exists:
         return None
+    data = doc.to_dict()
+    data['id'] = doc.id
+    return data
+
+
+def _processar_evento_relatorio_criado(db: firestore.client, evento_id: str, payload: Dict):
+    relatorio = _ler_documento_com_id(db.collection('relatorios_medicos').document(payload['relatorio_id']))
+    if relatorio:
+        _notificar_medico_novo_relatorio(db, evento_id, relatorio)
+
 
-    client = _get_cloud_tasks_client()
-    queue_path = client.queue_path(project_id, location, queue_name)
-    logger.info(f"🔍 DEBUG queue_path: {queue_path}")
-    return queue_path
+def _processar_evento_relatorio_avaliado(db: firestore.client, evento_id: str, payload: Dict):
+    relatorio = _ler_documento_com_id(db.collection('relatorios_medicos').document(payload['relatorio_id']))
+    if relatorio:
+        _notificar_avaliacao_relatorio_cascata(db, evento_id, relatorio, payload['medico_id'], payload['status'])
+
+
+def _processar_evento_registro_diario_criado(db: firestore.client, evento_id: str, payload: Dict):
+    tecnico_id = payload['tecnico_id']
+    tecnico_doc = db.collection('usuarios').document(tecnico_id).get()
+    tecnico_nome = 'Usuário'
+    if tecnico_doc.exists and (tecnico_doc.to_dict() or {}).get('nome'):
+        tecnico_nome = decrypt_data(tecnico_doc.to_dict()['nome'])
+
+    _notificar_enfermeiro_novo_registro_diario(db, evento_id, {
+        'id': payload['registro_id'],
+        'paciente_id': payload['paciente_id'],
+        'tecnico': {'id': tecnico_id, 'nome': tecnico_nome},
+    })
+
+
+def _processar_evento_tarefa_concluida(db: firestore.client, evento_id: str, payload: Dict):
+    tarefa = _ler_documento_com_id(db.collection('tarefas_essenciais').document(payload['tarefa_id']))
+    if tarefa:
+        _notificar_tarefa_concluida(db, evento_id, tarefa)
+
+
+def _processar_evento_exame_criado(db: firestore.client, evento_id: str, payload: Dict):
+    paciente_id = payload['paciente_id']
+    exame = _ler_documento_com_id(
+        db.collection('usuarios').document(paciente_id).collection('exames').document(payload['exame_id'])
+    )
+    if exame:
+        _notificar_paciente_exame_criado(db, evento_id, paciente_id, exame)
+
+
+registrar_handler('RELATORIO_CRIADO', _processar_evento_relatorio_criado)
+registrar_handler('RELATORIO_AVALIADO', _processar_evento_relatorio_avaliado)
+registrar_handler('REGISTRO_DIARIO_CRIADO', _processar_evento_registro_diario_criado)
+registrar_handler('TAREFA_CONCLUIDA', _processar_evento_tarefa_concluida)
+registrar_handler('EXAME_CRIADO', _processar_evento_exame_criado)
+
+# =================================================================================
+# JOBS AGENDADOS - NOTIFICAÇÕES DE TAREFA ATRASADA
+# =================================================================================
+# Agendados em agendador.py (Cloud Tasks ou roda de tempo local, ver AGENDADOR_BACKEND).
+# A referência do job fica em 'job_agendado' (tarefas antigas: 'cloud_task_name').
+
+import json
+import os
+
+JOB_TAREFA_ATRASADA = 'TAREFA_ATRASADA'
 
 
 def agendar_notificacao_tarefa_atrasada(
@@ -7505,33 +7703,18 @@ def agendar_notificacao_tarefa_atrasada(
     service_url: str = None
 ):
     """
-    Cria uma Cloud Task para enviar notificação quando a tarefa ficar atrasada.
+    Agenda o job que envia a notificação quando a tarefa ficar atrasada.
     """
     try:
         tarefa_id = tarefa['id']
         data_hora_limite = tarefa['dataHoraLimite']
 
-        # Converte para timestamp Unix
         if isinstance(data_hora_limite, datetime):
-            timestamp_unix = int(data_hora_limite.timestamp())
+            executar_em = data_hora_limite
         else:
-            dt = datetime.fromisoformat(data_hora_limite.replace('Z', '+00:00'))
-            timestamp_unix = int(dt.timestamp())
-
-        # Obtém a URL do serviço
-        if not service_url:
-            service_url = os.getenv('CLOUD_RUN_SERVICE_URL') or 'https://barbearia-backend-service-je3t25fkiq-rj.a.run.app'  # HARDCODED PORRA!
-
-        # Garante que a URL comece com https:// (obrigatório para OIDC)
-        if not service_url.startswith('https://') and not service_url.startswith('http://'):
-            service_url = f'https://{service_url}'
-        elif service_url.startswith('http://'):
-            service_url = service_url.replace('http://', 'https://', 1)
-
-        endpoint_url = f"{service_url}/internal/notificar-tarefa-atrasada"
-        logger.info(f"🔍 DEBUG endpoint_url: {endpoint_url}")
+            executar_em = datetime.fromisoformat(data_hora_limite.replace('Z', '+00:00'))
 
-        # Payload da task
+        # Payload do job
         task_payload = {
             "tarefa_id": tarefa_id,
             "paciente_id": tarefa['pacienteId'],
@@ -7541,82 +7724,91 @@ def agendar_notificacao_tarefa_atrasada(
             "data_hora_limite": data_hora_limite.isoformat() if isinstance(data_hora_limite, datetime) else data_hora_limite
         }
 
-        queue_path = _get_cloud_tasks_queue_path()
-        if not queue_path:
-            logger.error(f"❌ Não foi possível obter queue_path. Task não agendada para tarefa {tarefa_id}")
-            return
-
-        # Monta a task
-        task = {
-            'http_request': {
-                'http_method': tasks_v2.HttpMethod.POST,
-                'url': endpoint_url,
-                'headers': {
-                    'Content-Type': 'application/json',
-                },
-                'body': json.dumps(task_payload).encode()
-            },
-            'schedule_time': timestamp_pb2.Timestamp(seconds=timestamp_unix)
-        }
-
-        # Adiciona autenticação OIDC para Cloud Run
-        if 'run.app' in service_url:
-            service_account = os.getenv('CLOUD_RUN_SERVICE_ACCOUNT') or '862082955632-compute@developer.gserviceaccount.com'
-            task['http_request']['oidc_token'] = {
-                'service_account_email': service_account,
-                'audience': service_url
-            }
-            logger.info(f"🔐 OIDC token configurado com service account: {service_account}")
+        referencia = agendar_job(db, JOB_TAREFA_ATRASADA, executar_em, task_payload, chave=tarefa_id, service_url=service_url)
 
-        # Cria a task
-        client = _get_cloud_tasks_client()
-        response = client.create_task(parent=queue_path, task=task)
-
-        # Salva o nome da task no Firestore
+        # Salva a referência do job no Firestore
         db.collection('tarefas_essenciais').document(tarefa_id).update({
-            'cloud_task_name': response.name
+            'job_agendado': referencia
         })
 
-        logger.info(
-            f"✅ Cloud Task criada para tarefa {tarefa_id}. "
-            f"Notificação em: {datetime.fromtimestamp(timestamp_unix, tz=timezone.utc).isoformat()}"
-        )
+        logger.info(f"✅ Job agendado para tarefa {tarefa_id}. Notificação em: {executar_em.isoformat()}")
 
     except Exception as e:
-        logger.error(f"❌ Erro ao agendar Cloud Task para tarefa {tarefa['id']}: {e}", exc_info=True)
+        logger.error(f"❌ Erro ao agendar notificação da tarefa {tarefa['id']}: {e}", exc_info=True)
 
 
 def cancelar_notificacao_tarefa_atrasada(db: firestore.client, tarefa_id: str):
-    """Cancela a Cloud Task agendada quando a tarefa é concluída."""
+    """Cancela o job agendado quando a tarefa é concluída."""
     try:
         tarefa_ref = db.collection('tarefas_essenciais').document(tarefa_id)
         tarefa_doc = tarefa_ref.get()
 
         if not tarefa_doc.exists:
-            logger.warning(f"⚠️ Tarefa {tarefa_id} não encontrada para cancelar Cloud Task")
+            logger.warning(f"⚠️ Tarefa {tarefa_id} não encontrada para cancelar o job agendado")
             return
 
         tarefa_data = tarefa_doc.to_dict()
-        cloud_task_name = tarefa_data.get('cloud_task_name')
+        referencia = tarefa_data.get('job_agendado') or tarefa_data.get('cloud_task_name')
 
-        if not cloud_task_name:
-            logger.info(f"ℹ️ Tarefa {tarefa_id} não tem Cloud Task agendada")
+        if not referencia:
+            logger.info(f"ℹ️ Tarefa {tarefa_id} não tem job agendado")
             return
 
-        client = _get_cloud_tasks_client()
-        client.delete_task(name=cloud_task_name)
+        if cancelar_job(db, referencia):
+            logger.info(f"✅ Job agendado cancelado para tarefa {tarefa_id}")
+        else:
+            logger.info(f"ℹ️ Job da tarefa {tarefa_id} já executado/expirado")
 
         tarefa_ref.update({
+            'job_agendado': firestore.DELETE_FIELD,
             'cloud_task_name': firestore.DELETE_FIELD
         })
 
-        logger.info(f"✅ Cloud Task cancelada para tarefa {tarefa_id}")
-
     except Exception as e:
-        if 'NOT_FOUND' in str(e):
-            logger.info(f"ℹ️ Cloud Task para tarefa {tarefa_id} já executada/expirada")
-        else:
-            logger.error(f"❌ Erro ao cancelar Cloud Task: {e}", exc_info=True)
+        logger.error(f"❌ Erro ao cancelar job agendado: {e}", exc_info=True)
+
+
+def _notificar_tarefa_atrasada_se_pendente(db: firestore.client, payload: Dict, tarefa_data: Optional[Dict]) -> str:
+    if tarefa_data is None:
+        logger.warning(f"⚠️ Tarefa {payload['tarefa_id']} não existe mais")
+        return "Tarefa não existe mais"
+
+    if tarefa_data.get('foiConcluida'):
+        logger.info(f"ℹ️ Tarefa {payload['tarefa_id']} já foi concluída")
+        return "Tarefa já foi concluída"
+
+    enviar_notificacoes_tarefa_atrasada(
+        db=db,
+        tarefa_id=payload['tarefa_id'],
+        paciente_id=payload['paciente_id'],
+        negocio_id=payload['negocio_id'],
+        criado_por_id=payload['criado_por_id'],
+        descricao=payload.get('descricao', 'Tarefa sem descrição')
+    )
+    logger.info(f"✅ Notificações enviadas para tarefa {payload['tarefa_id']}")
+    return "Notificações enviadas com sucesso"
+
+
+def executar_notificacao_tarefa_atrasada(db: firestore.client, payload: Dict) -> str:
+    """
+    Executa o job de tarefa atrasada (payload de agendar_notificacao_tarefa_atrasada):
+    notifica se a tarefa ainda existe e não foi concluída. Retorna a situação.
+    """
+    tarefa_doc = db.collection('tarefas_essenciais').document(payload['tarefa_id']).get()
+    return _notificar_tarefa_atrasada_se_pendente(db, payload, tarefa_doc.to_dict() if tarefa_doc.exists else None)
+
+
+def _executar_lote_tarefas_atrasadas(db: firestore.client, payloads: List[Dict]):
+    """Jobs de tarefa atrasada que venceram juntos: as tarefas são lidas num único get_all."""
+    tarefas = get_carregador(db).carregar_muitos('tarefas_essenciais', [p['tarefa_id'] for p in payloads])
+    for payload in payloads:
+        try:
+            _notificar_tarefa_atrasada_se_pendente(db, payload, tarefas.get(payload['tarefa_id']))
+        except Exception as e:
+            logger.error(f"❌ Erro ao notificar tarefa atrasada {payload.get('tarefa_id')}: {e}")
+
+
+registrar_tipo_job(JOB_TAREFA_ATRASADA, _executar_lote_tarefas_atrasadas, rota='/internal/notificar-tarefa-atrasada')
 
 
 def buscar_destinatarios_notificacao_tarefa(
@@ -7641,7 +7833,7 @@ def buscar_destinatarios_notificacao_tarefa(
             criador_data['id'] = criado_por_id
             destinatarios.append(criador_data)
             destinatarios_ids.add(criado_por_id)
-            logger.info(f"📌 Destinatário: Criador - {criador_data.get('nome', 'N/A')}")
+            logger.info("📌 Destinatário: Criador - %s", criado_por_id)
 
         # 2. Todos os admins
         admins_query = db.collection('usuarios').where('negocioId', '==', negocio_id).where('role', '==', 'admin').stream()
@@ -7653,7 +7845,7 @@ def buscar_destinatarios_notificacao_tarefa(
                 admin_data['id'] = admin_id
                 destinatarios.append(admin_data)
                 destinatarios_ids.add(admin_id)
-                logger.info(f"📌 Destinatário: Admin - {admin_data.get('nome', 'N/A')}")
+                logger.info("📌 Destinatário: Admin - %s", admin_id)
 
         # 3. Enfermeiro responsável
         paciente_ref = db.collection('pacientes').document(paciente_id)
@@ -7672,7 +7864,7 @@ def buscar_destinatarios_notificacao_tarefa(
                     enfermeiro_data['id'] = enfermeiro_id
                     destinatarios.append(enfermeiro_data)
                     destinatarios_ids.add(enfermeiro_id)
-                    logger.info(f"📌 Destinatário: Enfermeiro - {enfermeiro_data.get('nome', 'N/A')}")
+                    logger.info("📌 Destinatário: Enfermeiro - %s", enfermeiro_id)
 
         logger.info(f"📊 Total de destinatários: {len(destinatarios)}")
         return destinatarios
@@ -7714,14 +7906,14 @@ def enviar_notificacoes_tarefa_atrasada(
         if nome_encrypted and isinstance(nome_encrypted, str) and nome_encrypted.startswith('gAAAAA'):
             try:
                 paciente_nome = decrypt_data(nome_encrypted)
-                logger.info(f"✅ Nome do paciente descriptografado: {paciente_nome}")
+                logger.info("✅ Nome do paciente %s descriptografado", paciente_id)
             except Exception as e:
-                logger.warning(f"⚠️ Erro ao descriptografar nome: {e}")
+                logger.warning("⚠️ Erro ao descriptografar o nome do paciente %s: %s", paciente_id, e)
 
         # Se falhou, tenta nomeCompleto (não criptografado)
         if not paciente_nome:
             paciente_nome = paciente_data.get('nomeCompleto') or 'Paciente'
-            logger.info(f"📝 Nome do paciente (não criptografado): {paciente_nome}")
+            logger.info("📝 Nome do paciente %s não criptografado", paciente_id)
 
         # Monta mensagem
         titulo = "⚠️ Tarefa Atrasada"
@@ -7752,16 +7944,15 @@ def enviar_notificacoes_tarefa_atrasada(
 
         for destinatario in destinatarios:
             usuario_id = destinatario['id']
-            usuario_nome = destinatario.get('nome', 'Usuário')
 
             fcm_tokens = destinatario.get('fcm_tokens', [])
             apns_tokens = destinatario.get('apns_tokens', [])
 
             if not fcm_tokens and not apns_tokens:
-                logger.warning(f"⚠️ Usuário {usuario_nome} sem tokens")
+                logger.warning("⚠️ Usuário %s sem tokens", usuario_id)
                 continue
 
-            logger.info(f"📤 Enviando para {usuario_nome}: {len(fcm_tokens)} FCM + {len(apns_tokens)} APNs")
+            logger.info("📤 Enviando para %s: %d FCM + %d APNs", usuario_id, len(fcm_tokens), len(apns_tokens))
 
             resultado = enviar_notificacao_hibrida(
                 fcm_tokens=fcm_tokens,
@@ -7774,6 +7965,7 @@ def enviar_notificacoes_tarefa_atrasada(
 
             total_enviadas += resultado['fcm_sucessos'] + resultado['apns_sucessos']
             total_falhas += resultado['fcm_falhas'] + resultado['apns_falhas']
+            remover_tokens_invalidos_do_envio(db, usuario_id, resultado)
 
             # Salva notificação no Firestore para persistência
             salvar_notificacao_firestore(
@@ -7808,9 +8000,12 @@ def enviar_notificacoes_tarefa_atrasada(
 
 
 # =================================================================================
-# CLOUD TASKS - LEMBRETES DE EXAME
+# JOBS AGENDADOS - LEMBRETES DE EXAME
 # =================================================================================
 
+JOB_LEMBRETE_EXAME = 'LEMBRETE_EXAME'
+
+
 def agendar_lembrete_exame(
     db: firestore.client,
     exame_id: str,
@@ -7822,7 +8017,7 @@ def agendar_lembrete_exame(
     service_url: Optional[str] = None
 ):
     """
-    Agenda Cloud Task para lembrete de exame.
+    Agenda o job do lembrete de exame (ver agendador.py).
 
     REGRAS:
     - Se TEM horário: notifica 1 hora antes do horário (horário em BRT)
@@ -7836,19 +8031,15 @@ def agendar_lembrete_exame(
         if isinstance(data_exame, str):
             data_exame = datetime.fromisoformat(data_exame.replace('Z', '+00:00'))
 
-        logger.info(f"🔍 [DEBUG TIMEZONE] Dados recebidos:")
-        logger.info(f"   data_exame: {data_exame}")
-        logger.info(f"   horario_exame: {horario_exame}")
+        logger.debug("Lembrete de exame %s: data_exame=%s, horario_exame=%s", exame_id, data_exame, horario_exame)
 
         # Pega apenas a data (sem hora)
         data_base = data_exame.date()
-        logger.info(f"   data_base (sem TZ): {data_base}")
 
         # Calcula horário do lembrete
         if horario_exame:
             # TEM horário: 1 hora antes do horário LOCAL (BRT)
             hora, minuto = map(int, horario_exame.split(':'))
-            logger.info(f"   hora: {hora}, minuto: {minuto}")
 
             # Combina data + horário + timezone BRT (horário LOCAL)
             data_hora_exame_brt = datetime(
@@ -7861,11 +8052,9 @@ def agendar_lembrete_exame(
                 0,  # microsegundo
                 tzinfo=BRT
             )
-            logger.info(f"   data_hora_exame_brt: {data_hora_exame_brt}")
 
             # Converte para UTC
             data_hora_exame_utc = data_hora_exame_brt.astimezone(ZoneInfo("UTC"))
-            logger.info(f"   data_hora_exame_utc: {data_hora_exame_utc}")
 
             # Calcula lembrete: 1 hora antes em UTC
             data_hora_lembrete = data_hora_exame_utc - timedelta(hours=1)
@@ -7886,9 +8075,6 @@ def agendar_lembrete_exame(
             data_hora_lembrete = data_hora_lembrete_brt.astimezone(ZoneInfo("UTC"))
             logger.info(f"📅 Exame SEM horário: {data_base} → Lembrete: {data_hora_lembrete.strftime('%d/%m/%Y %H:%M UTC')} (09:00 BRT)")
 
-        # Converte para timestamp Unix
-        timestamp_unix = int(data_hora_lembrete.timestamp())
-
         # Não agenda se já passou
         agora_utc = datetime.now(ZoneInfo("UTC"))
         logger.info(f"   agora_utc: {agora_utc}")
@@ -7899,20 +8085,7 @@ def agendar_lembrete_exame(
             logger.warning(f"   Mas agora já são: {agora_utc}")
             return
 
-        # Obtém a URL do serviço
-        if not service_url:
-            service_url = os.getenv('CLOUD_RUN_SERVICE_URL') or 'https://barbearia-backend-service-je3t25fkiq-rj.a.run.app'
-
-        # Garante que a URL comece com https://
-        if not service_url.startswith('https://') and not service_url.startswith('http://'):
-            service_url = f'https://{service_url}'
-        elif service_url.startswith('http://'):
-            service_url = service_url.replace('http://', 'https://', 1)
-
-        endpoint_url = f"{service_url}/internal/notificar-lembrete-exame"
-        logger.info(f"🔍 DEBUG endpoint_url: {endpoint_url}")
-
-        # Payload da task
+        # Payload do job
         task_payload = {
             "exame_id": exame_id,
             "paciente_id": paciente_id,
@@ -7922,84 +8095,92 @@ def agendar_lembrete_exame(
             "horario_exame": horario_exame
         }
 
-        queue_path = _get_cloud_tasks_queue_path()
-        if not queue_path:
-            logger.error(f"❌ Não foi possível obter queue_path. Task não agendada para exame {exame_id}")
-            return
-
-        # Monta a task
-        task = {
-            'http_request': {
-                'http_method': tasks_v2.HttpMethod.POST,
-                'url': endpoint_url,
-                'headers': {
-                    'Content-Type': 'application/json',
-                },
-                'body': json.dumps(task_payload).encode()
-            },
-            'schedule_time': timestamp_pb2.Timestamp(seconds=timestamp_unix)
-        }
-
-        # Adiciona autenticação OIDC para Cloud Run
-        if 'run.app' in service_url:
-            service_account = os.getenv('CLOUD_RUN_SERVICE_ACCOUNT') or '862082955632-compute@developer.gserviceaccount.com'
-            task['http_request']['oidc_token'] = {
-                'service_account_email': service_account,
-                'audience': service_url
-            }
-            logger.info(f"🔐 OIDC token configurado com service account: {service_account}")
+        referencia = agendar_job(db, JOB_LEMBRETE_EXAME, data_hora_lembrete, task_payload, chave=f"{paciente_id}:{exame_id}", service_url=service_url)
 
-        # Cria a task
-        client = _get_cloud_tasks_client()
-        response = client.create_task(parent=queue_path, task=task)
-
-        # Salva o nome da task no exame
+        # Salva a referência do job no exame
         db.collection('usuarios').document(paciente_id).collection('exames').document(exame_id).update({
-            'cloud_task_name': response.name,
+            'job_agendado': referencia,
             'lembrete_agendado_para': data_hora_lembrete
         })
 
-        logger.info(
-            f"✅ Cloud Task criada para exame {exame_id}. "
-            f"Lembrete em: {data_hora_lembrete.isoformat()}"
-        )
+        logger.info(f"✅ Job agendado para exame {exame_id}. Lembrete em: {data_hora_lembrete.isoformat()}")
 
     except Exception as e:
-        logger.error(f"❌ Erro ao agendar Cloud Task para exame {exame_id}: {e}", exc_info=True)
+        logger.error(f"❌ Erro ao agendar lembrete do exame {exame_id}: {e}", exc_info=True)
 
 
 def cancelar_lembrete_exame(db: firestore.client, paciente_id: str, exame_id: str):
-    """Cancela a Cloud Task agendada para lembrete de exame."""
+    """Cancela o job agendado para lembrete de exame."""
     try:
         exame_ref = db.collection('usuarios').document(paciente_id).collection('exames').document(exame_id)
         exame_doc = exame_ref.get()
 
         if not exame_doc.exists:
-            logger.warning(f"⚠️ Exame {exame_id} não encontrado para cancelar Cloud Task")
+            logger.warning(f"⚠️ Exame {exame_id} não encontrado para cancelar o job agendado")
             return
 
         exame_data = exame_doc.to_dict()
-        cloud_task_name = exame_data.get('cloud_task_name')
+        referencia = exame_data.get('job_agendado') or exame_data.get('cloud_task_name')
 
-        if not cloud_task_name:
-            logger.info(f"ℹ️ Exame {exame_id} não tem Cloud Task agendada")
+        if not referencia:
+            logger.info(f"ℹ️ Exame {exame_id} não tem job agendado")
             return
 
-        client = _get_cloud_tasks_client()
-        client.delete_task(name=cloud_task_name)
+        if cancelar_job(db, referencia):
+            logger.info(f"✅ Job agendado cancelado para exame {exame_id}")
+        else:
+            logger.info(f"ℹ️ Job do exame {exame_id} já executado/expirado")
 
         exame_ref.update({
+            'job_agendado': firestore.DELETE_FIELD,
             'cloud_task_name': firestore.DELETE_FIELD,
             'lembrete_agendado_para': firestore.DELETE_FIELD
         })
 
-        logger.info(f"✅ Cloud Task cancelada para exame {exame_id}")
-
     except Exception as e:
-        if 'NOT_FOUND' in str(e):
-            logger.info(f"ℹ️ Cloud Task para exame {exame_id} já executada/expirada")
-        else:
-            logger.error(f"❌ Erro ao cancelar Cloud Task: {e}", exc_info=True)
+        logger.error(f"❌ Erro ao cancelar job agendado: {e}", exc_info=True)
+
+
+def executar_lembrete_exame(db: firestore.client, payload: Dict) -> Tuple[bool, str]:
+    """
+    Executa o job de lembrete de exame (payload de agendar_lembrete_exame):
+    envia o lembrete se o exame e o paciente ainda existem.
+
+    Returns:
+        (sucesso, situação)
+    """
+    exame_doc = db.collection('usuarios').document(payload['paciente_id']).collection('exames').document(payload['exame_id']).get()
+    if not exame_doc.exists:
+        logger.warning(f"⚠️ Exame {payload['exame_id']} não existe mais")
+        return True, "Exame não existe mais"
+
+    if not db.collection('usuarios').document(payload['paciente_id']).get().exists:
+        logger.warning(f"⚠️ Paciente {payload['paciente_id']} não encontrado")
+        return False, "Paciente não encontrado"
+
+    enviar_lembrete_exame(
+        db=db,
+        exame_id=payload['exame_id'],
+        paciente_id=payload['paciente_id'],
+        negocio_id=payload['negocio_id'],
+        nome_exame=payload['nome_exame'],
+        data_exame=payload['data_exame'],
+        horario_exame=payload.get('horario_exame')
+    )
+    logger.info(f"✅ Lembrete enviado para exame {payload['exame_id']}")
+    return True, "Lembrete enviado com sucesso"
+
+
+def _executar_lote_lembretes_exame(db: firestore.client, payloads: List[Dict]):
+    """Lembretes de exame que venceram juntos (backend local do agendador)."""
+    for payload in payloads:
+        try:
+            executar_lembrete_exame(db, payload)
+        except Exception as e:
+            logger.error(f"❌ Erro ao executar lembrete do exame {payload.get('exame_id')}: {e}")
+
+
+registrar_tipo_job(JOB_LEMBRETE_EXAME, _executar_lote_lembretes_exame, rota='/internal/notificar-lembrete-exame')
 
 
 def enviar_lembrete_exame(
@@ -8033,13 +8214,13 @@ def enviar_lembrete_exame(
         if nome_encrypted and isinstance(nome_encrypted, str) and nome_encrypted.startswith('gAAAAA'):
             try:
                 paciente_nome = decrypt_data(nome_encrypted)
-                logger.info(f"✅ Nome do paciente descriptografado: {paciente_nome}")
+                logger.info("✅ Nome do paciente %s descriptografado", paciente_id)
             except Exception as e:
-                logger.warning(f"⚠️ Erro ao descriptografar nome: {e}")
+                logger.warning("⚠️ Erro ao descriptografar o nome do paciente %s: %s", paciente_id, e)
 
         if not paciente_nome:
             paciente_nome = paciente_data.get('nomeCompleto') or 'Paciente'
-            logger.info(f"📝 Nome do paciente (não criptografado): {paciente_nome}")
+            logger.info("📝 Nome do paciente %s não criptografado", paciente_id)
 
         # Monta mensagem
         if horario_exame:
@@ -8077,6 +8258,7 @@ def enviar_lembrete_exame(
 
         total_enviadas = resultado['fcm_sucessos'] + resultado['apns_sucessos']
         total_falhas = resultado['fcm_falhas'] + resultado['apns_falhas']
+        remover_tokens_invalidos_do_envio(db, paciente_id, resultado)
 
         logger.info(f"✅ Notificações: {total_enviadas} sucessos, {total_falhas} falhas")
 
@@ -8147,14 +8329,11 @@ def salvar_notificacao_firestore(
             'data_criacao': firestore.SERVER_TIMESTAMP  # Usa 'data_criacao' para compatibilidade
         }
 
-        # DEBUG: Log dos dados ANTES de salvar
-        logger.info(f"🔍 DEBUG salvar_notificacao - Dados: tipo={tipo}, title={titulo}, body_len={len(mensagem) if mensagem else 0}, lida=False, usuario_id={usuario_id}")
-
         # Salva na SUBCOLEÇÃO /usuarios/{id}/notificacoes/
         doc_ref = db.collection('usuarios').document(usuario_id).collection('notificacoes').add(notificacao_data)
         notificacao_id = doc_ref[1].id
 
-        logger.info(f"✅ Notificação salva no Firestore: {notificacao_id} (tipo: {tipo}, usuário: {usuario_id}, title: {titulo}, lida: False)")
+        logger.info("✅ Notificação %s salva no Firestore (tipo: %s, usuário: %s)", notificacao_id, tipo, usuario_id)
         return notificacao_id
 
     except Exception as e:
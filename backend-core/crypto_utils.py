@@ -1,13 +1,28 @@
 # crypto_utils.py
 
 import os
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 from google.cloud import kms
 from cryptography.fernet import Fernet
 import base64
+from metricas import registrar_crypto
+
+logger = logging.getLogger(__name__)
 
 # Carrega o nome do recurso da chave a partir das variáveis de ambiente
 KEY_RESOURCE_NAME = os.getenv("KMS_CRYPTO_KEY_NAME")
 
+# Tamanho do cache LRU de texto cifrado -> texto claro (0 desativa o cache)
+DECRYPT_CACHE_MAX_ENTRIES = int(os.getenv("CRYPTO_DECRYPT_CACHE_MAX_ENTRIES", "4096"))
+# Número de threads para descriptografar listas grandes (0 ou 1 = sequencial)
+DECRYPT_MAX_WORKERS = int(os.getenv("CRYPTO_DECRYPT_WORKERS", "0"))
+# Quantidade mínima de documentos para valer a pena distribuir entre threads
+DECRYPT_PARALLEL_MIN_DOCS = 200
+
 kms_client = None
 fernet_instance = None
 
@@ -58,7 +73,14 @@ def encrypt_data(data: str) -> str:
         raise TypeError("Apenas strings podem ser criptografadas.")
         
     # Converte a string para bytes, criptografa, e depois converte de volta para string para salvar no Firestore
-    return fernet_instance.encrypt(data.encode('utf-8')).decode('utf-8')
+    inicio = time.perf_counter()
+    sucesso = False
+    try:
+        resultado = fernet_instance.encrypt(data.encode('utf-8')).decode('utf-8')
+        sucesso = True
+        return resultado
+    finally:
+        registrar_crypto('encrypt', inicio, sucesso)
 
 def decrypt_data(encrypted_data: str) -> str:
     """Descriptografa um texto usando a chave gerenciada."""
@@ -68,8 +90,113 @@ def decrypt_data(encrypted_data: str) -> str:
     if not isinstance(encrypted_data, str):
         raise TypeError("Apenas strings podem ser descriptografadas.")
         
+    inicio = time.perf_counter()
+    sucesso = False
+    try:
+        resultado = _decrypt_cached(encrypted_data)
+        sucesso = True
+        return resultado
+    finally:
+        registrar_crypto('decrypt', inicio, sucesso)
+
+
+def _decrypt_uncached(encrypted_data: str) -> str:
     # Converte a string criptografada para bytes, descriptografa, e converte de volta para string
     return fernet_instance.decrypt(encrypted_data.encode('utf-8')).decode('utf-8')
 
+# Cada token Fernet é único (IV aleatório), então a chave do cache identifica exatamente
+# um valor gravado. Falhas de descriptografia não são cacheadas (lru_cache não guarda exceções).
+if DECRYPT_CACHE_MAX_ENTRIES > 0:
+    _decrypt_cached = lru_cache(maxsize=DECRYPT_CACHE_MAX_ENTRIES)(_decrypt_uncached)
+else:
+    _decrypt_cached = _decrypt_uncached
+
+
+# =================================================================================
+# DESCRIPTOGRAFIA EM LOTE DE DOCUMENTOS
+# =================================================================================
+
+# Políticas de erro por campo (além de um valor fixo de fallback)
+MANTER_ORIGINAL = object()  # mantém o texto cifrado original
+LANCAR_ERRO = object()      # propaga a exceção para o chamador
+
+ERRO_DESCRIPTOGRAFIA = "[Erro na descriptografia]"
+
+# Especificação padrão dos campos sensíveis de um documento da coleção 'usuarios'.
+# Chave = campo; valor = valor usado quando a descriptografia falha.
+# Campos do tipo dict (ex: endereco) têm cada valor string descriptografado individualmente.
+CAMPOS_SENSIVEIS_USUARIO: Dict[str, Any] = {
+    'nome': ERRO_DESCRIPTOGRAFIA,
+    'telefone': ERRO_DESCRIPTOGRAFIA,
+    'endereco': ERRO_DESCRIPTOGRAFIA,
+}
+
+
+def _decrypt_valor(valor: str, fallback: Any, campo: str, doc_id: Optional[str]) -> Any:
+    """Descriptografa um valor aplicando a política de erro do campo."""
+    try:
+        return decrypt_data(valor)
+    except Exception as e:
+        if fallback is LANCAR_ERRO:
+            raise
+        logger.error(f"Erro ao descriptografar campo '{campo}' do documento {doc_id}: {e}")
+        if fallback is MANTER_ORIGINAL:
+            return valor
+        return fallback
+
+
+def decrypt_document(doc: Dict, field_spec: Optional[Dict[str, Any]] = None) -> Dict:
+    """
+    Descriptografa, no próprio dicionário, todos os campos sensíveis de um documento.
+
+    Args:
+        doc: Dicionário do documento (já convertido com to_dict()).
+        field_spec: Mapa campo -> valor de fallback em caso de erro (ou MANTER_ORIGINAL / LANCAR_ERRO).
+                    Padrão: CAMPOS_SENSIVEIS_USUARIO.
+
+    Returns:
+        O mesmo dicionário, com os campos descriptografados.
+    """
+    if not doc:
+        return doc
+    spec = CAMPOS_SENSIVEIS_USUARIO if field_spec is None else field_spec
+    doc_id = doc.get('id')
+
+    for campo, fallback in spec.items():
+        valor = doc.get(campo)
+        if not valor:
+            continue
+        if isinstance(valor, dict):
+            doc[campo] = {
+                k: _decrypt_valor(v, fallback, f"{campo}.{k}", doc_id) if isinstance(v, str) and v.strip() else v
+                for k, v in valor.items()
+            }
+        elif isinstance(valor, str):
+            doc[campo] = _decrypt_valor(valor, fallback, campo, doc_id)
+    return doc
+
+
+def decrypt_many(docs: List[Dict], field_spec: Optional[Dict[str, Any]] = None, max_workers: Optional[int] = None) -> List[Dict]:
+    """
+    Descriptografa os campos sensíveis de uma lista de documentos em uma única passada.
+
+    Listas grandes podem ser distribuídas entre threads (CRYPTO_DECRYPT_WORKERS ou max_workers);
+    em instâncias de uma única vCPU o padrão sequencial é o mais eficiente.
+
+    Returns:
+        A mesma lista, com os documentos descriptografados no lugar.
+    """
+    if fernet_instance is None:
+        _initialize_crypto()
+
+    workers = DECRYPT_MAX_WORKERS if max_workers is None else max_workers
+    if workers > 1 and len(docs) >= DECRYPT_PARALLEL_MIN_DOCS:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda d: decrypt_document(d, field_spec), docs))
+    else:
+        for doc in docs:
+            decrypt_document(doc, field_spec)
+    return docs
+
 # Inicializa o módulo quando o arquivo é importado pela primeira vez
 _initialize_crypto()
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""
+Carregamento em lote de documentos por ID (DataLoader) com escopo de requisição.
+
+Listagens enriquecidas (registros com o técnico, relatórios com paciente e
+criador, tarefas com criador e executor...) faziam um
+db.collection('usuarios').document(id).get() por item: N round trips em série.
+O CarregadorDocumentos junta os IDs e resolve todos com um único db.get_all()
+por coleção, memorizando o resultado até o fim da requisição.
+
+USO (em crud.py):
+    carregador = get_carregador(db)
+    docs = list(query.stream())
+    carregador.carregar_muitos('usuarios', [d.to_dict().get('tecnico_id') for d in docs])  # 1 round trip
+    for doc in docs:
+        tecnico = carregador.perfil_usuario(doc.to_dict().get('tecnico_id'))  # já em memória
+
+ESCOPO:
+    O middleware de main.py abre um escopo_requisicao() por requisição: todas as
+    funções do crud chamadas na mesma requisição (inclusive nas threads do
+    query_executor) compartilham o mesmo carregador. Fora de uma requisição
+    (jobs, outbox) get_carregador() retorna um carregador novo a cada chamada,
+    que ainda agrupa as leituras mas não memoriza entre funções.
+
+MAPA DE IDENTIDADE:
+    O carregador também é o mapa de identidade da requisição: documentos
+    guardados pelo caminho ('usuarios/{id}'), com os dados brutos e as visões
+    descriptografadas já montadas. As dependências de auth.py leem o usuário
+    autenticado e o paciente por aqui (ou registram o que leram com
+    registrar()), e as funções do crud consultam o mapa antes de ir ao
+    Firestore: o documento do paciente validado pelo get_paciente_autorizado
+    não é lido de novo pelo endpoint.
+
+    carregador.registrar('usuarios', doc.id, doc.to_dict())      # lido por uma consulta
+    carregador.visao('usuarios', paciente_id, 'completo', montar)  # descriptografa 1x por requisição
+
+IMPORTANTE: os documentos são memorizados como estavam na última leitura da
+requisição. Quem altera um documento e depois precisa lê-lo na mesma
+requisição chama esquecer_documento() após a escrita (auth_cache.invalidar_usuario
+já faz isso para 'usuarios'); na dúvida, leia direto do Firestore.
+"""
+
+import copy
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from firebase_admin import firestore
+
+from crypto_utils import decrypt_document, ERRO_DESCRIPTOGRAFIA
+
+logger = logging.getLogger(__name__)
+
+# Quantidade de documentos por chamada ao get_all (BatchGetDocuments)
+TAMANHO_LOTE_GET_ALL = 300
+
+
+def _caminho(colecao: str, doc_id: str) -> str:
+    return f"{colecao}/{doc_id}"
+
+
+class CarregadorDocumentos:
+    """
+    Resolve documentos por ID em lote e memoriza os resultados (thread-safe).
+    Funciona como mapa de identidade da requisição (ver docstring do módulo).
+    """
+
+    def __init__(self, db: firestore.client):
+        self.db = db
+        self._lock = threading.Lock()
+        # caminho ('usuarios/abc') -> dados brutos do documento, ou None se não existir
+        self._documentos: Dict[str, Optional[Dict]] = {}
+        # (caminho, nome da visão) -> visão montada a partir dos dados brutos (ex: descriptografada)
+        self._visoes: Dict[tuple, Any] = {}
+        self.round_trips = 0
+
+    def carregar_muitos(self, colecao: str, ids: Iterable[Optional[str]]) -> Dict[str, Optional[Dict]]:
+        """
+        Carrega os documentos informados com um db.get_all() para os que ainda não estão em memória.
+
+        Returns:
+            {id: dados do documento (cópia) ou None se não existir}. IDs vazios são ignorados.
+        """
+        ids_unicos = list(dict.fromkeys(i for i in ids if i))
+        with self._lock:
+            faltantes = [i for i in ids_unicos if _caminho(colecao, i) not in self._documentos]
+
+        for inicio in range(0, len(faltantes), TAMANHO_LOTE_GET_ALL):
+            lote = faltantes[inicio:inicio + TAMANHO_LOTE_GET_ALL]
+            refs = [self.db.collection(colecao).document(doc_id) for doc_id in lote]
+            encontrados = {snapshot.id: snapshot.to_dict() for snapshot in self.db.get_all(refs) if snapshot.exists}
+            with self._lock:
+                self.round_trips += 1
+                for doc_id in lote:
+                    self._documentos[_caminho(colecao, doc_id)] = encontrados.get(doc_id)
+
+        if faltantes:
+            logger.debug("DataLoader: %d documento(s) de '%s' carregados em lote", len(faltantes), colecao)
+
+        with self._lock:
+            return {i: copy.deepcopy(self._documentos.get(_caminho(colecao, i))) for i in ids_unicos}
+
+    def carregar(self, colecao: str, doc_id: Optional[str]) -> Optional[Dict]:
+        """Retorna os dados de um documento (cópia), lendo do Firestore apenas se ainda não estiver em memória."""
+        if not doc_id:
+            return None
+        return self.carregar_muitos(colecao, [doc_id]).get(doc_id)
+
+    def registrar(self, colecao: str, doc_id: str, dados: Optional[Dict]):
+        """
+        Guarda um documento lido fora do carregador (ex: por uma consulta) para
+        que as próximas leituras dele na requisição não voltem ao Firestore.
+        dados=None registra que o documento não existe. Descarta as visões antigas.
+        """
+        caminho = _caminho(colecao, doc_id)
+        copia = copy.deepcopy(dados)
+        with self._lock:
+            self._documentos[caminho] = copia
+            self._descartar_visoes(caminho)
+
+    def esquecer(self, colecao: str, doc_id: str):
+        """Remove o documento (e suas visões) do mapa; a próxima leitura vai ao Firestore."""
+        caminho = _caminho(colecao, doc_id)
+        with self._lock:
+            self._documentos.pop(caminho, None)
+            self._descartar_visoes(caminho)
+
+    def _descartar_visoes(self, caminho: str):
+        for chave in [c for c in self._visoes if c[0] == caminho]:
+            del self._visoes[chave]
+
+    def visao(self, colecao: str, doc_id: Optional[str], nome: str, montar: Callable[[str, Dict], Any]) -> Any:
+        """
+        Visão de um documento (ex: dados descriptografados), montada uma vez por
+        requisição com montar(doc_id, dados) e devolvida como cópia.
+
+        Returns:
+            A visão, ou None se o documento não existir.
+        """
+        if not doc_id:
+            return None
+        chave = (_caminho(colecao, doc_id), nome)
+        with self._lock:
+            if chave in self._visoes:
+                return copy.deepcopy(self._visoes[chave])
+
+        dados = self.carregar(colecao, doc_id)
+        resultado = montar(doc_id, dados) if dados is not None else None
+        with self._lock:
+            # Se o documento foi esquecido enquanto a visão era montada, não a memoriza
+            if _caminho(colecao, doc_id) in self._documentos:
+                self._visoes[chave] = resultado
+        return copy.deepcopy(resultado)
+
+    def perfis_usuarios(self, usuario_ids: Iterable[Optional[str]]) -> Dict[str, Optional[Dict]]:
+        """
+        Projeção resumida e descriptografada de usuários: {'id', 'nome', 'email'}.
+
+        Returns:
+            {id: perfil ou None se o usuário não existir}
+        """
+        ids_unicos = list(dict.fromkeys(i for i in usuario_ids if i))
+        # Uma leitura em lote para os que faltam; as visões saem da memória
+        self.carregar_muitos('usuarios', ids_unicos)
+        return {i: self.visao('usuarios', i, 'perfil', _montar_perfil) for i in ids_unicos}
+
+    def perfil_usuario(self, usuario_id: Optional[str]) -> Optional[Dict]:
+        """Projeção resumida de um usuário ({'id', 'nome', 'email'}) ou None se não existir."""
+        if not usuario_id:
+            return None
+        return self.perfis_usuarios([usuario_id]).get(usuario_id)
+
+
+def _montar_perfil(usuario_id: str, dados: Dict) -> Dict:
+    perfil = {'id': usuario_id, 'nome': dados.get('nome'), 'email': dados.get('email')}
+    return decrypt_document(perfil, {'nome': ERRO_DESCRIPTOGRAFIA})
+
+
+class _EscopoCarregador:
+    """Guarda o carregador da requisição atual (criado na primeira utilização)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.carregador: Optional[CarregadorDocumentos] = None
+
+    def obter(self, db: firestore.client) -> CarregadorDocumentos:
+        with self._lock:
+            if self.carregador is None or self.carregador.db is not db:
+                self.carregador = CarregadorDocumentos(db)
+            return self.carregador
+
+
+_escopo_atual: ContextVar[Optional[_EscopoCarregador]] = ContextVar('escopo_carregador_documentos', default=None)
+
+
+@contextmanager
+def escopo_requisicao():
+    """Abre um escopo em que get_carregador() retorna sempre o mesmo carregador."""
+    token = _escopo_atual.set(_EscopoCarregador())
+    try:
+        yield
+    finally:
+        _escopo_atual.reset(token)
+
+
+def get_carregador(db: firestore.client) -> CarregadorDocumentos:
+    """Retorna o carregador da requisição atual, ou um novo se não houver escopo aberto."""
+    escopo = _escopo_atual.get()
+    if escopo is None:
+        return CarregadorDocumentos(db)
+    return escopo.obter(db)
+
+
+def esquecer_documento(colecao: str, doc_id: Optional[str]):
+    """Tira o documento do mapa de identidade da requisição atual (sem efeito fora de uma requisição)."""
+    escopo = _escopo_atual.get()
+    if escopo is None or escopo.carregador is None or not doc_id:
+        return
+    escopo.carregador.esquecer(colecao, doc_id)
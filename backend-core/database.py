@@ -2,6 +2,7 @@
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+from firestore_metricas import instrumentar_cliente
 from google.cloud import secretmanager
 import json
 import os
@@ -59,7 +60,8 @@ def initialize_firebase_app():
             raise e
 
     # Inicializa o cliente do Firestore e o armazena na variável global
-    db_client = firestore.client()
+    # (envolvido para contabilizar leituras/escritas por rota, ver metricas.py)
+    db_client = instrumentar_cliente(firestore.client())
     print("Cliente do Firestore inicializado.")
 
 def get_db():
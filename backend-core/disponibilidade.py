@@ -0,0 +1,194 @@
+"""
+Cálculo de horários livres por varredura de intervalos e cache da disponibilidade.
+
+A tela de agendamento montava a semana disparando uma requisição por dia e por
+profissional, e cada uma fazia três leituras no Firestore e comparava cada slot
+com todos os bloqueios. O crud agora carrega horários de trabalho, agendamentos
+e bloqueios do período inteiro de uma vez (crud.calcular_disponibilidade_periodo)
+e este módulo faz a parte em memória:
+
+- calcular_slots_livres(): junta agendamentos e bloqueios do dia em intervalos
+  ocupados ordenados e percorre os slots uma única vez (O(slots + ocupados)).
+- CacheDisponibilidade: guarda os slots por (profissional, dia, duração) por
+  poucos segundos. As escritas que mudam a agenda (criar_agendamento,
+  cancelar_agendamento*, criar_bloqueio, deletar_bloqueio,
+  definir_horarios_trabalho) chamam invalidar_profissional().
+
+A invalidação é local à instância; as demais instâncias do Cloud Run enxergam a
+alteração no máximo após o TTL. O cache só alimenta a exibição dos horários:
+a criação do agendamento não consulta o cache.
+
+Configuração (variáveis de ambiente):
+    DISPONIBILIDADE_CACHE_ENABLED=true
+    DISPONIBILIDADE_CACHE_TTL_SECONDS=30
+    DISPONIBILIDADE_CACHE_MAX_ENTRIES=5000
+"""
+
+import logging
+import os
+import threading
+import time as relogio
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Intervalo = Tuple[datetime, datetime]
+
+
+def mesclar_intervalos(intervalos: Iterable[Intervalo]) -> List[Intervalo]:
+    """Ordena os intervalos [início, fim) e junta os que se sobrepõem ou se encostam."""
+    mesclados: List[Intervalo] = []
+    for inicio, fim in sorted(i for i in intervalos if i[0] < i[1]):
+        if mesclados and inicio <= mesclados[-1][1]:
+            if fim > mesclados[-1][1]:
+                mesclados[-1] = (mesclados[-1][0], fim)
+        else:
+            mesclados.append((inicio, fim))
+    return mesclados
+
+
+def calcular_slots_livres(dia: date, hora_inicio: time, hora_fim: time, duracao_servico_min: int,
+                          ocupados: Iterable[Intervalo]) -> List[time]:
+    """
+    Retorna os inícios de slot do expediente que não se sobrepõem a nenhum intervalo ocupado.
+
+    Os slots começam em hora_inicio, a cada duracao_servico_min, enquanto o início
+    for anterior a hora_fim. Um slot [s, s + duração) fica indisponível se tocar
+    qualquer agendamento ou bloqueio do dia.
+    """
+    duracao = timedelta(minutes=duracao_servico_min)
+    inicio_expediente = datetime.combine(dia, hora_inicio)
+    fim_expediente = datetime.combine(dia, hora_fim)
+    intervalos = mesclar_intervalos(ocupados)
+
+    livres = []
+    indice = 0
+    slot = inicio_expediente
+    while slot < fim_expediente:
+        fim_slot = slot + duracao
+        # Intervalos ordenados e disjuntos: os que terminam antes deste slot não afetam os próximos
+        while indice < len(intervalos) and intervalos[indice][1] <= slot:
+            indice += 1
+        if indice == len(intervalos) or intervalos[indice][0] >= fim_slot:
+            livres.append(slot.time())
+        slot = fim_slot
+    return livres
+
+
+class CacheDisponibilidade:
+    """Cache LRU com TTL dos horários livres por (profissional, dia, duração)."""
+
+    def __init__(self, ttl_segundos: int = 30, max_entradas: int = 5000, enabled: bool = True):
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.enabled = enabled and ttl_segundos > 0 and max_entradas > 0
+        self._lock = threading.Lock()
+        # (profissional_id, dia, duração) -> (expira_em, slots)
+        self._entradas: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._chaves_por_profissional: Dict[str, set] = {}
+        # Incrementada a cada invalidação: um cálculo iniciado antes dela não é armazenado
+        self._versoes: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def versao(self, profissional_id: str) -> int:
+        """Versão atual da agenda do profissional (ler ANTES de carregar os dados do Firestore)."""
+        with self._lock:
+            return self._versoes.get(profissional_id, 0)
+
+    def obter(self, profissional_id: str, dia: date, duracao_servico_min: int) -> Optional[List[time]]:
+        """Retorna os slots em cache, ou None se ausente/expirado."""
+        if not self.enabled:
+            return None
+
+        chave = (profissional_id, dia, duracao_servico_min)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] <= relogio.monotonic():
+                if entrada is not None:
+                    self._remover_chave(chave)
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return list(entrada[1])
+
+    def armazenar(self, profissional_id: str, dia: date, duracao_servico_min: int, slots: List[time],
+                  versao: int) -> None:
+        """Armazena os slots, a menos que a agenda tenha sido invalidada depois de 'versao'."""
+        if not self.enabled:
+            return
+
+        chave = (profissional_id, dia, duracao_servico_min)
+        with self._lock:
+            if self._versoes.get(profissional_id, 0) != versao:
+                return
+            self._entradas.pop(chave, None)
+            self._entradas[chave] = (relogio.monotonic() + self.ttl_segundos, tuple(slots))
+            self._chaves_por_profissional.setdefault(profissional_id, set()).add(chave)
+
+            while len(self._entradas) > self.max_entradas:
+                self._remover_chave(next(iter(self._entradas)))
+
+    def invalidar(self, profissional_id: str) -> int:
+        """Remove todas as entradas do profissional. Retorna quantas entradas foram removidas."""
+        with self._lock:
+            self._versoes[profissional_id] = self._versoes.get(profissional_id, 0) + 1
+            chaves = list(self._chaves_por_profissional.get(profissional_id, ()))
+            for chave in chaves:
+                self._remover_chave(chave)
+
+        if chaves:
+            logger.debug(f"Cache de disponibilidade invalidado: {len(chaves)} entrada(s) do profissional {profissional_id}")
+        return len(chaves)
+
+    def limpar(self) -> None:
+        """Remove todas as entradas do cache."""
+        with self._lock:
+            self._entradas.clear()
+            self._chaves_por_profissional.clear()
+
+    def estatisticas(self) -> Dict[str, int]:
+        """Retorna contadores simples para diagnóstico."""
+        with self._lock:
+            return {"entradas": len(self._entradas), "hits": self.hits, "misses": self.misses}
+
+    def _remover_chave(self, chave: tuple) -> None:
+        """Remove uma chave e seu índice. Deve ser chamado com o lock adquirido."""
+        if self._entradas.pop(chave, None) is None:
+            return
+        chaves = self._chaves_por_profissional.get(chave[0])
+        if chaves is not None:
+            chaves.discard(chave)
+            if not chaves:
+                del self._chaves_por_profissional[chave[0]]
+
+
+# Instância global do cache (singleton)
+_cache_disponibilidade_instance = None
+
+def get_cache_disponibilidade() -> CacheDisponibilidade:
+    """Retorna a instância singleton do CacheDisponibilidade"""
+    global _cache_disponibilidade_instance
+    if _cache_disponibilidade_instance is None:
+        _cache_disponibilidade_instance = CacheDisponibilidade(
+            ttl_segundos=int(os.getenv('DISPONIBILIDADE_CACHE_TTL_SECONDS', '30')),
+            max_entradas=int(os.getenv('DISPONIBILIDADE_CACHE_MAX_ENTRIES', '5000')),
+            enabled=os.getenv('DISPONIBILIDADE_CACHE_ENABLED', 'True').lower() == 'true'
+        )
+    return _cache_disponibilidade_instance
+
+
+def invalidar_profissional(profissional_id: Optional[str]) -> None:
+    """
+    Hook de invalidação chamado pelas funções de escrita da agenda no crud.
+    Nunca lança exceção: uma falha aqui não pode derrubar a operação de escrita.
+    """
+    if not profissional_id:
+        return
+    try:
+        get_cache_disponibilidade().invalidar(profissional_id)
+    except Exception as e:
+        logger.error(f"Erro ao invalidar cache de disponibilidade do profissional {profissional_id}: {e}")
@@ -0,0 +1,62 @@
+"""
+Cliente assíncrono do Firestore (google.cloud.firestore.AsyncClient).
+
+Os endpoints síncronos ocupam uma thread do threadpool do Starlette (40 por
+padrão) durante todos os round trips ao Firestore: com poucas dezenas de
+requisições lentas simultâneas a instância passa a enfileirar, mesmo com a CPU
+ociosa. Os endpoints mais acessados (ver repositorio_async.py) usam este
+cliente: enquanto esperam o Firestore, liberam o event loop para outras
+requisições, e leituras independentes rodam juntas com asyncio.gather.
+
+O cliente reutiliza as credenciais e o projeto do app do Firebase Admin
+inicializado em database.initialize_firebase_app(). O canal gRPC assíncrono
+fica vinculado ao event loop em que foi criado, por isso o cliente é criado
+no primeiro uso, dentro do loop do uvicorn, e não no import.
+Como o cliente síncrono, ele é envolvido por firestore_metricas.py.
+
+USO:
+    from firestore_async import get_async_db
+
+    @app.get("/rota")
+    async def rota(db_async = Depends(get_async_db)):
+        snapshot = await db_async.collection('usuarios').document(id).get()
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+import firebase_admin
+from google.cloud import firestore
+
+from firestore_metricas import instrumentar_cliente
+
+logger = logging.getLogger(__name__)
+
+_async_client = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_client():
+    """
+    Retorna o AsyncClient do event loop atual (criado no primeiro uso).
+    Deve ser chamado de dentro de uma corrotina.
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        # Sem 'await' entre a verificação e a atribuição: não há corrida dentro do mesmo loop
+        app = firebase_admin.get_app()
+        _async_client = instrumentar_cliente(firestore.AsyncClient(
+            project=app.project_id,
+            credentials=app.credential.get_credential()
+        ))
+        _async_client_loop = loop
+        logger.info("⚡ Cliente assíncrono do Firestore inicializado")
+    return _async_client
+
+
+async def get_async_db():
+    """Função de dependência do FastAPI que fornece o AsyncClient do Firestore."""
+    return get_async_client()
+
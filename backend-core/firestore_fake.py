@@ -0,0 +1,821 @@
+"""
+Firestore em memória para medições locais (benchmark_endpoints.py).
+
+Implementa a parte da API do firestore.client usada por crud.py e main.py
+(collection/document/where/order_by/limit/start_after/select/stream/get,
+count(), get_all, batch e transaction) e contabiliza as operações como o
+Firestore cobra:
+
+- leituras: 1 por documento retornado (mínimo 1 por consulta), 1 por get de
+  documento, 1 a cada 1000 entradas de índice numa agregação count()
+- escritas: 1 por documento gravado/removido
+- round_trips: 1 por chamada que iria ao servidor (get, stream, commit, ...)
+
+NÃO é um emulador completo: não valida índices compostos, regras de segurança
+nem limites de tamanho. Serve para comparar o custo de endpoints entre versões
+do código (ex: detectar N+1 antes do deploy).
+
+USO:
+    from firestore_fake import FakeFirestore, transactional
+
+    db = FakeFirestore()
+    db.semear('usuarios', 'u1', {'nome': 'Ana'})   # sem contabilizar
+    db.contador.zerar()
+    ...
+    db.contador.snapshot()  # {"leituras": 3, "escritas": 1, "round_trips": 2}
+
+FakeAsyncFirestore(db) expõe o mesmo armazenamento com a API do AsyncClient
+(get/commit como corrotinas, stream/get_all como geradores assíncronos), para
+os endpoints de repositorio_async.py.
+"""
+
+import copy
+import math
+import random
+import string
+import threading
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+ASCENDING = 'ASCENDING'
+DESCENDING = 'DESCENDING'
+DOCUMENT_ID = '__name__'
+
+
+try:  # Usa a exceção real quando a biblioteca está disponível, para que 'except NotFound' do app funcione
+    from google.api_core.exceptions import NotFound
+except ImportError:
+    class NotFound(Exception):
+        """Documento inexistente em update() (equivalente a google.api_core.exceptions.NotFound)."""
+
+
+_CARACTERES_ID = string.ascii_letters + string.digits
+
+
+def _gerar_id() -> str:
+    return ''.join(random.choice(_CARACTERES_ID) for _ in range(20))
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# =================================================================================
+# CONTABILIZAÇÃO
+# =================================================================================
+
+class ContadorOperacoes:
+    """Contadores de leituras, escritas e round trips (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.leituras = 0
+            self.escritas = 0
+            self.round_trips = 0
+
+    def registrar(self, leituras: int = 0, escritas: int = 0, round_trips: int = 1):
+        with self._lock:
+            self.leituras += leituras
+            self.escritas += escritas
+            self.round_trips += round_trips
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"leituras": self.leituras, "escritas": self.escritas, "round_trips": self.round_trips}
+
+
+# =================================================================================
+# VALORES, SENTINELAS E ORDENAÇÃO
+# =================================================================================
+
+def _tipo_especial(valor) -> Optional[str]:
+    """Identifica as sentinelas/transforms do SDK sem depender da biblioteca instalada."""
+    nome = type(valor).__name__
+    if nome == 'Sentinel':
+        descricao = (getattr(valor, 'description', '') or '').lower()
+        if 'delete' in descricao:
+            return 'DELETE_FIELD'
+        if 'timestamp' in descricao:
+            return 'SERVER_TIMESTAMP'
+    if nome in ('ArrayUnion', 'ArrayRemove', 'Increment'):
+        return nome
+    return None
+
+
+def _normalizar_valor(valor):
+    """Converte o valor como o SDK faria ao gravar (datetime sempre em UTC, tuplas viram listas)."""
+    if isinstance(valor, datetime):
+        return valor.replace(tzinfo=timezone.utc) if valor.tzinfo is None else valor.astimezone(timezone.utc)
+    if isinstance(valor, date):
+        raise TypeError(f"Cannot convert to a Firestore Value: {valor!r} (datetime.date não é suportado)")
+    if isinstance(valor, dict):
+        return {k: _normalizar_valor(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_normalizar_valor(v) for v in valor]
+    return valor
+
+
+def _aplicar_transform(atual, valor):
+    """Resolve sentinelas/transforms em relação ao valor atual do campo."""
+    tipo = _tipo_especial(valor)
+    if tipo == 'SERVER_TIMESTAMP':
+        return _agora()
+    if tipo == 'ArrayUnion':
+        resultado = list(atual) if isinstance(atual, list) else []
+        for item in valor.values:
+            item = _normalizar_valor(item)
+            if item not in resultado:
+                resultado.append(item)
+        return resultado
+    if tipo == 'ArrayRemove':
+        remover = [_normalizar_valor(v) for v in valor.values]
+        return [item for item in (atual if isinstance(atual, list) else []) if item not in remover]
+    if tipo == 'Increment':
+        base = atual if isinstance(atual, (int, float)) and not isinstance(atual, bool) else 0
+        return base + valor.value
+    if isinstance(valor, dict):
+        base = atual if isinstance(atual, dict) else {}
+        return {k: _aplicar_transform(base.get(k), v) for k, v in valor.items() if _tipo_especial(v) != 'DELETE_FIELD'}
+    return _normalizar_valor(valor)
+
+
+def _mesclar(destino: Dict, dados: Dict):
+    """set(merge=True): mescla mapas recursivamente e aplica DELETE_FIELD/transforms."""
+    for chave, valor in dados.items():
+        if _tipo_especial(valor) == 'DELETE_FIELD':
+            destino.pop(chave, None)
+        elif isinstance(valor, dict) and isinstance(destino.get(chave), dict):
+            _mesclar(destino[chave], valor)
+        else:
+            destino[chave] = _aplicar_transform(destino.get(chave), valor)
+
+
+_AUSENTE = object()
+
+
+def _obter_campo(dados: Dict, caminho: str):
+    atual = dados
+    for parte in caminho.split('.'):
+        if not isinstance(atual, dict) or parte not in atual:
+            return _AUSENTE
+        atual = atual[parte]
+    return atual
+
+
+def _definir_campo(dados: Dict, caminho: str, valor):
+    partes = caminho.split('.')
+    atual = dados
+    for parte in partes[:-1]:
+        if not isinstance(atual.get(parte), dict):
+            atual[parte] = {}
+        atual = atual[parte]
+    if _tipo_especial(valor) == 'DELETE_FIELD':
+        atual.pop(partes[-1], None)
+    else:
+        atual[partes[-1]] = _aplicar_transform(atual.get(partes[-1]), valor)
+
+
+def _chave_ordenacao(valor) -> Tuple:
+    """Ordem de tipos do Firestore: null < bool < número < timestamp < string < bytes < referência < array < mapa."""
+    if valor is None:
+        return (0,)
+    if isinstance(valor, bool):
+        return (1, valor)
+    if isinstance(valor, (int, float)):
+        return (2, valor)
+    if isinstance(valor, datetime):
+        return (3, _normalizar_valor(valor).timestamp())
+    if isinstance(valor, str):
+        return (4, valor)
+    if isinstance(valor, bytes):
+        return (5, valor)
+    if isinstance(valor, FakeDocumentReference):
+        return (6, valor.path)
+    if isinstance(valor, list):
+        return (8, tuple(_chave_ordenacao(v) for v in valor))
+    if isinstance(valor, dict):
+        return (9, tuple((k, _chave_ordenacao(v)) for k, v in sorted(valor.items())))
+    return (10, str(valor))
+
+
+def _caminho_do_campo(field_path) -> str:
+    """Aceita o caminho como string ou FieldPath (FieldPath.document_id() equivale a '__name__')."""
+    if isinstance(field_path, str):
+        return field_path
+    return field_path.to_api_repr()
+
+
+def _valor_do_campo(snapshot_dados: Dict, doc_id: str, caminho: str):
+    if caminho == DOCUMENT_ID:
+        return doc_id
+    return _obter_campo(snapshot_dados, caminho)
+
+
+def _normalizar_valor_filtro(caminho: str, valor):
+    if caminho == DOCUMENT_ID:
+        if isinstance(valor, FakeDocumentReference):
+            return valor.id
+        if isinstance(valor, (list, tuple)):
+            return [v.id if isinstance(v, FakeDocumentReference) else v for v in valor]
+        return valor
+    if isinstance(valor, (list, tuple)):
+        return [_normalizar_valor(v) for v in valor]
+    return _normalizar_valor(valor)
+
+
+def _atende_filtro(valor_doc, operador: str, valor) -> bool:
+    operador = operador.replace('-', '_') if operador.startswith('array') else operador
+    if valor_doc is _AUSENTE:
+        return False
+
+    if operador == '==':
+        return _chave_ordenacao(valor_doc) == _chave_ordenacao(valor)
+    if operador == '!=':
+        return valor_doc is not None and _chave_ordenacao(valor_doc) != _chave_ordenacao(valor)
+    if operador == 'in':
+        return any(_chave_ordenacao(valor_doc) == _chave_ordenacao(v) for v in valor)
+    if operador == 'not-in':
+        return valor_doc is not None and all(_chave_ordenacao(valor_doc) != _chave_ordenacao(v) for v in valor)
+    if operador == 'array_contains':
+        return isinstance(valor_doc, list) and any(_chave_ordenacao(i) == _chave_ordenacao(valor) for i in valor_doc)
+    if operador == 'array_contains_any':
+        return isinstance(valor_doc, list) and any(
+            _chave_ordenacao(i) == _chave_ordenacao(v) for i in valor_doc for v in valor
+        )
+
+    chave_doc, chave_valor = _chave_ordenacao(valor_doc), _chave_ordenacao(valor)
+    # Desigualdades só comparam valores do mesmo tipo
+    if chave_doc[0] != chave_valor[0]:
+        return False
+    if operador == '<':
+        return chave_doc < chave_valor
+    if operador == '<=':
+        return chave_doc <= chave_valor
+    if operador == '>':
+        return chave_doc > chave_valor
+    if operador == '>=':
+        return chave_doc >= chave_valor
+    raise ValueError(f"Operador não suportado pelo FakeFirestore: {operador}")
+
+
+# =================================================================================
+# SNAPSHOTS E REFERÊNCIAS
+# =================================================================================
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: 'FakeDocumentReference', dados: Optional[Dict], create_time=None, update_time=None):
+        self.reference = reference
+        self._dados = dados
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = _agora()
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._dados is not None
+
+    def to_dict(self) -> Optional[Dict]:
+        return copy.deepcopy(self._dados) if self._dados is not None else None
+
+    def get(self, caminho: str):
+        if self._dados is None:
+            return None
+        valor = _obter_campo(self._dados, caminho)
+        if valor is _AUSENTE:
+            raise KeyError(caminho)
+        return copy.deepcopy(valor)
+
+
+class FakeDocumentReference:
+    def __init__(self, db: 'FakeFirestore', caminho_colecao: str, doc_id: str):
+        self._db = db
+        self._caminho_colecao = caminho_colecao
+        self.id = doc_id
+
+    @property
+    def path(self) -> str:
+        return f"{self._caminho_colecao}/{self.id}"
+
+    @property
+    def parent(self) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self._db, self._caminho_colecao)
+
+    def __eq__(self, outro):
+        return isinstance(outro, FakeDocumentReference) and outro.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"<FakeDocumentReference {self.path}>"
+
+    def collection(self, nome: str) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self._db, f"{self.path}/{nome}")
+
+    def collections(self) -> List['FakeCollectionReference']:
+        self._db.contador.registrar()
+        return [FakeCollectionReference(self._db, c) for c in self._db._subcolecoes(self.path)]
+
+    def get(self, field_paths: Optional[Iterable[str]] = None, transaction=None) -> FakeDocumentSnapshot:
+        self._db.contador.registrar(leituras=1)
+        return self._db._ler(self, field_paths)
+
+    def create(self, dados: Dict):
+        self._db.contador.registrar(escritas=1)
+        return self._db._aplicar([('create', self, dados, {})])
+
+    def set(self, dados: Dict, merge: bool = False):
+        self._db.contador.registrar(escritas=1)
+        return self._db._aplicar([('set', self, dados, {'merge': merge})])
+
+    def update(self, dados: Dict):
+        self._db.contador.registrar(escritas=1)
+        return self._db._aplicar([('update', self, dados, {})])
+
+    def delete(self):
+        self._db.contador.registrar(escritas=1)
+        return self._db._aplicar([('delete', self, None, {})])
+
+
+# =================================================================================
+# CONSULTAS
+# =================================================================================
+
+class FakeAggregationResult:
+    def __init__(self, alias: str, value: int):
+        self.alias = alias
+        self.value = value
+        self.read_time = _agora()
+
+
+class FakeAggregationQuery:
+    def __init__(self, query: 'FakeQuery', alias: Optional[str]):
+        self._query = query
+        self._alias = alias or 'field_1'
+
+    def get(self, transaction=None):
+        total = len(self._query._executar())
+        self._query._db.contador.registrar(leituras=max(1, math.ceil(total / 1000)))
+        return [[FakeAggregationResult(self._alias, total)]]
+
+
+class FakeQuery:
+    def __init__(self, db: 'FakeFirestore', caminho_colecao: str):
+        self._db = db
+        self._caminho_colecao = caminho_colecao
+        self._filtros: List[Tuple[str, str, Any]] = []
+        self._ordens: List[Tuple[str, str]] = []
+        self._limite: Optional[int] = None
+        self._offset = 0
+        self._projecao: Optional[List[str]] = None
+        self._inicio = None  # (valores, inclusivo)
+        self._fim = None     # (valores, inclusivo)
+
+    def _copiar(self) -> 'FakeQuery':
+        nova = FakeQuery(self._db, self._caminho_colecao)
+        nova._filtros = list(self._filtros)
+        nova._ordens = list(self._ordens)
+        nova._limite = self._limite
+        nova._offset = self._offset
+        nova._projecao = self._projecao
+        nova._inicio = self._inicio
+        nova._fim = self._fim
+        return nova
+
+    # --- Construção ---
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None) -> 'FakeQuery':
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        field_path = _caminho_do_campo(field_path)
+        nova = self._copiar()
+        nova._filtros.append((field_path, op_string, _normalizar_valor_filtro(field_path, value)))
+        return nova
+
+    def order_by(self, field_path, direction: str = ASCENDING) -> 'FakeQuery':
+        nova = self._copiar()
+        nova._ordens.append((_caminho_do_campo(field_path), DESCENDING if str(direction).upper().endswith('DESCENDING') else ASCENDING))
+        return nova
+
+    def limit(self, quantidade: int) -> 'FakeQuery':
+        nova = self._copiar()
+        nova._limite = quantidade
+        return nova
+
+    def offset(self, quantidade: int) -> 'FakeQuery':
+        nova = self._copiar()
+        nova._offset = quantidade
+        return nova
+
+    def select(self, field_paths: Iterable[str]) -> 'FakeQuery':
+        nova = self._copiar()
+        nova._projecao = list(field_paths)
+        return nova
+
+    def start_at(self, cursor) -> 'FakeQuery':
+        return self._com_cursor('_inicio', cursor, True)
+
+    def start_after(self, cursor) -> 'FakeQuery':
+        return self._com_cursor('_inicio', cursor, False)
+
+    def end_at(self, cursor) -> 'FakeQuery':
+        return self._com_cursor('_fim', cursor, True)
+
+    def end_before(self, cursor) -> 'FakeQuery':
+        return self._com_cursor('_fim', cursor, False)
+
+    def count(self, alias: Optional[str] = None) -> FakeAggregationQuery:
+        return FakeAggregationQuery(self, alias)
+
+    # --- Execução ---
+
+    def stream(self, transaction=None):
+        snapshots = self._executar()
+        self._db.contador.registrar(leituras=max(1, len(snapshots)))
+        return iter(snapshots)
+
+    def get(self, transaction=None) -> List[FakeDocumentSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+    # --- Interno ---
+
+    def _ordens_efetivas(self) -> List[Tuple[str, str]]:
+        ordens = list(self._ordens)
+        # Campos com desigualdade sem order_by explícito são ordenados implicitamente
+        if not ordens:
+            for campo, operador, _ in self._filtros:
+                if operador in ('<', '<=', '>', '>=', '!=', 'not-in') and campo != DOCUMENT_ID:
+                    ordens.append((campo, ASCENDING))
+                    break
+        if not any(campo == DOCUMENT_ID for campo, _ in ordens):
+            ordens.append((DOCUMENT_ID, ordens[-1][1] if ordens else ASCENDING))
+        return ordens
+
+    def _com_cursor(self, atributo: str, cursor, inclusivo: bool) -> 'FakeQuery':
+        nova = self._copiar()
+        ordens = nova._ordens_efetivas()
+        if isinstance(cursor, FakeDocumentSnapshot):
+            dados = cursor._dados or {}
+            valores = [_valor_do_campo(dados, cursor.id, campo) for campo, _ in ordens]
+        elif isinstance(cursor, dict):
+            valores = []
+            for campo, _ in ordens:
+                if campo not in cursor:
+                    break
+                valores.append(_normalizar_valor_filtro(campo, cursor[campo]))
+        else:
+            valores = [_normalizar_valor_filtro(campo, v) for (campo, _), v in zip(ordens, cursor)]
+        setattr(nova, atributo, (valores, inclusivo))
+        return nova
+
+    def _comparar_com_cursor(self, chave_doc: List, valores_cursor: List, ordens) -> int:
+        for (campo, direcao), valor_doc, valor_cursor in zip(ordens, chave_doc, valores_cursor):
+            a, b = _chave_ordenacao(valor_doc), _chave_ordenacao(valor_cursor)
+            if a != b:
+                resultado = -1 if a < b else 1
+                return -resultado if direcao == DESCENDING else resultado
+        return 0
+
+    def _executar(self) -> List[FakeDocumentSnapshot]:
+        ordens = self._ordens_efetivas()
+        candidatos = []
+        for doc_id, dados, metadados in self._db._documentos_da_colecao(self._caminho_colecao):
+            if not all(_atende_filtro(_valor_do_campo(dados, doc_id, c), op, v) for c, op, v in self._filtros):
+                continue
+            chave = [_valor_do_campo(dados, doc_id, campo) for campo, _ in ordens]
+            # order_by exclui documentos sem o campo
+            if any(valor is _AUSENTE for valor in chave):
+                continue
+            candidatos.append((chave, doc_id, dados, metadados))
+
+        for posicao in range(len(ordens) - 1, -1, -1):
+            candidatos.sort(
+                key=lambda c: _chave_ordenacao(c[0][posicao]),
+                reverse=ordens[posicao][1] == DESCENDING
+            )
+
+        if self._inicio:
+            valores, inclusivo = self._inicio
+            candidatos = [c for c in candidatos
+                          if (lambda r: r > 0 or (inclusivo and r == 0))(self._comparar_com_cursor(c[0], valores, ordens))]
+        if self._fim:
+            valores, inclusivo = self._fim
+            candidatos = [c for c in candidatos
+                          if (lambda r: r < 0 or (inclusivo and r == 0))(self._comparar_com_cursor(c[0], valores, ordens))]
+
+        candidatos = candidatos[self._offset:]
+        if self._limite is not None:
+            candidatos = candidatos[:self._limite]
+
+        snapshots = []
+        for _, doc_id, dados, metadados in candidatos:
+            if self._projecao is not None:
+                projetado = {}
+                for campo in self._projecao:
+                    valor = _obter_campo(dados, campo)
+                    if valor is not _AUSENTE:
+                        _definir_campo(projetado, campo, copy.deepcopy(valor))
+                dados = projetado
+            else:
+                dados = copy.deepcopy(dados)
+            snapshots.append(FakeDocumentSnapshot(
+                FakeDocumentReference(self._db, self._caminho_colecao, doc_id), dados, *metadados
+            ))
+        return snapshots
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db: 'FakeFirestore', caminho_colecao: str):
+        super().__init__(db, caminho_colecao)
+
+    @property
+    def id(self) -> str:
+        return self._caminho_colecao.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self) -> Optional[FakeDocumentReference]:
+        if '/' not in self._caminho_colecao:
+            return None
+        caminho_doc = self._caminho_colecao.rsplit('/', 1)[0]
+        colecao, doc_id = caminho_doc.rsplit('/', 1)
+        return FakeDocumentReference(self._db, colecao, doc_id)
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self._db, self._caminho_colecao, doc_id or _gerar_id())
+
+    def add(self, dados: Dict, document_id: Optional[str] = None):
+        ref = self.document(document_id)
+        ref.create(dados)
+        return _agora(), ref
+
+    def list_documents(self, page_size=None) -> List[FakeDocumentReference]:
+        self._db.contador.registrar()
+        return [self.document(doc_id) for doc_id, _, _ in self._db._documentos_da_colecao(self._caminho_colecao)]
+
+
+# =================================================================================
+# BATCH E TRANSAÇÃO
+# =================================================================================
+
+class FakeWriteBatch:
+    def __init__(self, db: 'FakeFirestore'):
+        self._db = db
+        self._operacoes = []
+
+    def create(self, ref, dados):
+        self._operacoes.append(('create', ref, dados, {}))
+        return self
+
+    def set(self, ref, dados, merge: bool = False):
+        self._operacoes.append(('set', ref, dados, {'merge': merge}))
+        return self
+
+    def update(self, ref, dados):
+        self._operacoes.append(('update', ref, dados, {}))
+        return self
+
+    def delete(self, ref):
+        self._operacoes.append(('delete', ref, None, {}))
+        return self
+
+    def __len__(self):
+        return len(self._operacoes)
+
+    def commit(self):
+        if len(self._operacoes) > 500:
+            raise ValueError("maximum 500 writes allowed per request")
+        self._db.contador.registrar(escritas=len(self._operacoes))
+        operacoes, self._operacoes = self._operacoes, []
+        return self._db._aplicar(operacoes)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """As leituras vão direto ao armazenamento; as escritas são aplicadas no commit."""
+
+    def get(self, ref_ou_query):
+        if isinstance(ref_ou_query, FakeDocumentReference):
+            return iter([ref_ou_query.get(transaction=self)])
+        return ref_ou_query.stream(transaction=self)
+
+    def get_all(self, refs, field_paths=None):
+        return self._db.get_all(refs, field_paths=field_paths, transaction=self)
+
+    def rollback(self):
+        self._operacoes = []
+
+
+def transactional(funcao):
+    """Substituto de firestore.transactional para o FakeFirestore (sem novas tentativas)."""
+    def wrapper(transaction: FakeTransaction, *args, **kwargs):
+        try:
+            resultado = funcao(transaction, *args, **kwargs)
+        except Exception:
+            transaction.rollback()
+            raise
+        transaction.commit()
+        return resultado
+    return wrapper
+
+
+# =================================================================================
+# CLIENTE
+# =================================================================================
+
+class FakeFirestore:
+    """Substituto em memória do firestore.client."""
+
+    def __init__(self):
+        self.contador = ContadorOperacoes()
+        self._lock = threading.RLock()
+        # caminho da coleção -> {doc_id: (dados, (create_time, update_time))}
+        self._colecoes: Dict[str, Dict[str, Tuple[Dict, Tuple[datetime, datetime]]]] = {}
+
+    # --- API pública ---
+
+    def collection(self, caminho: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, caminho.strip('/'))
+
+    def document(self, caminho: str) -> FakeDocumentReference:
+        colecao, doc_id = caminho.strip('/').rsplit('/', 1)
+        return FakeDocumentReference(self, colecao, doc_id)
+
+    def collections(self) -> List[FakeCollectionReference]:
+        self.contador.registrar()
+        with self._lock:
+            return [FakeCollectionReference(self, c) for c in self._colecoes if '/' not in c]
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def get_all(self, refs, field_paths=None, transaction=None):
+        refs = list(refs)
+        self.contador.registrar(leituras=len(refs))
+        return iter([self._ler(ref, field_paths) for ref in refs])
+
+    # --- Semeadura (não contabilizada) ---
+
+    def semear(self, caminho_colecao: str, doc_id: Optional[str], dados: Dict) -> str:
+        """Grava um documento diretamente, sem contabilizar (para montar a massa de dados)."""
+        doc_id = doc_id or _gerar_id()
+        agora = _agora()
+        with self._lock:
+            self._colecoes.setdefault(caminho_colecao.strip('/'), {})[doc_id] = (
+                _aplicar_transform({}, dados), (agora, agora)
+            )
+        return doc_id
+
+    def total_documentos(self) -> int:
+        with self._lock:
+            return sum(len(docs) for docs in self._colecoes.values())
+
+    # --- Interno ---
+
+    def _documentos_da_colecao(self, caminho: str):
+        with self._lock:
+            return [(doc_id, dados, metadados) for doc_id, (dados, metadados) in self._colecoes.get(caminho, {}).items()]
+
+    def _subcolecoes(self, caminho_doc: str) -> List[str]:
+        prefixo = caminho_doc + '/'
+        with self._lock:
+            return [c for c in self._colecoes
+                    if c.startswith(prefixo) and '/' not in c[len(prefixo):] and self._colecoes[c]]
+
+    def _ler(self, ref: FakeDocumentReference, field_paths=None) -> FakeDocumentSnapshot:
+        with self._lock:
+            registro = self._colecoes.get(ref._caminho_colecao, {}).get(ref.id)
+        if registro is None:
+            return FakeDocumentSnapshot(ref, None)
+        dados, (create_time, update_time) = registro
+        if field_paths is not None:
+            projetado = {}
+            for campo in field_paths:
+                valor = _obter_campo(dados, campo)
+                if valor is not _AUSENTE:
+                    _definir_campo(projetado, campo, valor)
+            dados = projetado
+        return FakeDocumentSnapshot(ref, copy.deepcopy(dados), create_time, update_time)
+
+    def _aplicar(self, operacoes):
+        """Aplica as operações de forma atômica (valida tudo antes de gravar)."""
+        agora = _agora()
+        with self._lock:
+            for tipo, ref, _, _ in operacoes:
+                existe = ref.id in self._colecoes.get(ref._caminho_colecao, {})
+                if tipo == 'update' and not existe:
+                    raise NotFound(f"No document to update: {ref.path}")
+                if tipo == 'create' and existe:
+                    raise ValueError(f"Document already exists: {ref.path}")
+
+            for tipo, ref, dados, opcoes in operacoes:
+                colecao = self._colecoes.setdefault(ref._caminho_colecao, {})
+                if tipo == 'delete':
+                    colecao.pop(ref.id, None)
+                    continue
+
+                atual, (create_time, _) = colecao.get(ref.id, ({}, (agora, agora)))
+                if tipo == 'update':
+                    novo = copy.deepcopy(atual)
+                    for caminho, valor in dados.items():
+                        _definir_campo(novo, caminho, valor)
+                elif tipo == 'set' and opcoes.get('merge'):
+                    novo = copy.deepcopy(atual)
+                    _mesclar(novo, dados)
+                else:
+                    novo = _aplicar_transform({}, dados)
+                colecao[ref.id] = (novo, (create_time, agora))
+
+        return [agora for _ in operacoes]
+
+
+# =================================================================================
+# CLIENTE ASSÍNCRONO
+# =================================================================================
+
+_TIPOS_ENVOLVIDOS = (FakeQuery, FakeDocumentReference, FakeAggregationQuery, FakeWriteBatch)
+# Chamadas que vão ao servidor e, no AsyncClient, são corrotinas
+_METODOS_ASSINCRONOS = frozenset({'get', 'create', 'set', 'update', 'delete', 'add', 'commit'})
+
+
+def _envolver(valor):
+    return _ProxyAssincrono(valor) if isinstance(valor, _TIPOS_ENVOLVIDOS) else valor
+
+
+def _desembrulhar(valor):
+    """Troca proxies pelos objetos síncronos (ex: referência usada num cursor ou num batch)."""
+    if isinstance(valor, _ProxyAssincrono):
+        return valor._alvo
+    if isinstance(valor, dict):
+        return {chave: _desembrulhar(v) for chave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return type(valor)(_desembrulhar(v) for v in valor)
+    return valor
+
+
+class _ProxyAssincrono:
+    """Envolve uma referência, consulta ou batch do FakeFirestore com a API assíncrona."""
+
+    def __init__(self, alvo):
+        self._alvo = alvo
+
+    def __getattr__(self, nome: str):
+        atributo = getattr(self._alvo, nome)
+        if not callable(atributo):
+            return _envolver(atributo)
+
+        def chamar(*args, **kwargs):
+            return atributo(*_desembrulhar(args), **_desembrulhar(kwargs))
+
+        if nome == 'stream':
+            async def stream(*args, **kwargs):
+                for snapshot in chamar(*args, **kwargs):
+                    yield snapshot
+            return stream
+
+        # No batch, só o commit vai ao servidor; set/update/delete apenas acumulam operações
+        assincrono = nome == 'commit' if isinstance(self._alvo, FakeWriteBatch) else nome in _METODOS_ASSINCRONOS
+        if assincrono:
+            async def corrotina(*args, **kwargs):
+                return _envolver(chamar(*args, **kwargs))
+            return corrotina
+
+        def metodo(*args, **kwargs):
+            return _envolver(chamar(*args, **kwargs))
+        return metodo
+
+    def __eq__(self, outro):
+        return self._alvo == _desembrulhar(outro)
+
+    def __hash__(self):
+        return hash(self._alvo)
+
+
+class FakeAsyncFirestore:
+    """Substituto em memória do google.cloud.firestore.AsyncClient, sobre um FakeFirestore."""
+
+    def __init__(self, db: FakeFirestore):
+        self.sincrono = db
+        self.contador = db.contador
+
+    def collection(self, caminho: str):
+        return _ProxyAssincrono(self.sincrono.collection(caminho))
+
+    def document(self, caminho: str):
+        return _ProxyAssincrono(self.sincrono.document(caminho))
+
+    def batch(self):
+        return _ProxyAssincrono(self.sincrono.batch())
+
+    async def get_all(self, refs, field_paths=None, transaction=None):
+        for snapshot in self.sincrono.get_all([_desembrulhar(ref) for ref in refs], field_paths=field_paths):
+            yield snapshot
@@ -0,0 +1,249 @@
+"""
+Wrapper do cliente do Firestore que contabiliza chamadas, leituras e escritas
+por rota (métricas em metricas.py).
+
+instrumentar_cliente(cliente) devolve um objeto com a mesma API do
+firestore.client (ou do AsyncClient): collection/document/batch/get_all
+retornam referências, consultas e batches envolvidos, que contam:
+
+- consultas (stream/get): 1 chamada; leituras = documentos retornados (mínimo 1,
+  como o Firestore cobra)
+- get de documento: 1 chamada, 1 leitura
+- get_all: 1 chamada, 1 leitura por documento pedido
+- count().get(): 1 chamada, 1 leitura a cada 1000 entradas de índice
+- set/update/create/delete/add de documento: 1 chamada, 1 escrita
+- batch: 1 escrita por operação acumulada, 1 chamada no commit
+
+Os snapshots retornados também são envolvidos, para que escritas feitas por
+snapshot.reference (ex: doc.reference.update(...)) sejam contadas.
+
+Os argumentos são desembrulhados antes de chegar à biblioteca (ex: uma
+referência usada num cursor start_after ou num batch), então o código do app
+não precisa saber do wrapper. Transações (db.transaction()) não são
+envolvidas, para não interferir com firestore.transactional: as leituras
+feitas com transaction=... em referências e consultas são contadas; as
+escritas feitas pelo objeto da transação não são.
+"""
+
+import inspect
+import math
+
+from google.cloud.firestore_v1.base_aggregation import BaseAggregationQuery
+from google.cloud.firestore_v1.base_batch import BaseWriteBatch
+from google.cloud.firestore_v1.base_collection import BaseCollectionReference
+from google.cloud.firestore_v1.base_document import BaseDocumentReference
+from google.cloud.firestore_v1.base_query import BaseQuery
+
+from metricas import registrar_firestore
+
+_ESCRITAS_DOCUMENTO = frozenset({'set', 'update', 'create', 'delete'})
+_ESCRITAS_BATCH = frozenset({'set', 'update', 'create', 'delete'})
+_LISTAGENS = frozenset({'collections', 'list_documents'})
+
+
+def _desembrulhar(valor):
+    """Troca os wrappers pelos objetos da biblioteca (devolve o próprio valor se não houver wrapper dentro)."""
+    if isinstance(valor, (_Instrumentado, _Snapshot)):
+        return valor._alvo
+    if isinstance(valor, dict):
+        novo = {chave: _desembrulhar(v) for chave, v in valor.items()}
+        return novo if any(novo[c] is not valor[c] for c in valor) else valor
+    if isinstance(valor, (list, tuple)):
+        novo = [_desembrulhar(v) for v in valor]
+        return type(valor)(novo) if any(n is not v for n, v in zip(novo, valor)) else valor
+    return valor
+
+
+def _envolver(valor):
+    if isinstance(valor, (BaseQuery, BaseCollectionReference, BaseDocumentReference, BaseAggregationQuery, BaseWriteBatch)):
+        return _Instrumentado(valor)
+    return valor
+
+
+def _contar_consulta(snapshots: list) -> list:
+    registrar_firestore('consulta', leituras=max(1, len(snapshots)))
+    return [_Snapshot(snapshot) for snapshot in snapshots]
+
+
+def _contar_leitura_documento(snapshot):
+    registrar_firestore('leitura_documento', leituras=1)
+    return _Snapshot(snapshot)
+
+
+def _contar_agregacao(resultado):
+    try:
+        total = max(int(r.value) for linha in resultado for r in linha)
+    except Exception:
+        total = 0
+    registrar_firestore('agregacao', leituras=max(1, math.ceil(total / 1000)))
+    return resultado
+
+
+def _depois(resultado, contar):
+    """Aplica 'contar' ao resultado da chamada (síncrona ou corrotina do AsyncClient) e retorna o que ele devolver."""
+    if inspect.isawaitable(resultado):
+        async def aguardar():
+            return contar(await resultado)
+        return aguardar()
+    return contar(resultado)
+
+
+def _contar_stream(iteravel, operacao: str, minimo: int):
+    """Envolve o iterador (síncrono ou assíncrono) contando os documentos recebidos."""
+    if hasattr(iteravel, '__aiter__'):
+        async def stream_assincrono():
+            quantidade = 0
+            try:
+                async for snapshot in iteravel:
+                    quantidade += 1
+                    yield _Snapshot(snapshot)
+            finally:
+                registrar_firestore(operacao, leituras=max(minimo, quantidade))
+        return stream_assincrono()
+
+    def stream():
+        quantidade = 0
+        try:
+            for snapshot in iteravel:
+                quantidade += 1
+                yield _Snapshot(snapshot)
+        finally:
+            registrar_firestore(operacao, leituras=max(minimo, quantidade))
+    return stream()
+
+
+class _Instrumentado:
+    """Referência, consulta, agregação ou batch do Firestore com contagem de operações."""
+
+    __slots__ = ('_alvo',)
+
+    def __init__(self, alvo):
+        self._alvo = alvo
+
+    def __getattr__(self, nome: str):
+        atributo = getattr(self._alvo, nome)
+        if not callable(atributo):
+            return _envolver(atributo)
+
+        alvo = self._alvo
+
+        def chamar(*args, **kwargs):
+            return atributo(*_desembrulhar(args), **_desembrulhar(kwargs))
+
+        if isinstance(alvo, BaseWriteBatch):
+            if nome in _ESCRITAS_BATCH:
+                def acumular(*args, **kwargs):
+                    registrar_firestore(escritas=1)
+                    chamar(*args, **kwargs)
+                    return self
+                return acumular
+            if nome == 'commit':
+                def commit(*args, **kwargs):
+                    registrar_firestore('commit')
+                    return chamar(*args, **kwargs)
+                return commit
+
+        elif isinstance(alvo, BaseAggregationQuery):
+            if nome == 'get':
+                return lambda *args, **kwargs: _depois(chamar(*args, **kwargs), _contar_agregacao)
+
+        elif isinstance(alvo, BaseDocumentReference):
+            if nome == 'get':
+                return lambda *args, **kwargs: _depois(chamar(*args, **kwargs), _contar_leitura_documento)
+            if nome in _ESCRITAS_DOCUMENTO:
+                def escrever(*args, **kwargs):
+                    registrar_firestore('escrita', escritas=1)
+                    return chamar(*args, **kwargs)
+                return escrever
+
+        else:  # consultas e coleções
+            if nome == 'stream':
+                return lambda *args, **kwargs: _contar_stream(chamar(*args, **kwargs), 'consulta', 1)
+            if nome == 'get':
+                return lambda *args, **kwargs: _depois(chamar(*args, **kwargs), _contar_consulta)
+            if nome == 'add':
+                def adicionar(*args, **kwargs):
+                    registrar_firestore('escrita', escritas=1)
+                    return chamar(*args, **kwargs)
+                return adicionar
+
+        if nome in _LISTAGENS:
+            def listar(*args, **kwargs):
+                registrar_firestore('listagem')
+                return chamar(*args, **kwargs)
+            return listar
+
+        return lambda *args, **kwargs: _envolver(chamar(*args, **kwargs))
+
+    def __eq__(self, outro):
+        return self._alvo == _desembrulhar(outro)
+
+    def __hash__(self):
+        return hash(self._alvo)
+
+    def __len__(self):
+        return len(self._alvo)
+
+    def __repr__(self):
+        return f"<instrumentado {self._alvo!r}>"
+
+
+class _Snapshot:
+    """DocumentSnapshot cuja 'reference' é instrumentada; o restante é repassado ao snapshot original."""
+
+    __slots__ = ('_alvo',)
+
+    def __init__(self, alvo):
+        self._alvo = alvo
+
+    @property
+    def reference(self):
+        return _Instrumentado(self._alvo.reference)
+
+    def __getattr__(self, nome: str):
+        return getattr(self._alvo, nome)
+
+    def __eq__(self, outro):
+        return self._alvo == _desembrulhar(outro)
+
+    def __hash__(self):
+        return hash(self._alvo)
+
+    def __repr__(self):
+        return f"<instrumentado {self._alvo!r}>"
+
+
+class ClienteInstrumentado:
+    """Cliente do Firestore (síncrono ou AsyncClient) com contagem de operações por rota."""
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+
+    def __getattr__(self, nome: str):
+        # transaction(), project, close() etc. passam direto para o cliente
+        return getattr(self._cliente, nome)
+
+    def collection(self, *caminho: str):
+        return _Instrumentado(self._cliente.collection(*caminho))
+
+    def collection_group(self, colecao_id: str):
+        return _Instrumentado(self._cliente.collection_group(colecao_id))
+
+    def document(self, *caminho: str):
+        return _Instrumentado(self._cliente.document(*caminho))
+
+    def batch(self):
+        return _Instrumentado(self._cliente.batch())
+
+    def collections(self, *args, **kwargs):
+        registrar_firestore('listagem')
+        return self._cliente.collections(*args, **kwargs)
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_desembrulhar(ref) for ref in references]
+        return _contar_stream(self._cliente.get_all(references, *args, **_desembrulhar(kwargs)), 'leitura_em_lote', 0)
+
+
+def instrumentar_cliente(cliente) -> ClienteInstrumentado:
+    """Envolve o cliente do Firestore para alimentar as métricas de metricas.py."""
+    return ClienteInstrumentado(cliente)
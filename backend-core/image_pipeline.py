@@ -0,0 +1,190 @@
+"""
+Pipeline de processamento de imagens dos uploads (variantes original/medium/thumbnail).
+
+upload_and_resize_image era 'async', mas decodificava, redimensionava e
+codificava com o PIL e fazia três upload_from_string em sequência direto no
+event loop: uma foto grande travava todas as outras requisições do mesmo
+worker do uvicorn. Agora:
+
+1. Decodificação, redimensionamento e codificação rodam num pool de processos
+   (o PIL segura o GIL em boa parte do trabalho, então threads não bastam).
+2. As variantes são enviadas ao Cloud Storage em paralelo, em threads, com o
+   backend de cloud_storage.py (GCS com o cliente compartilhado, ou local).
+3. Além do JPEG (chaves 'original', 'medium', 'thumbnail', usadas pelos apps),
+   as variantes podem ser geradas em WebP (chaves '<variante>_webp').
+4. Cada etapa é cronometrada (fila, decodificação, redimensionamento,
+   codificação, upload) para log e para o header Server-Timing.
+
+Configuração (variáveis de ambiente):
+    IMAGE_PIPELINE_MAX_PROCESSOS=2   # 0 = processa em thread (sem pool de processos)
+    IMAGE_PIPELINE_FORMATOS=jpeg,webp
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+MAX_PROCESSOS = int(os.getenv('IMAGE_PIPELINE_MAX_PROCESSOS', str(min(2, os.cpu_count() or 1))))
+FORMATOS = tuple(f.strip().lower() for f in os.getenv('IMAGE_PIPELINE_FORMATOS', 'jpeg,webp').split(',') if f.strip())
+
+# (nome da variante, maior lado em pixels ou None para manter o tamanho, qualidade JPEG, qualidade WebP)
+# Cada variante é reduzida a partir da anterior, como no fluxo original.
+VARIANTES = (
+    ('original', None, 90, 85),
+    ('medium', 800, 85, 80),
+    ('thumbnail', 200, 80, 75),
+)
+
+_FORMATOS_PIL = {
+    'jpeg': ('JPEG', 'image/jpeg', '.jpeg'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+}
+
+
+# =================================================================================
+# PROCESSAMENTO (executado no pool de processos)
+# =================================================================================
+
+def processar_variantes(conteudo: bytes, formatos: Tuple[str, ...] = FORMATOS) -> Tuple[List[Tuple], Dict[str, float]]:
+    """
+    Decodifica a imagem e gera as variantes em cada formato.
+    Função de módulo (picklable) para poder rodar no ProcessPoolExecutor.
+
+    Returns:
+        ([(variante, formato, bytes, content_type, extensão), ...], {etapa: milissegundos})
+    """
+    tempos = {}
+    inicio = time.perf_counter()
+    image = Image.open(BytesIO(conteudo))
+    image.load()
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    tempos['decodificacao'] = (time.perf_counter() - inicio) * 1000
+
+    formatos_validos = [f for f in formatos if f in _FORMATOS_PIL and (f != 'webp' or features.check('webp'))]
+    if 'jpeg' not in formatos_validos:
+        # JPEG é o formato consumido pelos apps: sempre gerado
+        formatos_validos.insert(0, 'jpeg')
+
+    resultado = []
+    tempos['redimensionamento'] = 0.0
+    tempos['codificacao'] = 0.0
+    for nome, lado_maximo, qualidade_jpeg, qualidade_webp in VARIANTES:
+        if lado_maximo:
+            inicio = time.perf_counter()
+            image.thumbnail((lado_maximo, lado_maximo))
+            tempos['redimensionamento'] += (time.perf_counter() - inicio) * 1000
+
+        for formato in formatos_validos:
+            formato_pil, content_type, extensao = _FORMATOS_PIL[formato]
+            inicio = time.perf_counter()
+            buffer = BytesIO()
+            if formato == 'jpeg':
+                image.save(buffer, format=formato_pil, quality=qualidade_jpeg)
+            else:
+                image.save(buffer, format=formato_pil, quality=qualidade_webp, method=4)
+            tempos['codificacao'] += (time.perf_counter() - inicio) * 1000
+            resultado.append((nome, formato, buffer.getvalue(), content_type, extensao))
+
+    return resultado, tempos
+
+
+# =================================================================================
+# POOL DE PROCESSOS
+# =================================================================================
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Pool compartilhado, criado no primeiro uso. None quando IMAGE_PIPELINE_MAX_PROCESSOS=0."""
+    global _process_pool
+    if MAX_PROCESSOS <= 0:
+        return None
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                # 'spawn': o processo do app já tem threads (gRPC do Firestore); fork com threads é inseguro
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=MAX_PROCESSOS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _process_pool
+
+
+def encerrar_pool():
+    """Encerra o pool de processos (chamado no shutdown da aplicação)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+async def _processar_fora_do_event_loop(conteudo: bytes) -> Tuple[List[Tuple], Dict[str, float]]:
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+    if pool is None:
+        return await asyncio.to_thread(processar_variantes, conteudo, FORMATOS)
+    try:
+        return await loop.run_in_executor(pool, processar_variantes, conteudo, FORMATOS)
+    except BrokenProcessPool:
+        # Um worker morreu (ex.: falta de memória): recria o pool na próxima chamada e processa em thread
+        logger.error("❌ Pool de processos de imagem quebrado; recriando e processando em thread")
+        encerrar_pool()
+        return await asyncio.to_thread(processar_variantes, conteudo, FORMATOS)
+
+
+# =================================================================================
+# PIPELINE
+# =================================================================================
+
+async def processar_e_enviar_imagem(file_content: bytes, filename_base: str, bucket_name: str) -> Tuple[Dict[str, str], Dict[str, float]]:
+    """
+    Gera as variantes da imagem fora do event loop e as envia em paralelo ao Cloud Storage.
+
+    Returns:
+        ({variante: url pública}, {etapa: milissegundos})
+    """
+    from cloud_storage import get_backend_armazenamento
+
+    inicio_total = time.perf_counter()
+    variantes, tempos = await _processar_fora_do_event_loop(file_content)
+    tempo_processamento = (time.perf_counter() - inicio_total) * 1000
+    tempos['fila'] = max(0.0, tempo_processamento - sum(tempos.values()))
+
+    backend = get_backend_armazenamento(bucket_name)
+    inicio_upload = time.perf_counter()
+    chaves = []
+    envios = []
+    for nome, formato, dados, content_type, extensao in variantes:
+        chaves.append(nome if formato == 'jpeg' else f"{nome}_{formato}")
+        envios.append(asyncio.to_thread(
+            backend.enviar_bytes, f"uploads/{filename_base}_{nome}{extensao}", dados, content_type
+        ))
+    urls_enviadas = await asyncio.gather(*envios)
+    tempos['upload'] = (time.perf_counter() - inicio_upload) * 1000
+    tempos['total'] = (time.perf_counter() - inicio_total) * 1000
+
+    logger.info(
+        f"🖼️ Imagem {filename_base}: {len(variantes)} variante(s), "
+        + ", ".join(f"{etapa}={ms:.0f}ms" for etapa, ms in tempos.items())
+    )
+    return dict(zip(chaves, urls_enviadas)), tempos
+
+
+def formatar_server_timing(tempos: Dict[str, float]) -> str:
+    """Valor do header Server-Timing (ex.: 'decodificacao;dur=12.3, upload;dur=80.1')."""
+    return ", ".join(f"{etapa};dur={ms:.1f}" for etapa, ms in tempos.items())
@@ -0,0 +1,180 @@
+"""
+Configuração de logging da aplicação: saída estruturada, nível por módulo,
+correlação por requisição e amostragem de eventos de debug.
+
+- Formato: em JSON (uma linha por evento, com 'severity' e 'message', como o
+  Cloud Logging espera) quando roda no Cloud Run, ou texto no desenvolvimento.
+- Cada evento leva o request_id da requisição em andamento (header
+  X-Request-ID do cliente, o trace do X-Cloud-Trace-Context ou um UUID novo),
+  devolvido na resposta em X-Request-ID. No JSON, o trace também é gravado em
+  logging.googleapis.com/trace, agrupando os logs da requisição no console.
+- Nível global em LOG_LEVEL e por módulo em LOG_LEVELS (ex: o crud em
+  WARNING e o auth em DEBUG durante uma investigação, sem novo deploy).
+- debug_amostrado() registra só uma fração dos eventos de debug de alto
+  volume (por documento, por item de lista).
+
+REGRAS PARA OS LOGS DO APP:
+- Formatação preguiçosa: logger.debug("Usuário %s", usuario_id) e nunca
+  f-strings, para que eventos abaixo do nível configurado não custem nada.
+- Sem dados de saúde ou pessoais nos logs (nomes, e-mails, telefones,
+  documentos de pacientes, conteúdo de notificações): apenas IDs.
+
+O request_id fica numa ContextVar; as threads do query_executor, do
+bulk_writer e do asyncio.to_thread herdam o contexto.
+
+Configuração (variáveis de ambiente):
+    LOG_LEVEL=INFO
+    LOG_LEVELS=crud=WARNING,auth=DEBUG    # nível por logger (nome do módulo)
+    LOG_FORMAT=json | texto               # padrão: json no Cloud Run (K_SERVICE), texto fora dele
+    LOG_SAMPLE_RATE=0.01                  # fração dos eventos de debug_amostrado() registrados
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json' if os.getenv('K_SERVICE') else 'texto').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+
+_PROJETO = os.getenv('GOOGLE_CLOUD_PROJECT') or os.getenv('GCLOUD_PROJECT')
+
+# Tamanho máximo aceito para um X-Request-ID vindo do cliente
+_MAX_REQUEST_ID = 128
+
+logger = logging.getLogger(__name__)
+
+
+# =================================================================================
+# CONTEXTO DA REQUISIÇÃO
+# =================================================================================
+
+class _ContextoLog:
+    __slots__ = ('request_id', 'trace')
+
+    def __init__(self, request_id: str, trace: Optional[str]):
+        self.request_id = request_id
+        self.trace = trace
+
+
+_contexto_atual: contextvars.ContextVar[Optional[_ContextoLog]] = contextvars.ContextVar(
+    'contexto_log', default=None
+)
+
+
+def request_id_atual() -> Optional[str]:
+    """ID da requisição em andamento (None fora de requisições)."""
+    contexto = _contexto_atual.get()
+    return contexto.request_id if contexto is not None else None
+
+
+def _extrair_trace(headers) -> Optional[str]:
+    # X-Cloud-Trace-Context: TRACE_ID/SPAN_ID;o=1
+    valor = headers.get('x-cloud-trace-context')
+    if not valor:
+        return None
+    return valor.split('/', 1)[0].strip() or None
+
+
+@contextmanager
+def escopo_requisicao_log(headers):
+    """
+    Abre o contexto de log da requisição (usado pelo middleware em main.py) e
+    devolve o request_id, que o middleware repassa no header X-Request-ID.
+    """
+    trace = _extrair_trace(headers)
+    request_id = (headers.get('x-request-id') or '').strip()[:_MAX_REQUEST_ID] or trace or uuid.uuid4().hex
+    token = _contexto_atual.set(_ContextoLog(request_id, trace))
+    try:
+        yield request_id
+    finally:
+        _contexto_atual.reset(token)
+
+
+class _FiltroContexto(logging.Filter):
+    """Acrescenta request_id e trace da requisição em andamento a cada registro."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        contexto = _contexto_atual.get()
+        record.request_id = contexto.request_id if contexto is not None else '-'
+        record.trace = contexto.trace if contexto is not None else None
+        return True
+
+
+# =================================================================================
+# FORMATOS
+# =================================================================================
+
+class _FormatoJson(logging.Formatter):
+    """Uma linha JSON por evento, no formato de logs estruturados do Cloud Logging."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        evento = {
+            'severity': record.levelname,
+            'message': record.getMessage(),
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        trace = getattr(record, 'trace', None)
+        if trace and _PROJETO:
+            evento['logging.googleapis.com/trace'] = f"projects/{_PROJETO}/traces/{trace}"
+        if record.exc_info:
+            evento['exception'] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+_FORMATO_TEXTO = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+
+
+def _niveis_por_modulo(valor: str) -> Dict[str, str]:
+    niveis = {}
+    for item in valor.split(','):
+        nome, separador, nivel = item.partition('=')
+        if separador and nome.strip() and nivel.strip():
+            niveis[nome.strip()] = nivel.strip().upper()
+    return niveis
+
+
+def configurar_logging():
+    """
+    Configura o logger raiz (substitui logging.basicConfig). Chamado uma vez
+    no import de main.py, antes dos demais módulos registrarem eventos.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(_FiltroContexto())
+    handler.setFormatter(_FormatoJson() if LOG_FORMAT == 'json' else logging.Formatter(_FORMATO_TEXTO))
+
+    raiz = logging.getLogger()
+    for existente in list(raiz.handlers):
+        raiz.removeHandler(existente)
+    raiz.addHandler(handler)
+    raiz.setLevel(LOG_LEVEL)
+
+    for nome, nivel in _niveis_por_modulo(LOG_LEVELS).items():
+        try:
+            logging.getLogger(nome).setLevel(nivel)
+        except ValueError:
+            logger.warning("⚠️ Nível de log inválido em LOG_LEVELS para %s: %s", nome, nivel)
+
+
+# =================================================================================
+# AMOSTRAGEM
+# =================================================================================
+
+def debug_amostrado(log: logging.Logger, mensagem: str, *args):
+    """
+    logger.debug para eventos de alto volume (por documento, por item): só
+    uma fração LOG_SAMPLE_RATE é registrada. Não custa nada se DEBUG estiver
+    desligado para o logger.
+    """
+    if log.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE:
+        log.debug(mensagem, *args)
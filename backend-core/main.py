@@ -1,6 +1,6 @@
 # barbearia-backend/main.py (Versão estável com Checklist do Técnico)
 
-from fastapi import FastAPI, Depends, HTTPException, status, Header, Path, Query, UploadFile, File, Request
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Path, Query, UploadFile, File, Request, Response
 from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
@@ -10,8 +10,13 @@ import schemas
 import crud
 import logging
 from datetime import date, timedelta, datetime
-from crypto_utils import decrypt_data
+from crypto_utils import decrypt_data, decrypt_document
+from query_executor import executar_em_paralelo, PrazoExcedidoError
+from data_loader import escopo_requisicao, get_carregador
+import metricas
+from logging_config import configurar_logging, escopo_requisicao_log
 from database import initialize_firebase_app, get_db
+from firestore_async import get_async_db
 from auth import (
     get_current_user_firebase, get_super_admin_user, get_current_admin_user,
     get_current_profissional_user, get_optional_current_user_firebase,
@@ -19,13 +24,18 @@ from auth import (
     get_current_admin_or_profissional_user, get_current_tecnico_user,
     get_current_admin_or_tecnico_user,
     get_paciente_autorizado_anamnese, get_current_medico_user, get_relatorio_autorizado,
-    get_admin_or_profissional_autorizado_paciente
+    get_admin_or_profissional_autorizado_paciente,
+    get_current_user_firebase_async, validate_negocio_id_async, get_paciente_autorizado_async
 )
+import repositorio_async
 from firebase_admin import firestore, messaging
 from pydantic import BaseModel
-from google.cloud import storage
-from PIL import Image
-from io import BytesIO
+from cloud_storage import get_bucket, get_backend_armazenamento
+from upload_streaming import (
+    receber_uploads_multipart, ResultadoUpload, ArquivoMuitoGrandeError, UploadInvalidoError, UPLOAD_MAX_ARQUIVOS
+)
+from image_pipeline import processar_e_enviar_imagem, formatar_server_timing, encerrar_pool
+import agendador
 import os
 import uuid
 from fastapi.responses import JSONResponse
@@ -61,6 +71,9 @@ class NotificarLembreteExameResponse(BaseModel):
     message: str
     exame_id: str
 
+class ProcessarEventoOutboxRequest(BaseModel):
+    evento_id: str
+
 # --- Configuração da Aplicação ---
 app = FastAPI(
     title="API de Agendamento Multi-Tenant",
@@ -74,12 +87,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Permite todos os métodos (GET, POST, etc.)
     allow_headers=["*"],  # Permite todos os cabeçalhos
+    # Cursor da paginação (/notificacoes, /medico/relatorios, /feed) e ID de correlação dos logs
+    expose_headers=["X-Next-Cursor", "X-Request-ID"],
 )
+
+@app.middleware("http")
+async def escopo_carregador_documentos(request: Request, call_next):
+    """Abre o escopo do DataLoader: leituras por ID em lote e memorizadas durante a requisição."""
+    with escopo_requisicao():
+        return await call_next(request)
 # --- FIM DO BLOCO ---
 
+@app.middleware("http")
+async def metricas_por_rota(request: Request, call_next):
+    """Latência e operações de Firestore por rota, expostas em /metrics (ver metricas.py)."""
+    with metricas.medir_requisicao(request) as medicao:
+        response = await call_next(request)
+        medicao.status = response.status_code
+        return response
+
+
+@app.middleware("http")
+async def correlacao_de_logs(request: Request, call_next):
+    """Associa os logs da requisição a um request_id, devolvido em X-Request-ID (ver logging_config.py)."""
+    with escopo_requisicao_log(request.headers) as request_id:
+        response = await call_next(request)
+        response.headers['X-Request-ID'] = request_id
+        return response
+
 
-# Adicionar um logger para ajudar no debug
-logging.basicConfig(level=logging.INFO)
+# Logs estruturados, com nível por módulo (LOG_LEVEL / LOG_LEVELS)
+configurar_logging()
 logger = logging.getLogger(__name__)
 
 CLOUD_STORAGE_BUCKET_NAME_GLOBAL = os.getenv("CLOUD_STORAGE_BUCKET_NAME")
@@ -90,6 +128,16 @@ CLOUD_STORAGE_BUCKET_NAME_GLOBAL = os.getenv("CLOUD_STORAGE_BUCKET_NAME")
 def startup_event():
     """Inicializa a conexão com o Firebase ao iniciar a aplicação."""
     initialize_firebase_app()
+    # Backend local do agendador: recarrega os jobs pendentes e inicia a roda de tempo
+    agendador.iniciar(next(get_db()))
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Fecha a conexão HTTP/2 compartilhada com o APNs."""
+    from apns_service import get_apns_service
+    get_apns_service().close()
+    encerrar_pool()
+    agendador.encerrar()
 
 # --- Servir imagens de perfil ---
 @app.get("/uploads/profiles/{filename}", tags=["Arquivos"])
@@ -103,11 +151,8 @@ def get_profile_image(filename: str):
     
     # Se não existir localmente, tentar buscar no Cloud Storage
     try:
-        from google.cloud import storage
-        
         bucket_name = os.getenv('CLOUD_STORAGE_BUCKET_NAME', 'barbearia-app-fotoss')
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
+        bucket = get_bucket(bucket_name)
         blob = bucket.blob(f"profiles/{filename}")
         
         if blob.exists():
@@ -125,6 +170,17 @@ def get_profile_image(filename: str):
 def root():
     return {"mensagem": "API de Agendamento Multi-Tenant funcionando", "versao": "2.2.0-FINAL"}
 
+# --- Métricas (Prometheus) ---
+@app.get("/metrics", include_in_schema=False)
+def get_metricas(authorization: Optional[str] = Header(None)):
+    """Métricas no formato texto do Prometheus (ver metricas.py)."""
+    if not metricas.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not metricas.autorizado(authorization):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de métricas inválido.")
+    corpo, content_type = metricas.exportar()
+    return Response(content=corpo, media_type=content_type)
+
 # =================================================================================
 # ENDPOINTS DE ADMINISTRAÇÃO DA PLATAFORMA (SUPER-ADMIN)
 # =================================================================================
@@ -489,10 +545,9 @@ def adicionar_medicacao(
 
     # Se consulta_id não foi enviado, usa a consulta mais recente
     if not final_consulta_id:
-        consultas = crud.listar_consultas(db, paciente_id)
-        if not consultas:
+        final_consulta_id = crud.get_plano_ativo_id(db, paciente_id)
+        if not final_consulta_id:
             raise HTTPException(status_code=400, detail="Paciente não possui consultas. Crie uma consulta primeiro.")
-        final_consulta_id = consultas[0]['id']
 
     return crud.prescrever_medicacao(db, medicacao_data, final_consulta_id)
 
@@ -512,10 +567,9 @@ def adicionar_checklist_item(
 
     # Se consulta_id não foi enviado, usa a consulta mais recente
     if not final_consulta_id:
-        consultas = crud.listar_consultas(db, paciente_id)
-        if not consultas:
+        final_consulta_id = crud.get_plano_ativo_id(db, paciente_id)
+        if not final_consulta_id:
             raise HTTPException(status_code=400, detail="Paciente não possui consultas. Crie uma consulta primeiro.")
-        final_consulta_id = consultas[0]['id']
 
     return crud.adicionar_item_checklist(db, item_data, final_consulta_id)
 
@@ -535,29 +589,24 @@ def adicionar_orientacao(
 
     # Se consulta_id não foi enviado, usa a consulta mais recente
     if not final_consulta_id:
-        consultas = crud.listar_consultas(db, paciente_id)
-        if not consultas:
+        final_consulta_id = crud.get_plano_ativo_id(db, paciente_id)
+        if not final_consulta_id:
             raise HTTPException(status_code=400, detail="Paciente não possui consultas. Crie uma consulta primeiro.")
-        final_consulta_id = consultas[0]['id']
 
     return crud.criar_orientacao(db, orientacao_data, final_consulta_id)
 
 @app.get("/pacientes/{paciente_id}/ficha-completa", response_model=schemas.FichaCompletaResponse, tags=["Ficha do Paciente"])
-def get_ficha_completa(
+async def get_ficha_completa(
     paciente_id: str,
     consulta_id: Optional[str] = Query(None, description="Opcional: força o retorno da consulta informada."),
-    current_user: schemas.UsuarioProfile = Depends(get_paciente_autorizado),
-    db: firestore.client = Depends(get_db)
+    current_user: schemas.UsuarioProfile = Depends(get_paciente_autorizado_async),
+    db_async = Depends(get_async_db)
 ):
     """(Autorizado) Retorna a ficha clínica do paciente (sem os exames)."""
-    if consulta_id:
-        return {
-            "consultas": crud.listar_consultas(db, paciente_id),
-            "medicacoes": crud.listar_medicacoes(db, paciente_id, consulta_id),
-            "checklist": crud._dedup_checklist_items(crud.listar_checklist(db, paciente_id, consulta_id)),
-            "orientacoes": crud.listar_orientacoes(db, paciente_id, consulta_id),
-        }
-    return crud.get_ficha_completa_paciente(db, paciente_id)
+    try:
+        return await repositorio_async.get_ficha_completa_paciente(db_async, paciente_id, consulta_id)
+    except PrazoExcedidoError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
 
 @app.get("/pacientes/{paciente_id}/consultas", response_model=List[schemas.ConsultaResponse], tags=["Ficha do Paciente"])
 def get_consultas(
@@ -986,11 +1035,11 @@ def listar_tecnicos_supervisionados_por_paciente_endpoint(
     
     if is_admin:
         # Lógica para admin ver todos os técnicos vinculados ao paciente
-        paciente_doc = db.collection('usuarios').document(paciente_id).get()
-        if not paciente_doc.exists:
+        # Já lido por get_paciente_autorizado (mapa de identidade da requisição)
+        paciente_data = get_carregador(db).carregar('usuarios', paciente_id)
+        if paciente_data is None:
             raise HTTPException(status_code=404, detail="Paciente não encontrado.")
         
-        paciente_data = paciente_doc.to_dict()
         tecnicos_vinculados_ids = paciente_data.get('tecnicos_ids', [])
         
         tecnicos_perfil = []
@@ -1182,10 +1231,10 @@ def deletar_meu_bloqueio(
     return
 
 @app.get("/me/pacientes", response_model=List[schemas.PacienteProfile], tags=["Profissional - Autogestão"])
-def listar_meus_pacientes(
-    negocio_id: str = Depends(validate_negocio_id),
-    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase),
-    db: firestore.client = Depends(get_db)
+async def listar_meus_pacientes(
+    negocio_id: str = Depends(validate_negocio_id_async),
+    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase_async),
+    db_async = Depends(get_async_db)
 ):
     """
     (Gestor, Enfermeiro, Técnico ou Super Admin)
@@ -1205,7 +1254,7 @@ def listar_meus_pacientes(
                 detail="Acesso negado: seu perfil não tem permissão para visualizar pacientes."
             )
 
-    pacientes = crud.listar_pacientes_por_profissional_ou_tecnico(db, negocio_id, current_user.id, user_role)
+    pacientes = await repositorio_async.listar_pacientes_por_profissional_ou_tecnico(db_async, negocio_id, current_user.id, user_role)
     return pacientes
 
 # =================================================================================
@@ -1232,12 +1281,31 @@ def criar_postagem(
 @app.get("/feed", response_model=List[schemas.PostagemResponse], tags=["Feed e Interações"])
 def get_feed(
     negocio_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Tamanho da página (sem limit, retorna o feed completo)"),
+    cursor: Optional[str] = Query(None, description="Cursor retornado no header X-Next-Cursor da página anterior"),
     db: firestore.client = Depends(get_db),
     current_user: Optional[schemas.UsuarioProfile] = Depends(get_optional_current_user_firebase)
 ):
-    """(Público) Retorna o feed de postagens de um negócio específico."""
+    """
+    (Público) Retorna o feed de postagens de um negócio específico.
+    Com 'limit', retorna uma página; o cursor da próxima página vem no header
+    X-Next-Cursor (ausente na última página).
+    """
     user_id = current_user.id if current_user else None
-    return crud.listar_feed_por_negocio(db, negocio_id, user_id)
+    if limit is None:
+        if cursor:
+            raise HTTPException(status_code=400, detail="O parâmetro 'cursor' exige 'limit'.")
+        return crud.listar_feed_por_negocio(db, negocio_id, user_id)
+
+    try:
+        pagina = crud.listar_feed_por_negocio_paginado(db, negocio_id, limit, cursor, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if pagina["proximo_cursor"]:
+        response.headers["X-Next-Cursor"] = pagina["proximo_cursor"]
+    return pagina["postagens"]
 
 @app.post("/postagens/{postagem_id}/curtir", tags=["Feed e Interações"])
 def curtir_postagem(
@@ -1322,20 +1390,39 @@ def listar_avaliacoes(
 # =================================================================================
 
 @app.get("/notificacoes", response_model=List[schemas.NotificacaoResponse], tags=["Notificações"])
-def get_notificacoes(
-    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase),
-    db: firestore.client = Depends(get_db)
+async def get_notificacoes(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Tamanho da página (sem limit, retorna o histórico completo)"),
+    cursor: Optional[str] = Query(None, description="Cursor retornado no header X-Next-Cursor da página anterior"),
+    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase_async),
+    db_async = Depends(get_async_db)
 ):
-    """(Autenticado) Retorna o histórico de notificações do usuário."""
-    return crud.listar_notificacoes(db, current_user.id)
+    """
+    (Autenticado) Retorna o histórico de notificações do usuário.
+    Com 'limit', retorna uma página; o cursor da próxima página vem no header
+    X-Next-Cursor (ausente na última página).
+    """
+    if limit is None:
+        if cursor:
+            raise HTTPException(status_code=400, detail="O parâmetro 'cursor' exige 'limit'.")
+        return await repositorio_async.listar_notificacoes(db_async, current_user.id)
+
+    try:
+        pagina = await repositorio_async.listar_notificacoes_paginado(db_async, current_user.id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if pagina["proximo_cursor"]:
+        response.headers["X-Next-Cursor"] = pagina["proximo_cursor"]
+    return pagina["notificacoes"]
 
 @app.get("/notificacoes/nao-lidas/contagem", response_model=schemas.NotificacaoContagemResponse, tags=["Notificações"])
-def get_contagem_notificacoes_nao_lidas(
-    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase),
-    db: firestore.client = Depends(get_db)
+async def get_contagem_notificacoes_nao_lidas(
+    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase_async),
+    db_async = Depends(get_async_db)
 ):
     """(Autenticado) Retorna o número de notificações não lidas."""
-    count = crud.contar_notificacoes_nao_lidas(db, current_user.id)
+    count = await repositorio_async.contar_notificacoes_nao_lidas(db_async, current_user.id)
     return {"count": count}
 
 @app.post("/notificacoes/ler-todas", status_code=status.HTTP_204_NO_CONTENT, tags=["Notificações"])
@@ -1423,7 +1510,7 @@ def sync_user_profile(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Ocorreu um erro interno no servidor.")
 
 @app.get("/me/profile", response_model=schemas.UsuarioProfile, tags=["Usuários"])
-def get_me_profile(current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase)):
+async def get_me_profile(current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase_async)):
     """Retorna o perfil completo do usuário autenticado."""
     return current_user
 
@@ -1769,6 +1856,36 @@ def listar_profissionais(
 
 # Em main.py
 
+# Limites da consulta de disponibilidade por período
+MAX_DIAS_DISPONIBILIDADE = 31
+MAX_PROFISSIONAIS_DISPONIBILIDADE = 20
+
+# Declarado antes de /profissionais/{profissional_id} para não ser capturado por ele
+@app.get("/profissionais/horarios-disponiveis", response_model=List[schemas.HorariosDisponiveisProfissional], tags=["Agendamentos"])
+def get_horarios_disponiveis_periodo(
+    inicio: date = Query(..., description="Primeiro dia do período (formato: AAAA-MM-DD)."),
+    fim: date = Query(..., description="Último dia do período, inclusivo (formato: AAAA-MM-DD)."),
+    profissional_ids: str = Query(..., description="IDs dos profissionais separados por vírgula."),
+    duracao_servico: int = Query(60, ge=1, description="Duração do serviço em minutos para calcular os slots."),
+    db: firestore.client = Depends(get_db)
+):
+    """
+    (Público) Horários livres de vários profissionais em vários dias, numa única chamada.
+    Substitui uma chamada a /profissionais/{id}/horarios-disponiveis por dia e por profissional.
+    """
+    ids = list(dict.fromkeys(i.strip() for i in profissional_ids.split(',') if i.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="Informe ao menos um profissional em 'profissional_ids'.")
+    if len(ids) > MAX_PROFISSIONAIS_DISPONIBILIDADE:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_PROFISSIONAIS_DISPONIBILIDADE} profissionais por consulta.")
+    if fim < inicio:
+        raise HTTPException(status_code=400, detail="'fim' deve ser igual ou posterior a 'inicio'.")
+    if (fim - inicio).days + 1 > MAX_DIAS_DISPONIBILIDADE:
+        raise HTTPException(status_code=400, detail=f"Período máximo de {MAX_DIAS_DISPONIBILIDADE} dias por consulta.")
+
+    disponibilidade = crud.calcular_disponibilidade_periodo(db, ids, inicio, fim, duracao_servico)
+    return [{"profissional_id": profissional_id, "dias": dias} for profissional_id, dias in disponibilidade.items()]
+
 @app.get("/profissionais/{profissional_id}", response_model=schemas.ProfissionalResponse, tags=["Profissionais"])
 def get_profissional_details(
     profissional_id: str,
@@ -1939,41 +2056,7 @@ async def upload_and_resize_image(
     content_type: str
 ) -> dict:
     """Função auxiliar para upload e redimensionamento de imagens no Cloud Storage."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    urls = {}
-    extension = ".jpeg"
-    
-    image = Image.open(BytesIO(file_content))
-    if image.mode in ('RGBA', 'P'):
-        image = image.convert('RGB')
-
-    buffer_original = BytesIO()
-    image.save(buffer_original, format="JPEG", quality=90)
-    buffer_original.seek(0)
-    original_blob_name = f"uploads/{filename_base}_original{extension}"
-    original_blob = bucket.blob(original_blob_name)
-    original_blob.upload_from_string(buffer_original.getvalue(), content_type="image/jpeg")
-    urls['original'] = original_blob.public_url
-
-    image.thumbnail((800, 800))
-    buffer_medium = BytesIO()
-    image.save(buffer_medium, format="JPEG", quality=85)
-    buffer_medium.seek(0)
-    medium_blob_name = f"uploads/{filename_base}_medium{extension}"
-    medium_blob = bucket.blob(medium_blob_name)
-    medium_blob.upload_from_string(buffer_medium.getvalue(), content_type="image/jpeg")
-    urls['medium'] = medium_blob.public_url
-
-    image.thumbnail((200, 200))
-    buffer_thumbnail = BytesIO()
-    image.save(buffer_thumbnail, format="JPEG", quality=80)
-    buffer_thumbnail.seek(0)
-    thumbnail_blob_name = f"uploads/{filename_base}_thumbnail{extension}"
-    thumbnail_blob = bucket.blob(thumbnail_blob_name)
-    thumbnail_blob.upload_from_string(buffer_thumbnail.getvalue(), content_type="image/jpeg")
-    urls['thumbnail'] = thumbnail_blob.public_url
-
+    urls, _ = await processar_e_enviar_imagem(file_content, filename_base, bucket_name)
     return urls
 
 @app.post("/upload-foto", tags=["Utilitários"])
@@ -1989,45 +2072,56 @@ async def upload_foto(
         file_content = await file.read()
         filename_base = f"{uuid.uuid4()}-{os.path.splitext(file.filename)[0]}"
         
-        uploaded_urls = await upload_and_resize_image(
+        uploaded_urls, tempos = await processar_e_enviar_imagem(
             file_content=file_content,
             filename_base=filename_base,
-            bucket_name=CLOUD_STORAGE_BUCKET_NAME_GLOBAL,
-            content_type=file.content_type
+            bucket_name=CLOUD_STORAGE_BUCKET_NAME_GLOBAL
         )
-        return JSONResponse(content=uploaded_urls)
+        return JSONResponse(content=uploaded_urls, headers={"Server-Timing": formatar_server_timing(tempos)})
     except Exception as e:
         logger.error(f"ERRO CRÍTICO NO UPLOAD: {e}")
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
 
 # =================================================================================
-# FUNÇÃO AUXILIAR PARA UPLOAD DE ARQUIVOS GENÉRICOS
+# FUNÇÕES AUXILIARES PARA UPLOAD DE ARQUIVOS GENÉRICOS (STREAMING)
 # =================================================================================
 
-async def upload_generic_file(
-    file_content: bytes,
-    filename: str,
-    bucket_name: str,
-    content_type: str
-) -> str:
-    """Função auxiliar para upload de arquivos genéricos no Cloud Storage."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    
-    unique_filename = f"uploads/anexos/{uuid.uuid4()}-{filename}"
-    
-    blob = bucket.blob(unique_filename)
-    blob.upload_from_string(file_content, content_type=content_type)
-    
-    return blob.public_url
+# Documenta no OpenAPI o corpo multipart lido em streaming (sem parâmetros File)
+def _openapi_upload_multipart(campo: str, multiplos: bool) -> dict:
+    arquivo = {"type": "string", "format": "binary"}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": [campo],
+        "properties": {campo: {"type": "array", "items": arquivo} if multiplos else arquivo},
+    }}}}}
+
+async def _receber_anexos(request: Request, max_arquivos: int) -> List[ResultadoUpload]:
+    """Envia os arquivos do corpo multipart para uploads/anexos/ sem carregá-los inteiros na memória."""
+    try:
+        resultados = await receber_uploads_multipart(
+            request,
+            get_backend_armazenamento(CLOUD_STORAGE_BUCKET_NAME_GLOBAL),
+            gerar_blob_name=lambda nome: f"uploads/anexos/{uuid.uuid4()}-{nome}",
+            max_arquivos=max_arquivos
+        )
+    except ArquivoMuitoGrandeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except UploadInvalidoError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not resultados:
+        raise HTTPException(status_code=400, detail="Nenhum arquivo enviado.")
+    return resultados
+
+def _resultado_upload_json(resultado: ResultadoUpload) -> dict:
+    return {"url": resultado.url, "nome": resultado.nome_arquivo, "tamanho": resultado.tamanho, "sha256": resultado.sha256}
 
 # =================================================================================
 # ENDPOINT DE UPLOAD GENÉRICO
 # =================================================================================
 
-@app.post("/upload-file", tags=["Utilitários"])
+@app.post("/upload-file", tags=["Utilitários"], openapi_extra=_openapi_upload_multipart("file", multiplos=False))
 async def upload_file_endpoint(
-    file: UploadFile = File(...),
+    request: Request,
     current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase)
 ):
     """(Autenticado) Faz o upload de um arquivo genérico (PDF, DOCX, etc.) e retorna a URL."""
@@ -2035,19 +2129,32 @@ async def upload_file_endpoint(
         raise HTTPException(status_code=500, detail="Bucket do Cloud Storage não configurado.")
     
     try:
-        file_content = await file.read()
-        
-        uploaded_url = await upload_generic_file(
-            file_content=file_content,
-            filename=file.filename,
-            bucket_name=CLOUD_STORAGE_BUCKET_NAME_GLOBAL,
-            content_type=file.content_type
-        )
-        return JSONResponse(content={"url": uploaded_url})
+        resultado = (await _receber_anexos(request, max_arquivos=1))[0]
+        return JSONResponse(content=_resultado_upload_json(resultado))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"ERRO CRÍTICO NO UPLOAD DE ARQUIVO: {e}")
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
 
+@app.post("/upload-files", tags=["Utilitários"], openapi_extra=_openapi_upload_multipart("files", multiplos=True))
+async def upload_files_endpoint(
+    request: Request,
+    current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase)
+):
+    """(Autenticado) Faz o upload de vários arquivos em paralelo e retorna as URLs na ordem de envio."""
+    if not CLOUD_STORAGE_BUCKET_NAME_GLOBAL:
+        raise HTTPException(status_code=500, detail="Bucket do Cloud Storage não configurado.")
+
+    try:
+        resultados = await _receber_anexos(request, max_arquivos=UPLOAD_MAX_ARQUIVOS)
+        return JSONResponse(content=[_resultado_upload_json(r) for r in resultados])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"ERRO CRÍTICO NO UPLOAD DE ARQUIVOS: {e}")
+        raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
+
 # =================================================================================
 # ENDPOINTS DA PESQUISA DE SATISFAÇÃO
 # =================================================================================
@@ -2196,12 +2303,12 @@ def confirmar_leitura_status_alias(
     return status_leitura
 
 @app.get("/pacientes/{paciente_id}/checklist-diario", response_model=List[schemas.ChecklistItemDiarioResponse], tags=["Fluxo do Técnico"])
-def get_checklist_diario(
+async def get_checklist_diario(
     paciente_id: str,
     data: date = Query(..., description="Data do checklist (formato: YYYY-MM-DD)."),
     negocio_id: str = Header(..., alias="negocio-id", description="ID do Negócio."),
-    current_user: schemas.UsuarioProfile = Depends(get_paciente_autorizado),
-    db: firestore.client = Depends(get_db),
+    current_user: schemas.UsuarioProfile = Depends(get_paciente_autorizado_async),
+    db_async = Depends(get_async_db),
 ):
     """
     (Técnico, Profissional ou Admin) Retorna o checklist do dia, baseado EXCLUSIVAMENTE no plano de cuidado mais recente.
@@ -2209,7 +2316,7 @@ def get_checklist_diario(
     Se não existir, o checklist do dia é replicado a partir do plano ativo.
     """
     # ALTERAÇÃO AQUI: Chame a nova função corrigida
-    return crud.get_checklist_diario_plano_ativo(db, paciente_id, data, negocio_id)
+    return await repositorio_async.get_checklist_diario_plano_ativo(db_async, paciente_id, data, negocio_id)
 
 
 @app.patch("/pacientes/{paciente_id}/checklist-diario/{item_id}", response_model=schemas.ChecklistItemDiarioResponse, tags=["Fluxo do Técnico"])
@@ -2224,7 +2331,7 @@ def update_checklist_item_diario(
     """(Técnico) Permite marcar/desmarcar um item do checklist."""
     if not crud.verificar_leitura_plano_do_dia(db, paciente_id, current_user.id, data):
         raise HTTPException(status_code=403, detail="Leitura do Plano Ativo pendente para hoje.")
-    item_atualizado = crud.atualizar_item_checklist_diario(db, paciente_id, item_id, update_data)
+    item_atualizado = crud.atualizar_item_checklist_diario(db, paciente_id, item_id, update_data, dia=data)
     if not item_atualizado:
         raise HTTPException(status_code=404, detail="Item do checklist não encontrado.")
     return item_atualizado
@@ -2374,10 +2481,11 @@ from auth import get_current_user_firebase, validate_negocio_id
 
 # ... (resto do arquivo)
 
-@app.post("/relatorios/{relatorio_id}/fotos", response_model=schemas.RelatorioMedicoResponse, tags=["Relatórios Médicos"])
+@app.post("/relatorios/{relatorio_id}/fotos", response_model=schemas.RelatorioMedicoResponse, tags=["Relatórios Médicos"],
+          openapi_extra=_openapi_upload_multipart("files", multiplos=True))
 async def upload_foto_relatorio(
     relatorio_id: str,
-    files: List[UploadFile] = File(...),
+    request: Request,
     negocio_id: str = Depends(validate_negocio_id),
     current_user: schemas.UsuarioProfile = Depends(get_current_user_firebase),
     db: firestore.client = Depends(get_db)
@@ -2394,18 +2502,8 @@ async def upload_foto_relatorio(
         raise HTTPException(status_code=500, detail="Bucket do Cloud Storage não configurado.")
     
     try:
-        uploaded_urls = []
-        
-        for file in files:
-            file_content = await file.read()
-            
-            uploaded_url = await upload_generic_file(
-                file_content=file_content,
-                filename=file.filename,
-                bucket_name=CLOUD_STORAGE_BUCKET_NAME_GLOBAL,
-                content_type=file.content_type
-            )
-            uploaded_urls.append(uploaded_url)
+        # Streaming com uploads em paralelo; a ordem das URLs acompanha a ordem dos arquivos
+        uploaded_urls = [r.url for r in await _receber_anexos(request, max_arquivos=UPLOAD_MAX_ARQUIVOS)]
         
         relatorio_atualizado = None
         for url in uploaded_urls:
@@ -2415,28 +2513,64 @@ async def upload_foto_relatorio(
         
         logger.info(f"Upload concluído. Fotos={len(uploaded_urls)}")
         return relatorio_atualizado
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"ERRO CRÍTICO NO UPLOAD DE FOTO PARA RELATÓRIO: {e}")
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
     
 @app.get("/medico/relatorios/pendentes", response_model=List[schemas.RelatorioMedicoResponse], tags=["Relatórios Médicos - Médico"])
 def listar_relatorios_pendentes_medico_endpoint(
+    response: Response,
     negocio_id: str = Header(..., description="ID do Negócio no qual o médico está atuando."),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Tamanho da página (sem limit, retorna todos os pendentes)"),
+    cursor: Optional[str] = Query(None, description="Cursor retornado no header X-Next-Cursor da página anterior"),
     current_user: schemas.UsuarioProfile = Depends(get_current_medico_user),
     db: firestore.client = Depends(get_db)
 ):
-    """(Médico) Lista os relatórios pendentes de avaliação para o médico logado."""
-    return crud.listar_relatorios_pendentes_medico(db, current_user.id, negocio_id)
+    """
+    (Médico) Lista os relatórios pendentes de avaliação para o médico logado.
+    Com 'limit', retorna uma página; o cursor da próxima página vem no header X-Next-Cursor.
+    """
+    return _pagina_inbox_medico(response, db, current_user.id, negocio_id, ['pendente'], 'data_criacao', limit, cursor)
 
 @app.get("/medico/relatorios", response_model=List[schemas.RelatorioMedicoResponse], tags=["Relatórios Médicos - Médico"])
 def listar_historico_relatorios_medico_endpoint(
+    response: Response,
     negocio_id: str = Header(..., description="ID do Negócio no qual o médico está atuando."),
     status: Optional[str] = Query(None, description="Filtro por status: 'aprovado', 'recusado' ou omitir para todos"),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Tamanho da página (sem limit, retorna o histórico completo)"),
+    cursor: Optional[str] = Query(None, description="Cursor retornado no header X-Next-Cursor da página anterior"),
     current_user: schemas.UsuarioProfile = Depends(get_current_medico_user),
     db: firestore.client = Depends(get_db)
 ):
     """(Médico) Lista o histórico de relatórios já avaliados pelo médico (aprovados + recusados)."""
-    return crud.listar_historico_relatorios_medico(db, current_user.id, negocio_id, status)
+    return _pagina_inbox_medico(
+        response, db, current_user.id, negocio_id, crud._status_historico_inbox(status), 'data_revisao', limit, cursor
+    )
+
+@app.get("/medico/relatorios/contadores", response_model=schemas.RelatorioInboxContadoresResponse, tags=["Relatórios Médicos - Médico"])
+def get_contadores_relatorios_medico(
+    negocio_id: str = Header(..., description="ID do Negócio no qual o médico está atuando."),
+    current_user: schemas.UsuarioProfile = Depends(get_current_medico_user),
+    db: firestore.client = Depends(get_db)
+):
+    """(Médico) Retorna a quantidade de relatórios pendentes, aprovados e recusados do médico logado."""
+    return crud.obter_contadores_inbox_medico(db, current_user.id, negocio_id)
+
+def _pagina_inbox_medico(response: Response, db, medico_id: str, negocio_id: str, status_lista: List[str],
+                         ordenar_por: str, limit: Optional[int], cursor: Optional[str]) -> List[Dict]:
+    """Lê uma página (ou tudo, sem limit) da inbox do médico e expõe o próximo cursor em X-Next-Cursor."""
+    if cursor and limit is None:
+        raise HTTPException(status_code=400, detail="O parâmetro 'cursor' exige 'limit'.")
+    try:
+        pagina = crud.listar_inbox_medico(db, medico_id, negocio_id, status_lista, ordenar_por, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if pagina["proximo_cursor"]:
+        response.headers["X-Next-Cursor"] = pagina["proximo_cursor"]
+    return pagina["relatorios"]
 
 @app.get("/relatorios/{relatorio_id}", response_model=schemas.RelatorioCompletoResponse, tags=["Relatórios Médicos"])
 def get_relatorio_completo_endpoint(
@@ -2447,7 +2581,33 @@ def get_relatorio_completo_endpoint(
     paciente_id = relatorio.get("paciente_id")
     consulta_id = relatorio.get("consulta_id")
 
-    paciente_doc = db.collection('usuarios').document(paciente_id).get()
+    # Busca registros dos últimos 30 dias
+    data_inicio = datetime.utcnow() - timedelta(days=30)
+
+    # Paciente, registros e plano de cuidado são independentes: lidos em paralelo
+    tarefas = {
+        "paciente_doc": lambda: db.collection('usuarios').document(paciente_id).get(),
+        "registros": lambda: crud.listar_registros_diario_estruturado(db, paciente_id, data=data_inicio),
+    }
+    if consulta_id:
+        # Com a consulta conhecida, os itens do plano entram no mesmo lote de leituras
+        tarefas["consultas"] = lambda: crud.listar_consultas(db, paciente_id)
+        tarefas.update(crud._tarefas_itens_plano(db, paciente_id, consulta_id))
+    else:
+        tarefas["plano"] = lambda: crud.get_ficha_completa_paciente(db, paciente_id)
+
+    try:
+        resultados = executar_em_paralelo(tarefas)
+    except PrazoExcedidoError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+
+    if consulta_id:
+        plano_cuidado = {chave: resultados[chave] for chave in ("consultas", "medicacoes", "checklist", "orientacoes")}
+        plano_cuidado["checklist"] = crud._dedup_checklist_items(plano_cuidado["checklist"])
+    else:
+        plano_cuidado = resultados["plano"]
+
+    paciente_doc = resultados["paciente_doc"]
     if not paciente_doc.exists:
         raise HTTPException(status_code=404, detail="Paciente associado ao relatório não encontrado.")
     
@@ -2455,29 +2615,13 @@ def get_relatorio_completo_endpoint(
     paciente_data['id'] = paciente_doc.id
     
     # Descriptografar dados sensíveis do paciente para médicos
-    if 'nome' in paciente_data and paciente_data['nome']:
-        try:
-            paciente_data['nome'] = decrypt_data(paciente_data['nome'])
-        except Exception as e:
-            logger.error(f"Erro ao descriptografar nome do paciente {paciente_id}: {e}")
-            paciente_data['nome'] = "[Erro na descriptografia]"
-    
-    if 'telefone' in paciente_data and paciente_data['telefone']:
-        try:
-            paciente_data['telefone'] = decrypt_data(paciente_data['telefone'])
-        except Exception as e:
-            logger.error(f"Erro ao descriptografar telefone do paciente {paciente_id}: {e}")
-            paciente_data['telefone'] = "[Erro na descriptografia]"
-
-    # Busca registros dos últimos 30 dias
-    data_inicio = datetime.utcnow() - timedelta(days=30)
-    registros_diarios = crud.listar_registros_diario_estruturado(db, paciente_id, data=data_inicio)
+    decrypt_document(paciente_data, {'nome': "[Erro na descriptografia]", 'telefone': "[Erro na descriptografia]"})
 
     return {
         "relatorio": relatorio,
         "paciente": paciente_data,
-        "planoCuidado": crud.get_ficha_completa_paciente(db, paciente_id, consulta_id),
-        "registrosDiarios": registros_diarios
+        "planoCuidado": plano_cuidado,
+        "registrosDiarios": resultados["registros"]
     }
 
 @app.post("/relatorios/{relatorio_id}/aprovar", response_model=schemas.RelatorioMedicoResponse, tags=["Relatórios Médicos - Médico"])
@@ -2696,162 +2840,6 @@ def process_overdue_tasks_debug():
         }
 
 
-def processar_notificacoes_agendadas(db: firestore.client, now: datetime) -> dict:
-    """
-    Processa notificações agendadas que estão prontas para serem enviadas.
-    """
-    stats = {
-        "notificacoes_verificadas": 0,
-        "notificacoes_enviadas": 0,
-        "notificacoes_erro": 0
-    }
-
-    try:
-        # Buscar notificações agendadas que devem ser enviadas agora
-        notificacoes_ref = db.collection('notificacoes_agendadas')
-        query = notificacoes_ref.where('status', '==', 'agendada').where('data_agendamento', '<=', now)
-
-        notificacoes_pendentes = list(query.stream())
-        stats["notificacoes_verificadas"] = len(notificacoes_pendentes)
-
-        logger.info(f"Encontradas {len(notificacoes_pendentes)} notificações para processar")
-
-        for doc_notificacao in notificacoes_pendentes:
-            try:
-                notif_data = doc_notificacao.to_dict()
-                paciente_id = notif_data.get('paciente_id')
-                titulo = notif_data.get('titulo')
-                mensagem = notif_data.get('mensagem')
-
-                if not paciente_id:
-                    logger.warning(f"Notificação {doc_notificacao.id} sem paciente_id")
-                    continue
-
-                # Buscar dados do paciente
-                paciente_doc = db.collection('usuarios').document(paciente_id).get()
-                if not paciente_doc.exists:
-                    logger.warning(f"Paciente {paciente_id} não encontrado")
-                    doc_notificacao.reference.update({"status": "erro", "erro": "Paciente não encontrado"})
-                    stats["notificacoes_erro"] += 1
-                    continue
-
-                paciente_data = paciente_doc.to_dict()
-                tokens_fcm = paciente_data.get('fcm_tokens', [])
-
-                # Persistir notificação no banco do paciente
-                db.collection('usuarios').document(paciente_id).collection('notificacoes').add({
-                    "title": titulo,
-                    "body": mensagem,
-                    "tipo": "LEMBRETE_AGENDADO",
-                    "relacionado": {"notificacao_agendada_id": doc_notificacao.id},
-                    "lida": False,
-                    "data_criacao": firestore.SERVER_TIMESTAMP,
-                    "dedupe_key": f"AGENDADA_{doc_notificacao.id}"
-                })
-
-                # HÍBRIDO: Tenta Web Push VAPID primeiro, depois FCM como fallback
-                data_payload = {"tipo": "LEMBRETE_AGENDADO", "notificacao_agendada_id": doc_notificacao.id}
-                webpush_tag = f"LEMBRETE_AGENDADO-{doc_notificacao.id}-paciente-{paciente_id}"
-                enviado_vapid = False
-
-                # 1. Tentar Web Push VAPID
-                webpush_subscription = paciente_data.get('webpush_subscription_exames')
-                if webpush_subscription:
-                    try:
-                        from pywebpush import webpush, WebPushException
-                        from vapid_config import VAPID_PRIVATE_KEY, VAPID_CLAIMS_EMAIL
-                        import json
-
-                        payload = json.dumps({
-                            "title": titulo,
-                            "body": mensagem,
-                            "data": data_payload,
-                            "tag": webpush_tag
-                        })
-
-                        webpush(
-                            subscription_info={
-                                "endpoint": webpush_subscription["endpoint"],
-                                "keys": webpush_subscription["keys"]
-                            },
-                            data=payload,
-                            vapid_private_key=VAPID_PRIVATE_KEY,
-                            vapid_claims={"sub": VAPID_CLAIMS_EMAIL}
-                        )
-
-                        enviado_vapid = True
-                        logger.info(f"✅ LEMBRETE_AGENDADO enviado via Web Push para {paciente_id}")
-
-                    except WebPushException as e:
-                        logger.error(f"❌ Erro Web Push para {paciente_id}: {e}")
-                        if e.response and e.response.status_code == 410:
-                            paciente_doc.reference.update({"webpush_subscription_exames": firestore.DELETE_FIELD})
-                    except Exception as e:
-                        logger.error(f"❌ Erro Web Push para {paciente_id}: {e}")
-
-                # 2. Fallback: FCM (se VAPID não enviou)
-                if not enviado_vapid and tokens_fcm:
-                    try:
-                        from firebase_admin import messaging
-
-                        message = messaging.MulticastMessage(
-                            notification=messaging.Notification(
-                                title=titulo,
-                                body=mensagem
-                            ),
-                            data=data_payload,
-                            tokens=tokens_fcm
-                        )
-
-                        response = messaging.send_multicast(message)
-                        logger.info(f"✅ LEMBRETE_AGENDADO enviado via FCM: {response.success_count} sucessos")
-
-                        # Remover tokens inválidos
-                        if response.failure_count > 0:
-                            valid_tokens = []
-                            for idx, resp in enumerate(response.responses):
-                                if resp.success:
-                                    valid_tokens.append(tokens_fcm[idx])
-                                else:
-                                    logger.warning(f"Token FCM inválido removido: {resp.exception}")
-
-                            if len(valid_tokens) != len(tokens_fcm):
-                                db.collection('usuarios').document(paciente_id).update({
-                                    "fcm_tokens": valid_tokens
-                                })
-
-                    except Exception as e:
-                        logger.error(f"Erro ao enviar push notification: {e}")
-
-                # Marcar notificação como enviada
-                doc_notificacao.reference.update({
-                    "status": "enviada",
-                    "data_envio": firestore.SERVER_TIMESTAMP
-                })
-
-                stats["notificacoes_enviadas"] += 1
-                logger.info(f"Notificação {doc_notificacao.id} enviada com sucesso")
-
-            except Exception as e:
-                logger.error(f"Erro ao processar notificação {doc_notificacao.id}: {e}")
-                stats["notificacoes_erro"] += 1
-                try:
-                    doc_notificacao.reference.update({
-                        "status": "erro",
-                        "erro": str(e),
-                        "data_erro": firestore.SERVER_TIMESTAMP
-                    })
-                except:
-                    pass
-
-        return stats
-
-    except Exception as e:
-        logger.error(f"Erro geral no processamento de notificações: {e}")
-        stats["notificacoes_erro"] += 1
-        return stats
-
-
 @app.post("/tasks/process-overdue-v2", response_model=schemas.ProcessarTarefasResponse, tags=["Jobs Agendados"])
 def process_overdue_tasks_v2(db: firestore.client = Depends(get_db)):
     """
@@ -2938,10 +2926,70 @@ def processar_lembretes_exames_endpoint(db: firestore.client = Depends(get_db)):
         logger.error(f"Erro ao processar lembretes de exames: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/tasks/reconstruir-fila-lembretes-exames", tags=["Jobs Agendados"])
+def reconstruir_fila_lembretes_exames_endpoint(
+    admin: schemas.UsuarioProfile = Depends(get_super_admin_user),
+    db: firestore.client = Depends(get_db)
+):
+    """
+    (Super-Admin) Backfill da fila 'lembretes_exames' a partir dos exames já cadastrados.
+    Necessário uma única vez para exames criados antes da fila existir.
+    """
+    try:
+        return crud.reconstruir_fila_lembretes_exames(db)
+    except Exception as e:
+        logger.error(f"Erro ao reconstruir fila de lembretes de exames: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/tasks/reconstruir-planos-ativos", tags=["Jobs Agendados"])
+def reconstruir_planos_ativos_endpoint(
+    admin: schemas.UsuarioProfile = Depends(get_super_admin_user),
+    db: firestore.client = Depends(get_db)
+):
+    """
+    (Super-Admin) Backfill do ponteiro do plano ativo (plano_ativo_id) nos pacientes.
+    Necessário uma única vez para pacientes cadastrados antes do ponteiro existir.
+    """
+    try:
+        return crud.reconstruir_planos_ativos(db)
+    except Exception as e:
+        logger.error(f"Erro ao reconstruir planos ativos: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/tasks/reconstruir-inboxes-medicos", tags=["Jobs Agendados"])
+def reconstruir_inboxes_medicos_endpoint(
+    admin: schemas.UsuarioProfile = Depends(get_super_admin_user),
+    db: firestore.client = Depends(get_db)
+):
+    """
+    (Super-Admin) Reconstrói as inboxes de relatórios dos médicos já criadas.
+    Necessário uma única vez após o deploy que passou a guardar só os IDs do paciente e do criador.
+    """
+    try:
+        return crud.reconstruir_inboxes_medicos(db)
+    except Exception as e:
+        logger.error(f"Erro ao reconstruir inboxes dos médicos: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/tasks/processar-outbox", tags=["Jobs Agendados"])
+def processar_outbox_endpoint(db: firestore.client = Depends(get_db)):
+    """
+    (PÚBLICO - CHAMADO PELO CLOUD SCHEDULER) Reprocessa eventos do outbox de
+    notificações que ficaram pendentes (falha no envio ou instância encerrada).
+    Precisa estar agendado (ex: a cada minuto): é o que garante as novas
+    tentativas e a entrega dos eventos do backend 'thread' interrompidos no Cloud Run.
+    """
+    import notification_outbox
+    try:
+        return notification_outbox.processar_pendentes(db)
+    except Exception as e:
+        logger.error(f"Erro ao reprocessar outbox de notificações: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/test-notificacao/{paciente_id}", tags=["Debug"])
 def test_notificacao_paciente(paciente_id: str, db: firestore.client = Depends(get_db)):
     """Envia notificação de teste para um paciente específico"""
-    from firebase_admin import messaging
+    from notification_helper import enviar_fcm_em_lote
     try:
         paciente_doc = db.collection('usuarios').document(paciente_id).get()
         if not paciente_doc.exists:
@@ -2956,18 +3004,20 @@ def test_notificacao_paciente(paciente_id: str, db: firestore.client = Depends(g
         titulo = "Teste de Notificação"
         corpo = "Esta é uma notificação de teste do sistema."
 
+        envio = enviar_fcm_em_lote(
+            tokens=fcm_tokens,
+            titulo=titulo,
+            corpo=corpo,
+            data_payload={"tipo": "TESTE", "paciente_id": paciente_id}
+        )
+        crud.remover_fcm_tokens_invalidos(db, paciente_id, envio["tokens_invalidos"])
+
         resultados = []
-        for token in fcm_tokens:
-            try:
-                message = messaging.Message(
-                    notification=messaging.Notification(title=titulo, body=corpo),
-                    data={"tipo": "TESTE", "paciente_id": paciente_id},
-                    token=token
-                )
-                response = messaging.send(message)
-                resultados.append({"token": token[:20] + "...", "status": "enviado", "response": response})
-            except Exception as e:
-                resultados.append({"token": token[:20] + "...", "status": "erro", "erro": str(e)})
+        for r in envio["resultados"]:
+            if r["sucesso"]:
+                resultados.append({"token": r["token"][:20] + "...", "status": "enviado", "response": r["message_id"]})
+            else:
+                resultados.append({"token": r["token"][:20] + "...", "status": "erro", "erro": r["erro"]})
 
         return {
             "paciente_id": paciente_id,
@@ -3240,43 +3290,12 @@ async def processar_notificacao_tarefa_atrasada(
     try:
         logger.info(f"📨 Recebido webhook do Cloud Tasks para tarefa {payload.tarefa_id}")
 
-        # Valida se tarefa existe e não foi concluída
-        tarefa_ref = db.collection('tarefas_essenciais').document(payload.tarefa_id)
-        tarefa_doc = tarefa_ref.get()
-
-        if not tarefa_doc.exists:
-            logger.warning(f"⚠️ Tarefa {payload.tarefa_id} não existe mais")
-            return NotificarTarefaAtrasadaResponse(
-                success=True,
-                message="Tarefa não existe mais",
-                tarefa_id=payload.tarefa_id
-            )
-
-        tarefa_data = tarefa_doc.to_dict()
-
-        if tarefa_data.get('foiConcluida'):
-            logger.info(f"ℹ️ Tarefa {payload.tarefa_id} já foi concluída")
-            return NotificarTarefaAtrasadaResponse(
-                success=True,
-                message="Tarefa já foi concluída",
-                tarefa_id=payload.tarefa_id
-            )
-
-        # Envia notificações
-        crud.enviar_notificacoes_tarefa_atrasada(
-            db=db,
-            tarefa_id=payload.tarefa_id,
-            paciente_id=payload.paciente_id,
-            negocio_id=payload.negocio_id,
-            criado_por_id=payload.criado_por_id,
-            descricao=payload.descricao
-        )
-
-        logger.info(f"✅ Notificações enviadas para tarefa {payload.tarefa_id}")
+        # Notifica se a tarefa ainda existe e não foi concluída
+        mensagem = crud.executar_notificacao_tarefa_atrasada(db, payload.model_dump())
 
         return NotificarTarefaAtrasadaResponse(
             success=True,
-            message="Notificações enviadas com sucesso",
+            message=mensagem,
             tarefa_id=payload.tarefa_id
         )
 
@@ -3303,87 +3322,19 @@ async def processar_lembrete_exame(
     SEGURANÇA: Chamado apenas pelo Cloud Tasks via OIDC token.
     """
     try:
-        print("=" * 80)
-        print("🔔 [LEMBRETE EXAME] Endpoint /internal/notificar-lembrete-exame chamado!")
-        print(f"📦 [LEMBRETE EXAME] Payload recebido: {payload.dict()}")
-        print(f"🔍 [LEMBRETE EXAME] IDs extraídos:")
-        print(f"   - exame_id: {payload.exame_id}")
-        print(f"   - paciente_id: {payload.paciente_id}")
-        print(f"   - negocio_id: {payload.negocio_id}")
-        print(f"   - nome_exame: {payload.nome_exame}")
-        print(f"   - data_exame: {payload.data_exame}")
-        print(f"   - horario_exame: {payload.horario_exame}")
-
-        logger.info(f"📨 Recebido webhook do Cloud Tasks para exame {payload.exame_id}")
-
-        # Valida se exame existe
-        print(f"🔍 [LEMBRETE EXAME] Buscando exame {payload.exame_id} do paciente {payload.paciente_id}...")
-        exame_ref = db.collection('usuarios').document(payload.paciente_id).collection('exames').document(payload.exame_id)
-        exame_doc = exame_ref.get()
-
-        if not exame_doc.exists:
-            print(f"❌ [LEMBRETE EXAME] Exame {payload.exame_id} não encontrado!")
-            logger.warning(f"⚠️ Exame {payload.exame_id} não existe mais")
-            return NotificarLembreteExameResponse(
-                success=True,
-                message="Exame não existe mais",
-                exame_id=payload.exame_id
-            )
-
-        exame_data = exame_doc.to_dict()
-        print(f"✅ [LEMBRETE EXAME] Exame encontrado: {exame_data.get('nome_exame')}")
-
-        # Buscar paciente
-        print(f"🔍 [LEMBRETE EXAME] Buscando dados do paciente {payload.paciente_id}...")
-        paciente_ref = db.collection('usuarios').document(payload.paciente_id)
-        paciente_doc = paciente_ref.get()
+        logger.info("📨 Recebido webhook do Cloud Tasks para o exame %s (paciente %s, negócio %s)",
+                    payload.exame_id, payload.paciente_id, payload.negocio_id)
 
-        if not paciente_doc.exists:
-            print(f"❌ [LEMBRETE EXAME] Paciente {payload.paciente_id} não encontrado!")
-            logger.warning(f"⚠️ Paciente {payload.paciente_id} não encontrado")
-            return NotificarLembreteExameResponse(
-                success=False,
-                message="Paciente não encontrado",
-                exame_id=payload.exame_id
-            )
-
-        paciente_data = paciente_doc.to_dict()
-        fcm_tokens = paciente_data.get('fcm_tokens', [])
-        apns_tokens = paciente_data.get('apns_tokens', [])
-        print(f"✅ [LEMBRETE EXAME] Paciente encontrado. FCM tokens: {len(fcm_tokens)}, APNs tokens: {len(apns_tokens)}")
-
-        if not fcm_tokens and not apns_tokens:
-            print(f"⚠️ [LEMBRETE EXAME] Paciente não tem tokens de notificação!")
-            logger.warning(f"⚠️ Paciente {payload.paciente_id} sem tokens")
-
-        # Envia lembrete
-        print(f"📤 [LEMBRETE EXAME] Chamando crud.enviar_lembrete_exame()...")
-        crud.enviar_lembrete_exame(
-            db=db,
-            exame_id=payload.exame_id,
-            paciente_id=payload.paciente_id,
-            negocio_id=payload.negocio_id,
-            nome_exame=payload.nome_exame,
-            data_exame=payload.data_exame,
-            horario_exame=payload.horario_exame
-        )
-
-        print(f"✅ [LEMBRETE EXAME] crud.enviar_lembrete_exame() concluído!")
-        print("=" * 80)
-        logger.info(f"✅ Lembrete enviado para exame {payload.exame_id}")
+        # Envia o lembrete se o exame e o paciente ainda existem
+        sucesso, mensagem = crud.executar_lembrete_exame(db, payload.model_dump())
 
         return NotificarLembreteExameResponse(
-            success=True,
-            message="Lembrete enviado com sucesso",
+            success=sucesso,
+            message=mensagem,
             exame_id=payload.exame_id
         )
 
     except Exception as e:
-        print(f"❌ [LEMBRETE EXAME] ERRO CRÍTICO: {str(e)}")
-        print(f"❌ [LEMBRETE EXAME] Traceback completo:")
-        import traceback
-        print(traceback.format_exc())
-        print("=" * 80)
         logger.error(f"❌ Erro ao processar lembrete: {e}", exc_info=True)
         raise HTTPException(
             status_code=500,
@@ -3432,3 +3383,21 @@ def testar_notificacao_tarefa_atrasada(
     except Exception as e:
         logger.error(f"Erro ao testar notificação: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/internal/outbox/processar", tags=["Internal - Cloud Tasks"])
+def processar_evento_outbox(
+    payload: ProcessarEventoOutboxRequest,
+    db: firestore.client = Depends(get_db)
+):
+    """
+    Endpoint INTERNO chamado pelo Cloud Tasks (OUTBOX_BACKEND=cloud_tasks) para
+    processar um evento do outbox de notificações.
+
+    SEGURANÇA: Chamado apenas pelo Cloud Tasks via OIDC token.
+    Responde 500 em caso de falha para que o Cloud Tasks tente novamente.
+    """
+    import notification_outbox
+    if not notification_outbox.processar_evento(db, payload.evento_id):
+        raise HTTPException(status_code=500, detail=f"Evento {payload.evento_id} não processado")
+    return {"success": True, "evento_id": payload.evento_id}
@@ -0,0 +1,198 @@
+"""
+Métricas da aplicação no formato Prometheus (endpoint /metrics).
+
+Responde "onde está o custo" sem depender de grep nos logs:
+
+- http_requisicao_duracao_segundos{metodo, rota, status}: latência por rota
+  (o template, ex: /pacientes/{paciente_id}/ficha-completa, nunca o ID).
+- firestore_chamadas_total{rota, operacao}, firestore_documentos_lidos_total{rota},
+  firestore_documentos_gravados_total{rota} e o histograma
+  firestore_leituras_por_requisicao{rota}: contados pelo wrapper do cliente
+  (firestore_metricas.py), atribuídos à rota da requisição em andamento.
+- crypto_operacoes_total{operacao, resultado} e crypto_duracao_segundos{operacao}:
+  encrypt/decrypt de crypto_utils (decrypt inclui acertos do cache LRU).
+- push_envio_duracao_segundos{canal} e push_entregas_total{canal, resultado}:
+  lotes FCM, envios APNs por token e o envio completo de _send_data_push_to_tokens.
+
+A rota da requisição fica numa ContextVar aberta pelo middleware
+(medir_requisicao); as threads do query_executor, do bulk_writer e do
+asyncio.to_thread herdam o contexto. Operações fora de requisições (startup,
+jobs) usam a rota 'fora_de_requisicao'.
+
+Configuração (variáveis de ambiente):
+    METRICS_ENABLED=true
+    METRICS_TOKEN=              # se definido, /metrics exige 'Authorization: Bearer <token>'
+"""
+
+import contextvars
+import hmac
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+ROTA_FORA_DE_REQUISICAO = 'fora_de_requisicao'
+# Requisições que não casaram com nenhuma rota: um único rótulo, para não
+# criar uma série por URL inexistente
+ROTA_NAO_ENCONTRADA = 'nao_encontrada'
+
+_BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUISICAO_DURACAO = Histogram(
+    'http_requisicao_duracao_segundos', 'Latência das requisições HTTP por rota',
+    ['metodo', 'rota', 'status'], buckets=_BUCKETS_LATENCIA
+)
+FIRESTORE_CHAMADAS = Counter(
+    'firestore_chamadas_total', 'Chamadas ao Firestore (round trips) por rota e operação',
+    ['rota', 'operacao']
+)
+FIRESTORE_LEITURAS = Counter(
+    'firestore_documentos_lidos_total', 'Leituras de documentos cobradas pelo Firestore, por rota',
+    ['rota']
+)
+FIRESTORE_ESCRITAS = Counter(
+    'firestore_documentos_gravados_total', 'Documentos gravados/removidos no Firestore, por rota',
+    ['rota']
+)
+FIRESTORE_LEITURAS_POR_REQUISICAO = Histogram(
+    'firestore_leituras_por_requisicao', 'Leituras de documentos em uma requisição (detecta N+1)',
+    ['rota'], buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+)
+CRYPTO_OPERACOES = Counter(
+    'crypto_operacoes_total', 'Operações de criptografia de crypto_utils',
+    ['operacao', 'resultado']
+)
+CRYPTO_DURACAO = Histogram(
+    'crypto_duracao_segundos', 'Tempo de cada operação de criptografia de crypto_utils',
+    ['operacao'], buckets=(0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+PUSH_DURACAO = Histogram(
+    'push_envio_duracao_segundos', 'Latência dos envios de push (lote FCM, token APNs, envio completo)',
+    ['canal'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+PUSH_ENTREGAS = Counter(
+    'push_entregas_total', 'Resultado dos envios de push por token',
+    ['canal', 'resultado']
+)
+
+
+# =================================================================================
+# CONTEXTO DA REQUISIÇÃO
+# =================================================================================
+
+class _MedicaoRequisicao:
+    """Estado de métricas de uma requisição (compartilhado pelas threads que herdam o contexto)."""
+
+    __slots__ = ('scope', 'status', 'leituras', '_lock')
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.status = 500
+        self.leituras = 0
+        self._lock = threading.Lock()
+
+    def rota(self) -> str:
+        # O roteador do FastAPI grava a rota que casou em scope['route']
+        return getattr(self.scope.get('route'), 'path', None) or ROTA_NAO_ENCONTRADA
+
+    def somar_leituras(self, quantidade: int):
+        with self._lock:
+            self.leituras += quantidade
+
+
+_medicao_atual: contextvars.ContextVar[Optional[_MedicaoRequisicao]] = contextvars.ContextVar(
+    'medicao_requisicao', default=None
+)
+
+
+def rota_atual() -> str:
+    """Rota (template) da requisição em andamento, usada como rótulo das métricas."""
+    medicao = _medicao_atual.get()
+    return medicao.rota() if medicao is not None else ROTA_FORA_DE_REQUISICAO
+
+
+@contextmanager
+def medir_requisicao(request):
+    """
+    Abre a medição da requisição (usado pelo middleware em main.py). Quem usa
+    deve preencher medicao.status com o status da resposta.
+    """
+    if not METRICS_ENABLED:
+        yield _MedicaoRequisicao(request.scope)
+        return
+
+    medicao = _MedicaoRequisicao(request.scope)
+    token = _medicao_atual.set(medicao)
+    inicio = time.perf_counter()
+    try:
+        yield medicao
+    finally:
+        _medicao_atual.reset(token)
+        rota = medicao.rota()
+        REQUISICAO_DURACAO.labels(request.method, rota, str(medicao.status)).observe(time.perf_counter() - inicio)
+        FIRESTORE_LEITURAS_POR_REQUISICAO.labels(rota).observe(medicao.leituras)
+
+
+# =================================================================================
+# REGISTRO
+# =================================================================================
+
+def registrar_firestore(operacao: Optional[str] = None, leituras: int = 0, escritas: int = 0):
+    """Contabiliza uma chamada ao Firestore (operacao) e/ou documentos lidos e gravados na rota atual."""
+    if not METRICS_ENABLED:
+        return
+    medicao = _medicao_atual.get()
+    rota = medicao.rota() if medicao is not None else ROTA_FORA_DE_REQUISICAO
+    if operacao:
+        FIRESTORE_CHAMADAS.labels(rota, operacao).inc()
+    if leituras:
+        FIRESTORE_LEITURAS.labels(rota).inc(leituras)
+        if medicao is not None:
+            medicao.somar_leituras(leituras)
+    if escritas:
+        FIRESTORE_ESCRITAS.labels(rota).inc(escritas)
+
+
+def registrar_crypto(operacao: str, inicio: float, sucesso: bool):
+    """Registra uma operação de crypto_utils iniciada em 'inicio' (time.perf_counter())."""
+    if not METRICS_ENABLED:
+        return
+    CRYPTO_DURACAO.labels(operacao).observe(time.perf_counter() - inicio)
+    CRYPTO_OPERACOES.labels(operacao, 'ok' if sucesso else 'erro').inc()
+
+
+def registrar_push(canal: str, inicio: float, sucessos: int = 0, falhas: int = 0, tokens_invalidos: int = 0):
+    """
+    Registra um envio de push iniciado em 'inicio' (time.perf_counter()).
+    tokens_invalidos é um subconjunto de falhas.
+    """
+    if not METRICS_ENABLED:
+        return
+    PUSH_DURACAO.labels(canal).observe(time.perf_counter() - inicio)
+    if sucessos:
+        PUSH_ENTREGAS.labels(canal, 'sucesso').inc(sucessos)
+    if falhas - tokens_invalidos > 0:
+        PUSH_ENTREGAS.labels(canal, 'falha').inc(falhas - tokens_invalidos)
+    if tokens_invalidos:
+        PUSH_ENTREGAS.labels(canal, 'token_invalido').inc(tokens_invalidos)
+
+
+def exportar() -> tuple:
+    """(corpo, content type) da exposição no formato texto do Prometheus."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def autorizado(authorization: Optional[str]) -> bool:
+    """Valida o header Authorization contra METRICS_TOKEN (sempre autorizado se o token não está configurado)."""
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(authorization or '', f"Bearer {METRICS_TOKEN}")
@@ -0,0 +1,235 @@
+"""
+Despachante das notificações agendadas ('notificacoes_agendadas').
+
+O job buscava todas as notificações vencidas e as enviava uma a uma (leitura
+do paciente, histórico, Web Push, FCM, status): um pico de lembretes pela
+manhã rodava em série e podia passar do timeout do Cloud Scheduler. O
+despachante reivindica cada notificação com um lease numa transação (status
+'enviando', dono e validade), então várias instâncias e threads esvaziam a
+fila juntas sem envio duplicado, com concorrência limitada:
+
+    agendada --(lease)--> enviando --> enviada
+        ^                    |
+        +--- falha (backoff) +--> erro (tentativas esgotadas ou falha definitiva)
+
+- Falhas voltam para 'agendada' com proxima_tentativa_em (backoff
+  exponencial); depois de AGENDADAS_MAX_TENTATIVAS a notificação fica em
+  'erro', com o último erro em ultimo_erro.
+- Um lease vencido (instância encerrada no meio do envio) é recuperado pela
+  próxima execução.
+- Primeiras tentativas (tentativas_envio == 0, por data_agendamento) e novas
+  tentativas (por proxima_tentativa_em) são consultadas separadamente:
+  notificações em backoff não ocupam o limite de AGENDADAS_LIMITE_POR_EXECUCAO.
+  Cada consulta roda no seu próprio try; se uma falhar (ex: índice ausente), as
+  outras são despachadas normalmente. Os índices compostos estão em
+  firestore.indexes.json.
+- Cada execução para de reivindicar novas notificações após
+  AGENDADAS_PRAZO_SEGUNDOS; as restantes ficam para a próxima.
+
+A entrega (paciente, histórico, push) é a função informada pelo crud; ela
+lança EntregaImpossivel para falhas que não se resolvem com nova tentativa.
+
+USO (em crud.py):
+    processar_vencidas(db, agora, _entregar_notificacao_agendada)
+
+Configuração (variáveis de ambiente):
+    AGENDADAS_WORKERS=8
+    AGENDADAS_MAX_TENTATIVAS=5
+    AGENDADAS_LEASE_SECONDS=120
+    AGENDADAS_BACKOFF_SECONDS=60        # 1ª nova tentativa; dobra a cada falha (máx. 1h)
+    AGENDADAS_LIMITE_POR_EXECUCAO=500
+    AGENDADAS_PRAZO_SEGUNDOS=240
+"""
+
+import contextvars
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+AGENDADAS_COLLECTION = 'notificacoes_agendadas'
+
+AGENDADAS_WORKERS = int(os.getenv('AGENDADAS_WORKERS', '8'))
+AGENDADAS_MAX_TENTATIVAS = int(os.getenv('AGENDADAS_MAX_TENTATIVAS', '5'))
+AGENDADAS_LEASE_SECONDS = int(os.getenv('AGENDADAS_LEASE_SECONDS', '120'))
+AGENDADAS_BACKOFF_SECONDS = int(os.getenv('AGENDADAS_BACKOFF_SECONDS', '60'))
+AGENDADAS_LIMITE_POR_EXECUCAO = int(os.getenv('AGENDADAS_LIMITE_POR_EXECUCAO', '500'))
+AGENDADAS_PRAZO_SEGUNDOS = float(os.getenv('AGENDADAS_PRAZO_SEGUNDOS', '240'))
+
+_BACKOFF_MAXIMO_SEGUNDOS = 3600
+
+STATUS_AGENDADA = 'agendada'
+STATUS_ENVIANDO = 'enviando'
+STATUS_ENVIADA = 'enviada'
+STATUS_ERRO = 'erro'
+
+# Resultados de _processar_uma (chaves das estatísticas)
+_ENVIADA = 'notificacoes_enviadas'
+_REAGENDADA = 'notificacoes_reagendadas'
+_ERRO = 'notificacoes_erro'
+_IGNORADA = 'notificacoes_ignoradas'
+
+
+class EntregaImpossivel(Exception):
+    """Falha definitiva da entrega (ex: paciente não existe): vai direto para 'erro', sem nova tentativa."""
+
+
+def _utc(valor) -> Optional[datetime]:
+    if not isinstance(valor, datetime):
+        return None
+    return valor if valor.tzinfo is not None else valor.replace(tzinfo=timezone.utc)
+
+
+def _backoff(tentativas: int) -> timedelta:
+    return timedelta(seconds=min(AGENDADAS_BACKOFF_SECONDS * 2 ** max(tentativas - 1, 0), _BACKOFF_MAXIMO_SEGUNDOS))
+
+
+def _disponivel(dados: Dict, agora: datetime) -> bool:
+    """Se a notificação pode ser reivindicada agora (fora do backoff e sem lease válido)."""
+    status = dados.get('status')
+    if status == STATUS_AGENDADA:
+        proxima = _utc(dados.get('proxima_tentativa_em'))
+        return proxima is None or proxima <= agora
+    if status == STATUS_ENVIANDO:
+        lease_ate = _utc(dados.get('lease_ate'))
+        return lease_ate is None or lease_ate <= agora
+    return False
+
+
+def _reivindicar(db: firestore.client, notificacao_ref, dono: str) -> Optional[Dict]:
+    """Marca a notificação como 'enviando' com lease. Retorna os dados ou None se não estiver disponível."""
+
+    @firestore.transactional
+    def reivindicar(transaction):
+        snapshot = notificacao_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        dados = snapshot.to_dict() or {}
+        agora = datetime.now(timezone.utc)
+        if not _disponivel(dados, agora):
+            return None
+
+        dados['tentativas_envio'] = dados.get('tentativas_envio', 0) + 1
+        transaction.update(notificacao_ref, {
+            'status': STATUS_ENVIANDO,
+            'tentativas_envio': dados['tentativas_envio'],
+            'lease_dono': dono,
+            'lease_ate': agora + timedelta(seconds=AGENDADAS_LEASE_SECONDS),
+        })
+        return dados
+
+    return reivindicar(db.transaction())
+
+
+def _processar_uma(db: firestore.client, notificacao_id: str, entregar: Callable[[firestore.client, str, Dict], None]) -> str:
+    notificacao_ref = db.collection(AGENDADAS_COLLECTION).document(notificacao_id)
+    dono = uuid.uuid4().hex
+
+    dados = _reivindicar(db, notificacao_ref, dono)
+    if dados is None:
+        return _IGNORADA
+
+    try:
+        entregar(db, notificacao_id, dados)
+    except Exception as e:
+        tentativas = dados['tentativas_envio']
+        definitiva = isinstance(e, EntregaImpossivel) or tentativas >= AGENDADAS_MAX_TENTATIVAS
+        alteracoes = {
+            'status': STATUS_ERRO if definitiva else STATUS_AGENDADA,
+            'lease_dono': None,
+            'lease_ate': None,
+            'ultimo_erro': str(e)[:500],
+        }
+        if definitiva:
+            alteracoes['data_erro'] = firestore.SERVER_TIMESTAMP
+            logger.error("❌ Notificação agendada %s falhou definitivamente (tentativa %d): %s", notificacao_id, tentativas, e)
+        else:
+            alteracoes['proxima_tentativa_em'] = datetime.now(timezone.utc) + _backoff(tentativas)
+            logger.warning("⚠️ Notificação agendada %s falhou na tentativa %d, reagendada: %s", notificacao_id, tentativas, e)
+        notificacao_ref.update(alteracoes)
+        return _ERRO if definitiva else _REAGENDADA
+
+    notificacao_ref.update({
+        'status': STATUS_ENVIADA,
+        'data_envio': firestore.SERVER_TIMESTAMP,
+        'lease_dono': None,
+        'lease_ate': None,
+        'ultimo_erro': None,
+    })
+    return _ENVIADA
+
+
+def processar_vencidas(
+    db: firestore.client,
+    agora: datetime,
+    entregar: Callable[[firestore.client, str, Dict], None],
+    prazo_segundos: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Envia as notificações vencidas até 'agora' (e recupera leases vencidos),
+    com até AGENDADAS_WORKERS envios simultâneos.
+
+    Returns:
+        Estatísticas: verificadas, enviadas, reagendadas (falha com nova
+        tentativa), erro (falha definitiva) e ignoradas (reivindicadas por
+        outro worker, em backoff ou deixadas para a próxima execução pelo prazo).
+    """
+    stats = {"notificacoes_verificadas": 0, _ENVIADA: 0, _REAGENDADA: 0, _ERRO: 0, _IGNORADA: 0}
+    prazo = AGENDADAS_PRAZO_SEGUNDOS if prazo_segundos is None else prazo_segundos
+    inicio = time.monotonic()
+    agora = _utc(agora)
+    colecao = db.collection(AGENDADAS_COLLECTION)
+
+    consultas = {
+        'vencidas': colecao.where('status', '==', STATUS_AGENDADA).where('tentativas_envio', '==', 0)
+            .where('data_agendamento', '<=', agora)
+            .select(['status', 'proxima_tentativa_em']).limit(AGENDADAS_LIMITE_POR_EXECUCAO),
+        'reagendadas': colecao.where('status', '==', STATUS_AGENDADA).where('proxima_tentativa_em', '<=', agora)
+            .select(['status', 'proxima_tentativa_em']).limit(AGENDADAS_LIMITE_POR_EXECUCAO),
+        'presas': colecao.where('status', '==', STATUS_ENVIANDO).where('lease_ate', '<=', agora)
+            .select(['status', 'lease_ate']).limit(AGENDADAS_LIMITE_POR_EXECUCAO),
+    }
+
+    ids = []
+    for nome, consulta in consultas.items():
+        try:
+            docs = list(consulta.stream())
+        except Exception as e:
+            # Uma consulta com falha (ex: índice ausente) não impede o despacho das demais
+            logger.error("❌ Erro ao buscar notificações agendadas (%s): %s", nome, e)
+            continue
+        for doc in docs:
+            dados = doc.to_dict() or {}
+            stats["notificacoes_verificadas"] += 1
+            # Notificações em backoff ficam de fora sem abrir transação
+            if _disponivel(dados, agora):
+                ids.append(doc.id)
+            else:
+                stats[_IGNORADA] += 1
+
+    def processar(notificacao_id: str) -> str:
+        if time.monotonic() - inicio > prazo:
+            return _IGNORADA
+        try:
+            return _processar_uma(db, notificacao_id, entregar)
+        except Exception as e:
+            # Falha ao reivindicar ou registrar o resultado: o lease vence e a notificação volta na próxima execução
+            logger.error("❌ Erro ao despachar notificação agendada %s: %s", notificacao_id, e)
+            return _ERRO
+
+    if ids:
+        with ThreadPoolExecutor(max_workers=min(AGENDADAS_WORKERS, len(ids)), thread_name_prefix="agendadas") as executor:
+            # Cada envio roda numa cópia do contexto (request_id dos logs e rota das métricas do job)
+            futures = [executor.submit(contextvars.copy_context().run, processar, notificacao_id) for notificacao_id in ids]
+            for future in futures:
+                stats[future.result()] += 1
+
+    logger.info("📨 Notificações agendadas despachadas em %.1fs: %s", time.monotonic() - inicio, stats)
+    return stats
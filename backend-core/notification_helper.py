@@ -15,12 +15,116 @@ USO:
 """
 
 import logging
+import time
 from typing import List, Optional, Dict
 from firebase_admin import messaging
 from apns_service import get_apns_service
+from metricas import registrar_push
 
 logger = logging.getLogger(__name__)
 
+# Limite de tokens por chamada de send_each_for_multicast imposto pelo FCM
+FCM_TOKENS_POR_LOTE = 500
+
+# Heurísticas comuns do Admin SDK para token inválido
+_MENSAGENS_TOKEN_INVALIDO = [
+    "Unregistered",                        # Android/iOS
+    "NotRegistered",                       # variação
+    "requested entity was not found",      # inglês minúsculo em algumas libs
+    "Requested entity was not found",      # inglês capitalizado
+    "registration-token-not-registered"    # mensagem do FCM
+]
+
+
+def fcm_token_invalido(erro: Exception) -> bool:
+    """Indica se o erro do FCM significa que o token não existe mais e deve ser removido."""
+    if isinstance(erro, messaging.UnregisteredError):
+        return True
+    msg = str(erro)
+    return any(s in msg for s in _MENSAGENS_TOKEN_INVALIDO)
+
+
+def enviar_fcm_em_lote(
+    tokens: List[str],
+    titulo: Optional[str] = None,
+    corpo: Optional[str] = None,
+    data_payload: Optional[Dict[str, str]] = None,
+    webpush_tag: Optional[str] = None,
+    logger_prefix: str = ""
+) -> Dict:
+    """
+    Envia a mesma mensagem FCM para vários tokens usando send_each_for_multicast,
+    em lotes de até 500 tokens (uma requisição por lote, não por token).
+
+    Args:
+        tokens: Lista de tokens FCM
+        titulo / corpo: Notification object (enviado apenas se ambos forem informados)
+        data_payload: Dados extras
+        webpush_tag: Tag para substituir notificações antigas (opcional)
+        logger_prefix: Prefixo das mensagens de log
+
+    Returns:
+        {"sucessos": X, "falhas": Y, "resultados": [{"token", "sucesso", "message_id", "erro", "token_invalido"}],
+         "tokens_invalidos": [...]}
+    """
+    resultado = {"sucessos": 0, "falhas": 0, "resultados": [], "tokens_invalidos": []}
+
+    tokens = list(dict.fromkeys(t for t in (tokens or []) if t))
+    if not tokens:
+        return resultado
+
+    message_kwargs = {}
+    if titulo and corpo:
+        message_kwargs["notification"] = messaging.Notification(title=titulo, body=corpo)
+    if data_payload:
+        message_kwargs["data"] = data_payload
+    if webpush_tag:
+        message_kwargs["webpush"] = messaging.WebpushConfig(
+            notification=messaging.WebpushNotification(tag=webpush_tag)
+        )
+
+    for inicio in range(0, len(tokens), FCM_TOKENS_POR_LOTE):
+        lote = tokens[inicio:inicio + FCM_TOKENS_POR_LOTE]
+        inicio_lote = time.perf_counter()
+
+        try:
+            batch_response = messaging.send_each_for_multicast(
+                messaging.MulticastMessage(tokens=lote, **message_kwargs)
+            )
+            respostas = [(r.success, r.message_id, r.exception) for r in batch_response.responses]
+        except Exception as e:
+            # Falha do lote inteiro (ex: credenciais, rede): todos os tokens do lote falham
+            logger.error(f"{logger_prefix}❌ Erro ao enviar lote FCM de {len(lote)} token(s): {e}")
+            respostas = [(False, None, e)] * len(lote)
+
+        sucessos_antes, falhas_antes = resultado["sucessos"], resultado["falhas"]
+        invalidos_antes = len(resultado["tokens_invalidos"])
+        for token, (sucesso, message_id, erro) in zip(lote, respostas):
+            invalido = not sucesso and erro is not None and fcm_token_invalido(erro)
+            resultado["resultados"].append({
+                "token": token,
+                "sucesso": sucesso,
+                "message_id": message_id,
+                "erro": str(erro) if erro else None,
+                "token_invalido": invalido
+            })
+            if sucesso:
+                resultado["sucessos"] += 1
+            else:
+                resultado["falhas"] += 1
+                logger.error(f"{logger_prefix}Erro no token {token[:12]}…: {erro}")
+                if invalido:
+                    resultado["tokens_invalidos"].append(token)
+
+        registrar_push(
+            'fcm', inicio_lote,
+            sucessos=resultado["sucessos"] - sucessos_antes,
+            falhas=resultado["falhas"] - falhas_antes,
+            tokens_invalidos=len(resultado["tokens_invalidos"]) - invalidos_antes
+        )
+
+    return resultado
+
 
 def enviar_notificacao_hibrida(
     fcm_tokens: List[str],
@@ -29,10 +133,10 @@ def enviar_notificacao_hibrida(
     corpo: str,
     data_payload: Optional[Dict[str, str]] = None,
     webpush_tag: Optional[str] = None
-) -> Dict[str, int]:
+) -> Dict:
     """
     Envia notificação para AMBOS FCM (Android/Chrome) e APNs (Safari/iOS).
-    Segue o PADRÃO DE ENVIO EM LOOP que já está funcionando no sistema.
+    FCM é enviado em lote (send_each_for_multicast) e APNs em paralelo pelo cliente HTTP/2 compartilhado.
 
     Args:
         fcm_tokens: Lista de tokens FCM (Android/Chrome/Edge)
@@ -44,43 +148,32 @@ def enviar_notificacao_hibrida(
 
     Returns:
         Dicionário com contadores: {"fcm_sucessos": X, "fcm_falhas": Y, "apns_sucessos": Z, "apns_falhas": W}
+        e "fcm_tokens_invalidos"/"apns_tokens_invalidos" (tokens recusados, a serem removidos do usuário)
     """
+    inicio = time.perf_counter()
     resultado = {
         "fcm_sucessos": 0,
         "fcm_falhas": 0,
         "apns_sucessos": 0,
-        "apns_falhas": 0
+        "apns_falhas": 0,
+        "fcm_tokens_invalidos": [],
+        "apns_tokens_invalidos": []
     }
 
     # ==============================
     # PARTE 1: ENVIAR PARA FCM (Android/Chrome)
     # ==============================
     if fcm_tokens:
-        for token in fcm_tokens:
-            try:
-                # Monta o objeto Message do FCM
-                message_kwargs = {
-                    "notification": messaging.Notification(title=titulo, body=corpo),
-                    "token": token
-                }
-
-                # Adiciona dados customizados se fornecidos
-                if data_payload:
-                    message_kwargs["data"] = data_payload
-
-                # Adiciona configuração WebPush se tag foi fornecida
-                if webpush_tag:
-                    message_kwargs["webpush"] = messaging.WebpushConfig(
-                        notification=messaging.WebpushNotification(tag=webpush_tag)
-                    )
-
-                # Envia a mensagem
-                messaging.send(messaging.Message(**message_kwargs))
-                resultado["fcm_sucessos"] += 1
-
-            except Exception as e:
-                logger.error(f"❌ Erro ao enviar FCM para token {token[:10]}...: {e}")
-                resultado["fcm_falhas"] += 1
+        envio_fcm = enviar_fcm_em_lote(
+            tokens=fcm_tokens,
+            titulo=titulo,
+            corpo=corpo,
+            data_payload=data_payload,
+            webpush_tag=webpush_tag
+        )
+        resultado["fcm_sucessos"] = envio_fcm["sucessos"]
+        resultado["fcm_falhas"] = envio_fcm["falhas"]
+        resultado["fcm_tokens_invalidos"] = envio_fcm["tokens_invalidos"]
 
     # ==============================
     # PARTE 2: ENVIAR PARA APNs (Safari/iOS)
@@ -89,23 +182,20 @@ def enviar_notificacao_hibrida(
         apns_service = get_apns_service()
 
         if apns_service.enabled:
-            for token in apns_tokens:
-                try:
-                    sucesso = apns_service.send_notification(
-                        token=token,
-                        titulo=titulo,
-                        corpo=corpo,
-                        data_payload=data_payload
-                    )
-
-                    if sucesso:
-                        resultado["apns_sucessos"] += 1
-                    else:
-                        resultado["apns_falhas"] += 1
-
-                except Exception as e:
-                    logger.error(f"❌ Erro ao enviar APNs para token {token[:10]}...: {e}")
-                    resultado["apns_falhas"] += 1
+            try:
+                envio_apns = apns_service.send_notification_batch(
+                    tokens=apns_tokens,
+                    titulo=titulo,
+                    corpo=corpo,
+                    data_payload=data_payload
+                )
+                resultado["apns_sucessos"] = envio_apns["sucessos"]
+                resultado["apns_falhas"] = envio_apns["falhas"]
+                resultado["apns_tokens_invalidos"] = envio_apns["tokens_invalidos"]
+
+            except Exception as e:
+                logger.error(f"❌ Erro ao enviar APNs para {len(apns_tokens)} token(s): {e}")
+                resultado["apns_falhas"] += len(apns_tokens)
         else:
             logger.debug("APNs desabilitado. Tokens Safari ignorados.")
 
@@ -118,6 +208,8 @@ def enviar_notificacao_hibrida(
         f"FCM ({resultado['fcm_sucessos']}/{total_fcm}), "
         f"APNs ({resultado['apns_sucessos']}/{total_apns})"
     )
+    # Só a duração: as entregas por token já foram contadas nos canais fcm/apns
+    registrar_push('hibrida', inicio)
 
     return resultado
 
@@ -128,7 +220,7 @@ def enviar_notificacao_para_usuario(
     corpo: str,
     data_payload: Optional[Dict[str, str]] = None,
     webpush_tag: Optional[str] = None
-) -> Dict[str, int]:
+) -> Dict:
     """
     Versão simplificada: recebe o dicionário do usuário e envia para todos os tokens dele.
 
@@ -0,0 +1,302 @@
+"""
+Outbox de efeitos colaterais de notificação.
+
+Endpoints de escrita (criar relatório, aprovar/recusar, registro diário, concluir
+tarefa, adicionar exame) executavam os _notificar_* antes de responder: mais
+leituras, gravação do histórico e push para todos os dispositivos. Com o outbox,
+o documento de domínio e um evento em 'outbox_notificacoes' são gravados no mesmo
+batch, e o evento é processado fora do caminho da requisição.
+
+USO (em crud.py):
+    batch = db.batch()
+    batch.set(doc_ref, dados)
+    evento_ref = registrar_evento(db, batch, 'RELATORIO_CRIADO', {'relatorio_id': doc_ref.id})
+    batch.commit()
+    despachar(db, evento_ref.id)
+
+    registrar_handler('RELATORIO_CRIADO', _processar_evento_relatorio_criado)
+
+HANDLERS: handler(db, evento_id, payload). O handler LANÇA exceção quando a
+entrega falha (o evento volta para 'pendente' com proxima_tentativa_em em backoff
+exponencial e é tentado de novo até OUTBOX_MAX_TENTATIVAS, depois fica em 'erro')
+e precisa ser idempotente por evento_id: uma nova tentativa não pode duplicar o
+que já foi entregue (em crud.py o histórico de cada destinatário usa o evento_id
+como ID do documento e registra em push_entregue se o push já foi entregue).
+
+BACKENDS (OUTBOX_BACKEND):
+    thread       - pool de threads no próprio processo (padrão, desenvolvimento)
+    cloud_tasks  - cria uma Cloud Task que chama POST /internal/outbox/processar (produção)
+    sincrono     - processa na hora, na mesma thread (testes/scripts locais)
+
+Eventos que não foram processados (instância encerrada, falha do handler, erro
+ao criar a Cloud Task) são reprocessados por processar_pendentes(), chamado pelo
+job POST /tasks/processar-outbox.
+
+NO CLOUD RUN: com o backend 'thread' o evento roda depois que a resposta foi
+enviada, quando a CPU da instância é reduzida (a menos que o serviço use "CPU
+sempre alocada"); o envio pode atrasar ou ser interrompido. Em qualquer backend,
+o job POST /tasks/processar-outbox PRECISA estar agendado no Cloud Scheduler
+(ex: a cada minuto), senão eventos não processados ficam parados. As consultas
+de processar_pendentes() usam os índices compostos de 'outbox_notificacoes'
+em firestore.indexes.json: (status, proxima_tentativa_em) e (status, lease_ate).
+    firebase deploy --only firestore:indexes --project <projeto>
+
+Configuração (variáveis de ambiente):
+    OUTBOX_BACKEND=thread
+    OUTBOX_WORKERS=4
+    OUTBOX_MAX_TENTATIVAS=5
+    OUTBOX_LEASE_SECONDS=120
+    OUTBOX_BACKOFF_SECONDS=30           # 1ª nova tentativa; dobra a cada falha (máx. 1h)
+    OUTBOX_CLOUD_TASKS_QUEUE=notificacoes-outbox
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = 'outbox_notificacoes'
+
+BACKEND_THREAD = 'thread'
+BACKEND_CLOUD_TASKS = 'cloud_tasks'
+BACKEND_SINCRONO = 'sincrono'
+
+OUTBOX_BACKEND = os.getenv('OUTBOX_BACKEND', BACKEND_THREAD).lower()
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+OUTBOX_MAX_TENTATIVAS = int(os.getenv('OUTBOX_MAX_TENTATIVAS', '5'))
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '120'))
+OUTBOX_BACKOFF_SECONDS = int(os.getenv('OUTBOX_BACKOFF_SECONDS', '30'))
+
+_BACKOFF_MAXIMO_SEGUNDOS = 3600
+
+STATUS_PENDENTE = 'pendente'
+STATUS_PROCESSANDO = 'processando'
+STATUS_CONCLUIDO = 'concluido'
+STATUS_ERRO = 'erro'
+
+# tipo do evento -> função(db, evento_id, payload)
+_handlers: Dict[str, Callable[[firestore.client, str, Dict], None]] = {}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def registrar_handler(tipo: str, funcao: Callable[[firestore.client, str, Dict], None]) -> None:
+    """Associa um tipo de evento à função que executa o efeito colateral."""
+    _handlers[tipo] = funcao
+
+
+def registrar_evento(db: firestore.client, batch, tipo: str, payload: Dict):
+    """
+    Adiciona o evento ao batch/transação que grava o documento de domínio.
+    O payload deve conter apenas IDs: o handler lê o estado atual ao processar.
+
+    Returns:
+        DocumentReference do evento (use .id para despachar após o commit)
+    """
+    evento_ref = db.collection(OUTBOX_COLLECTION).document()
+    agora = datetime.now(timezone.utc)
+    batch.set(evento_ref, {
+        'tipo': tipo,
+        'payload': payload,
+        'status': STATUS_PENDENTE,
+        'tentativas': 0,
+        'criado_em': agora,
+        'proxima_tentativa_em': agora,
+        'processado_em': None,
+        'lease_ate': None,
+        'ultimo_erro': None,
+    })
+    return evento_ref
+
+
+def despachar(db: firestore.client, evento_id: str) -> None:
+    """
+    Entrega o evento ao backend configurado, sem bloquear a requisição.
+    Nunca lança exceção: o evento já está gravado e será recuperado por processar_pendentes().
+    """
+    try:
+        if OUTBOX_BACKEND == BACKEND_SINCRONO:
+            processar_evento(db, evento_id)
+        elif OUTBOX_BACKEND == BACKEND_CLOUD_TASKS:
+            _criar_cloud_task(evento_id)
+        else:
+            _get_executor().submit(processar_evento, db, evento_id)
+    except Exception as e:
+        logger.error(f"❌ Erro ao despachar evento do outbox {evento_id} ({OUTBOX_BACKEND}): {e}")
+
+
+def processar_evento(db: firestore.client, evento_id: str) -> bool:
+    """
+    Reivindica o evento (lease), executa o handler e registra o resultado.
+
+    Returns:
+        True se o evento foi concluído (agora ou anteriormente), False se falhou
+        ou está sendo processado por outro worker.
+    """
+    evento_ref = db.collection(OUTBOX_COLLECTION).document(evento_id)
+
+    evento = _reivindicar_evento(db, evento_ref)
+    if evento is None:
+        snapshot = evento_ref.get()
+        return snapshot.exists and (snapshot.to_dict() or {}).get('status') == STATUS_CONCLUIDO
+
+    tipo = evento.get('tipo')
+    handler = _handlers.get(tipo)
+
+    try:
+        if handler is None:
+            raise ValueError(f"Nenhum handler registrado para o tipo '{tipo}'")
+        handler(db, evento_id, evento.get('payload') or {})
+    except Exception as e:
+        tentativas = evento.get('tentativas', 1)
+        esgotado = tentativas >= OUTBOX_MAX_TENTATIVAS
+        alteracoes = {
+            'status': STATUS_ERRO if esgotado else STATUS_PENDENTE,
+            'lease_ate': None,
+            'ultimo_erro': str(e)[:500],
+        }
+        if not esgotado:
+            alteracoes['proxima_tentativa_em'] = datetime.now(timezone.utc) + _backoff(tentativas)
+        evento_ref.update(alteracoes)
+        logger.error(f"❌ Evento do outbox {evento_id} ({tipo}) falhou na tentativa {tentativas}: {e}")
+        return False
+
+    evento_ref.update({
+        'status': STATUS_CONCLUIDO,
+        'processado_em': datetime.now(timezone.utc),
+        'lease_ate': None,
+        'ultimo_erro': None,
+    })
+    logger.info(f"✅ Evento do outbox {evento_id} ({tipo}) processado")
+    return True
+
+
+def processar_pendentes(db: firestore.client, idade_minima_segundos: int = 60, limite: int = 100) -> Dict[str, int]:
+    """
+    Reprocessa eventos pendentes há mais de idade_minima_segundos (ou cujo backoff
+    terminou há esse tempo) e eventos cujo lease expirou (worker encerrado no meio
+    do processamento). Eventos em backoff ficam fora da consulta e não ocupam o limite.
+    """
+    agora = datetime.now(timezone.utc)
+    stats = {"encontrados": 0, "processados": 0, "falhas": 0}
+
+    pendentes = (
+        db.collection(OUTBOX_COLLECTION)
+        .where('status', '==', STATUS_PENDENTE)
+        .where('proxima_tentativa_em', '<=', agora - timedelta(seconds=idade_minima_segundos))
+        .limit(limite)
+        .stream()
+    )
+    presos = (
+        db.collection(OUTBOX_COLLECTION)
+        .where('status', '==', STATUS_PROCESSANDO)
+        .where('lease_ate', '<=', agora)
+        .limit(limite)
+        .stream()
+    )
+
+    for doc in list(pendentes) + list(presos):
+        stats["encontrados"] += 1
+        if processar_evento(db, doc.id):
+            stats["processados"] += 1
+        else:
+            stats["falhas"] += 1
+
+    logger.info(f"📬 Outbox reprocessado: {stats}")
+    return stats
+
+
+def _reivindicar_evento(db: firestore.client, evento_ref) -> Optional[Dict]:
+    """Marca o evento como 'processando' com lease. Retorna os dados ou None se não estiver disponível."""
+
+    @firestore.transactional
+    def reivindicar(transaction):
+        snapshot = evento_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        evento = snapshot.to_dict() or {}
+        status = evento.get('status')
+        agora = datetime.now(timezone.utc)
+
+        if status in (STATUS_CONCLUIDO, STATUS_ERRO):
+            return None
+        if status == STATUS_PENDENTE and evento.get('proxima_tentativa_em') and evento['proxima_tentativa_em'] > agora:
+            return None
+        if status == STATUS_PROCESSANDO and evento.get('lease_ate') and evento['lease_ate'] > agora:
+            return None
+
+        evento['tentativas'] = evento.get('tentativas', 0) + 1
+        transaction.update(evento_ref, {
+            'status': STATUS_PROCESSANDO,
+            'tentativas': evento['tentativas'],
+            'lease_ate': agora + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+        })
+        return evento
+
+    return reivindicar(db.transaction())
+
+
+def _backoff(tentativas: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_BACKOFF_SECONDS * 2 ** max(tentativas - 1, 0), _BACKOFF_MAXIMO_SEGUNDOS))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix="outbox")
+    return _executor
+
+
+def _criar_cloud_task(evento_id: str) -> None:
+    """Cria uma Cloud Task que chama o endpoint interno de processamento do evento."""
+    from google.cloud import tasks_v2
+
+    project_id = os.getenv('GCP_PROJECT_ID') or os.getenv('GOOGLE_CLOUD_PROJECT') or os.getenv('FIREBASE_PROJECT_ID')
+    location = os.getenv('CLOUD_TASKS_LOCATION') or 'southamerica-east1'
+    queue_name = os.getenv('OUTBOX_CLOUD_TASKS_QUEUE') or 'notificacoes-outbox'
+    service_url = os.getenv('CLOUD_RUN_SERVICE_URL')
+
+    if not project_id or not service_url:
+        raise RuntimeError("GCP_PROJECT_ID/CLOUD_RUN_SERVICE_URL não configurados para o outbox via Cloud Tasks")
+
+    if service_url.startswith('http://'):
+        service_url = service_url.replace('http://', 'https://', 1)
+    elif not service_url.startswith('https://'):
+        service_url = f'https://{service_url}'
+
+    client = _get_cloud_tasks_client()
+    task = {
+        'http_request': {
+            'http_method': tasks_v2.HttpMethod.POST,
+            'url': f"{service_url}/internal/outbox/processar",
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({"evento_id": evento_id}).encode()
+        }
+    }
+
+    # Adiciona autenticação OIDC para Cloud Run
+    if 'run.app' in service_url:
+        task['http_request']['oidc_token'] = {
+            'service_account_email': os.getenv('CLOUD_RUN_SERVICE_ACCOUNT') or '862082955632-compute@developer.gserviceaccount.com',
+            'audience': service_url
+        }
+
+    client.create_task(parent=client.queue_path(project_id, location, queue_name), task=task)
+
+
+def _get_cloud_tasks_client():
+    """Retorna o cliente do Cloud Tasks (singleton)."""
+    if not hasattr(_get_cloud_tasks_client, 'client'):
+        from google.cloud import tasks_v2
+        _get_cloud_tasks_client.client = tasks_v2.CloudTasksClient()
+    return _get_cloud_tasks_client.client
@@ -0,0 +1,147 @@
+"""
+Executor de consultas concorrentes ao Firestore.
+
+Telas como a ficha completa do paciente e o relatório completo disparam várias
+leituras independentes (consultas, medicações, checklist, orientações, registros...).
+Executadas em sequência, cada uma soma um round trip ao Firestore. Este módulo
+executa essas leituras em paralelo num pool de threads compartilhado, com um
+prazo (deadline) por requisição.
+
+USO:
+    from query_executor import executar_em_paralelo
+
+    resultados = executar_em_paralelo({
+        "medicacoes": lambda: crud.listar_medicacoes(db, paciente_id, consulta_id),
+        "checklist": lambda: crud.listar_checklist(db, paciente_id, consulta_id),
+    })
+    resultados["medicacoes"]
+
+Nos endpoints assíncronos, executar_em_paralelo_async() aplica o mesmo prazo
+a corrotinas (ex: leituras com o AsyncClient), sem usar o pool de threads.
+
+Configuração (variáveis de ambiente):
+    QUERY_EXECUTOR_MAX_WORKERS=16
+    QUERY_DEADLINE_SECONDS=10
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.getenv('QUERY_EXECUTOR_MAX_WORKERS', '16'))
+DEADLINE_PADRAO_SEGUNDOS = float(os.getenv('QUERY_DEADLINE_SECONDS', '10'))
+
+
+class PrazoExcedidoError(TimeoutError):
+    """Lançada quando as leituras concorrentes não terminam dentro do prazo da requisição."""
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+# Marca as threads do pool, para que chamadas aninhadas rodem em sequência
+# em vez de esperar por workers do mesmo pool (o que poderia travar o pool).
+_contexto = threading.local()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS,
+                    thread_name_prefix="firestore-query",
+                    initializer=_marcar_thread_do_pool
+                )
+    return _executor
+
+
+def _marcar_thread_do_pool():
+    _contexto.no_pool = True
+
+
+def executar_em_paralelo(tarefas: Dict[str, Callable[[], Any]], prazo_segundos: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Executa as funções informadas concorrentemente e retorna {nome: resultado}.
+
+    Args:
+        tarefas: Mapa nome -> função sem argumentos que realiza a leitura.
+        prazo_segundos: Prazo total para todas as leituras (padrão: QUERY_DEADLINE_SECONDS).
+
+    Raises:
+        PrazoExcedidoError: se alguma leitura não terminar dentro do prazo.
+        Exception: a primeira exceção lançada por uma das tarefas é propagada.
+    """
+    if not tarefas:
+        return {}
+
+    prazo = DEADLINE_PADRAO_SEGUNDOS if prazo_segundos is None else prazo_segundos
+
+    # Uma tarefa só, ou chamada feita de dentro do próprio pool: executa em sequência
+    if len(tarefas) == 1 or getattr(_contexto, 'no_pool', False):
+        return {nome: funcao() for nome, funcao in tarefas.items()}
+
+    inicio = time.monotonic()
+    executor = _get_executor()
+    # Cada tarefa roda numa cópia do contexto da requisição (ex: escopo do data_loader)
+    futures = {nome: executor.submit(contextvars.copy_context().run, funcao) for nome, funcao in tarefas.items()}
+
+    concluidas, pendentes = wait(futures.values(), timeout=prazo, return_when=FIRST_EXCEPTION)
+    for future in concluidas:
+        erro = future.exception()
+        if erro is not None:
+            for pendente in pendentes:
+                pendente.cancel()
+            raise erro
+
+    if pendentes:
+        for pendente in pendentes:
+            pendente.cancel()
+        nomes_pendentes = [nome for nome, future in futures.items() if future in pendentes]
+        logger.error(f"⏱️ Prazo de {prazo}s excedido aguardando leituras: {nomes_pendentes}")
+        raise PrazoExcedidoError(f"Prazo de {prazo}s excedido aguardando: {', '.join(nomes_pendentes)}")
+
+    logger.debug(f"Leituras concorrentes {list(tarefas)} concluídas em {(time.monotonic() - inicio) * 1000:.0f}ms")
+    return {nome: future.result() for nome, future in futures.items()}
+
+
+async def executar_em_paralelo_async(tarefas: Dict[str, Awaitable], prazo_segundos: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Versão para os endpoints assíncronos (repositorio_async.py): aguarda as
+    corrotinas informadas juntas no event loop, sem ocupar threads do pool.
+
+    Raises:
+        PrazoExcedidoError: se alguma leitura não terminar dentro do prazo.
+        Exception: a primeira exceção lançada por uma das tarefas é propagada.
+    """
+    if not tarefas:
+        return {}
+
+    prazo = DEADLINE_PADRAO_SEGUNDOS if prazo_segundos is None else prazo_segundos
+    inicio = time.monotonic()
+    futures = {nome: asyncio.ensure_future(corrotina) for nome, corrotina in tarefas.items()}
+
+    concluidas, pendentes = await asyncio.wait(futures.values(), timeout=prazo, return_when=asyncio.FIRST_EXCEPTION)
+    for future in concluidas:
+        erro = future.exception()
+        if erro is not None:
+            for pendente in pendentes:
+                pendente.cancel()
+            raise erro
+
+    if pendentes:
+        for pendente in pendentes:
+            pendente.cancel()
+        nomes_pendentes = [nome for nome, future in futures.items() if future in pendentes]
+        logger.error(f"⏱️ Prazo de {prazo}s excedido aguardando leituras: {nomes_pendentes}")
+        raise PrazoExcedidoError(f"Prazo de {prazo}s excedido aguardando: {', '.join(nomes_pendentes)}")
+
+    logger.debug(f"Leituras assíncronas {list(tarefas)} concluídas em {(time.monotonic() - inicio) * 1000:.0f}ms")
+    return {nome: future.result() for nome, future in futures.items()}
@@ -0,0 +1,272 @@
+"""
+Leituras assíncronas (AsyncClient do Firestore) dos endpoints mais acessados.
+
+Atende /me/profile, /me/pacientes, /pacientes/{id}/ficha-completa,
+/pacientes/{id}/checklist-diario, /notificacoes e
+/notificacoes/nao-lidas/contagem, além das dependências de autenticação
+assíncronas de auth.py. Enquanto aguardam o Firestore, essas rotas não
+ocupam threads do threadpool, e as leituras independentes são feitas juntas
+(asyncio.gather / executar_em_paralelo_async).
+
+Só o I/O é duplicado aqui: a montagem das consultas e o tratamento dos
+documentos reutilizam as funções de crud.py, para que as versões síncrona e
+assíncrona devolvam exatamente o mesmo resultado.
+
+REGRAS:
+- Descriptografia de listas (CPU) roda em asyncio.to_thread, fora do event loop.
+- As funções recebem o cliente de firestore_async.get_async_db() (ou o
+  FakeAsyncFirestore do benchmark) no parâmetro db_async.
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, time
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from firebase_admin import firestore
+
+import crud
+from crud import CAMPOS_USUARIO_AUTENTICADO
+from crypto_utils import decrypt_document, decrypt_many
+from query_executor import executar_em_paralelo_async
+
+logger = logging.getLogger(__name__)
+
+
+async def _listar(query) -> List:
+    """Executa a consulta e retorna a lista de snapshots."""
+    return [doc async for doc in query.stream()]
+
+
+def _com_id(doc) -> Dict:
+    dados = doc.to_dict()
+    dados['id'] = doc.id
+    return dados
+
+
+# =================================================================================
+# USUÁRIOS E PROFISSIONAIS
+# =================================================================================
+
+async def buscar_usuario_por_firebase_uid(db_async, firebase_uid: str) -> Optional[Dict]:
+    """Versão assíncrona de crud.buscar_usuario_por_firebase_uid."""
+    try:
+        query = db_async.collection('usuarios').where('firebase_uid', '==', firebase_uid).limit(1)
+        docs = await _listar(query)
+        if not docs:
+            return None
+        return decrypt_document(_com_id(docs[0]), CAMPOS_USUARIO_AUTENTICADO)
+    except Exception as e:
+        logger.error(f"Erro ao buscar/descriptografar usuário por firebase_uid {firebase_uid}: {e}")
+        return None
+
+
+async def buscar_profissional_por_uid(db_async, negocio_id: str, firebase_uid: str) -> Optional[Dict]:
+    """Versão assíncrona de crud.buscar_profissional_por_uid."""
+    try:
+        query = db_async.collection('profissionais')\
+            .where('negocio_id', '==', negocio_id)\
+            .where('usuario_uid', '==', firebase_uid)\
+            .limit(1)
+        docs = await _listar(query)
+        return _com_id(docs[0]) if docs else None
+    except Exception as e:
+        logger.error(f"Erro ao buscar profissional por UID {firebase_uid} no negócio {negocio_id}: {e}")
+        return None
+
+
+async def buscar_profissional_id_por_roles(db_async, roles: Dict[str, str], firebase_uid: str) -> Optional[str]:
+    """
+    ID do perfil profissional do usuário no primeiro negócio (na ordem das roles)
+    em que ele é admin ou profissional. As buscas dos negócios rodam juntas.
+    """
+    negocios = [negocio_id for negocio_id, role in (roles or {}).items() if role in ('admin', 'profissional')]
+    if not negocios:
+        return None
+    perfis = await asyncio.gather(*(buscar_profissional_por_uid(db_async, n, firebase_uid) for n in negocios))
+    for perfil in perfis:
+        if perfil:
+            return perfil.get('id')
+    return None
+
+
+async def buscar_documento_usuario(db_async, usuario_id: str) -> Optional[Dict]:
+    """Documento bruto (sem descriptografar) de usuarios/{usuario_id}, ou None se não existe."""
+    snapshot = await db_async.collection('usuarios').document(usuario_id).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+async def listar_pacientes_por_profissional_ou_tecnico(db_async, negocio_id: str, usuario_id: str, role: str) -> List[Dict]:
+    """Versão assíncrona de crud.listar_pacientes_por_profissional_ou_tecnico."""
+    try:
+        query = crud._query_pacientes_vinculados(db_async, negocio_id, usuario_id, role)
+        if query is None:
+            return []
+
+        pacientes = []
+        async for doc in query.stream():
+            paciente_data = crud._paciente_ativo(doc, negocio_id)
+            if paciente_data:
+                pacientes.append(paciente_data)
+
+        return await asyncio.to_thread(decrypt_many, pacientes)
+    except Exception as e:
+        logger.error(f"Erro ao listar pacientes para o usuário {usuario_id} com role '{role}': {e}")
+        return []
+
+
+# =================================================================================
+# NOTIFICAÇÕES
+# =================================================================================
+
+async def listar_notificacoes(db_async, usuario_id: str) -> List[Dict]:
+    """Versão assíncrona de crud.listar_notificacoes."""
+    query = db_async.collection('usuarios').document(usuario_id).collection('notificacoes')\
+        .order_by('data_criacao', direction=firestore.Query.DESCENDING)
+    return [crud._normalizar_notificacao(doc) for doc in await _listar(query)]
+
+
+async def listar_notificacoes_paginado(db_async, usuario_id: str, limit: int, cursor: Optional[str] = None) -> Dict:
+    """
+    Versão assíncrona de crud.listar_notificacoes_paginado.
+
+    Raises:
+        ValueError: se o cursor for inválido
+    """
+    docs = await _listar(crud._query_pagina_notificacoes(db_async, usuario_id, limit, cursor))
+    return crud._montar_pagina_notificacoes(docs, limit)
+
+
+async def contar_notificacoes_nao_lidas(db_async, usuario_id: str) -> int:
+    """Versão assíncrona de crud.contar_notificacoes_nao_lidas (agregação count() no servidor)."""
+    query = db_async.collection('usuarios').document(usuario_id).collection('notificacoes')\
+        .where('lida', '==', False)
+    resultado = await query.count(alias='nao_lidas').get()
+    return int(resultado[0][0].value)
+
+
+# =================================================================================
+# FICHA DO PACIENTE
+# =================================================================================
+
+async def listar_consultas(db_async, paciente_id: str) -> List[Dict]:
+    """Versão assíncrona de crud.listar_consultas (mesma ordem de fallbacks)."""
+    col = db_async.collection('usuarios').document(paciente_id).collection('consultas')
+    consultas = []
+    try:
+        try:
+            consultas = [_com_id(doc) for doc in await _listar(col.order_by('created_at', direction=firestore.Query.DESCENDING))]
+        except Exception as created_at_error:
+            logger.warning(f"Não foi possível ordenar por created_at: {created_at_error}")
+
+        if not consultas:
+            try:
+                consultas = [_com_id(doc) for doc in await _listar(col.order_by('__name__', direction=firestore.Query.DESCENDING))]
+            except Exception as name_error:
+                logger.warning(f"Não foi possível ordenar por __name__: {name_error}")
+                consultas = [_com_id(doc) for doc in await _listar(col)]
+                consultas.sort(key=lambda x: x.get('created_at', x.get('id', '')), reverse=True)
+    except Exception as e:
+        logger.error(f"Erro ao listar consultas do paciente {paciente_id}: {e}")
+    return consultas
+
+
+async def _listar_itens_do_plano(db_async, paciente_id: str, colecao: str, consulta_id: str) -> List[Dict]:
+    """Medicações, checklist ou orientações de uma consulta (como crud.listar_medicacoes & cia.)."""
+    try:
+        query = db_async.collection('usuarios').document(paciente_id).collection(colecao)\
+            .where('consulta_id', '==', consulta_id)
+        itens = [_com_id(doc) for doc in await _listar(query)]
+        itens.sort(key=lambda x: x.get('data_criacao', ''), reverse=True)
+        return itens
+    except Exception as e:
+        logger.error(f"Erro ao listar {colecao} do paciente {paciente_id}: {e}")
+        return []
+
+
+def _tarefas_itens_plano(db_async, paciente_id: str, consulta_id: str) -> Dict:
+    return {
+        colecao: _listar_itens_do_plano(db_async, paciente_id, colecao, consulta_id)
+        for colecao in ('medicacoes', 'checklist', 'orientacoes')
+    }
+
+
+async def get_ficha_completa_paciente(db_async, paciente_id: str, consulta_id: Optional[str] = None) -> Dict:
+    """
+    Versão assíncrona de crud.get_ficha_completa_paciente.
+
+    Raises:
+        PrazoExcedidoError: se as leituras não terminarem dentro de QUERY_DEADLINE_SECONDS
+    """
+    if not consulta_id:
+        # O ponteiro do plano ativo dispensa esperar a lista de consultas (ver crud.get_plano_ativo_id)
+        paciente = await buscar_documento_usuario(db_async, paciente_id)
+        if crud._tem_ponteiro_plano_ativo(paciente):
+            consulta_id = paciente.get('plano_ativo_id')
+            if not consulta_id:
+                return {"consultas": [], "medicacoes": [], "checklist": [], "orientacoes": []}
+
+    if consulta_id:
+        ficha = await executar_em_paralelo_async({
+            "consultas": listar_consultas(db_async, paciente_id),
+            **_tarefas_itens_plano(db_async, paciente_id, consulta_id),
+        })
+    else:
+        consultas = await listar_consultas(db_async, paciente_id)
+        if not consultas:
+            return {"consultas": [], "medicacoes": [], "checklist": [], "orientacoes": []}
+        ficha = {
+            "consultas": consultas,
+            **await executar_em_paralelo_async(_tarefas_itens_plano(db_async, paciente_id, consultas[0]['id'])),
+        }
+
+    ficha['checklist'] = crud._dedup_checklist_items(ficha.get('checklist', []))
+    return ficha
+
+
+async def _criar_checklist_do_dia(db_async, paciente_id: str, dia: date, negocio_id: str) -> Optional[Dict]:
+    """Versão assíncrona de crud._criar_checklist_do_dia."""
+    paciente_ref = db_async.collection('usuarios').document(paciente_id)
+    paciente = await buscar_documento_usuario(db_async, paciente_id)
+    if crud._tem_ponteiro_plano_ativo(paciente) and (
+        not paciente.get('plano_ativo_id') or crud._plano_vigente_no_dia(paciente.get('plano_ativo'), dia)
+    ):
+        plano_valido_id = paciente.get('plano_ativo_id')
+    else:
+        end_of_day = datetime.combine(dia, time.max)
+        docs_plano_valido = await _listar(paciente_ref.collection('consultas').where('created_at', '<=', end_of_day))
+        plano_valido_id = crud._plano_mais_recente(docs_plano_valido) if docs_plano_valido else None
+    if not plano_valido_id:
+        logger.info(f"Nenhum plano de cuidado ativo para {paciente_id} em {dia.isoformat()}.")
+        return None
+
+    docs_do_plano = await _listar(paciente_ref.collection('checklist').where('consulta_id', '==', plano_valido_id))
+    checklist_do_dia = crud._novo_checklist_do_dia(docs_do_plano, paciente_id, negocio_id, plano_valido_id, dia)
+    if checklist_do_dia is None:
+        logger.info(f"Plano {plano_valido_id} não possui checklist para {dia.isoformat()}.")
+        return None
+
+    dia_ref = crud._checklist_do_dia_ref(db_async, paciente_id, dia)
+    try:
+        await dia_ref.create(checklist_do_dia)
+    except Exception:
+        existente = await dia_ref.get()
+        if not existente.exists:
+            raise
+        return existente.to_dict()
+    logger.info(f"Checklist de {dia.isoformat()} criado com {checklist_do_dia['total_itens']} itens do plano {plano_valido_id}.")
+    return checklist_do_dia
+
+
+async def get_checklist_diario_plano_ativo(db_async, paciente_id: str, dia: date, negocio_id: str) -> List[Dict]:
+    """Versão assíncrona de crud.get_checklist_diario_plano_ativo (mesmas regras)."""
+    try:
+        snapshot = await crud._checklist_do_dia_ref(db_async, paciente_id, dia).get()
+        if snapshot.exists:
+            return crud._itens_checklist_do_dia(snapshot.to_dict())
+        return crud._itens_checklist_do_dia(await _criar_checklist_do_dia(db_async, paciente_id, dia, negocio_id))
+
+    except Exception as e:
+        logger.error(f"ERRO CRÍTICO ao buscar checklist do plano ativo para o paciente {paciente_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno ao processar o checklist: {e}")
@@ -463,6 +463,10 @@ class Bloqueio(BaseModel):
     inicio: datetime
     fim: datetime
     motivo: Optional[str] = None
+
+class HorariosDisponiveisProfissional(BaseModel):
+    profissional_id: str
+    dias: Dict[date, List[time]] = Field(..., description="Horários livres por dia (AAAA-MM-DD)")
     
 # =================================================================================
 # SCHEMAS DE NOTIFICAÇÕES
@@ -879,6 +883,11 @@ class RelatorioAprovacao(BaseModel):
 class RelatorioRecusa(BaseModel):
     motivo: str = Field(..., description="Motivo da recusa do relatório")
 
+class RelatorioInboxContadoresResponse(BaseModel):
+    pendente: int
+    aprovado: int
+    recusado: int
+
 class RelatorioCompletoResponse(BaseModel):
     relatorio: RelatorioMedicoResponse
     paciente: UsuarioProfile
@@ -0,0 +1,274 @@
+"""
+Upload em streaming do corpo multipart direto para o armazenamento (GCS ou local).
+
+Com 'file: UploadFile = File(...)', o Starlette grava o corpo inteiro num
+arquivo temporário antes de chamar o endpoint, e os endpoints ainda faziam
+'await file.read()' (arquivo inteiro na memória) + upload_from_string. No
+Cloud Run o /tmp também é memória: poucos PDFs simultâneos derrubavam uma
+instância pequena.
+
+receber_uploads_multipart() lê o corpo da requisição em blocos com o parser
+do python-multipart e, para cada arquivo:
+- envia os blocos a um upload resumable (cloud_storage.BackendGCS) ou ao disco
+  (BackendLocal) à medida que chegam, com fila limitada (backpressure);
+- interrompe e descarta o upload assim que o limite de tamanho é ultrapassado;
+- calcula o SHA-256 no caminho.
+
+Vários arquivos na mesma requisição são ingeridos em paralelo: enquanto o
+próximo arquivo é lido, os anteriores terminam de ser enviados (até
+UPLOAD_MAX_PARALELO uploads abertos). Se qualquer arquivo falhar, os já
+gravados na requisição são removidos.
+
+O endpoint NÃO deve declarar parâmetros File/Form: recebe 'request: Request'
+para que o FastAPI não consuma o corpo antes.
+
+Configuração (variáveis de ambiente):
+    UPLOAD_MAX_BYTES=26214400       # limite por arquivo
+    UPLOAD_MAX_ARQUIVOS=10          # arquivos por requisição
+    UPLOAD_MAX_PARALELO=4           # uploads simultâneos por requisição
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from multipart.multipart import MultipartParser, parse_options_header
+
+from cloud_storage import UPLOAD_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+UPLOAD_MAX_ARQUIVOS = int(os.getenv('UPLOAD_MAX_ARQUIVOS', '10'))
+UPLOAD_MAX_PARALELO = int(os.getenv('UPLOAD_MAX_PARALELO', '4'))
+
+# Blocos recebidos aguardando envio, por arquivo (limita a memória por upload)
+_MAX_BLOCOS_NA_FILA = 16
+# Campos comuns do formulário (não arquivos) são descartados, mas com limite
+_MAX_BYTES_CAMPO = 64 * 1024
+
+
+class UploadInvalidoError(ValueError):
+    """Corpo da requisição não é um multipart/form-data válido ou excede o número de arquivos."""
+
+
+class ArquivoMuitoGrandeError(ValueError):
+    """Lançada quando um arquivo ultrapassa o limite de tamanho durante o upload."""
+
+    def __init__(self, nome_arquivo: str, limite_bytes: int):
+        super().__init__(f"O arquivo '{nome_arquivo}' excede o limite de {limite_bytes // (1024 * 1024)} MB.")
+        self.limite_bytes = limite_bytes
+
+
+@dataclass
+class ResultadoUpload:
+    nome_arquivo: str
+    url: str
+    blob_name: str
+    content_type: str
+    tamanho: int
+    sha256: str
+
+
+class _ArquivoEmEnvio:
+    """Estado de um arquivo do multipart enquanto seus blocos são recebidos e enviados."""
+
+    def __init__(self, nome_arquivo: str, blob_name: str, content_type: str):
+        self.nome_arquivo = nome_arquivo
+        self.blob_name = blob_name
+        self.content_type = content_type
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=_MAX_BLOCOS_NA_FILA)
+        self.sha256 = hashlib.sha256()
+        self.tamanho = 0
+        self.tarefa: Optional[asyncio.Task] = None
+
+    def resultado(self, backend) -> ResultadoUpload:
+        return ResultadoUpload(
+            nome_arquivo=self.nome_arquivo, url=backend.url_publica(self.blob_name), blob_name=self.blob_name,
+            content_type=self.content_type, tamanho=self.tamanho, sha256=self.sha256.hexdigest()
+        )
+
+
+async def _enviar_arquivo(arquivo: _ArquivoEmEnvio, backend, semaforo: asyncio.Semaphore):
+    """Consome a fila do arquivo e grava no backend em blocos de UPLOAD_CHUNK_BYTES."""
+    async with semaforo:
+        escrita = await asyncio.to_thread(backend.abrir_escrita, arquivo.blob_name, arquivo.content_type)
+        try:
+            acumulado = bytearray()
+            while True:
+                bloco = await arquivo.fila.get()
+                if bloco is None:
+                    break
+                acumulado += bloco
+                if len(acumulado) >= UPLOAD_CHUNK_BYTES:
+                    await asyncio.to_thread(escrita.write, bytes(acumulado))
+                    acumulado.clear()
+            if acumulado:
+                await asyncio.to_thread(escrita.write, bytes(acumulado))
+        except BaseException:
+            # Não finaliza o upload: o objeto parcial não deve ficar visível
+            await asyncio.to_thread(backend.descartar, escrita, arquivo.blob_name)
+            raise
+        await asyncio.to_thread(escrita.close)
+
+
+async def _enfileirar(arquivo: _ArquivoEmEnvio, bloco: Optional[bytes]):
+    """Coloca o bloco na fila; se o envio do arquivo falhar enquanto espera, propaga o erro."""
+    colocar = asyncio.ensure_future(arquivo.fila.put(bloco))
+    await asyncio.wait({colocar, arquivo.tarefa}, return_when=asyncio.FIRST_COMPLETED)
+    if not colocar.done():
+        colocar.cancel()
+        arquivo.tarefa.result()  # lança a exceção do envio
+        raise RuntimeError(f"Envio de '{arquivo.nome_arquivo}' terminou antes do fim do arquivo")
+
+
+async def receber_uploads_multipart(
+    request,
+    backend,
+    gerar_blob_name: Callable[[str], str],
+    limite_bytes: int = UPLOAD_MAX_BYTES,
+    max_arquivos: int = UPLOAD_MAX_ARQUIVOS,
+) -> List[ResultadoUpload]:
+    """
+    Lê o corpo multipart da requisição e envia cada arquivo ao backend em streaming.
+
+    Args:
+        request: Request do FastAPI/Starlette (corpo ainda não consumido)
+        backend: Backend de cloud_storage.get_backend_armazenamento()
+        gerar_blob_name: Recebe o nome original do arquivo e retorna o caminho do objeto
+        limite_bytes: Tamanho máximo de cada arquivo
+        max_arquivos: Quantidade máxima de arquivos na requisição
+
+    Returns:
+        Um ResultadoUpload por arquivo, na ordem em que vieram no formulário.
+
+    Raises:
+        UploadInvalidoError: corpo inválido ou arquivos demais
+        ArquivoMuitoGrandeError: algum arquivo ultrapassou limite_bytes
+    """
+    tipo, opcoes = parse_options_header(request.headers.get('content-type', ''))
+    boundary = opcoes.get(b'boundary')
+    if tipo != b'multipart/form-data' or not boundary:
+        raise UploadInvalidoError("A requisição deve ser multipart/form-data.")
+
+    inicio = time.perf_counter()
+    eventos = []
+    cabecalhos = {}
+    campo_atual = bytearray()
+    valor_atual = bytearray()
+
+    def on_part_begin():
+        cabecalhos.clear()
+
+    def on_header_field(data, start, end):
+        campo_atual.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        valor_atual.extend(data[start:end])
+
+    def on_header_end():
+        cabecalhos[bytes(campo_atual).lower()] = bytes(valor_atual)
+        campo_atual.clear()
+        valor_atual.clear()
+
+    def on_headers_finished():
+        eventos.append(('cabecalhos', dict(cabecalhos)))
+
+    def on_part_data(data, start, end):
+        eventos.append(('dados', bytes(data[start:end])))
+
+    def on_part_end():
+        eventos.append(('fim', None))
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+
+    semaforo = asyncio.Semaphore(max(1, UPLOAD_MAX_PARALELO))
+    arquivos: List[_ArquivoEmEnvio] = []
+    arquivo_atual: Optional[_ArquivoEmEnvio] = None
+    bytes_campo = 0
+
+    async def processar_eventos():
+        nonlocal arquivo_atual, bytes_campo
+        pendentes = list(eventos)
+        eventos.clear()
+        for tipo_evento, valor in pendentes:
+            if tipo_evento == 'cabecalhos':
+                _, disposicao = parse_options_header(valor.get(b'content-disposition', b''))
+                nome_arquivo = disposicao.get(b'filename')
+                bytes_campo = 0
+                if nome_arquivo is None:
+                    arquivo_atual = None
+                    continue
+                if len(arquivos) >= max_arquivos:
+                    raise UploadInvalidoError(f"Máximo de {max_arquivos} arquivo(s) por requisição.")
+                nome = os.path.basename(nome_arquivo.decode('utf-8', errors='replace')) or 'arquivo'
+                content_type = valor.get(b'content-type', b'application/octet-stream').decode('latin-1')
+                arquivo_atual = _ArquivoEmEnvio(nome, gerar_blob_name(nome), content_type)
+                arquivo_atual.tarefa = asyncio.create_task(_enviar_arquivo(arquivo_atual, backend, semaforo))
+                arquivos.append(arquivo_atual)
+            elif tipo_evento == 'dados':
+                if arquivo_atual is None:
+                    bytes_campo += len(valor)
+                    if bytes_campo > _MAX_BYTES_CAMPO:
+                        raise UploadInvalidoError("Campo do formulário excede o tamanho permitido.")
+                    continue
+                arquivo_atual.tamanho += len(valor)
+                if arquivo_atual.tamanho > limite_bytes:
+                    raise ArquivoMuitoGrandeError(arquivo_atual.nome_arquivo, limite_bytes)
+                arquivo_atual.sha256.update(valor)
+                await _enfileirar(arquivo_atual, valor)
+            elif tipo_evento == 'fim' and arquivo_atual is not None:
+                await _enfileirar(arquivo_atual, None)
+                arquivo_atual = None
+
+    try:
+        async for bloco in request.stream():
+            if bloco:
+                parser.write(bloco)
+                await processar_eventos()
+        parser.finalize()
+        await processar_eventos()
+        if arquivo_atual is not None:
+            raise UploadInvalidoError("Corpo multipart incompleto.")
+
+        await asyncio.gather(*(arquivo.tarefa for arquivo in arquivos))
+    except BaseException as erro:
+        await _desfazer(arquivos, backend)
+        if isinstance(erro, Exception) and not isinstance(erro, (UploadInvalidoError, ArquivoMuitoGrandeError)):
+            logger.error(f"❌ Falha no upload em streaming: {erro}")
+        raise
+
+    resultados = [arquivo.resultado(backend) for arquivo in arquivos]
+    logger.info(
+        f"📤 Upload em streaming: {len(resultados)} arquivo(s), "
+        f"{sum(r.tamanho for r in resultados)} bytes em {(time.perf_counter() - inicio) * 1000:.0f}ms"
+    )
+    return resultados
+
+
+async def _desfazer(arquivos: List[_ArquivoEmEnvio], backend):
+    """Cancela os envios em andamento e remove os arquivos já gravados nesta requisição."""
+    for arquivo in arquivos:
+        if arquivo.tarefa and not arquivo.tarefa.done():
+            arquivo.tarefa.cancel()
+    await asyncio.gather(*(a.tarefa for a in arquivos if a.tarefa), return_exceptions=True)
+
+    for arquivo in arquivos:
+        tarefa = arquivo.tarefa
+        if tarefa and not tarefa.cancelled() and tarefa.exception() is None:
+            try:
+                await asyncio.to_thread(backend.remover, arquivo.blob_name)
+            except Exception as e:
+                logger.warning(f"⚠️ Não foi possível remover o upload parcial {arquivo.blob_name}: {e}")